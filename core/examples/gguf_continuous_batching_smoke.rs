@@ -0,0 +1,186 @@
+use aeronum_core::{
+    GgufBatchScheduler, GgufDecodeSession, GgufDecodeSessionOptions, GgufGenerationRequest,
+    GgufHeader,
+};
+use std::time::Instant;
+
+fn parse_arg(name: &str, default: &str) -> String {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value;
+            }
+        }
+    }
+    default.to_string()
+}
+
+fn parse_bool_arg(name: &str, default: bool) -> bool {
+    match parse_arg(name, if default { "true" } else { "false" }).as_str() {
+        "1" | "true" | "yes" => true,
+        "0" | "false" | "no" => false,
+        _ => default,
+    }
+}
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    parse_arg(name, &default.to_string())
+        .parse()
+        .unwrap_or(default)
+}
+
+fn json_escape(value: &str) -> String {
+    value.replace('\\', "\\\\").replace('"', "\\\"")
+}
+
+fn main() {
+    let model_path = parse_arg("--model", "");
+    if model_path.is_empty() {
+        eprintln!(
+            "usage: gguf_continuous_batching_smoke --model <path> [--prompt <text>] [--requests <count>] [--max-new-tokens <count>] [--max-sequences <count>] [--arrival-interval <steps>]"
+        );
+        std::process::exit(2);
+    }
+    let prompt = parse_arg("--prompt", "<s>[INST]Hello[/INST]");
+    let add_bos = parse_bool_arg("--add-bos", false);
+    let parse_special = parse_bool_arg("--parse-special", true);
+    let layer_count = parse_usize_arg("--layers", 40);
+    let request_count = parse_usize_arg("--requests", 8);
+    let max_new_tokens = parse_usize_arg("--max-new-tokens", 16);
+    let max_sequences = parse_usize_arg("--max-sequences", 4).max(1);
+    let arrival_interval = parse_usize_arg("--arrival-interval", 2).max(1);
+    let max_context = parse_usize_arg("--max-context", 512);
+
+    let header = GgufHeader::read(&model_path).expect("read GGUF header");
+    let tokenizer = header.tokenizer_index().expect("tokenizer index");
+    let prompt_rows = tokenizer
+        .encode_byte_bpe_with_special(&prompt, add_bos, parse_special)
+        .expect("encode prompt")
+        .iter()
+        .map(|token_id| *token_id as u64)
+        .collect::<Vec<_>>();
+    // Synthetic workload: rotations of the prompt with a few extra tokens, so
+    // requests differ in content and length.
+    let workload = (0..request_count)
+        .map(|request_index| {
+            prompt_rows
+                .iter()
+                .cycle()
+                .skip(request_index)
+                .take(prompt_rows.len() + request_index % 4)
+                .copied()
+                .collect::<Vec<_>>()
+        })
+        .collect::<Vec<_>>();
+
+    let mut options = GgufDecodeSessionOptions::new(layer_count, max_context);
+    options.max_sequences = max_sequences;
+    options.max_batch_tokens = options.max_batch_tokens.max(max_sequences);
+    let max_batch_tokens = options.max_batch_tokens;
+    let load_start = Instant::now();
+    let mut session = GgufDecodeSession::new(&header, options).expect("build decode session");
+    let load_ms = load_start.elapsed().as_secs_f64() * 1000.0;
+
+    let sequential_start = Instant::now();
+    let sequential = workload
+        .iter()
+        .map(|prompt| {
+            session.reset();
+            session
+                .generate_greedy(prompt, max_new_tokens)
+                .expect("sequential greedy decode")
+        })
+        .collect::<Vec<_>>();
+    let sequential_seconds = sequential_start.elapsed().as_secs_f64();
+
+    let mut scheduler = GgufBatchScheduler::new(session).expect("build scheduler");
+    let mut batched = vec![Vec::new(); request_count];
+    let mut submitted = 0usize;
+    let batched_start = Instant::now();
+    while submitted < request_count || !scheduler.is_idle() {
+        // A new request arrives every `arrival_interval` steps, or at once
+        // when nothing else is running.
+        if submitted < request_count
+            && (scheduler.is_idle()
+                || scheduler.stats().step_count as usize >= submitted * arrival_interval)
+        {
+            scheduler
+                .submit(GgufGenerationRequest::new(
+                    workload[submitted].clone(),
+                    max_new_tokens,
+                ))
+                .expect("submit request");
+            submitted += 1;
+        }
+        for result in scheduler.step().expect("scheduler step") {
+            batched[result.request_id as usize] = result.generated_token_ids;
+        }
+    }
+    let batched_seconds = batched_start.elapsed().as_secs_f64();
+    let stats = scheduler.stats();
+
+    let generated_token_count = sequential.iter().map(Vec::len).sum::<usize>();
+    let tokens_per_second = |seconds: f64| {
+        if seconds > 0.0 {
+            generated_token_count as f64 / seconds
+        } else {
+            0.0
+        }
+    };
+    let sequential_tokens_per_second = tokens_per_second(sequential_seconds);
+    let batched_tokens_per_second = tokens_per_second(batched_seconds);
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"gguf_continuous_batching_smoke\",",
+            "\"model_path\":\"{}\",",
+            "\"session_load_ms\":{:.6},",
+            "\"prompt\":\"{}\",",
+            "\"layer_count\":{},",
+            "\"request_count\":{},",
+            "\"max_new_tokens\":{},",
+            "\"max_sequences\":{},",
+            "\"max_batch_tokens\":{},",
+            "\"arrival_interval_steps\":{},",
+            "\"generated_token_count\":{},",
+            "\"sequential_seconds\":{:.6},",
+            "\"sequential_tokens_per_second\":{:.6},",
+            "\"batched_seconds\":{:.6},",
+            "\"batched_tokens_per_second\":{:.6},",
+            "\"throughput_speedup\":{:.6},",
+            "\"scheduler_step_count\":{},",
+            "\"mean_batch_size\":{:.6},",
+            "\"matches_sequential\":{},",
+            "\"limitations\":[",
+            "\"greedy decoding only\",",
+            "\"timings include prompt prefill\",",
+            "\"CPU execution only\"",
+            "]",
+            "}}"
+        ),
+        json_escape(&model_path),
+        load_ms,
+        json_escape(&prompt),
+        layer_count,
+        request_count,
+        max_new_tokens,
+        max_sequences,
+        max_batch_tokens,
+        arrival_interval,
+        generated_token_count,
+        sequential_seconds,
+        sequential_tokens_per_second,
+        batched_seconds,
+        batched_tokens_per_second,
+        if sequential_tokens_per_second > 0.0 {
+            batched_tokens_per_second / sequential_tokens_per_second
+        } else {
+            0.0
+        },
+        stats.step_count,
+        stats.mean_batch_size(),
+        batched == sequential
+    );
+}
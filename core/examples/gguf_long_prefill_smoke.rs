@@ -0,0 +1,98 @@
+use aeronum_core::{GgufDecodeSession, GgufDecodeSessionOptions, GgufHeader};
+use std::time::Instant;
+
+fn parse_arg(name: &str, default: &str) -> String {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value;
+            }
+        }
+    }
+    default.to_string()
+}
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    parse_arg(name, &default.to_string())
+        .parse()
+        .unwrap_or(default)
+}
+
+fn json_escape(value: &str) -> String {
+    value.replace('\\', "\\\\").replace('"', "\\\"")
+}
+
+fn main() {
+    let model_path = parse_arg("--model", "");
+    if model_path.is_empty() {
+        eprintln!(
+            "usage: gguf_long_prefill_smoke --model <path> [--layers <count>] [--prompt-tokens <count>] [--batch-tokens <count>] [--kv-block-tokens <count>]"
+        );
+        std::process::exit(2);
+    }
+    let layer_count = parse_usize_arg("--layers", 40);
+    let prompt_token_count = parse_usize_arg("--prompt-tokens", 2048).max(1);
+    let batch_tokens = parse_usize_arg("--batch-tokens", 256);
+    let kv_block_tokens = parse_usize_arg("--kv-block-tokens", 64);
+
+    let header = GgufHeader::read(&model_path).expect("read GGUF header");
+    let mut options = GgufDecodeSessionOptions::new(layer_count, prompt_token_count);
+    options.max_batch_tokens = batch_tokens;
+    options.kv_block_tokens = kv_block_tokens;
+    let load_start = Instant::now();
+    let mut session = GgufDecodeSession::new(&header, options).expect("build decode session");
+    let load_ms = load_start.elapsed().as_secs_f64() * 1000.0;
+
+    // A deterministic spread of token ids; attention cost depends only on
+    // the prompt length.
+    let vocab_size = session.vocab_size() as u64;
+    let prompt = (0..prompt_token_count as u64)
+        .map(|index| (index * 7919 + 13) % vocab_size)
+        .collect::<Vec<_>>();
+
+    let prefill_start = Instant::now();
+    let logits = session.prefill(&prompt).expect("prefill prompt");
+    let prefill_seconds = prefill_start.elapsed().as_secs_f64();
+    let next_token_id = logits
+        .iter()
+        .enumerate()
+        .fold((0usize, f64::NEG_INFINITY), |best, (index, value)| {
+            if *value > best.1 {
+                (index, *value)
+            } else {
+                best
+            }
+        })
+        .0;
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"gguf_long_prefill_smoke\",",
+            "\"model_path\":\"{}\",",
+            "\"session_load_ms\":{:.6},",
+            "\"layer_count\":{},",
+            "\"prompt_token_count\":{},",
+            "\"batch_tokens\":{},",
+            "\"kv_block_tokens\":{},",
+            "\"prefill_seconds\":{:.6},",
+            "\"prefill_tokens_per_second\":{:.6},",
+            "\"next_token_id\":{},",
+            "\"limitations\":[",
+            "\"synthetic prompt token ids\",",
+            "\"CPU execution only\"",
+            "]",
+            "}}"
+        ),
+        json_escape(&model_path),
+        load_ms,
+        layer_count,
+        prompt_token_count,
+        batch_tokens,
+        kv_block_tokens,
+        prefill_seconds,
+        prompt_token_count as f64 / prefill_seconds.max(f64::MIN_POSITIVE),
+        next_token_id
+    );
+}
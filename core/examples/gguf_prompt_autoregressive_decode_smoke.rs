@@ -1,5 +1,6 @@
 use aeronum_core::{
-    GgufHeader, GgufLayerExecutionSummary, GgufMultiLayerFinalLogitsSample, GgufQuantizedLogitValue,
+    GgufHeader, GgufLayerExecutionSummary, GgufMultiLayerFinalLogitsSample,
+    GgufQuantizedLogitValue, GgufSampler, GgufSamplerOptions, GgufSamplingCandidate,
 };
 use std::time::Instant;
 
@@ -144,70 +145,23 @@ fn json_layer_array(values: &[GgufLayerExecutionSummary]) -> String {
     format!("[{items}]")
 }
 
-fn splitmix64_next(seed: &mut u64) -> u64 {
-    *seed = seed.wrapping_add(0x9E3779B97F4A7C15);
-    let mut value = *seed;
-    value = (value ^ (value >> 30)).wrapping_mul(0xBF58476D1CE4E5B9);
-    value = (value ^ (value >> 27)).wrapping_mul(0x94D049BB133111EB);
-    value ^ (value >> 31)
-}
-
-fn splitmix64_unit(seed: &mut u64) -> f64 {
-    let value = splitmix64_next(seed) >> 11;
-    (value as f64) * (1.0 / ((1u64 << 53) as f64))
-}
-
-fn sampling_probabilities(values: &[GgufQuantizedLogitValue], temperature: f64) -> Vec<f64> {
-    if values.is_empty() {
-        return Vec::new();
-    }
-    let max_value = values
-        .iter()
-        .map(|value| value.value as f64 / temperature)
-        .fold(f64::NEG_INFINITY, f64::max);
-    let weights = values
+fn probability_for_token(candidates: &[GgufSamplingCandidate], token_id: u64) -> f64 {
+    candidates
         .iter()
-        .map(|value| ((value.value as f64 / temperature) - max_value).exp())
-        .collect::<Vec<_>>();
-    let weight_sum = weights.iter().sum::<f64>();
-    weights
-        .iter()
-        .map(|weight| {
-            if weight_sum > 0.0 {
-                weight / weight_sum
-            } else {
-                1.0 / values.len() as f64
-            }
-        })
-        .collect()
-}
-
-fn choose_sampled_index(probabilities: &[f64], draw: f64) -> usize {
-    let mut cumulative_probability = 0.0f64;
-    for (index, probability) in probabilities.iter().enumerate() {
-        cumulative_probability += *probability;
-        if draw <= cumulative_probability {
-            return index;
-        }
-    }
-    probabilities.len().saturating_sub(1)
+        .find(|candidate| candidate.token_id == token_id)
+        .map(|candidate| candidate.probability)
+        .unwrap_or(0.0)
 }
 
-fn probability_for_token(
-    values: &[GgufQuantizedLogitValue],
-    probabilities: &[f64],
-    token_id: u64,
+fn cumulative_probability_for_index(
+    candidates: &[GgufSamplingCandidate],
+    selected_index: usize,
 ) -> f64 {
-    values
+    candidates
         .iter()
-        .zip(probabilities.iter())
-        .find(|(value, _)| value.row_index == token_id)
-        .map(|(_, probability)| *probability)
-        .unwrap_or(0.0)
-}
-
-fn cumulative_probability_for_index(probabilities: &[f64], selected_index: usize) -> f64 {
-    probabilities.iter().take(selected_index + 1).sum::<f64>()
+        .take(selected_index + 1)
+        .map(|candidate| candidate.probability)
+        .sum::<f64>()
 }
 
 fn decode_step_json(
@@ -325,7 +279,17 @@ fn main() {
         std::process::exit(2);
     }
     let initial_seed = parse_u64_arg("--seed", 12345);
-    let mut sampling_seed = initial_seed;
+    // Top-k scope samples the sorted top-k logits; full-vocab scope samples
+    // every logit in token order.
+    let mut sampler = GgufSampler::new(GgufSamplerOptions {
+        top_k: if decode_mode == "sample" && sampling_scope == "full-vocab" {
+            0
+        } else {
+            top_k
+        },
+        ..GgufSamplerOptions::new(temperature, initial_seed)
+    })
+    .expect("build sampler");
     let input_tensor = parse_arg("--input-tensor", "token_embd.weight");
     let final_norm_tensor = parse_arg("--final-norm-tensor", "output_norm.weight");
     let output_tensor = parse_arg("--output-tensor", "output.weight");
@@ -372,26 +336,29 @@ fn main() {
         let top_token_pieces = tokenizer
             .decode_ids(&top_token_ids)
             .expect("decode top token ids");
-        let sampling_source = if decode_mode == "sample" && sampling_scope == "full-vocab" {
-            &sample.logits
-        } else {
-            &sample.top_logits
-        };
-        let sampling_probabilities = sampling_probabilities(sampling_source, temperature);
-        let seed_before = sampling_seed;
-        let sample_draw = if decode_mode == "sample" {
-            splitmix64_unit(&mut sampling_seed)
-        } else {
-            0.0
-        };
-        let seed_after = sampling_seed;
-        let selected_source_index = if decode_mode == "sample" {
-            choose_sampled_index(&sampling_probabilities, sample_draw)
+        let full_logits = sample
+            .logits
+            .iter()
+            .map(|value| value.value)
+            .collect::<Vec<_>>();
+        let seed_before = sampler.rng_state();
+        let (generated_token_id, sample_draw) = if decode_mode == "sample" {
+            let token_id = sampler
+                .sample(&full_logits, &[])
+                .expect("sample next token");
+            (token_id as u32, sampler.last_draw())
         } else {
-            0
+            let candidates = sampler
+                .prepare(&full_logits, &[])
+                .expect("prepare sampling candidates");
+            (candidates[0].token_id as u32, 0.0)
         };
-        let selected_value = &sampling_source[selected_source_index];
-        let generated_token_id = selected_value.row_index as u32;
+        let seed_after = sampler.rng_state();
+        let sampling_candidates = sampler.candidates();
+        let selected_source_index = sampling_candidates
+            .iter()
+            .position(|candidate| candidate.token_id == generated_token_id as u64)
+            .expect("selected token is a sampling candidate");
         let generated_piece = tokenizer
             .decode_ids(&[generated_token_id])
             .expect("decode selected token id")[0]
@@ -401,13 +368,11 @@ fn main() {
         let top_token_probabilities = sample
             .top_logits
             .iter()
-            .map(|value| {
-                probability_for_token(sampling_source, &sampling_probabilities, value.row_index)
-            })
+            .map(|value| probability_for_token(sampling_candidates, value.row_index))
             .collect::<Vec<_>>();
-        let selected_probability = sampling_probabilities[selected_source_index];
+        let selected_probability = sampling_candidates[selected_source_index].probability;
         let selected_cumulative_probability =
-            cumulative_probability_for_index(&sampling_probabilities, selected_source_index);
+            cumulative_probability_for_index(sampling_candidates, selected_source_index);
         let elapsed_ms = step_start.elapsed().as_secs_f64() * 1000.0;
         step_json_values.push(decode_step_json(
             step_index,
@@ -417,7 +382,7 @@ fn main() {
             seed_before,
             seed_after,
             sample_draw,
-            sampling_source.len(),
+            sampling_candidates.len(),
             selected_probability,
             selected_cumulative_probability,
             &context_token_ids,
@@ -507,7 +472,7 @@ fn main() {
         top_k,
         temperature,
         initial_seed,
-        sampling_seed,
+        sampler.rng_state(),
         generated_token_ids.len(),
         generated_tokens_per_second,
         json_u32_array(&generated_token_ids),
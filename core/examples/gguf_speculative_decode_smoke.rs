@@ -0,0 +1,159 @@
+use aeronum_core::{GgufDecodeSession, GgufDecodeSessionOptions, GgufHeader};
+use std::time::Instant;
+
+fn parse_arg(name: &str, default: &str) -> String {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value;
+            }
+        }
+    }
+    default.to_string()
+}
+
+fn parse_bool_arg(name: &str, default: bool) -> bool {
+    match parse_arg(name, if default { "true" } else { "false" }).as_str() {
+        "1" | "true" | "yes" => true,
+        "0" | "false" | "no" => false,
+        _ => default,
+    }
+}
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    parse_arg(name, &default.to_string())
+        .parse()
+        .unwrap_or(default)
+}
+
+fn json_escape(value: &str) -> String {
+    value.replace('\\', "\\\\").replace('"', "\\\"")
+}
+
+fn json_u64_array(values: &[u64]) -> String {
+    let items = values
+        .iter()
+        .map(u64::to_string)
+        .collect::<Vec<_>>()
+        .join(",");
+    format!("[{items}]")
+}
+
+fn main() {
+    let model_path = parse_arg("--model", "");
+    if model_path.is_empty() {
+        eprintln!(
+            "usage: gguf_speculative_decode_smoke --model <path> [--prompt <text>] [--max-new-tokens <count>] [--draft-layers <count>] [--draft-length <count>]"
+        );
+        std::process::exit(2);
+    }
+    let prompt = parse_arg("--prompt", "<s>[INST]Hello[/INST]");
+    let add_bos = parse_bool_arg("--add-bos", false);
+    let parse_special = parse_bool_arg("--parse-special", true);
+    let layer_count = parse_usize_arg("--layers", 40);
+    let draft_layer_count = parse_usize_arg("--draft-layers", layer_count / 4);
+    let draft_length = parse_usize_arg("--draft-length", 4);
+    let max_new_tokens = parse_usize_arg("--max-new-tokens", 16);
+    let max_context = parse_usize_arg("--max-context", 512);
+
+    let header = GgufHeader::read(&model_path).expect("read GGUF header");
+    let tokenizer = header.tokenizer_index().expect("tokenizer index");
+    let prompt_token_ids = tokenizer
+        .encode_byte_bpe_with_special(&prompt, add_bos, parse_special)
+        .expect("encode prompt");
+    let prompt_rows = prompt_token_ids
+        .iter()
+        .map(|token_id| *token_id as u64)
+        .collect::<Vec<_>>();
+    let mut options = GgufDecodeSessionOptions::new(layer_count, max_context);
+    options.max_batch_tokens = draft_length + 1;
+
+    let load_start = Instant::now();
+    let mut session = GgufDecodeSession::new(&header, options).expect("build decode session");
+    let load_ms = load_start.elapsed().as_secs_f64() * 1000.0;
+
+    let baseline_start = Instant::now();
+    let baseline = session
+        .generate_greedy(&prompt_rows, max_new_tokens)
+        .expect("greedy decode");
+    let baseline_seconds = baseline_start.elapsed().as_secs_f64();
+
+    session.reset();
+    let speculative_start = Instant::now();
+    let sample = session
+        .generate_speculative(
+            &prompt_rows,
+            max_new_tokens,
+            draft_layer_count,
+            draft_length,
+        )
+        .expect("speculative decode");
+    let speculative_seconds = speculative_start.elapsed().as_secs_f64();
+    let generated_token_ids = sample
+        .generated_token_ids
+        .iter()
+        .map(|token_id| *token_id as u32)
+        .collect::<Vec<_>>();
+    let generated_text = tokenizer
+        .decode_byte_bpe_text(&generated_token_ids)
+        .expect("decode generated token text");
+    let baseline_tokens_per_second = if baseline_seconds > 0.0 {
+        baseline.len() as f64 / baseline_seconds
+    } else {
+        0.0
+    };
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"gguf_speculative_decode_smoke\",",
+            "\"model_path\":\"{}\",",
+            "\"session_load_ms\":{:.6},",
+            "\"prompt\":\"{}\",",
+            "\"prompt_token_count\":{},",
+            "\"layer_count\":{},",
+            "\"draft_layer_count\":{},",
+            "\"draft_length\":{},",
+            "\"max_new_tokens\":{},",
+            "\"verify_pass_count\":{},",
+            "\"drafted_token_count\":{},",
+            "\"accepted_token_count\":{},",
+            "\"acceptance_rate\":{:.6},",
+            "\"speculative_decode_seconds\":{:.6},",
+            "\"effective_tokens_per_second\":{:.6},",
+            "\"speculative_end_to_end_seconds\":{:.6},",
+            "\"baseline_greedy_end_to_end_seconds\":{:.6},",
+            "\"baseline_end_to_end_tokens_per_second\":{:.6},",
+            "\"matches_greedy\":{},",
+            "\"generated_token_ids\":{},",
+            "\"generated_text\":\"{}\",",
+            "\"limitations\":[",
+            "\"greedy decoding only\",",
+            "\"effective_tokens_per_second excludes prompt prefill; end-to-end timings include it\",",
+            "\"CPU execution only\"",
+            "]",
+            "}}"
+        ),
+        json_escape(&model_path),
+        load_ms,
+        json_escape(&prompt),
+        prompt_rows.len(),
+        layer_count,
+        sample.draft_layer_count,
+        sample.draft_length,
+        max_new_tokens,
+        sample.verify_pass_count,
+        sample.drafted_token_count,
+        sample.accepted_token_count,
+        sample.acceptance_rate,
+        sample.decode_seconds,
+        sample.effective_tokens_per_second,
+        speculative_seconds,
+        baseline_seconds,
+        baseline_tokens_per_second,
+        baseline == sample.generated_token_ids,
+        json_u64_array(&sample.generated_token_ids),
+        json_escape(&generated_text)
+    );
+}
@@ -0,0 +1,136 @@
+use aeronum_core::NdArray;
+use std::time::Instant;
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn filled(shape: &[usize], seed: f32) -> NdArray {
+    let len = shape.iter().product::<usize>();
+    NdArray::from_list(
+        (0..len)
+            .map(|index| ((index % 97) as f32 + seed) * 0.25)
+            .collect(),
+        Some(shape),
+    )
+}
+
+/// The per-element path `NdArray::add` used before strided iteration: every
+/// output position is unraveled into a fresh index vector, mapped into each
+/// operand with another, and read through `get`.
+fn legacy_add(left: &NdArray, right: &NdArray, out_shape: &[usize]) -> Vec<f32> {
+    let broadcast_get = |array: &NdArray, index: &[usize]| {
+        let lead = index.len() - array.shape().len();
+        let own = array
+            .shape()
+            .iter()
+            .enumerate()
+            .map(|(axis, dim)| if *dim == 1 { 0 } else { index[lead + axis] })
+            .collect::<Vec<_>>();
+        array.get(&own).expect("broadcast index")
+    };
+    let len = out_shape.iter().product::<usize>();
+    (0..len)
+        .map(|mut linear| {
+            let mut index = vec![0usize; out_shape.len()];
+            for axis in (0..out_shape.len()).rev() {
+                index[axis] = linear % out_shape[axis];
+                linear /= out_shape[axis];
+            }
+            broadcast_get(left, &index) + broadcast_get(right, &index)
+        })
+        .collect()
+}
+
+fn median_ms(runs: usize, mut run: impl FnMut()) -> f64 {
+    run();
+    let mut times = (0..runs)
+        .map(|_| {
+            let start = Instant::now();
+            run();
+            start.elapsed().as_secs_f64() * 1000.0
+        })
+        .collect::<Vec<_>>();
+    times.sort_by(f64::total_cmp);
+    times[times.len() / 2]
+}
+
+fn main() {
+    let n = parse_usize_arg("--n", 1024);
+    let runs = parse_usize_arg("--runs", 5).max(1);
+
+    let matrix = filled(&[n, n], 1.0);
+    let other = filled(&[n, n], 2.0);
+    let cases = [
+        ("contiguous_same_shape", matrix.clone(), other.clone()),
+        ("broadcast_row", matrix.clone(), filled(&[1, n], 3.0)),
+        ("broadcast_column", filled(&[n, 1], 4.0), matrix.clone()),
+        ("broadcast_scalar", matrix.clone(), filled(&[], 5.0)),
+        (
+            "transposed_view",
+            matrix.view(&[n, n], &[1, n as isize], 0),
+            other.clone(),
+        ),
+        (
+            "rank3_trailing_vector",
+            filled(&[16, n / 16, n], 6.0),
+            filled(&[n], 7.0),
+        ),
+    ];
+
+    let mut rows = Vec::with_capacity(cases.len());
+    for (name, left, right) in &cases {
+        let strided = left.add(right);
+        let out_shape = strided.shape().to_vec();
+        let legacy = legacy_add(left, right, &out_shape);
+        assert_eq!(strided.to_vec(), legacy, "{name} results differ");
+
+        let elements = strided.len();
+        let strided_ms = median_ms(runs, || {
+            std::hint::black_box(left.add(right));
+        });
+        let legacy_ms = median_ms(runs, || {
+            std::hint::black_box(legacy_add(left, right, &out_shape));
+        });
+        rows.push(format!(
+            concat!(
+                "{{\"case\":\"{}\",\"shape\":{:?},\"elements\":{},",
+                "\"strided_ms\":{:.6},\"legacy_ms\":{:.6},",
+                "\"strided_ns_per_element\":{:.6},\"speedup\":{:.3}}}"
+            ),
+            name,
+            out_shape,
+            elements,
+            strided_ms,
+            legacy_ms,
+            strided_ms * 1e6 / elements as f64,
+            legacy_ms / strided_ms.max(f64::MIN_POSITIVE),
+        ));
+    }
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"ndarray_elementwise\",",
+            "\"n\":{},",
+            "\"runs\":{},",
+            "\"cases\":[{}],",
+            "\"limitations\":[",
+            "\"legacy path is re-created through the public get API\",",
+            "\"single-threaded CPU execution\"",
+            "]",
+            "}}"
+        ),
+        n,
+        runs,
+        rows.join(",")
+    );
+}
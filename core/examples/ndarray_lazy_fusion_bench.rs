@@ -0,0 +1,147 @@
+use aeronum_core::{LazyArray, NdArray};
+use std::time::Instant;
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn filled(shape: &[usize], seed: usize) -> NdArray {
+    let len = shape.iter().product::<usize>();
+    NdArray::from_list(
+        (0..len)
+            .map(|index| ((index * seed % 97) as f32 - 48.0) / 32.0)
+            .collect(),
+        Some(shape),
+    )
+}
+
+fn scalar(value: f32) -> NdArray {
+    NdArray::from_list(vec![value], Some(&[]))
+}
+
+fn median_ms(runs: usize, mut run: impl FnMut()) -> f64 {
+    run();
+    let mut times = (0..runs)
+        .map(|_| {
+            let start = Instant::now();
+            run();
+            start.elapsed().as_secs_f64() * 1000.0
+        })
+        .collect::<Vec<_>>();
+    times.sort_by(f64::total_cmp);
+    times[times.len() / 2]
+}
+
+fn main() {
+    let rows = parse_usize_arg("--rows", 1024);
+    let columns = parse_usize_arg("--columns", 1024);
+    let runs = parse_usize_arg("--runs", 5).max(1);
+
+    let x = filled(&[rows, columns], 5);
+    let mean = filled(&[rows, 1], 7);
+    let variance = filled(&[rows, 1], 11).mul(&filled(&[rows, 1], 11));
+    let gamma = filled(&[columns], 13);
+    let beta = filled(&[columns], 17);
+
+    // Layer norm affine step: (x - mean) / sqrt(var + eps) * gamma + beta.
+    let eager_norm = || {
+        let eps = scalar(1e-5);
+        let std = variance.add(&eps).to_vec();
+        let std = NdArray::from_list(std.iter().map(|v| v.sqrt()).collect(), Some(&[rows, 1]));
+        x.sub(&mean).div(&std).mul(&gamma).add(&beta)
+    };
+    let lazy_norm = || {
+        x.lazy()
+            .sub(&mean.lazy())
+            .div(&variance.lazy().add(&LazyArray::scalar(1e-5)).sqrt())
+            .mul(&gamma.lazy())
+            .add(&beta.lazy())
+            .eval()
+    };
+    // Tanh GELU: 0.5 x (1 + tanh(0.79788456 (x + 0.044715 x^3))).
+    let eager_gelu = || {
+        let cube = x.mul(&x).mul(&x);
+        let inner = x
+            .add(&cube.mul(&scalar(0.044715)))
+            .mul(&scalar(0.797_884_6));
+        let tanh = inner.to_vec();
+        let tanh = NdArray::from_list(
+            tanh.iter().map(|v| v.tanh()).collect(),
+            Some(&[rows, columns]),
+        );
+        x.mul(&scalar(0.5)).mul(&tanh.add(&scalar(1.0)))
+    };
+    let lazy_gelu = || {
+        let x = x.lazy();
+        let cube = x.mul(&x).mul(&x);
+        let inner = x
+            .add(&cube.mul(&LazyArray::scalar(0.044715)))
+            .mul(&LazyArray::scalar(0.797_884_6))
+            .tanh();
+        x.mul(&LazyArray::scalar(0.5))
+            .mul(&inner.add(&LazyArray::scalar(1.0)))
+            .eval()
+    };
+
+    let elements = rows * columns;
+    type Case<'a> = (
+        &'a str,
+        usize,
+        &'a dyn Fn() -> NdArray,
+        &'a dyn Fn() -> NdArray,
+    );
+    let cases: [Case; 2] = [
+        ("layer_norm_affine", 4, &eager_norm, &lazy_norm),
+        ("tanh_gelu", 10, &eager_gelu, &lazy_gelu),
+    ];
+    let mut results = Vec::with_capacity(cases.len());
+    for (name, eager_temporaries, eager, lazy) in cases {
+        assert_eq!(eager(), lazy(), "{name} results differ");
+        let eager_ms = median_ms(runs, || {
+            std::hint::black_box(eager());
+        });
+        let lazy_ms = median_ms(runs, || {
+            std::hint::black_box(lazy());
+        });
+        results.push(format!(
+            concat!(
+                "{{\"case\":\"{}\",\"eager_ms\":{:.6},\"lazy_ms\":{:.6},",
+                "\"eager_full_size_arrays\":{},\"lazy_full_size_arrays\":1,\"speedup\":{:.3}}}"
+            ),
+            name,
+            eager_ms,
+            lazy_ms,
+            eager_temporaries,
+            eager_ms / lazy_ms.max(f64::MIN_POSITIVE),
+        ));
+    }
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"ndarray_lazy_fusion\",",
+            "\"shape\":[{},{}],",
+            "\"elements\":{},",
+            "\"runs\":{},",
+            "\"cases\":[{}],",
+            "\"limitations\":[",
+            "\"eager unary steps go through to_vec since NdArray has no eager tanh or sqrt\",",
+            "\"full-size array counts are per evaluation and exclude the inputs\"",
+            "]",
+            "}}"
+        ),
+        rows,
+        columns,
+        elements,
+        runs,
+        results.join(",")
+    );
+}
@@ -0,0 +1,117 @@
+use aeronum_core::NdArray;
+use std::time::Instant;
+
+fn parse_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn summarize(values: &[f64]) -> (f64, f64, f64, f64) {
+    let mean = values.iter().sum::<f64>() / values.len() as f64;
+    let mut sorted = values.to_vec();
+    sorted.sort_by(|a, b| a.partial_cmp(b).unwrap());
+    let median = if sorted.len().is_multiple_of(2) {
+        (sorted[sorted.len() / 2 - 1] + sorted[sorted.len() / 2]) * 0.5
+    } else {
+        sorted[sorted.len() / 2]
+    };
+    let min = sorted[0];
+    let max = sorted[sorted.len() - 1];
+    (mean, median, min, max)
+}
+
+fn main() {
+    let min_n = parse_arg("--min-n", 256);
+    let max_n = parse_arg("--max-n", 4096);
+    let runs = parse_arg("--runs", 5).max(1);
+    let warmup = parse_arg("--warmup", 1);
+    let threads = std::thread::available_parallelism().map_or(1, usize::from);
+
+    let mut n = min_n.max(1);
+    while n <= max_n {
+        let a = NdArray::ones(&[n, n]);
+        let b = NdArray::ones(&[n, n]);
+        // `b.transpose()` is a strided view; the GEMM packs it in place.
+        for (layout, b) in [("contiguous", b.clone()), ("transposed_b", b.transpose())] {
+            for _ in 0..warmup {
+                std::hint::black_box(a.matmul(&b));
+            }
+            let mut run_ms = Vec::with_capacity(runs);
+            let mut out = None;
+            for _ in 0..runs {
+                let start = Instant::now();
+                out = Some(std::hint::black_box(a.matmul(&b)));
+                run_ms.push(start.elapsed().as_secs_f64() * 1000.0);
+            }
+
+            let out = out.expect("measured matmul").to_vec();
+            let expected = n as f32;
+            let stride = (out.len() / 4096).max(1);
+            let valid = out
+                .iter()
+                .step_by(stride)
+                .all(|value| (*value - expected).abs() < 1e-3);
+            assert!(valid, "sampled matmul output mismatch");
+
+            let (mean_ms, median_ms, min_ms, max_ms) = summarize(&run_ms);
+            let flops = 2.0 * (n as f64).powi(3);
+            let median_gflops = (flops / (median_ms / 1000.0)) / 1e9;
+
+            println!(
+                "aeronum_core_cpu_sgemm: n={} layout={} runs={} median_ms={:.6} median_gflops={:.3}",
+                n, layout, runs, median_ms, median_gflops
+            );
+            println!(
+                "{{\"backend\":\"aeronum_core_cpu\",\"kernel\":\"ndarray_matmul\",\"layout\":\"{}\",\"n\":{},\"threads\":{},\"runs\":{},\"warmup\":{},\"mean_ms\":{:.6},\"median_ms\":{:.6},\"min_ms\":{:.6},\"max_ms\":{:.6},\"median_gflops\":{:.6},\"validation\":\"sampled_all_ones_expected_n\"}}",
+                layout, n, threads, runs, warmup, mean_ms, median_ms, min_ms, max_ms, median_gflops
+            );
+        }
+        n *= 2;
+    }
+
+    // Attention scores for a whole batch in one call: q @ k^T with k^T a
+    // permuted view, batches spread across threads.
+    let (batch, heads, seq, head_dim) = (
+        parse_arg("--batch", 4),
+        parse_arg("--heads", 8),
+        parse_arg("--seq", 256),
+        parse_arg("--head-dim", 64),
+    );
+    let q = NdArray::ones(&[batch, heads, seq, head_dim]);
+    let k = NdArray::ones(&[batch, heads, seq, head_dim]).permute(&[0, 1, 3, 2]);
+    for _ in 0..warmup {
+        std::hint::black_box(q.batched_matmul(&k));
+    }
+    let mut run_ms = Vec::with_capacity(runs);
+    let mut out = None;
+    for _ in 0..runs {
+        let start = Instant::now();
+        out = Some(std::hint::black_box(q.batched_matmul(&k)));
+        run_ms.push(start.elapsed().as_secs_f64() * 1000.0);
+    }
+    let out = out.expect("measured batched matmul").to_vec();
+    assert!(
+        out.iter()
+            .step_by((out.len() / 4096).max(1))
+            .all(|value| (*value - head_dim as f32).abs() < 1e-3),
+        "sampled batched matmul output mismatch"
+    );
+    let (mean_ms, median_ms, min_ms, max_ms) = summarize(&run_ms);
+    let flops = 2.0 * (batch * heads * seq * seq * head_dim) as f64;
+    let median_gflops = (flops / (median_ms / 1000.0)) / 1e9;
+    println!(
+        "aeronum_core_cpu_batched_sgemm: shape=[{},{},{},{}] runs={} median_ms={:.6} median_gflops={:.3}",
+        batch, heads, seq, head_dim, runs, median_ms, median_gflops
+    );
+    println!(
+        "{{\"backend\":\"aeronum_core_cpu\",\"kernel\":\"ndarray_batched_matmul\",\"layout\":\"attention_scores\",\"batch\":{},\"heads\":{},\"seq\":{},\"head_dim\":{},\"threads\":{},\"runs\":{},\"warmup\":{},\"mean_ms\":{:.6},\"median_ms\":{:.6},\"min_ms\":{:.6},\"max_ms\":{:.6},\"median_gflops\":{:.6},\"validation\":\"sampled_all_ones_expected_head_dim\"}}",
+        batch, heads, seq, head_dim, threads, runs, warmup, mean_ms, median_ms, min_ms, max_ms, median_gflops
+    );
+}
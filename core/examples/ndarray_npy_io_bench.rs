@@ -0,0 +1,122 @@
+use aeronum_core::NdArray;
+use std::time::Instant;
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn elapsed_ms(start: Instant) -> f64 {
+    start.elapsed().as_secs_f64() * 1000.0
+}
+
+fn main() {
+    let rows = parse_usize_arg("--rows", 4096);
+    let columns = parse_usize_arg("--columns", 4096);
+    let keep = parse_usize_arg("--keep", 0) != 0;
+    let dir = std::env::temp_dir();
+    let npy_path = dir.join(format!("aeronum-npy-bench-{}.npy", std::process::id()));
+    let npz_path = dir.join(format!("aeronum-npz-bench-{}.npz", std::process::id()));
+
+    let array = NdArray::from_list(
+        (0..rows * columns)
+            .map(|index| ((index * 7919 % 10007) as f32) * 1e-3)
+            .collect(),
+        Some(&[rows, columns]),
+    );
+    let bias = NdArray::from_list((0..columns).map(|i| i as f32).collect(), Some(&[columns]));
+    let bytes = rows * columns * 4;
+
+    let start = Instant::now();
+    array.save_npy(&npy_path).expect("save npy");
+    let save_ms = elapsed_ms(start);
+    let start = Instant::now();
+    array
+        .transpose()
+        .save_npy(&npy_path)
+        .expect("save transposed npy");
+    let save_transposed_ms = elapsed_ms(start);
+    array.save_npy(&npy_path).expect("save npy");
+
+    let start = Instant::now();
+    let loaded = NdArray::load_npy(&npy_path).expect("load npy");
+    let load_ms = elapsed_ms(start);
+    let start = Instant::now();
+    // SAFETY: nothing rewrites the file until the bench removes it at exit.
+    let mapped = unsafe { NdArray::map_npy(&npy_path) }.expect("map npy");
+    let map_ms = elapsed_ms(start);
+    let start = Instant::now();
+    let total = mapped.sum(None, false).to_vec()[0];
+    let first_pass_ms = elapsed_ms(start);
+    let start = Instant::now();
+    let copied = std::fs::read(&npy_path).expect("read npy");
+    let read_copy_ms = elapsed_ms(start);
+    assert_eq!(loaded, array);
+    assert_eq!(mapped, array);
+    assert_eq!(copied.len(), bytes + 128);
+
+    let start = Instant::now();
+    NdArray::save_npz(&npz_path, &[("weight", &array), ("bias", &bias)]).expect("save npz");
+    let save_npz_ms = elapsed_ms(start);
+    let start = Instant::now();
+    let archive = NdArray::load_npz(&npz_path).expect("load npz");
+    let load_npz_ms = elapsed_ms(start);
+    let start = Instant::now();
+    // SAFETY: as above, the archive is left alone while it is mapped.
+    let mapped_archive = unsafe { NdArray::map_npz(&npz_path) }.expect("map npz");
+    let map_npz_ms = elapsed_ms(start);
+    assert_eq!(mapped_archive, archive);
+    assert_eq!(archive[0].1, array);
+    assert_eq!(archive[1].1, bias);
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"ndarray_npy_io\",",
+            "\"shape\":[{},{}],",
+            "\"payload_bytes\":{},",
+            "\"save_npy_ms\":{:.6},",
+            "\"save_npy_transposed_ms\":{:.6},",
+            "\"load_npy_ms\":{:.6},",
+            "\"map_npy_ms\":{:.6},",
+            "\"map_npy_first_pass_ms\":{:.6},",
+            "\"read_to_vec_ms\":{:.6},",
+            "\"save_npz_ms\":{:.6},",
+            "\"load_npz_ms\":{:.6},",
+            "\"map_npz_ms\":{:.6},",
+            "\"checksum\":{:.3},",
+            "\"limitations\":[",
+            "\"files are hot in the page cache after saving\",",
+            "\"map times exclude page faults, which the first pass pays\"",
+            "]",
+            "}}"
+        ),
+        rows,
+        columns,
+        bytes,
+        save_ms,
+        save_transposed_ms,
+        load_ms,
+        map_ms,
+        first_pass_ms,
+        read_copy_ms,
+        save_npz_ms,
+        load_npz_ms,
+        map_npz_ms,
+        total,
+    );
+
+    if keep {
+        eprintln!("kept {} and {}", npy_path.display(), npz_path.display());
+    } else {
+        let _ = std::fs::remove_file(npy_path);
+        let _ = std::fs::remove_file(npz_path);
+    }
+}
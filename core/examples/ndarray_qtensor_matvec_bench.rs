@@ -0,0 +1,131 @@
+use aeronum_core::{NdArray, QTensor, QuantFormat};
+use std::time::Instant;
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn median_ms(runs: usize, mut run: impl FnMut()) -> f64 {
+    run();
+    let mut times = (0..runs)
+        .map(|_| {
+            let start = Instant::now();
+            run();
+            start.elapsed().as_secs_f64() * 1000.0
+        })
+        .collect::<Vec<_>>();
+    times.sort_by(f64::total_cmp);
+    times[times.len() / 2]
+}
+
+/// Pseudo-random blocks with a small fixed super-block scale, so every
+/// weight is finite.
+fn synthetic_blocks(format: QuantFormat, blocks: usize) -> Vec<u8> {
+    let mut state = 0x9e37_79b9_7f4a_7c15u64;
+    let mut bytes = (0..blocks * format.block_bytes())
+        .map(|_| {
+            state = state
+                .wrapping_mul(6364136223846793005)
+                .wrapping_add(1442695040888963407);
+            (state >> 33) as u8
+        })
+        .collect::<Vec<_>>();
+    for block in bytes.chunks_exact_mut(format.block_bytes()) {
+        match format {
+            QuantFormat::Q4K => {
+                block[0..2].copy_from_slice(&0x1c00u16.to_le_bytes());
+                block[2..4].copy_from_slice(&0x2000u16.to_le_bytes());
+            }
+            QuantFormat::Q6K => block[208..210].copy_from_slice(&0x1c00u16.to_le_bytes()),
+        }
+    }
+    bytes
+}
+
+fn main() {
+    let rows = parse_usize_arg("--rows", 4096);
+    let columns = parse_usize_arg("--columns", 4096).next_multiple_of(256);
+    let batch = parse_usize_arg("--batch", 8).max(1);
+    let runs = parse_usize_arg("--runs", 5).max(1);
+
+    let inputs = NdArray::from_list(
+        (0..batch * columns)
+            .map(|index| ((index * 37 % 101) as f32 - 50.0) / 50.0)
+            .collect(),
+        Some(&[batch, columns]),
+    );
+    let input = inputs.slice_axis(0, 0..1);
+
+    let mut results = Vec::new();
+    for format in [QuantFormat::Q4K, QuantFormat::Q6K] {
+        let weight = QTensor::from_bytes(
+            format,
+            [rows, columns],
+            synthetic_blocks(format, rows * columns / 256),
+        );
+        let dense = weight.dequantize();
+        let dense_t = dense.transpose();
+        let expected = input.matmul(&dense_t).to_vec();
+        let actual = input.matmul_quantized(&weight).to_vec();
+        let max_abs_diff = expected
+            .iter()
+            .zip(&actual)
+            .map(|(expected, actual)| (expected - actual).abs())
+            .fold(0.0f32, f32::max);
+
+        for (case, x) in [("matvec", &input), ("batched", &inputs)] {
+            let dense_ms = median_ms(runs, || {
+                std::hint::black_box(x.matmul(&dense_t));
+            });
+            let quantized_ms = median_ms(runs, || {
+                std::hint::black_box(x.matmul_quantized(&weight));
+            });
+            results.push(format!(
+                concat!(
+                    "{{\"format\":\"{:?}\",\"case\":\"{}\",\"rows\":{},",
+                    "\"dense_f32_ms\":{:.6},\"quantized_ms\":{:.6},",
+                    "\"dense_weight_bytes\":{},\"quantized_weight_bytes\":{},",
+                    "\"quantized_weight_gb_per_s\":{:.3},\"max_abs_diff\":{:.3e}}}"
+                ),
+                format,
+                case,
+                x.shape()[0],
+                dense_ms,
+                quantized_ms,
+                rows * columns * 4,
+                weight.nbytes(),
+                weight.nbytes() as f64 / (quantized_ms / 1000.0) / 1e9,
+                max_abs_diff,
+            ));
+        }
+    }
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"ndarray_qtensor_matvec\",",
+            "\"weight_shape\":[{},{}],",
+            "\"runs\":{},",
+            "\"threads\":{},",
+            "\"cases\":[{}],",
+            "\"limitations\":[",
+            "\"synthetic blocks with fixed super-block scales\",",
+            "\"dense baseline multiplies a transposed view of the dequantized weights\"",
+            "]",
+            "}}"
+        ),
+        rows,
+        columns,
+        runs,
+        std::thread::available_parallelism().map_or(1, usize::from),
+        results.join(",")
+    );
+}
@@ -0,0 +1,98 @@
+use aeronum_core::{NdArray, Reduction};
+use std::time::Instant;
+
+fn parse_usize_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn median_ms(runs: usize, mut run: impl FnMut()) -> f64 {
+    run();
+    let mut times = (0..runs)
+        .map(|_| {
+            let start = Instant::now();
+            run();
+            start.elapsed().as_secs_f64() * 1000.0
+        })
+        .collect::<Vec<_>>();
+    times.sort_by(f64::total_cmp);
+    times[times.len() / 2]
+}
+
+fn main() {
+    let elements = parse_usize_arg("--elements", 100_000_000);
+    let columns = parse_usize_arg("--columns", 1000);
+    let runs = parse_usize_arg("--runs", 5).max(1);
+    let rows = (elements / columns).max(1);
+    let elements = rows * columns;
+
+    let values = (0..elements)
+        .map(|index| ((index * 7919 % 10007) as f32) * 1e-3)
+        .collect::<Vec<_>>();
+    let exact = values.iter().map(|value| *value as f64).sum::<f64>();
+    let naive_f32 = values.iter().sum::<f32>() as f64;
+    let matrix = NdArray::from_list(values, Some(&[rows, columns]));
+    let transposed = matrix.transpose();
+
+    let total = matrix.sum(None, false).to_vec()[0] as f64;
+    let cases: [(&str, &NdArray, Reduction, &[usize]); 6] = [
+        ("sum_all", &matrix, Reduction::Sum, &[0, 1]),
+        ("sum_axis0", &matrix, Reduction::Sum, &[0]),
+        ("sum_axis1", &matrix, Reduction::Sum, &[1]),
+        ("max_all", &matrix, Reduction::Max, &[0, 1]),
+        ("logsumexp_axis1", &matrix, Reduction::LogSumExp, &[1]),
+        ("sum_axis0_transposed", &transposed, Reduction::Sum, &[0]),
+    ];
+    let mut results = Vec::with_capacity(cases.len() + 1);
+    for (name, array, reduction, axes) in cases {
+        let ms = median_ms(runs, || {
+            std::hint::black_box(array.reduce(reduction, axes, false));
+        });
+        results.push(format!(
+            "{{\"case\":\"{}\",\"median_ms\":{:.6},\"gb_per_s\":{:.3}}}",
+            name,
+            ms,
+            (elements * 4) as f64 / (ms / 1000.0) / 1e9,
+        ));
+    }
+    let ms = median_ms(runs, || {
+        std::hint::black_box(matrix.argmax(Some(1)));
+    });
+    results.push(format!(
+        "{{\"case\":\"argmax_axis1\",\"median_ms\":{:.6},\"gb_per_s\":{:.3}}}",
+        ms,
+        (elements * 4) as f64 / (ms / 1000.0) / 1e9,
+    ));
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"ndarray_reduce\",",
+            "\"shape\":[{},{}],",
+            "\"runs\":{},",
+            "\"threads\":{},",
+            "\"sum_relative_error\":{:.3e},",
+            "\"sequential_f32_relative_error\":{:.3e},",
+            "\"cases\":[{}],",
+            "\"limitations\":[",
+            "\"bandwidth counts input bytes only\",",
+            "\"synthetic values in [0, 10)\"",
+            "]",
+            "}}"
+        ),
+        rows,
+        columns,
+        runs,
+        std::thread::available_parallelism().map_or(1, usize::from),
+        (total - exact).abs() / exact,
+        (naive_f32 - exact).abs() / exact,
+        results.join(",")
+    );
+}
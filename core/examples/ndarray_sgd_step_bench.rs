@@ -0,0 +1,141 @@
+use aeronum_core::NdArray;
+use std::alloc::{GlobalAlloc, Layout, System};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::time::Instant;
+
+/// Counts every allocation the process makes, across all threads.
+struct CountingAllocator;
+
+static ALLOCATIONS: AtomicUsize = AtomicUsize::new(0);
+static ALLOCATED_BYTES: AtomicUsize = AtomicUsize::new(0);
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+        ALLOCATED_BYTES.fetch_add(layout.size(), Ordering::Relaxed);
+        System.alloc(layout)
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        System.dealloc(ptr, layout)
+    }
+}
+
+#[global_allocator]
+static GLOBAL: CountingAllocator = CountingAllocator;
+
+fn parse_arg(name: &str, default: usize) -> usize {
+    let mut args = std::env::args();
+    while let Some(arg) = args.next() {
+        if arg == name {
+            if let Some(value) = args.next() {
+                return value.parse().unwrap_or(default);
+            }
+        }
+    }
+    default
+}
+
+fn filled(shape: &[usize], seed: usize) -> NdArray {
+    let len = shape.iter().product::<usize>();
+    NdArray::from_list(
+        (0..len)
+            .map(|index| ((index * seed % 31) as f32 - 15.0) / 64.0)
+            .collect(),
+        Some(shape),
+    )
+}
+
+/// Runs `steps` calls of `step` and returns (ms per step, allocations per
+/// step, bytes allocated per step).
+fn measure(steps: usize, mut step: impl FnMut()) -> (f64, f64, f64) {
+    let allocations = ALLOCATIONS.load(Ordering::Relaxed);
+    let bytes = ALLOCATED_BYTES.load(Ordering::Relaxed);
+    let start = Instant::now();
+    for _ in 0..steps {
+        step();
+    }
+    let elapsed_ms = start.elapsed().as_secs_f64() * 1000.0;
+    let steps = steps as f64;
+    (
+        elapsed_ms / steps,
+        (ALLOCATIONS.load(Ordering::Relaxed) - allocations) as f64 / steps,
+        (ALLOCATED_BYTES.load(Ordering::Relaxed) - bytes) as f64 / steps,
+    )
+}
+
+/// Linear least-squares SGD: `grad = x^T (x w - y) / batch`,
+/// `w -= learning_rate * grad`.
+fn main() {
+    let batch = parse_arg("--batch", 256);
+    let features = parse_arg("--features", 512);
+    let outputs = parse_arg("--outputs", 256);
+    let steps = parse_arg("--steps", 20).max(1);
+    let learning_rate = 0.01f32;
+
+    let x = filled(&[batch, features], 7);
+    let y = filled(&[batch, outputs], 11);
+    let x_t = x.transpose();
+    let initial = filled(&[features, outputs], 13);
+    let step_scale = NdArray::from_list(vec![learning_rate / batch as f32], None);
+
+    // Every op returns a new array.
+    let mut allocating_w = initial.clone();
+    let allocating_step = |w: &mut NdArray| {
+        let error = x.matmul(w).sub(&y);
+        let grad = x_t.matmul(&error);
+        *w = w.sub(&grad.mul(&step_scale));
+    };
+    allocating_step(&mut allocating_w);
+    let allocating = measure(steps, || allocating_step(&mut allocating_w));
+
+    // Same step through caller-owned buffers and in-place updates.
+    let mut in_place_w = initial.clone();
+    let mut error = NdArray::zeros(&[batch, outputs]);
+    let mut grad = NdArray::zeros(&[features, outputs]);
+    let mut in_place_step = |w: &mut NdArray| {
+        x.matmul_into(w, &mut error);
+        error.sub_assign(&y);
+        x_t.matmul_into(&error, &mut grad);
+        w.axpy(-learning_rate / batch as f32, &grad);
+    };
+    in_place_step(&mut in_place_w);
+    let in_place = measure(steps, || in_place_step(&mut in_place_w));
+
+    let max_abs_diff = allocating_w
+        .to_vec()
+        .iter()
+        .zip(in_place_w.to_vec())
+        .map(|(a, b)| (a - b).abs())
+        .fold(0.0f32, f32::max);
+    assert!(max_abs_diff < 1e-4, "weights diverged by {max_abs_diff}");
+
+    println!(
+        concat!(
+            "{{",
+            "\"benchmark\":\"ndarray_sgd_step\",",
+            "\"batch\":{},\"features\":{},\"outputs\":{},\"steps\":{},",
+            "\"allocating\":{{\"ms_per_step\":{:.6},\"allocations_per_step\":{:.1},\"bytes_per_step\":{:.0}}},",
+            "\"in_place\":{{\"ms_per_step\":{:.6},\"allocations_per_step\":{:.1},\"bytes_per_step\":{:.0}}},",
+            "\"speedup\":{:.3},",
+            "\"max_abs_weight_diff\":{:.3e},",
+            "\"limitations\":[",
+            "\"allocation counts cover the whole process, including pool threads\",",
+            "\"synthetic data; one dense linear layer\"",
+            "]",
+            "}}"
+        ),
+        batch,
+        features,
+        outputs,
+        steps,
+        allocating.0,
+        allocating.1,
+        allocating.2,
+        in_place.0,
+        in_place.1,
+        in_place.2,
+        allocating.0 / in_place.0.max(f64::MIN_POSITIVE),
+        max_abs_diff,
+    );
+}
@@ -0,0 +1,277 @@
+//! Tiled causal attention for many queries of one sequence at once.
+//!
+//! Queries are taken `QUERY_TILE` positions at a time and swept over tiles of
+//! key rows. Each key tile is read once per query tile instead of once per
+//! query, and its scores update a running maximum, normalizer and weighted
+//! value sum per query (online softmax), so no score row longer than one tile
+//! is ever held. Heads are independent and run in parallel on the shared
+//! worker pool. Key tiles start at fixed row boundaries and each query stops
+//! at its own position, so a query's output does not depend on which other
+//! queries share its pass.
+
+use crate::parallel;
+
+/// Queries that share each sweep over the key tiles.
+const QUERY_TILE: usize = 16;
+
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub(super) struct HeadLayout {
+    pub(super) head_count: usize,
+    pub(super) kv_head_count: usize,
+    pub(super) head_dimension: usize,
+}
+
+impl HeadLayout {
+    pub(super) fn query_length(&self) -> usize {
+        self.head_count * self.head_dimension
+    }
+
+    pub(super) fn kv_length(&self) -> usize {
+        self.kv_head_count * self.head_dimension
+    }
+
+    /// Workspace [`causal_attention_into`] needs for up to `query_count`
+    /// queries and key tiles of `tile_rows` rows.
+    pub(super) fn workspace_len(&self, query_count: usize, tile_rows: usize) -> usize {
+        self.head_count * head_workspace_len(self.head_dimension, query_count, tile_rows)
+    }
+}
+
+fn head_workspace_len(head_dimension: usize, query_count: usize, tile_rows: usize) -> usize {
+    query_count * (head_dimension + 2) + tile_rows
+}
+
+/// Causal attention of `query_count` RoPE-rotated queries at consecutive
+/// positions from `first_position`, each over key rows `0..=position`.
+/// Query `i` starts at `queries[i * query_stride]`; `output` receives
+/// `query_length` values per query, back to back. `key_tile(t)` returns the
+/// keys and values of rows `t * tile_rows..`, `kv_length` values per row; a
+/// tile may hold stale rows past the last position, which are never read.
+#[allow(clippy::too_many_arguments)]
+pub(super) fn causal_attention_into<'k, F>(
+    heads: HeadLayout,
+    queries: &[f32],
+    query_stride: usize,
+    first_position: usize,
+    tile_rows: usize,
+    key_tile: F,
+    workspace: &mut [f64],
+    output: &mut [f32],
+) where
+    F: Fn(usize) -> (&'k [f32], &'k [f32]) + Sync,
+{
+    let head_dimension = heads.head_dimension;
+    let query_length = heads.query_length();
+    let query_count = output.len() / query_length;
+    let per_head = head_workspace_len(head_dimension, query_count, tile_rows);
+    let workspace = &mut workspace[..heads.head_count * per_head];
+    // Scores and value sums each take a multiply-add per key and dimension.
+    let key_count = first_position + query_count.div_ceil(2);
+    let heads_per_task = parallel::items_per_task(
+        heads.head_count,
+        query_count * key_count * 2 * head_dimension,
+    );
+    parallel::for_each_chunk_mut(workspace, heads_per_task * per_head, |task_index, task| {
+        for (offset, head_workspace) in task.chunks_exact_mut(per_head).enumerate() {
+            attend_head(
+                heads,
+                task_index * heads_per_task + offset,
+                queries,
+                query_stride,
+                first_position,
+                query_count,
+                tile_rows,
+                &key_tile,
+                head_workspace,
+            );
+        }
+    });
+
+    for (head_index, head_workspace) in workspace.chunks_exact(per_head).enumerate() {
+        let (sums, totals) = head_workspace.split_at(query_count * head_dimension);
+        for (query_index, (sum, total)) in sums
+            .chunks_exact(head_dimension)
+            .zip(&totals[query_count..])
+            .enumerate()
+        {
+            let start = query_index * query_length + head_index * head_dimension;
+            for (output, sum) in output[start..start + head_dimension].iter_mut().zip(sum) {
+                *output = (sum / total) as f32;
+            }
+        }
+    }
+}
+
+/// One head of [`causal_attention_into`]. Leaves the unnormalized value sums
+/// (`query_count * head_dimension`), running maxima and normalizers
+/// (`query_count` each) at the front of `workspace`.
+#[allow(clippy::too_many_arguments)]
+fn attend_head<'k, F>(
+    heads: HeadLayout,
+    head_index: usize,
+    queries: &[f32],
+    query_stride: usize,
+    first_position: usize,
+    query_count: usize,
+    tile_rows: usize,
+    key_tile: &F,
+    workspace: &mut [f64],
+) where
+    F: Fn(usize) -> (&'k [f32], &'k [f32]),
+{
+    let head_dimension = heads.head_dimension;
+    let kv_length = heads.kv_length();
+    let kv_offset = (head_index / (heads.head_count / heads.kv_head_count)) * head_dimension;
+    let scale = (head_dimension as f64).sqrt();
+    let (sums, rest) = workspace.split_at_mut(query_count * head_dimension);
+    let (maxima, rest) = rest.split_at_mut(query_count);
+    let (totals, scores) = rest.split_at_mut(query_count);
+    sums.fill(0.0);
+    maxima.fill(f64::NEG_INFINITY);
+    totals.fill(0.0);
+
+    for tile_start in (0..query_count).step_by(QUERY_TILE) {
+        let tile_end = (tile_start + QUERY_TILE).min(query_count);
+        let last_position = first_position + tile_end - 1;
+        for key_tile_index in 0..=last_position / tile_rows {
+            let (keys, values) = key_tile(key_tile_index);
+            let first_row = key_tile_index * tile_rows;
+            for query_index in tile_start..tile_end {
+                let position = first_position + query_index;
+                if position < first_row {
+                    continue;
+                }
+                let row_count = (position + 1 - first_row).min(tile_rows);
+                let query_start = query_index * query_stride + head_index * head_dimension;
+                let query = &queries[query_start..query_start + head_dimension];
+                let scores = &mut scores[..row_count];
+                let mut tile_max = f64::NEG_INFINITY;
+                for (score, key) in scores.iter_mut().zip(keys.chunks_exact(kv_length)) {
+                    *score = query
+                        .iter()
+                        .zip(key[kv_offset..kv_offset + head_dimension].iter())
+                        .map(|(left, right)| (*left as f64) * (*right as f64))
+                        .sum::<f64>()
+                        / scale;
+                    tile_max = tile_max.max(*score);
+                }
+
+                let sum =
+                    &mut sums[query_index * head_dimension..(query_index + 1) * head_dimension];
+                let max = maxima[query_index].max(tile_max);
+                if max > maxima[query_index] {
+                    // Rescales what earlier tiles accumulated; a no-op on the
+                    // first tile, where both are still zero.
+                    let correction = (maxima[query_index] - max).exp();
+                    totals[query_index] *= correction;
+                    for value in sum.iter_mut() {
+                        *value *= correction;
+                    }
+                    maxima[query_index] = max;
+                }
+                for (score, value) in scores.iter_mut().zip(values.chunks_exact(kv_length)) {
+                    *score = (*score - max).exp();
+                    totals[query_index] += *score;
+                    for (sum, value) in sum
+                        .iter_mut()
+                        .zip(&value[kv_offset..kv_offset + head_dimension])
+                    {
+                        *sum += *score * *value as f64;
+                    }
+                }
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn pseudo_random(count: usize, seed: u64) -> Vec<f32> {
+        let mut state = seed;
+        (0..count)
+            .map(|_| {
+                state = state
+                    .wrapping_mul(6364136223846793005)
+                    .wrapping_add(1442695040888963407);
+                ((state >> 40) as f32 / (1u64 << 24) as f32) * 4.0 - 2.0
+            })
+            .collect()
+    }
+
+    #[test]
+    fn tiled_attention_matches_full_softmax() {
+        let heads = HeadLayout {
+            head_count: 4,
+            kv_head_count: 2,
+            head_dimension: 8,
+        };
+        let (first_position, query_count, tile_rows) = (5, 37, 6);
+        let key_count = first_position + query_count;
+        let query_stride = heads.query_length() + 3;
+        let queries = pseudo_random(query_count * query_stride, 1);
+        let keys = pseudo_random(key_count.next_multiple_of(tile_rows) * heads.kv_length(), 2);
+        let values = pseudo_random(keys.len(), 3);
+        let tile_values = tile_rows * heads.kv_length();
+        let mut workspace = vec![0.0; heads.workspace_len(query_count, tile_rows)];
+        let mut output = vec![0.0; query_count * heads.query_length()];
+        causal_attention_into(
+            heads,
+            &queries,
+            query_stride,
+            first_position,
+            tile_rows,
+            |tile| {
+                let range = tile * tile_values..(tile + 1) * tile_values;
+                (&keys[range.clone()], &values[range])
+            },
+            &mut workspace,
+            &mut output,
+        );
+
+        let head_dimension = heads.head_dimension;
+        let scale = (head_dimension as f64).sqrt();
+        for query_index in 0..query_count {
+            let position = first_position + query_index;
+            for head_index in 0..heads.head_count {
+                let query = &queries[query_index * query_stride + head_index * head_dimension..]
+                    [..head_dimension];
+                let kv_offset = (head_index / 2) * head_dimension;
+                let row = |data: &[f32], key: usize| {
+                    let start = key * heads.kv_length() + kv_offset;
+                    data[start..start + head_dimension].to_vec()
+                };
+                let scores = (0..=position)
+                    .map(|key| {
+                        query
+                            .iter()
+                            .zip(row(&keys, key))
+                            .map(|(left, right)| *left as f64 * right as f64)
+                            .sum::<f64>()
+                            / scale
+                    })
+                    .collect::<Vec<_>>();
+                let max = scores.iter().copied().fold(f64::NEG_INFINITY, f64::max);
+                let weights = scores
+                    .iter()
+                    .map(|score| (score - max).exp())
+                    .collect::<Vec<_>>();
+                let total = weights.iter().sum::<f64>();
+                for dim in 0..head_dimension {
+                    let expected = weights
+                        .iter()
+                        .enumerate()
+                        .map(|(key, weight)| weight / total * row(&values, key)[dim] as f64)
+                        .sum::<f64>();
+                    let actual = output
+                        [query_index * heads.query_length() + head_index * head_dimension + dim];
+                    assert!(
+                        (actual as f64 - expected).abs() < 1e-5,
+                        "query {query_index} head {head_index} dim {dim}: {actual} vs {expected}"
+                    );
+                }
+            }
+        }
+    }
+}
@@ -1,13 +1,34 @@
+mod attention;
 pub mod model;
+pub mod paged_kv;
+pub mod plan;
+pub mod prefix_cache;
+pub mod sampling;
+pub mod scheduler;
+pub mod session;
+mod snapshot;
+#[cfg(test)]
+mod test_support;
 
 pub use model::{
     GgufAttentionScoreSample, GgufCachedAttentionParitySample, GgufError,
     GgufGpuQuantizedLogitsSample, GgufHeader, GgufLayerExecutionSummary, GgufMetadataValue,
     GgufMultiLayerCachedFinalLogitsParitySample, GgufMultiLayerFinalLogitsSample,
     GgufMultiTokenAttentionSample, GgufMultiTokenLayerLogitsSample, GgufProjectionValueSample,
-    GgufQuantizedBlockSample, GgufQuantizedLogitValue, GgufQuantizedNormalizedLogitsSample,
-    GgufQuantizedPrefixLogitsSample, GgufQuantizedRowDotSample, GgufQuantizedRowSample,
-    GgufRetainedKvAutoregressiveDecodeSample, GgufRetainedKvDecodeStepSample,
-    GgufSingleTokenAttentionOutputSample, GgufSingleTokenFfnOutputSample,
-    GgufSingleTokenLayerLogitsSample, GgufTensorByteSample, GgufValueType, LlamaModel,
+    GgufQkvProjection, GgufQuantizedBlockSample, GgufQuantizedLogitValue,
+    GgufQuantizedNormalizedLogitsSample, GgufQuantizedPrefixLogitsSample,
+    GgufQuantizedRowDotSample, GgufQuantizedRowSample, GgufRetainedKvAutoregressiveDecodeSample,
+    GgufRetainedKvDecodeStepSample, GgufSingleTokenAttentionOutputSample,
+    GgufSingleTokenFfnOutputSample, GgufSingleTokenLayerLogitsSample, GgufSwiGluScratch,
+    GgufTensorByteSample, GgufValueType, LlamaModel,
+};
+pub use paged_kv::GgufPagedKvCache;
+pub use plan::{GgufLayerPlan, GgufModelPlan};
+pub use prefix_cache::{GgufPrefixCache, GgufPrefixCacheStats};
+pub use sampling::{GgufSampler, GgufSamplerOptions, GgufSamplingCandidate, SplitMix64};
+pub use scheduler::{
+    GgufBatchScheduler, GgufGenerationRequest, GgufGenerationResult, GgufSchedulerStats,
+};
+pub use session::{
+    GgufBeamHypothesis, GgufDecodeSession, GgufDecodeSessionOptions, GgufSpeculativeDecodeSample,
 };
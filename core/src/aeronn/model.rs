@@ -1,11 +1,17 @@
+use super::plan::GgufModelPlan;
+use crate::dtype::{Element, BF16, F16};
 use crate::gpu::{Backend, Device, GpuDevice, HipBlas, HipBuffer, HipRuntime};
-use crate::NdArray;
+use crate::mmap::MappedFile;
+use crate::parallel;
+use crate::quant::{dequantize_q4_k_block_into, dequantize_q6_k_block_into};
+use crate::{NdArray, QTensor, QuantFormat, TypedArray};
 use std::collections::HashMap;
 use std::error::Error;
 use std::fmt;
 use std::fs::File;
 use std::io::{self, Read, Seek, SeekFrom};
 use std::path::PathBuf;
+use std::sync::Arc;
 use std::time::Instant;
 
 #[derive(Clone, Debug, PartialEq)]
@@ -455,6 +461,100 @@ pub struct GgufGpuQuantizedLogitsSample {
     pub top_token_matches: bool,
 }
 
+/// Reusable output of [`GgufHeader::read_qkv_projection_into`].
+///
+/// Query, key and value rows are written into one buffer so the fused pass can
+/// schedule all three projections together; the buffers keep their capacity
+/// across calls.
+#[derive(Clone, Debug, Default, PartialEq)]
+pub struct GgufQkvProjection {
+    values: Vec<f32>,
+    query_len: usize,
+    key_len: usize,
+    weight_bytes: Vec<u8>,
+}
+
+impl GgufQkvProjection {
+    pub fn query(&self) -> &[f32] {
+        &self.values[..self.query_len]
+    }
+
+    pub fn key(&self) -> &[f32] {
+        &self.values[self.query_len..self.query_len + self.key_len]
+    }
+
+    pub fn value(&self) -> &[f32] {
+        &self.values[self.query_len + self.key_len..]
+    }
+
+    pub fn split_mut(&mut self) -> (&mut [f32], &mut [f32], &mut [f32]) {
+        let (query, rest) = self.values.split_at_mut(self.query_len);
+        let (key, value) = rest.split_at_mut(self.key_len);
+        (query, key, value)
+    }
+}
+
+/// Reusable scratch for [`GgufHeader::read_swiglu_ffn_into`].
+///
+/// Holds the per-row gate/up/activation values, the contiguous activation fed
+/// to `ffn_down`, the block output and the weight bytes, all of which keep their
+/// capacity across calls so a decode loop can own one instance per session.
+#[derive(Clone, Debug, Default, PartialEq)]
+pub struct GgufSwiGluScratch {
+    rows: Vec<SwiGluRow>,
+    activated: Vec<f32>,
+    output: Vec<f32>,
+    weight_bytes: Vec<u8>,
+}
+
+impl GgufSwiGluScratch {
+    pub fn activated(&self) -> &[f32] {
+        &self.activated
+    }
+
+    pub fn output(&self) -> &[f32] {
+        &self.output
+    }
+
+    pub fn gate_checksum(&self) -> f64 {
+        self.rows
+            .iter()
+            .enumerate()
+            .map(|(idx, row)| (idx as f64 + 1.0) * row.gate as f64)
+            .sum()
+    }
+
+    pub fn up_checksum(&self) -> f64 {
+        self.rows
+            .iter()
+            .enumerate()
+            .map(|(idx, row)| (idx as f64 + 1.0) * row.up as f64)
+            .sum()
+    }
+}
+
+#[derive(Clone, Copy, Debug, Default, PartialEq)]
+pub(super) struct SwiGluRow {
+    pub(super) gate: f32,
+    pub(super) up: f32,
+    pub(super) activated: f32,
+}
+
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub(super) struct QuantizedMatrix {
+    pub(super) tensor_type: u32,
+    pub(super) column_count: usize,
+    pub(super) row_count: usize,
+    pub(super) row_nbytes: usize,
+    pub(super) absolute_offset: u64,
+}
+
+impl QuantizedMatrix {
+    pub(super) fn nbytes(&self) -> usize {
+        self.row_count * self.row_nbytes
+    }
+}
+
 #[derive(Clone, Debug, PartialEq)]
 struct GgufRetainedLayerKvCache {
     keys: Vec<Vec<f32>>,
@@ -1064,6 +1164,114 @@ impl GgufHeader {
         })
     }
 
+    /// Decodes `row_indices` of a Q4_K/Q6_K matrix (typically `token_embd.weight`)
+    /// into one contiguous `[row_indices.len(), column_count]` array.
+    ///
+    /// Unlike [`GgufHeader::read_quantized_row_sample`] this validates the tensor
+    /// once, reads every row through a single file handle, skips the diagnostic
+    /// checksums, and dequantizes the rows in parallel.
+    pub fn gather_rows(
+        &self,
+        tensor_name: &str,
+        row_indices: &[u64],
+    ) -> Result<NdArray, GgufError> {
+        let (values, column_count) = self.gather_row_values(tensor_name, row_indices)?;
+        Ok(NdArray::from_list(
+            values,
+            Some(&[row_indices.len(), column_count]),
+        ))
+    }
+
+    fn gather_row_values(
+        &self,
+        tensor_name: &str,
+        row_indices: &[u64],
+    ) -> Result<(Vec<f32>, usize), GgufError> {
+        let tensor = self
+            .tensors
+            .iter()
+            .find(|tensor| tensor.name == tensor_name)
+            .ok_or_else(|| GgufError::TensorNotFound(tensor_name.to_string()))?;
+        let (block_size, type_size) = ggml_type_layout(tensor.tensor_type).ok_or_else(|| {
+            GgufError::UnsupportedTensorType {
+                name: tensor_name.to_string(),
+                tensor_type: tensor.tensor_type,
+            }
+        })?;
+        if !matches!(tensor.tensor_type, 12 | 14) {
+            return Err(GgufError::UnsupportedTensorType {
+                name: tensor_name.to_string(),
+                tensor_type: tensor.tensor_type,
+            });
+        }
+        let column_count = tensor.dimensions.first().copied().unwrap_or(0);
+        let row_count = tensor.dimensions.get(1).copied().unwrap_or(1);
+        if column_count == 0 || row_indices.iter().any(|row_index| *row_index >= row_count) {
+            return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
+        }
+        let row_nbytes = column_count
+            .div_ceil(block_size)
+            .checked_mul(type_size)
+            .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        let tensor_nbytes = tensor
+            .nbytes
+            .ok_or_else(|| GgufError::UnknownTensorByteSize(tensor_name.to_string()))?;
+        let tensor_end = tensor
+            .absolute_offset
+            .checked_add(tensor_nbytes)
+            .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        let rows_end = row_count
+            .checked_mul(row_nbytes)
+            .and_then(|nbytes| tensor.absolute_offset.checked_add(nbytes))
+            .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        if rows_end > tensor_end || rows_end > self.file_size {
+            return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
+        }
+
+        let column_count = column_count as usize;
+        let row_nbytes = row_nbytes as usize;
+        let mut bytes = vec![0u8; row_indices.len() * row_nbytes];
+        let mut file = File::open(&self.path)?;
+        for (row_index, row_bytes) in row_indices.iter().zip(bytes.chunks_exact_mut(row_nbytes)) {
+            file.seek(SeekFrom::Start(
+                tensor.absolute_offset + row_index * row_nbytes as u64,
+            ))?;
+            file.read_exact(row_bytes)?;
+        }
+
+        let mut values = vec![0.0f32; row_indices.len() * column_count];
+        let rows_per_task = parallel::items_per_task(row_indices.len(), column_count);
+        let tensor_type = tensor.tensor_type;
+        parallel::for_each_chunk_mut(
+            &mut values,
+            rows_per_task * column_count,
+            |task_index, task_values| {
+                let first_row = task_index * rows_per_task;
+                for (offset, row_values) in task_values.chunks_exact_mut(column_count).enumerate() {
+                    let row = first_row + offset;
+                    decode_quantized_row_into(
+                        tensor_type,
+                        &bytes[row * row_nbytes..(row + 1) * row_nbytes],
+                        row_values,
+                    );
+                }
+            },
+        );
+        Ok((values, column_count))
+    }
+
+    fn gather_row_states(
+        &self,
+        tensor_name: &str,
+        row_indices: &[u64],
+    ) -> Result<Vec<Vec<f32>>, GgufError> {
+        let (values, column_count) = self.gather_row_values(tensor_name, row_indices)?;
+        Ok(values
+            .chunks_exact(column_count)
+            .map(<[f32]>::to_vec)
+            .collect())
+    }
+
     pub fn read_quantized_row_dot_sample(
         &self,
         lhs_tensor_name: &str,
@@ -1209,11 +1417,13 @@ impl GgufHeader {
         let input = self.read_quantized_row_sample(input_tensor_name, input_row_index)?;
         let norm_weight = self.load_f32_tensor(norm_tensor_name)?.to_vec();
         let (normalized_input, rms, rms_epsilon) =
-            rms_normalize_values(&input.decoded_values, &norm_weight, self).map_err(|_| {
-                GgufError::InvalidTensorRange(format!(
-                    "{input_tensor_name}:{input_row_index} norm {norm_tensor_name}"
-                ))
-            })?;
+            rms_normalize_values(&input.decoded_values, &norm_weight, self.rms_epsilon()).map_err(
+                |_| {
+                    GgufError::InvalidTensorRange(format!(
+                        "{input_tensor_name}:{input_row_index} norm {norm_tensor_name}"
+                    ))
+                },
+            )?;
         let norm_weight_checksum = checksum_f32_values(&norm_weight);
         let normalized_input_checksum = checksum_f32_values(&normalized_input);
         let logits = self.read_quantized_logits_for_values(
@@ -1330,7 +1540,7 @@ impl GgufHeader {
         let residual_checksum = checksum_f32_values(&residual);
         let norm_weight = self.load_f32_tensor(ffn_norm_tensor_name)?.to_vec();
         let (ffn_normalized_input, ffn_rms, ffn_rms_epsilon) =
-            rms_normalize_values(&residual, &norm_weight, self)?;
+            rms_normalize_values(&residual, &norm_weight, self.rms_epsilon())?;
         let ffn_norm_weight_checksum = checksum_f32_values(&norm_weight);
         let ffn_normalized_input_checksum = checksum_f32_values(&ffn_normalized_input);
 
@@ -1440,7 +1650,7 @@ impl GgufHeader {
         let layer_output_checksum = checksum_f32_values(&layer_output);
         let final_norm_weight = self.load_f32_tensor(final_norm_tensor_name)?.to_vec();
         let (final_normalized_input, final_rms, final_rms_epsilon) =
-            rms_normalize_values(&layer_output, &final_norm_weight, self)?;
+            rms_normalize_values(&layer_output, &final_norm_weight, self.rms_epsilon())?;
         let output_row_count = self.tensor_row_count(output_tensor_name)?;
         let logits = self.read_quantized_logits_for_values(
             &final_normalized_input,
@@ -1522,42 +1732,22 @@ impl GgufHeader {
         let mut keys = Vec::with_capacity(input_row_indices.len());
         let mut values = Vec::with_capacity(input_row_indices.len());
         let mut rms_epsilon = 0.0f32;
+        let mut qkv_projection = GgufQkvProjection::default();
 
-        for input_row_index in input_row_indices {
-            let input = self.read_quantized_row_sample(input_tensor_name, *input_row_index)?;
+        for input in self.gather_row_states(input_tensor_name, input_row_indices)? {
             let (normalized_input, _, epsilon) =
-                rms_normalize_values(&input.decoded_values, &norm_weight, self)?;
+                rms_normalize_values(&input, &norm_weight, self.rms_epsilon())?;
             rms_epsilon = epsilon;
-            let query = self
-                .read_quantized_logits_for_values(
-                    &normalized_input,
-                    query_tensor_name,
-                    0,
-                    query_row_count as u64,
-                )?
-                .into_iter()
-                .map(|logit| logit.value as f32)
-                .collect::<Vec<_>>();
-            let key = self
-                .read_quantized_logits_for_values(
-                    &normalized_input,
-                    key_tensor_name,
-                    0,
-                    key_row_count as u64,
-                )?
-                .into_iter()
-                .map(|logit| logit.value as f32)
-                .collect::<Vec<_>>();
-            let value = self
-                .read_quantized_logits_for_values(
-                    &normalized_input,
-                    value_tensor_name,
-                    0,
-                    value_row_count as u64,
-                )?
-                .into_iter()
-                .map(|logit| logit.value as f32)
-                .collect::<Vec<_>>();
+            self.read_qkv_projection_into(
+                &normalized_input,
+                query_tensor_name,
+                key_tensor_name,
+                value_tensor_name,
+                &mut qkv_projection,
+            )?;
+            let query = qkv_projection.query().to_vec();
+            let key = qkv_projection.key().to_vec();
+            let value = qkv_projection.value().to_vec();
             normalized_inputs.push(normalized_input);
             queries.push(query);
             keys.push(key);
@@ -1701,10 +1891,9 @@ impl GgufHeader {
 
         let mut cached_keys = Vec::with_capacity(cached_input_rows.len());
         let mut cached_values = Vec::with_capacity(cached_input_rows.len());
-        for input_row_index in cached_input_rows {
-            let input = self.read_quantized_row_sample(input_tensor_name, *input_row_index)?;
+        for input in self.gather_row_states(input_tensor_name, cached_input_rows)? {
             let (normalized_input, _, _) =
-                rms_normalize_values(&input.decoded_values, &norm_weight, self)?;
+                rms_normalize_values(&input, &norm_weight, self.rms_epsilon())?;
             let mut key = self
                 .read_quantized_logits_for_values(
                     &normalized_input,
@@ -1736,9 +1925,11 @@ impl GgufHeader {
             cached_values.push(value);
         }
 
-        let query_input = self.read_quantized_row_sample(input_tensor_name, query_input_row)?;
+        let query_input = self
+            .gather_row_values(input_tensor_name, &[query_input_row])?
+            .0;
         let (query_normalized_input, _, _) =
-            rms_normalize_values(&query_input.decoded_values, &norm_weight, self)?;
+            rms_normalize_values(&query_input, &norm_weight, self.rms_epsilon())?;
         let mut query_projection = self
             .read_quantized_logits_for_values(
                 &query_normalized_input,
@@ -1915,7 +2106,7 @@ impl GgufHeader {
         let residual_checksum = checksum_f32_values(&residual);
         let ffn_norm_weight = self.load_f32_tensor(ffn_norm_tensor_name)?.to_vec();
         let (ffn_normalized_input, ffn_rms, ffn_rms_epsilon) =
-            rms_normalize_values(&residual, &ffn_norm_weight, self)?;
+            rms_normalize_values(&residual, &ffn_norm_weight, self.rms_epsilon())?;
 
         let gate_row_count = self.tensor_row_count(gate_tensor_name)?;
         let up_row_count = self.tensor_row_count(up_tensor_name)?;
@@ -1964,7 +2155,7 @@ impl GgufHeader {
             .collect::<Vec<_>>();
         let final_norm_weight = self.load_f32_tensor(final_norm_tensor_name)?.to_vec();
         let (final_normalized_input, final_rms, final_rms_epsilon) =
-            rms_normalize_values(&layer_output, &final_norm_weight, self)?;
+            rms_normalize_values(&layer_output, &final_norm_weight, self.rms_epsilon())?;
         let output_row_count = self.tensor_row_count(output_tensor_name)?;
         let logits = self.read_quantized_logits_for_values(
             &final_normalized_input,
@@ -2025,13 +2216,7 @@ impl GgufHeader {
                 "multi-layer final logits input".to_string(),
             ));
         }
-        let mut states = input_row_indices
-            .iter()
-            .map(|row_index| {
-                self.read_quantized_row_sample(input_tensor_name, *row_index)
-                    .map(|row| row.decoded_values)
-            })
-            .collect::<Result<Vec<_>, _>>()?;
+        let mut states = self.gather_row_states(input_tensor_name, input_row_indices)?;
         let embedding_dimension = states
             .first()
             .map(Vec::len)
@@ -2096,46 +2281,26 @@ impl GgufHeader {
             let normalized_inputs = states
                 .iter()
                 .map(|state| {
-                    rms_normalize_values(state, &attn_norm_weight, self)
+                    rms_normalize_values(state, &attn_norm_weight, self.rms_epsilon())
                         .map(|(normalized, _, _)| normalized)
                 })
                 .collect::<Result<Vec<_>, _>>()?;
-            let queries = normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &query_tensor_name,
-                        0,
-                        query_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let keys = normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &key_tensor_name,
-                        0,
-                        key_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let values = normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &value_tensor_name,
-                        0,
-                        value_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
+            let mut queries = Vec::with_capacity(normalized_inputs.len());
+            let mut keys = Vec::with_capacity(normalized_inputs.len());
+            let mut values = Vec::with_capacity(normalized_inputs.len());
+            let mut qkv_projection = GgufQkvProjection::default();
+            for input in &normalized_inputs {
+                self.read_qkv_projection_into(
+                    input,
+                    &query_tensor_name,
+                    &key_tensor_name,
+                    &value_tensor_name,
+                    &mut qkv_projection,
+                )?;
+                queries.push(qkv_projection.query().to_vec());
+                keys.push(qkv_projection.key().to_vec());
+                values.push(qkv_projection.value().to_vec());
+            }
 
             let mut rope_queries = queries;
             let mut rope_keys = keys;
@@ -2230,7 +2395,7 @@ impl GgufHeader {
             let ffn_normalized_inputs = residuals
                 .iter()
                 .map(|residual| {
-                    rms_normalize_values(residual, &ffn_norm_weight, self).map(
+                    rms_normalize_values(residual, &ffn_norm_weight, self.rms_epsilon()).map(
                         |(normalized, rms, _)| {
                             ffn_rms_values.push(rms as f32);
                             normalized
@@ -2239,56 +2404,37 @@ impl GgufHeader {
                 })
                 .collect::<Result<Vec<_>, _>>()?;
 
-            let gate_row_count = self.tensor_row_count(&gate_tensor_name)?;
-            let up_row_count = self.tensor_row_count(&up_tensor_name)?;
-            if gate_row_count != up_row_count {
-                return Err(GgufError::InvalidTensorRange(format!(
-                    "layer {layer_index} FFN gate/up row count"
-                )));
-            }
-            let gate_projections = ffn_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &gate_tensor_name,
-                        0,
-                        gate_row_count,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let up_projections = ffn_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(input, &up_tensor_name, 0, up_row_count)
-                        .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let activated = gate_projections
-                .iter()
-                .zip(up_projections.iter())
-                .map(|(gate_projection, up_projection)| {
-                    gate_projection
+            let mut gate_projections = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut up_projections = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut activated = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut ffn_outputs = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut ffn_scratch = GgufSwiGluScratch::default();
+            for input in &ffn_normalized_inputs {
+                self.read_swiglu_ffn_into(
+                    input,
+                    &gate_tensor_name,
+                    &up_tensor_name,
+                    &down_tensor_name,
+                    &mut ffn_scratch,
+                )?;
+                gate_projections.push(
+                    ffn_scratch
+                        .rows
                         .iter()
-                        .zip(up_projection.iter())
-                        .map(|(gate, up)| silu(*gate) * *up)
-                        .collect::<Vec<_>>()
-                })
-                .collect::<Vec<_>>();
-            let down_row_count = self.tensor_row_count(&down_tensor_name)?;
-            let ffn_outputs = activated
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &down_tensor_name,
-                        0,
-                        down_row_count,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
+                        .map(|row| row.gate)
+                        .collect::<Vec<_>>(),
+                );
+                up_projections.push(
+                    ffn_scratch
+                        .rows
+                        .iter()
+                        .map(|row| row.up)
+                        .collect::<Vec<_>>(),
+                );
+                activated.push(ffn_scratch.activated().to_vec());
+                ffn_outputs.push(ffn_scratch.output().to_vec());
+            }
+
             let layer_outputs = residuals
                 .iter()
                 .zip(ffn_outputs.iter())
@@ -2319,8 +2465,11 @@ impl GgufHeader {
 
         let final_token_position = states.len() - 1;
         let final_norm_weight = self.load_f32_tensor(final_norm_tensor_name)?.to_vec();
-        let (final_normalized_input, final_rms, final_rms_epsilon) =
-            rms_normalize_values(&states[final_token_position], &final_norm_weight, self)?;
+        let (final_normalized_input, final_rms, final_rms_epsilon) = rms_normalize_values(
+            &states[final_token_position],
+            &final_norm_weight,
+            self.rms_epsilon(),
+        )?;
         let output_row_count = self.tensor_row_count(output_tensor_name)?;
         let logits = self.read_quantized_logits_for_values(
             &final_normalized_input,
@@ -2386,16 +2535,10 @@ impl GgufHeader {
             top_k,
         )?;
 
-        let mut cached_states = cached_input_rows
-            .iter()
-            .map(|row_index| {
-                self.read_quantized_row_sample(input_tensor_name, *row_index)
-                    .map(|row| row.decoded_values)
-            })
-            .collect::<Result<Vec<_>, _>>()?;
+        let mut cached_states = self.gather_row_states(input_tensor_name, cached_input_rows)?;
         let mut query_state = self
-            .read_quantized_row_sample(input_tensor_name, query_input_row)?
-            .decoded_values;
+            .gather_row_values(input_tensor_name, &[query_input_row])?
+            .0;
         let embedding_dimension = query_state.len();
         if cached_states
             .iter()
@@ -2457,46 +2600,26 @@ impl GgufHeader {
             let cached_normalized_inputs = cached_states
                 .iter()
                 .map(|state| {
-                    rms_normalize_values(state, &attn_norm_weight, self)
+                    rms_normalize_values(state, &attn_norm_weight, self.rms_epsilon())
                         .map(|(normalized, _, _)| normalized)
                 })
                 .collect::<Result<Vec<_>, _>>()?;
-            let cached_queries = cached_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &query_tensor_name,
-                        0,
-                        query_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let cached_keys = cached_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &key_tensor_name,
-                        0,
-                        key_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let cached_values = cached_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &value_tensor_name,
-                        0,
-                        value_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
+            let mut cached_queries = Vec::with_capacity(cached_normalized_inputs.len());
+            let mut cached_keys = Vec::with_capacity(cached_normalized_inputs.len());
+            let mut cached_values = Vec::with_capacity(cached_normalized_inputs.len());
+            let mut qkv_projection = GgufQkvProjection::default();
+            for input in &cached_normalized_inputs {
+                self.read_qkv_projection_into(
+                    input,
+                    &query_tensor_name,
+                    &key_tensor_name,
+                    &value_tensor_name,
+                    &mut qkv_projection,
+                )?;
+                cached_queries.push(qkv_projection.query().to_vec());
+                cached_keys.push(qkv_projection.key().to_vec());
+                cached_values.push(qkv_projection.value().to_vec());
+            }
 
             let mut cached_rope_queries = cached_queries;
             let mut cached_rope_keys = cached_keys;
@@ -2564,37 +2687,17 @@ impl GgufHeader {
             }
 
             let (query_normalized_input, _, _) =
-                rms_normalize_values(&query_state, &attn_norm_weight, self)?;
-            let mut query = self
-                .read_quantized_logits_for_values(
-                    &query_normalized_input,
-                    &query_tensor_name,
-                    0,
-                    query_row_count as u64,
-                )?
-                .into_iter()
-                .map(|logit| logit.value as f32)
-                .collect::<Vec<_>>();
-            let mut query_key = self
-                .read_quantized_logits_for_values(
-                    &query_normalized_input,
-                    &key_tensor_name,
-                    0,
-                    key_row_count as u64,
-                )?
-                .into_iter()
-                .map(|logit| logit.value as f32)
-                .collect::<Vec<_>>();
-            let query_value = self
-                .read_quantized_logits_for_values(
-                    &query_normalized_input,
-                    &value_tensor_name,
-                    0,
-                    value_row_count as u64,
-                )?
-                .into_iter()
-                .map(|logit| logit.value as f32)
-                .collect::<Vec<_>>();
+                rms_normalize_values(&query_state, &attn_norm_weight, self.rms_epsilon())?;
+            self.read_qkv_projection_into(
+                &query_normalized_input,
+                &query_tensor_name,
+                &key_tensor_name,
+                &value_tensor_name,
+                &mut qkv_projection,
+            )?;
+            let mut query = qkv_projection.query().to_vec();
+            let mut query_key = qkv_projection.key().to_vec();
+            let query_value = qkv_projection.value().to_vec();
             apply_rope_to_projection(
                 &mut query,
                 head_count,
@@ -2697,7 +2800,7 @@ impl GgufHeader {
             let cached_ffn_normalized_inputs = cached_residuals
                 .iter()
                 .map(|residual| {
-                    rms_normalize_values(residual, &ffn_norm_weight, self).map(
+                    rms_normalize_values(residual, &ffn_norm_weight, self.rms_epsilon()).map(
                         |(normalized, rms, _)| {
                             ffn_rms_values.push(rms as f32);
                             normalized
@@ -2706,7 +2809,7 @@ impl GgufHeader {
                 })
                 .collect::<Result<Vec<_>, _>>()?;
             let (query_ffn_normalized_input, query_ffn_rms, _) =
-                rms_normalize_values(&query_residual, &ffn_norm_weight, self)?;
+                rms_normalize_values(&query_residual, &ffn_norm_weight, self.rms_epsilon())?;
             ffn_rms_values.push(query_ffn_rms as f32);
 
             let gate_row_count = self.tensor_row_count(&gate_tensor_name)?;
@@ -2843,7 +2946,7 @@ impl GgufHeader {
 
         let final_norm_weight = self.load_f32_tensor(final_norm_tensor_name)?.to_vec();
         let (cached_final_normalized_input, cached_final_rms, _) =
-            rms_normalize_values(&query_state, &final_norm_weight, self)?;
+            rms_normalize_values(&query_state, &final_norm_weight, self.rms_epsilon())?;
         let output_row_count = self.tensor_row_count(output_tensor_name)?;
         let cached_logits = self.read_quantized_logits_for_values(
             &cached_final_normalized_input,
@@ -2953,31 +3056,25 @@ impl GgufHeader {
             ));
         }
 
-        let head_count = self
-            .u32_value("llama.attention.head_count")
-            .ok_or_else(|| GgufError::InvalidTensorRange("attention head count".to_string()))?
-            as usize;
-        let kv_head_count = self
-            .u32_value("llama.attention.head_count_kv")
-            .ok_or_else(|| GgufError::InvalidTensorRange("attention kv head count".to_string()))?
-            as usize;
-        if head_count == 0 || kv_head_count == 0 || head_count % kv_head_count != 0 {
-            return Err(GgufError::InvalidTensorRange(
-                "attention head topology".to_string(),
-            ));
-        }
-        let rope_freq_base = self.f32_value("llama.rope.freq_base").unwrap_or(10000.0);
+        // Tensors, shapes and topology are resolved once here; neither the
+        // prefill nor the per-token loop goes back to the metadata.
+        let plan = GgufModelPlan::new(
+            self,
+            input_tensor_name,
+            layer_start,
+            layer_count,
+            final_norm_tensor_name,
+            output_tensor_name,
+        )?;
+        let head_count = plan.head_count();
+        let kv_head_count = plan.kv_head_count();
+        let head_dimension = plan.head_dimension();
+        let rope_freq_base = plan.rope_freq_base();
+        let rms_epsilon = plan.rms_epsilon();
         let value_repeat_factor = head_count / kv_head_count;
-        let mut head_dimension = 0usize;
 
         let prefill_rows = &initial_input_rows[..initial_input_rows.len() - 1];
-        let mut states = prefill_rows
-            .iter()
-            .map(|row_index| {
-                self.read_quantized_row_sample(input_tensor_name, *row_index)
-                    .map(|row| row.decoded_values)
-            })
-            .collect::<Result<Vec<_>, _>>()?;
+        let mut states = self.gather_row_states(input_tensor_name, prefill_rows)?;
         let embedding_dimension = states
             .first()
             .map(Vec::len)
@@ -2993,79 +3090,31 @@ impl GgufHeader {
 
         let mut layer_caches = Vec::with_capacity(layer_count);
         let mut prefill_layer_summaries = Vec::with_capacity(layer_count);
-        for layer_index in layer_start..layer_start + layer_count {
-            let attn_norm_tensor_name = format!("blk.{layer_index}.attn_norm.weight");
-            let query_tensor_name = format!("blk.{layer_index}.attn_q.weight");
-            let key_tensor_name = format!("blk.{layer_index}.attn_k.weight");
-            let value_tensor_name = format!("blk.{layer_index}.attn_v.weight");
-            let attn_output_tensor_name = format!("blk.{layer_index}.attn_output.weight");
-            let ffn_norm_tensor_name = format!("blk.{layer_index}.ffn_norm.weight");
-            let gate_tensor_name = format!("blk.{layer_index}.ffn_gate.weight");
-            let up_tensor_name = format!("blk.{layer_index}.ffn_up.weight");
-            let down_tensor_name = format!("blk.{layer_index}.ffn_down.weight");
-
-            let attn_norm_weight = self.load_f32_tensor(&attn_norm_tensor_name)?.to_vec();
-            let query_row_count = self.tensor_row_count(&query_tensor_name)? as usize;
-            let key_row_count = self.tensor_row_count(&key_tensor_name)? as usize;
-            let value_row_count = self.tensor_row_count(&value_tensor_name)? as usize;
-            if query_row_count % head_count != 0
-                || key_row_count % kv_head_count != 0
-                || value_row_count != key_row_count
-            {
-                return Err(GgufError::InvalidTensorRange(format!(
-                    "layer {layer_index} retained prefill attention projection row counts"
-                )));
-            }
-            head_dimension = query_row_count / head_count;
-            if key_row_count / kv_head_count != head_dimension {
-                return Err(GgufError::InvalidTensorRange(format!(
-                    "layer {layer_index} retained prefill attention head dimension"
-                )));
-            }
-
+        if embedding_dimension != plan.embedding_length() {
+            return Err(GgufError::InvalidTensorRange(
+                "retained KV prefill input dimensions".to_string(),
+            ));
+        }
+        for layer in plan.layers() {
+            let layer_index = layer.layer_index();
+            let query_row_count = layer.qkv[0].row_count;
             let normalized_inputs = states
                 .iter()
                 .map(|state| {
-                    rms_normalize_values(state, &attn_norm_weight, self)
+                    rms_normalize_values(state, &layer.attn_norm, rms_epsilon)
                         .map(|(normalized, _, _)| normalized)
                 })
                 .collect::<Result<Vec<_>, _>>()?;
-            let queries = normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &query_tensor_name,
-                        0,
-                        query_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let keys = normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &key_tensor_name,
-                        0,
-                        key_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let values = normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &value_tensor_name,
-                        0,
-                        value_row_count as u64,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
+            let mut queries = Vec::with_capacity(normalized_inputs.len());
+            let mut keys = Vec::with_capacity(normalized_inputs.len());
+            let mut values = Vec::with_capacity(normalized_inputs.len());
+            let mut qkv_projection = GgufQkvProjection::default();
+            for input in &normalized_inputs {
+                self.project_qkv_matrices_into(&layer.qkv, input, &mut qkv_projection)?;
+                queries.push(qkv_projection.query().to_vec());
+                keys.push(qkv_projection.key().to_vec());
+                values.push(qkv_projection.value().to_vec());
+            }
 
             let mut rope_queries = queries;
             let mut rope_keys = keys;
@@ -3130,17 +3179,11 @@ impl GgufHeader {
                 }
             }
 
-            let attn_output_row_count = self.tensor_row_count(&attn_output_tensor_name)?;
             let attention_outputs = attention_inputs
                 .iter()
                 .map(|attention_input| {
-                    self.read_quantized_logits_for_values(
-                        attention_input,
-                        &attn_output_tensor_name,
-                        0,
-                        attn_output_row_count,
-                    )
-                    .map(logit_values_to_f32)
+                    self.read_matrix_logits_for_values(layer.attn_output, attention_input)
+                        .map(logit_values_to_f32)
                 })
                 .collect::<Result<Vec<_>, _>>()?;
             let residuals = states
@@ -3155,12 +3198,11 @@ impl GgufHeader {
                 })
                 .collect::<Vec<_>>();
 
-            let ffn_norm_weight = self.load_f32_tensor(&ffn_norm_tensor_name)?.to_vec();
             let mut ffn_rms_values = Vec::with_capacity(residuals.len());
             let ffn_normalized_inputs = residuals
                 .iter()
                 .map(|residual| {
-                    rms_normalize_values(residual, &ffn_norm_weight, self).map(
+                    rms_normalize_values(residual, &layer.ffn_norm, rms_epsilon).map(
                         |(normalized, rms, _)| {
                             ffn_rms_values.push(rms as f32);
                             normalized
@@ -3168,56 +3210,37 @@ impl GgufHeader {
                     )
                 })
                 .collect::<Result<Vec<_>, _>>()?;
-            let gate_row_count = self.tensor_row_count(&gate_tensor_name)?;
-            let up_row_count = self.tensor_row_count(&up_tensor_name)?;
-            if gate_row_count != up_row_count {
-                return Err(GgufError::InvalidTensorRange(format!(
-                    "layer {layer_index} retained prefill FFN gate/up row count"
-                )));
-            }
-            let gate_projections = ffn_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &gate_tensor_name,
-                        0,
-                        gate_row_count,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let up_projections = ffn_normalized_inputs
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(input, &up_tensor_name, 0, up_row_count)
-                        .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
-            let activated = gate_projections
-                .iter()
-                .zip(up_projections.iter())
-                .map(|(gate_projection, up_projection)| {
-                    gate_projection
+            let mut gate_projections = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut up_projections = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut activated = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut ffn_outputs = Vec::with_capacity(ffn_normalized_inputs.len());
+            let mut ffn_scratch = GgufSwiGluScratch::default();
+            for input in &ffn_normalized_inputs {
+                self.swiglu_ffn_matrices_into(
+                    layer.gate,
+                    layer.up,
+                    layer.down,
+                    input,
+                    &mut ffn_scratch,
+                )?;
+                gate_projections.push(
+                    ffn_scratch
+                        .rows
                         .iter()
-                        .zip(up_projection.iter())
-                        .map(|(gate, up)| silu(*gate) * *up)
-                        .collect::<Vec<_>>()
-                })
-                .collect::<Vec<_>>();
-            let down_row_count = self.tensor_row_count(&down_tensor_name)?;
-            let ffn_outputs = activated
-                .iter()
-                .map(|input| {
-                    self.read_quantized_logits_for_values(
-                        input,
-                        &down_tensor_name,
-                        0,
-                        down_row_count,
-                    )
-                    .map(logit_values_to_f32)
-                })
-                .collect::<Result<Vec<_>, _>>()?;
+                        .map(|row| row.gate)
+                        .collect::<Vec<_>>(),
+                );
+                up_projections.push(
+                    ffn_scratch
+                        .rows
+                        .iter()
+                        .map(|row| row.up)
+                        .collect::<Vec<_>>(),
+                );
+                activated.push(ffn_scratch.activated().to_vec());
+                ffn_outputs.push(ffn_scratch.output().to_vec());
+            }
+
             let layer_outputs = residuals
                 .iter()
                 .zip(ffn_outputs.iter())
@@ -3259,6 +3282,8 @@ impl GgufHeader {
         let mut max_logits_abs_diff = 0.0f64;
         let mut max_logits_checksum_diff = 0.0f64;
         let mut all_step_top_tokens_match = true;
+        let mut qkv_projection = GgufQkvProjection::default();
+        let mut ffn_scratch = GgufSwiGluScratch::default();
 
         for step_index in 0..max_new_tokens {
             let mut full_rows = context_prefix_rows.clone();
@@ -3282,86 +3307,34 @@ impl GgufHeader {
                 .collect::<Vec<_>>();
 
             let mut query_state = self
-                .read_quantized_row_sample(input_tensor_name, query_input_row)?
-                .decoded_values;
+                .gather_row_values(input_tensor_name, &[query_input_row])?
+                .0;
             let mut retained_layer_summaries = Vec::with_capacity(layer_count);
-            for (layer_offset, layer_index) in (layer_start..layer_start + layer_count).enumerate()
-            {
-                let attn_norm_tensor_name = format!("blk.{layer_index}.attn_norm.weight");
-                let query_tensor_name = format!("blk.{layer_index}.attn_q.weight");
-                let key_tensor_name = format!("blk.{layer_index}.attn_k.weight");
-                let value_tensor_name = format!("blk.{layer_index}.attn_v.weight");
-                let attn_output_tensor_name = format!("blk.{layer_index}.attn_output.weight");
-                let ffn_norm_tensor_name = format!("blk.{layer_index}.ffn_norm.weight");
-                let gate_tensor_name = format!("blk.{layer_index}.ffn_gate.weight");
-                let up_tensor_name = format!("blk.{layer_index}.ffn_up.weight");
-                let down_tensor_name = format!("blk.{layer_index}.ffn_down.weight");
-
-                let attn_norm_weight = self.load_f32_tensor(&attn_norm_tensor_name)?.to_vec();
-                let query_row_count = self.tensor_row_count(&query_tensor_name)? as usize;
-                let key_row_count = self.tensor_row_count(&key_tensor_name)? as usize;
-                let value_row_count = self.tensor_row_count(&value_tensor_name)? as usize;
-                if query_row_count % head_count != 0
-                    || key_row_count % kv_head_count != 0
-                    || value_row_count != key_row_count
-                {
-                    return Err(GgufError::InvalidTensorRange(format!(
-                        "layer {layer_index} retained decode attention projection row counts"
-                    )));
-                }
-                let layer_head_dimension = query_row_count / head_count;
-                if layer_head_dimension != head_dimension
-                    || key_row_count / kv_head_count != layer_head_dimension
-                {
-                    return Err(GgufError::InvalidTensorRange(format!(
-                        "layer {layer_index} retained decode attention head dimension"
-                    )));
-                }
-
+            for (layer_offset, layer) in plan.layers().iter().enumerate() {
+                let layer_index = layer.layer_index();
+                let query_row_count = layer.qkv[0].row_count;
                 let (query_normalized_input, _, _) =
-                    rms_normalize_values(&query_state, &attn_norm_weight, self)?;
-                let mut query = self
-                    .read_quantized_logits_for_values(
-                        &query_normalized_input,
-                        &query_tensor_name,
-                        0,
-                        query_row_count as u64,
-                    )?
-                    .into_iter()
-                    .map(|logit| logit.value as f32)
-                    .collect::<Vec<_>>();
-                let mut query_key = self
-                    .read_quantized_logits_for_values(
-                        &query_normalized_input,
-                        &key_tensor_name,
-                        0,
-                        key_row_count as u64,
-                    )?
-                    .into_iter()
-                    .map(|logit| logit.value as f32)
-                    .collect::<Vec<_>>();
-                let query_value = self
-                    .read_quantized_logits_for_values(
-                        &query_normalized_input,
-                        &value_tensor_name,
-                        0,
-                        value_row_count as u64,
-                    )?
-                    .into_iter()
-                    .map(|logit| logit.value as f32)
-                    .collect::<Vec<_>>();
+                    rms_normalize_values(&query_state, &layer.attn_norm, rms_epsilon)?;
+                self.project_qkv_matrices_into(
+                    &layer.qkv,
+                    &query_normalized_input,
+                    &mut qkv_projection,
+                )?;
+                let mut query = qkv_projection.query().to_vec();
+                let mut query_key = qkv_projection.key().to_vec();
+                let query_value = qkv_projection.value().to_vec();
                 let query_position = layer_caches[layer_offset].keys.len();
                 apply_rope_to_projection(
                     &mut query,
                     head_count,
-                    layer_head_dimension,
+                    head_dimension,
                     query_position,
                     rope_freq_base,
                 )?;
                 apply_rope_to_projection(
                     &mut query_key,
                     kv_head_count,
-                    layer_head_dimension,
+                    head_dimension,
                     query_position,
                     rope_freq_base,
                 )?;
@@ -3371,7 +3344,7 @@ impl GgufHeader {
                 let mut all_values = layer_caches[layer_offset].values.clone();
                 all_values.push(query_value.clone());
 
-                let scale = (layer_head_dimension as f64).sqrt();
+                let scale = (head_dimension as f64).sqrt();
                 let mut query_scores = Vec::with_capacity(head_count * all_keys.len());
                 let mut query_attention_input = vec![0.0f32; query_row_count];
                 for head_index in 0..head_count {
@@ -3383,7 +3356,7 @@ impl GgufHeader {
                                 head_index,
                                 &all_keys[key_position],
                                 kv_head_index,
-                                layer_head_dimension,
+                                head_dimension,
                             ) / scale;
                             query_scores.push(GgufAttentionScoreSample {
                                 query_position,
@@ -3396,30 +3369,23 @@ impl GgufHeader {
                         })
                         .collect::<Vec<_>>();
                     let weights = softmax_f64(&raw_scores);
-                    for dim in 0..layer_head_dimension {
+                    for dim in 0..head_dimension {
                         let weighted_value = weights
                             .iter()
                             .enumerate()
                             .map(|(key_position, weight)| {
                                 *weight
-                                    * all_values[key_position]
-                                        [kv_head_index * layer_head_dimension + dim]
+                                    * all_values[key_position][kv_head_index * head_dimension + dim]
                                         as f64
                             })
                             .sum::<f64>();
-                        query_attention_input[head_index * layer_head_dimension + dim] =
+                        query_attention_input[head_index * head_dimension + dim] =
                             weighted_value as f32;
                     }
                 }
 
-                let attn_output_row_count = self.tensor_row_count(&attn_output_tensor_name)?;
                 let query_attention_output = self
-                    .read_quantized_logits_for_values(
-                        &query_attention_input,
-                        &attn_output_tensor_name,
-                        0,
-                        attn_output_row_count,
-                    )
+                    .read_matrix_logits_for_values(layer.attn_output, &query_attention_input)
                     .map(logit_values_to_f32)?;
                 let query_residual = query_state
                     .iter()
@@ -3427,46 +3393,16 @@ impl GgufHeader {
                     .map(|(state_value, attention_value)| *state_value + *attention_value)
                     .collect::<Vec<_>>();
 
-                let ffn_norm_weight = self.load_f32_tensor(&ffn_norm_tensor_name)?.to_vec();
                 let (query_ffn_normalized_input, query_ffn_rms, _) =
-                    rms_normalize_values(&query_residual, &ffn_norm_weight, self)?;
-                let gate_row_count = self.tensor_row_count(&gate_tensor_name)?;
-                let up_row_count = self.tensor_row_count(&up_tensor_name)?;
-                if gate_row_count != up_row_count {
-                    return Err(GgufError::InvalidTensorRange(format!(
-                        "layer {layer_index} retained decode FFN gate/up row count"
-                    )));
-                }
-                let query_gate_projection = self
-                    .read_quantized_logits_for_values(
-                        &query_ffn_normalized_input,
-                        &gate_tensor_name,
-                        0,
-                        gate_row_count,
-                    )
-                    .map(logit_values_to_f32)?;
-                let query_up_projection = self
-                    .read_quantized_logits_for_values(
-                        &query_ffn_normalized_input,
-                        &up_tensor_name,
-                        0,
-                        up_row_count,
-                    )
-                    .map(logit_values_to_f32)?;
-                let query_activated = query_gate_projection
-                    .iter()
-                    .zip(query_up_projection.iter())
-                    .map(|(gate, up)| silu(*gate) * *up)
-                    .collect::<Vec<_>>();
-                let down_row_count = self.tensor_row_count(&down_tensor_name)?;
-                let query_ffn_output = self
-                    .read_quantized_logits_for_values(
-                        &query_activated,
-                        &down_tensor_name,
-                        0,
-                        down_row_count,
-                    )
-                    .map(logit_values_to_f32)?;
+                    rms_normalize_values(&query_residual, &layer.ffn_norm, rms_epsilon)?;
+                self.swiglu_ffn_matrices_into(
+                    layer.gate,
+                    layer.up,
+                    layer.down,
+                    &query_ffn_normalized_input,
+                    &mut ffn_scratch,
+                )?;
+                let query_ffn_output = ffn_scratch.output();
                 let query_layer_output = query_residual
                     .iter()
                     .zip(query_ffn_output.iter())
@@ -3480,10 +3416,10 @@ impl GgufHeader {
                     attention_output_checksum: checksum_f32_values(&query_attention_output),
                     residual_checksum: checksum_f32_values(&query_residual),
                     ffn_rms_checksum: query_ffn_rms,
-                    gate_projection_checksum: checksum_f32_values(&query_gate_projection),
-                    up_projection_checksum: checksum_f32_values(&query_up_projection),
-                    activated_checksum: checksum_f32_values(&query_activated),
-                    ffn_output_checksum: checksum_f32_values(&query_ffn_output),
+                    gate_projection_checksum: ffn_scratch.gate_checksum(),
+                    up_projection_checksum: ffn_scratch.up_checksum(),
+                    activated_checksum: checksum_f32_values(ffn_scratch.activated()),
+                    ffn_output_checksum: checksum_f32_values(query_ffn_output),
                     layer_output_checksum: checksum_f32_values(&query_layer_output),
                 });
 
@@ -3492,16 +3428,11 @@ impl GgufHeader {
                 query_state = query_layer_output;
             }
 
-            let final_norm_weight = self.load_f32_tensor(final_norm_tensor_name)?.to_vec();
+            let final_norm_weight = &plan.final_norm;
             let (retained_final_normalized_input, retained_final_rms, _) =
-                rms_normalize_values(&query_state, &final_norm_weight, self)?;
-            let output_row_count = self.tensor_row_count(output_tensor_name)?;
-            let retained_logits = self.read_quantized_logits_for_values(
-                &retained_final_normalized_input,
-                output_tensor_name,
-                0,
-                output_row_count,
-            )?;
+                rms_normalize_values(&query_state, final_norm_weight, rms_epsilon)?;
+            let retained_logits =
+                self.read_matrix_logits_for_values(plan.output, &retained_final_normalized_input)?;
             let retained_top_logits = top_k_logits(&retained_logits, top_k);
             let retained_logits_checksum = checksum_logits(&retained_logits);
             let logits_abs_max_diff = full_sample
@@ -3550,7 +3481,7 @@ impl GgufHeader {
                 full_sample,
                 retained_layer_summaries,
                 retained_final_rms,
-                retained_final_norm_weight_checksum: checksum_f32_values(&final_norm_weight),
+                retained_final_norm_weight_checksum: checksum_f32_values(final_norm_weight),
                 retained_final_normalized_input_checksum: checksum_f32_values(
                     &retained_final_normalized_input,
                 ),
@@ -3665,31 +3596,259 @@ impl GgufHeader {
             .ok_or_else(|| GgufError::InvalidTensorRange(output_tensor_name.to_string()))?;
         let output_tensor_nbytes = output_info
             .nbytes
-            .ok_or_else(|| GgufError::UnknownTensorByteSize(output_tensor_name.to_string()))?;
-        let output_tensor_end = output_info
+            .ok_or_else(|| GgufError::UnknownTensorByteSize(output_tensor_name.to_string()))?;
+        let output_tensor_end = output_info
+            .absolute_offset
+            .checked_add(output_tensor_nbytes)
+            .ok_or_else(|| GgufError::InvalidTensorRange(output_tensor_name.to_string()))?;
+        if output_end_offset > output_tensor_end || output_end_offset > self.file_size {
+            return Err(GgufError::InvalidTensorRange(
+                output_tensor_name.to_string(),
+            ));
+        }
+
+        self.read_logit_rows(
+            output_info.tensor_type,
+            output_row_nbytes as usize,
+            output_start_offset,
+            output_row_start..output_row_end,
+            input_values,
+        )
+    }
+
+    /// Logits of every row of a resolved matrix, computed exactly as
+    /// [`Self::read_quantized_logits_for_values`] does.
+    fn read_matrix_logits_for_values(
+        &self,
+        matrix: QuantizedMatrix,
+        input_values: &[f32],
+    ) -> Result<Vec<GgufQuantizedLogitValue>, GgufError> {
+        self.read_logit_rows(
+            matrix.tensor_type,
+            matrix.row_nbytes,
+            matrix.absolute_offset,
+            0..matrix.row_count as u64,
+            input_values,
+        )
+    }
+
+    /// Reads rows `rows` starting at file offset `start_offset` one at a
+    /// time and dots each with `input_values`.
+    fn read_logit_rows(
+        &self,
+        tensor_type: u32,
+        row_nbytes: usize,
+        start_offset: u64,
+        rows: std::ops::Range<u64>,
+        input_values: &[f32],
+    ) -> Result<Vec<GgufQuantizedLogitValue>, GgufError> {
+        let mut logits = Vec::with_capacity((rows.end - rows.start) as usize);
+        let mut file = File::open(&self.path)?;
+        file.seek(SeekFrom::Start(start_offset))?;
+        let mut row_bytes = vec![0u8; row_nbytes];
+        for row_index in rows {
+            file.read_exact(&mut row_bytes)?;
+            let mut output_values = decode_quantized_blocks(tensor_type, &row_bytes)?;
+            output_values.truncate(input_values.len());
+            logits.push(GgufQuantizedLogitValue {
+                row_index,
+                value: dot_f32_values(input_values, &output_values),
+            });
+        }
+        Ok(logits)
+    }
+
+    /// Projects one normalized input through the Q, K and V matrices in a single
+    /// fused pass: the three tensors are validated and read through one file
+    /// handle, and their rows are scheduled together across threads.
+    pub fn read_qkv_projection_into(
+        &self,
+        input_values: &[f32],
+        query_tensor_name: &str,
+        key_tensor_name: &str,
+        value_tensor_name: &str,
+        projection: &mut GgufQkvProjection,
+    ) -> Result<(), GgufError> {
+        let matrices = [
+            self.quantized_matrix(query_tensor_name)?,
+            self.quantized_matrix(key_tensor_name)?,
+            self.quantized_matrix(value_tensor_name)?,
+        ];
+        for (matrix, tensor_name) in
+            matrices
+                .iter()
+                .zip([query_tensor_name, key_tensor_name, value_tensor_name])
+        {
+            if matrix.column_count != input_values.len() {
+                return Err(GgufError::InvalidTensorRange(format!(
+                    "input logits {tensor_name}"
+                )));
+            }
+        }
+        self.project_qkv_matrices_into(&matrices, input_values, projection)
+    }
+
+    /// Body of [`Self::read_qkv_projection_into`] for matrices that are
+    /// already resolved and checked against the input length.
+    fn project_qkv_matrices_into(
+        &self,
+        matrices: &[QuantizedMatrix; 3],
+        input_values: &[f32],
+        projection: &mut GgufQkvProjection,
+    ) -> Result<(), GgufError> {
+        self.read_quantized_matrices(matrices, &mut projection.weight_bytes)?;
+        projection.query_len = matrices[0].row_count;
+        projection.key_len = matrices[1].row_count;
+        projection
+            .values
+            .resize(matrices.iter().map(|matrix| matrix.row_count).sum(), 0.0);
+        project_quantized_rows_into(
+            matrices,
+            &projection.weight_bytes,
+            input_values,
+            &mut projection.values,
+        );
+        Ok(())
+    }
+
+    pub fn read_qkv_projection(
+        &self,
+        input_values: &[f32],
+        query_tensor_name: &str,
+        key_tensor_name: &str,
+        value_tensor_name: &str,
+    ) -> Result<GgufQkvProjection, GgufError> {
+        let mut projection = GgufQkvProjection::default();
+        self.read_qkv_projection_into(
+            input_values,
+            query_tensor_name,
+            key_tensor_name,
+            value_tensor_name,
+            &mut projection,
+        )?;
+        Ok(projection)
+    }
+
+    /// Runs a SwiGLU feed-forward block, `down(silu(gate(x)) * up(x))`, as one
+    /// fused pass: each gate/up row pair is decoded and dotted together and the
+    /// activation is applied before anything is written back, so the only
+    /// intermediate that reaches memory is the activation vector in `scratch`.
+    pub fn read_swiglu_ffn_into(
+        &self,
+        input_values: &[f32],
+        gate_tensor_name: &str,
+        up_tensor_name: &str,
+        down_tensor_name: &str,
+        scratch: &mut GgufSwiGluScratch,
+    ) -> Result<(), GgufError> {
+        let gate = self.quantized_matrix(gate_tensor_name)?;
+        let up = self.quantized_matrix(up_tensor_name)?;
+        let down = self.quantized_matrix(down_tensor_name)?;
+        if gate.column_count != input_values.len() || up.column_count != input_values.len() {
+            return Err(GgufError::InvalidTensorRange(format!(
+                "input logits {gate_tensor_name}/{up_tensor_name}"
+            )));
+        }
+        if gate.row_count != up.row_count || down.column_count != gate.row_count {
+            return Err(GgufError::InvalidTensorRange(format!(
+                "SwiGLU FFN shape {gate_tensor_name}/{up_tensor_name}/{down_tensor_name}"
+            )));
+        }
+        self.swiglu_ffn_matrices_into(gate, up, down, input_values, scratch)
+    }
+
+    /// Body of [`Self::read_swiglu_ffn_into`] for matrices that are already
+    /// resolved and checked against each other and the input length.
+    fn swiglu_ffn_matrices_into(
+        &self,
+        gate: QuantizedMatrix,
+        up: QuantizedMatrix,
+        down: QuantizedMatrix,
+        input_values: &[f32],
+        scratch: &mut GgufSwiGluScratch,
+    ) -> Result<(), GgufError> {
+        self.read_quantized_matrices(&[gate, up, down], &mut scratch.weight_bytes)?;
+        let (gate_up_bytes, down_bytes) =
+            scratch.weight_bytes.split_at(gate.nbytes() + up.nbytes());
+        scratch.rows.resize(gate.row_count, SwiGluRow::default());
+        swiglu_rows_into(gate, up, gate_up_bytes, input_values, &mut scratch.rows);
+        scratch.activated.clear();
+        scratch
+            .activated
+            .extend(scratch.rows.iter().map(|row| row.activated));
+        scratch.output.resize(down.row_count, 0.0);
+        project_quantized_rows_into(&[down], down_bytes, &scratch.activated, &mut scratch.output);
+        Ok(())
+    }
+
+    pub(super) fn quantized_matrix(&self, tensor_name: &str) -> Result<QuantizedMatrix, GgufError> {
+        let tensor = self
+            .tensors
+            .iter()
+            .find(|tensor| tensor.name == tensor_name)
+            .ok_or_else(|| GgufError::TensorNotFound(tensor_name.to_string()))?;
+        let (block_size, type_size) = ggml_type_layout(tensor.tensor_type).ok_or_else(|| {
+            GgufError::UnsupportedTensorType {
+                name: tensor_name.to_string(),
+                tensor_type: tensor.tensor_type,
+            }
+        })?;
+        if !matches!(tensor.tensor_type, 12 | 14) {
+            return Err(GgufError::UnsupportedTensorType {
+                name: tensor_name.to_string(),
+                tensor_type: tensor.tensor_type,
+            });
+        }
+        let column_count = tensor.dimensions.first().copied().unwrap_or(0);
+        let row_count = tensor.dimensions.get(1).copied().unwrap_or(1);
+        if column_count == 0 || row_count == 0 {
+            return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
+        }
+        let row_nbytes = column_count
+            .div_ceil(block_size)
+            .checked_mul(type_size)
+            .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        let matrix_end = row_count
+            .checked_mul(row_nbytes)
+            .and_then(|nbytes| tensor.absolute_offset.checked_add(nbytes))
+            .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        let tensor_nbytes = tensor
+            .nbytes
+            .ok_or_else(|| GgufError::UnknownTensorByteSize(tensor_name.to_string()))?;
+        let tensor_end = tensor
             .absolute_offset
-            .checked_add(output_tensor_nbytes)
-            .ok_or_else(|| GgufError::InvalidTensorRange(output_tensor_name.to_string()))?;
-        if output_end_offset > output_tensor_end || output_end_offset > self.file_size {
-            return Err(GgufError::InvalidTensorRange(
-                output_tensor_name.to_string(),
-            ));
+            .checked_add(tensor_nbytes)
+            .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        if matrix_end > tensor_end || matrix_end > self.file_size {
+            return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
         }
+        Ok(QuantizedMatrix {
+            tensor_type: tensor.tensor_type,
+            column_count: column_count
+                .try_into()
+                .map_err(|_| GgufError::TensorShapeTooLarge(tensor_name.to_string()))?,
+            row_count: row_count
+                .try_into()
+                .map_err(|_| GgufError::TensorShapeTooLarge(tensor_name.to_string()))?,
+            row_nbytes: row_nbytes as usize,
+            absolute_offset: tensor.absolute_offset,
+        })
+    }
 
-        let mut logits = Vec::with_capacity(output_row_count as usize);
+    pub(super) fn read_quantized_matrices(
+        &self,
+        matrices: &[QuantizedMatrix],
+        bytes: &mut Vec<u8>,
+    ) -> Result<(), GgufError> {
+        bytes.resize(matrices.iter().map(QuantizedMatrix::nbytes).sum(), 0);
         let mut file = File::open(&self.path)?;
-        file.seek(SeekFrom::Start(output_start_offset))?;
-        let mut row_bytes = vec![0u8; output_row_nbytes as usize];
-        for row_index in output_row_start..output_row_end {
-            file.read_exact(&mut row_bytes)?;
-            let mut output_values = decode_quantized_blocks(output_info.tensor_type, &row_bytes)?;
-            output_values.truncate(output_column_count_usize);
-            logits.push(GgufQuantizedLogitValue {
-                row_index,
-                value: dot_f32_values(input_values, &output_values),
-            });
+        let mut byte_start = 0usize;
+        for matrix in matrices {
+            file.seek(SeekFrom::Start(matrix.absolute_offset))?;
+            file.read_exact(&mut bytes[byte_start..byte_start + matrix.nbytes()])?;
+            byte_start += matrix.nbytes();
         }
-        Ok(logits)
+        Ok(())
     }
 
     pub fn read_gpu_quantized_logits_for_values_sample(
@@ -3873,17 +4032,73 @@ impl GgufHeader {
     }
 
     pub fn load_f32_tensor(&self, tensor_name: &str) -> Result<NdArray, GgufError> {
+        let (_, shape, bytes) = self.read_dense_tensor(tensor_name, &[0])?;
+        let values = bytes
+            .chunks_exact(4)
+            .map(|chunk| f32::from_le_bytes([chunk[0], chunk[1], chunk[2], chunk[3]]))
+            .collect::<Vec<_>>();
+        Ok(NdArray::from_list(values, Some(&shape)))
+    }
+
+    /// Loads an F32, F16 or BF16 tensor as `T`. F16 into [`F16`] and BF16
+    /// into [`BF16`] keep the stored bits; other pairs round through `f32`.
+    pub fn load_typed_tensor<T: Element>(
+        &self,
+        tensor_name: &str,
+    ) -> Result<TypedArray<T>, GgufError> {
+        let (tensor_type, shape, bytes) = self.read_dense_tensor(tensor_name, &[0, 1, 30])?;
+        let values = match tensor_type {
+            0 => bytes
+                .chunks_exact(4)
+                .map(|chunk| {
+                    T::from_f32(f32::from_le_bytes([chunk[0], chunk[1], chunk[2], chunk[3]]))
+                })
+                .collect(),
+            1 => bytes
+                .chunks_exact(2)
+                .map(|chunk| {
+                    T::from_f32(F16::from_bits(u16::from_le_bytes([chunk[0], chunk[1]])).to_f32())
+                })
+                .collect(),
+            _ => bytes
+                .chunks_exact(2)
+                .map(|chunk| {
+                    T::from_f32(BF16::from_bits(u16::from_le_bytes([chunk[0], chunk[1]])).to_f32())
+                })
+                .collect(),
+        };
+        Ok(TypedArray::from_vec(values, &shape))
+    }
+
+    pub fn load_f16_tensor(&self, tensor_name: &str) -> Result<TypedArray<F16>, GgufError> {
+        self.load_typed_tensor(tensor_name)
+    }
+
+    pub fn load_bf16_tensor(&self, tensor_name: &str) -> Result<TypedArray<BF16>, GgufError> {
+        self.load_typed_tensor(tensor_name)
+    }
+
+    /// Reads the raw little-endian bytes of an unquantized tensor whose type
+    /// is one of `accepted_types`, returning its type and shape with them.
+    fn read_dense_tensor(
+        &self,
+        tensor_name: &str,
+        accepted_types: &[u32],
+    ) -> Result<(u32, Vec<usize>, Vec<u8>), GgufError> {
         let tensor = self
             .tensors
             .iter()
             .find(|tensor| tensor.name == tensor_name)
             .ok_or_else(|| GgufError::TensorNotFound(tensor_name.to_string()))?;
-        if tensor.tensor_type != 0 {
+        if !accepted_types.contains(&tensor.tensor_type) {
             return Err(GgufError::UnsupportedTensorType {
                 name: tensor_name.to_string(),
                 tensor_type: tensor.tensor_type,
             });
         }
+        let element_size = ggml_type_layout(tensor.tensor_type)
+            .map(|(_, type_size)| type_size)
+            .unwrap_or(4);
         let tensor_nbytes = tensor
             .nbytes
             .ok_or_else(|| GgufError::UnknownTensorByteSize(tensor_name.to_string()))?;
@@ -3891,7 +4106,7 @@ impl GgufHeader {
             .absolute_offset
             .checked_add(tensor_nbytes)
             .ok_or_else(|| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
-        if tensor_end > self.file_size || tensor_nbytes % 4 != 0 {
+        if tensor_end > self.file_size || tensor_nbytes % element_size != 0 {
             return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
         }
 
@@ -3905,7 +4120,7 @@ impl GgufHeader {
             .iter()
             .try_fold(1usize, |acc, dim| acc.checked_mul(*dim))
             .ok_or_else(|| GgufError::TensorShapeTooLarge(tensor_name.to_string()))?;
-        if element_count * 4 != tensor_nbytes as usize {
+        if element_count as u64 * element_size != tensor_nbytes {
             return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
         }
 
@@ -3913,11 +4128,69 @@ impl GgufHeader {
         file.seek(SeekFrom::Start(tensor.absolute_offset))?;
         let mut bytes = vec![0u8; tensor_nbytes as usize];
         file.read_exact(&mut bytes)?;
-        let values = bytes
-            .chunks_exact(4)
-            .map(|chunk| f32::from_le_bytes([chunk[0], chunk[1], chunk[2], chunk[3]]))
-            .collect::<Vec<_>>();
-        Ok(NdArray::from_list(values, Some(&shape)))
+        Ok((tensor.tensor_type, shape, bytes))
+    }
+
+    /// Loads a Q4_K or Q6_K matrix without decoding it: the returned tensor
+    /// holds the packed blocks, read into memory.
+    pub fn load_qtensor(&self, tensor_name: &str) -> Result<QTensor, GgufError> {
+        let matrix = self.quantized_matrix(tensor_name)?;
+        let mut file = File::open(&self.path)?;
+        file.seek(SeekFrom::Start(matrix.absolute_offset))?;
+        let mut bytes = vec![0u8; matrix.nbytes()];
+        file.read_exact(&mut bytes)?;
+        Ok(QTensor::from_bytes(
+            qtensor_format(&matrix),
+            [matrix.row_count, matrix.column_count],
+            bytes,
+        ))
+    }
+
+    /// [`Self::load_qtensor`] for several tensors.
+    pub fn load_qtensors(&self, tensor_names: &[&str]) -> Result<Vec<QTensor>, GgufError> {
+        tensor_names
+            .iter()
+            .map(|tensor_name| self.load_qtensor(tensor_name))
+            .collect()
+    }
+
+    /// Like [`Self::load_qtensors`], but without copying: the tensors read
+    /// their blocks from one read-only mapping of the model file.
+    ///
+    /// # Safety
+    ///
+    /// The model file must not be truncated or modified, by this or any other
+    /// process, while a returned tensor or a clone of it is alive. The mapping
+    /// does not protect against that: a truncated file makes reads of the
+    /// tensor fault with `SIGBUS`, and a rewritten one changes its weights
+    /// under live shared references, both undefined behavior.
+    pub unsafe fn map_qtensors(&self, tensor_names: &[&str]) -> Result<Vec<QTensor>, GgufError> {
+        // SAFETY: the caller upholds `MappedFile::open`'s contract for as
+        // long as the tensors that share the mapping live.
+        let file = Arc::new(unsafe { MappedFile::open(&self.path) }?);
+        tensor_names
+            .iter()
+            .map(|tensor_name| self.mapped_qtensor(&file, tensor_name))
+            .collect()
+    }
+
+    fn mapped_qtensor(
+        &self,
+        file: &Arc<MappedFile>,
+        tensor_name: &str,
+    ) -> Result<QTensor, GgufError> {
+        let matrix = self.quantized_matrix(tensor_name)?;
+        let offset = usize::try_from(matrix.absolute_offset)
+            .map_err(|_| GgufError::InvalidTensorRange(tensor_name.to_string()))?;
+        if offset + matrix.nbytes() > file.bytes().len() {
+            return Err(GgufError::InvalidTensorRange(tensor_name.to_string()));
+        }
+        Ok(QTensor::from_mapped(
+            qtensor_format(&matrix),
+            [matrix.row_count, matrix.column_count],
+            Arc::clone(file),
+            offset,
+        ))
     }
 
     pub fn f32_tensor_names(&self) -> Vec<String> {
@@ -3960,6 +4233,11 @@ impl GgufHeader {
         }
     }
 
+    fn rms_epsilon(&self) -> f32 {
+        self.f32_value("llama.attention.layer_norm_rms_epsilon")
+            .unwrap_or(0.00001)
+    }
+
     pub fn f32_value(&self, key: &str) -> Option<f32> {
         match self.metadata_value(key) {
             Some(GgufMetadataValue::F32(value)) => Some(*value),
@@ -4336,6 +4614,11 @@ fn tensor_nbytes(tensor_type: u32, dimensions: &[u64]) -> Option<u64> {
     Some(elements.div_ceil(block_size) * type_size)
 }
 
+fn qtensor_format(matrix: &QuantizedMatrix) -> QuantFormat {
+    QuantFormat::from_ggml_type(matrix.tensor_type)
+        .expect("quantized_matrix only accepts Q4_K and Q6_K")
+}
+
 fn ggml_type_layout(tensor_type: u32) -> Option<(u64, u64)> {
     match tensor_type {
         0 => Some((1, 4)),      // F32
@@ -4355,6 +4638,7 @@ fn ggml_type_layout(tensor_type: u32) -> Option<(u64, u64)> {
         16 => Some((1, 8)),     // I8
         17 => Some((1, 2)),     // I16
         18 => Some((1, 4)),     // I32
+        30 => Some((1, 2)),     // BF16
         _ => None,
     }
 }
@@ -4378,6 +4662,7 @@ fn ggml_type_name(tensor_type: u32) -> &'static str {
         16 => "I8",
         17 => "I16",
         18 => "I32",
+        30 => "BF16",
         _ => "UNKNOWN",
     }
 }
@@ -4386,29 +4671,8 @@ fn dequantize_q4_k_block(bytes: &[u8]) -> Result<Vec<f32>, GgufError> {
     if bytes.len() != 144 {
         return Err(GgufError::InvalidTensorRange("Q4_K block".to_string()));
     }
-    let d = f16_to_f32(u16::from_le_bytes([bytes[0], bytes[1]]));
-    let dmin = f16_to_f32(u16::from_le_bytes([bytes[2], bytes[3]]));
-    let scales = &bytes[4..16];
-    let qs = &bytes[16..144];
-    let mut values = Vec::with_capacity(256);
-    let mut q_offset = 0usize;
-    let mut scale_idx = 0usize;
-    for _ in (0..256).step_by(64) {
-        let (sc1, min1) = q4_k_scale_min(scale_idx, scales);
-        let (sc2, min2) = q4_k_scale_min(scale_idx + 1, scales);
-        let d1 = d * sc1 as f32;
-        let m1 = dmin * min1 as f32;
-        let d2 = d * sc2 as f32;
-        let m2 = dmin * min2 as f32;
-        for byte in &qs[q_offset..q_offset + 32] {
-            values.push(d1 * (byte & 0x0f) as f32 - m1);
-        }
-        for byte in &qs[q_offset..q_offset + 32] {
-            values.push(d2 * (byte >> 4) as f32 - m2);
-        }
-        q_offset += 32;
-        scale_idx += 2;
-    }
+    let mut values = vec![0.0f32; 256];
+    dequantize_q4_k_block_into(bytes, &mut values);
     Ok(values)
 }
 
@@ -4439,71 +4703,409 @@ fn decode_quantized_blocks(tensor_type: u32, bytes: &[u8]) -> Result<Vec<f32>, G
     Ok(values)
 }
 
-fn q4_k_scale_min(index: usize, scales: &[u8]) -> (u8, u8) {
-    if index < 4 {
-        (scales[index] & 63, scales[index + 4] & 63)
-    } else {
-        (
-            (scales[index + 4] & 0x0f) | ((scales[index - 4] >> 6) << 4),
-            (scales[index + 4] >> 4) | ((scales[index] >> 6) << 4),
-        )
-    }
-}
-
 fn dequantize_q6_k_block(bytes: &[u8]) -> Result<Vec<f32>, GgufError> {
     if bytes.len() != 210 {
         return Err(GgufError::InvalidTensorRange("Q6_K block".to_string()));
     }
-    let ql = &bytes[0..128];
-    let qh = &bytes[128..192];
-    let scales = &bytes[192..208];
-    let d = f16_to_f32(u16::from_le_bytes([bytes[208], bytes[209]]));
     let mut values = vec![0.0f32; 256];
-    for n in (0..256).step_by(128) {
-        let ql_base = n / 2;
-        let qh_base = n / 4;
-        let scale_base = n / 16;
-        for l in 0..32usize {
-            let scale_pair = l / 16;
-            let qh_byte = qh[qh_base + l];
-            let q1 = ((ql[ql_base + l] & 0x0f) | (((qh_byte >> 0) & 3) << 4)) as i8 - 32;
-            let q2 = ((ql[ql_base + l + 32] & 0x0f) | (((qh_byte >> 2) & 3) << 4)) as i8 - 32;
-            let q3 = ((ql[ql_base + l] >> 4) | (((qh_byte >> 4) & 3) << 4)) as i8 - 32;
-            let q4 = ((ql[ql_base + l + 32] >> 4) | (((qh_byte >> 6) & 3) << 4)) as i8 - 32;
-            values[n + l] = d * scales[scale_base + scale_pair] as i8 as f32 * q1 as f32;
-            values[n + l + 32] = d * scales[scale_base + scale_pair + 2] as i8 as f32 * q2 as f32;
-            values[n + l + 64] = d * scales[scale_base + scale_pair + 4] as i8 as f32 * q3 as f32;
-            values[n + l + 96] = d * scales[scale_base + scale_pair + 6] as i8 as f32 * q4 as f32;
+    dequantize_q6_k_block_into(bytes, &mut values);
+    Ok(values)
+}
+
+/// Decodes a row of Q4_K/Q6_K blocks into `values`, truncating the last block
+/// to `values.len()`. Callers validate the row length up front.
+pub(super) fn decode_quantized_row_into(tensor_type: u32, bytes: &[u8], values: &mut [f32]) {
+    let (type_size, decode_block) = quantized_block_decoder(tensor_type);
+    for (block, chunk) in bytes.chunks_exact(type_size).zip(values.chunks_mut(256)) {
+        if chunk.len() == 256 {
+            decode_block(block, chunk);
+        } else {
+            let mut tail = [0.0f32; 256];
+            decode_block(block, &mut tail);
+            let len = chunk.len();
+            chunk.copy_from_slice(&tail[..len]);
+        }
+    }
+}
+
+/// Expands one quantized block into its `f32` weights.
+type BlockDecoder = fn(&[u8], &mut [f32]);
+
+fn quantized_block_decoder(tensor_type: u32) -> (usize, BlockDecoder) {
+    if tensor_type == 12 {
+        (144, dequantize_q4_k_block_into)
+    } else {
+        (210, dequantize_q6_k_block_into)
+    }
+}
+
+/// Computes `output[row] = dot(input, row)` over the rows of `matrices`, which
+/// are stacked in order (their bytes laid out back to back in `bytes`).
+pub(super) fn project_quantized_rows_into(
+    matrices: &[QuantizedMatrix],
+    bytes: &[u8],
+    input_values: &[f32],
+    output: &mut [f32],
+) {
+    let rows_per_task = parallel::items_per_task(output.len(), input_values.len());
+    parallel::for_each_chunk_mut(output, rows_per_task, |task_index, task_output| {
+        let first_row = task_index * rows_per_task;
+        for (offset, output_value) in task_output.iter_mut().enumerate() {
+            let (tensor_type, row_bytes) =
+                quantized_matrix_row(matrices, bytes, first_row + offset);
+            *output_value = quantized_row_dot(tensor_type, row_bytes, input_values) as f32;
+        }
+    });
+}
+
+pub(super) fn swiglu_rows_into(
+    gate: QuantizedMatrix,
+    up: QuantizedMatrix,
+    bytes: &[u8],
+    input_values: &[f32],
+    rows: &mut [SwiGluRow],
+) {
+    let (gate_bytes, up_bytes) = bytes.split_at(gate.nbytes());
+    let (gate_type_size, decode_gate_block) = quantized_block_decoder(gate.tensor_type);
+    let (up_type_size, decode_up_block) = quantized_block_decoder(up.tensor_type);
+    let rows_per_task = parallel::items_per_task(rows.len(), 2 * input_values.len());
+    parallel::for_each_chunk_mut(rows, rows_per_task, |task_index, task_rows| {
+        let mut gate_values = [0.0f32; 256];
+        let mut up_values = [0.0f32; 256];
+        let first_row = task_index * rows_per_task;
+        for (offset, row) in task_rows.iter_mut().enumerate() {
+            let row_index = first_row + offset;
+            let gate_row =
+                &gate_bytes[row_index * gate.row_nbytes..(row_index + 1) * gate.row_nbytes];
+            let up_row = &up_bytes[row_index * up.row_nbytes..(row_index + 1) * up.row_nbytes];
+            let mut gate_sum = 0.0f64;
+            let mut up_sum = 0.0f64;
+            for ((gate_block, up_block), inputs) in gate_row
+                .chunks_exact(gate_type_size)
+                .zip(up_row.chunks_exact(up_type_size))
+                .zip(input_values.chunks(256))
+            {
+                decode_gate_block(gate_block, &mut gate_values);
+                decode_up_block(up_block, &mut up_values);
+                for ((input, gate_value), up_value) in
+                    inputs.iter().zip(gate_values.iter()).zip(up_values.iter())
+                {
+                    gate_sum += *input as f64 * *gate_value as f64;
+                    up_sum += *input as f64 * *up_value as f64;
+                }
+            }
+            let gate_value = gate_sum as f32;
+            let up_value = up_sum as f32;
+            *row = SwiGluRow {
+                gate: gate_value,
+                up: up_value,
+                activated: silu(gate_value) * up_value,
+            };
+        }
+    });
+}
+
+/// Dot product of `input_values` with one Q4_K/Q6_K row, decoding a block at a
+/// time into a stack buffer. Accumulates in f64 in element order, so the result
+/// matches decoding the whole row and calling `dot_f32_values`.
+pub(super) fn quantized_row_dot(tensor_type: u32, row_bytes: &[u8], input_values: &[f32]) -> f64 {
+    let (type_size, decode_block) = quantized_block_decoder(tensor_type);
+    let mut block_values = [0.0f32; 256];
+    let mut sum = 0.0f64;
+    for (block, inputs) in row_bytes
+        .chunks_exact(type_size)
+        .zip(input_values.chunks(256))
+    {
+        decode_block(block, &mut block_values);
+        for (input, value) in inputs.iter().zip(block_values.iter()) {
+            sum += *input as f64 * *value as f64;
+        }
+    }
+    sum
+}
+
+fn quantized_matrix_row<'a>(
+    matrices: &[QuantizedMatrix],
+    bytes: &'a [u8],
+    mut row: usize,
+) -> (u32, &'a [u8]) {
+    let mut byte_start = 0usize;
+    for matrix in matrices {
+        if row < matrix.row_count {
+            let row_start = byte_start + row * matrix.row_nbytes;
+            return (
+                matrix.tensor_type,
+                &bytes[row_start..row_start + matrix.row_nbytes],
+            );
+        }
+        row -= matrix.row_count;
+        byte_start += matrix.nbytes();
+    }
+    panic!("quantized matrix row out of range")
+}
+
+/// Inputs accumulated together by the multi-vector kernels; larger batches are
+/// handled in groups of this many, with accumulators kept on the stack.
+const BATCH_LANES: usize = 8;
+
+/// Multi-input form of [`project_quantized_rows_into`]: `inputs` holds `batch`
+/// vectors back to back and `output[row * batch + lane]` receives
+/// `store(dot(inputs[lane], row))`. Each weight block is decoded once per group
+/// of `BATCH_LANES` inputs, and every dot keeps the single-input summation
+/// order, so results match the one-vector kernel bit for bit.
+pub(super) fn project_quantized_rows_batch_into<T, S>(
+    matrices: &[QuantizedMatrix],
+    bytes: &[u8],
+    inputs: &[f32],
+    batch: usize,
+    output: &mut [T],
+    store: S,
+) where
+    T: Send,
+    S: Fn(f64) -> T + Sync,
+{
+    let column_count = inputs.len() / batch.max(1);
+    let row_count = output.len() / batch.max(1);
+    let rows_per_task = parallel::items_per_task(row_count, batch * column_count);
+    parallel::for_each_chunk_mut(output, rows_per_task * batch, |task_index, task_output| {
+        let first_row = task_index * rows_per_task;
+        let mut sums = [0.0f64; BATCH_LANES];
+        for (offset, row_output) in task_output.chunks_exact_mut(batch).enumerate() {
+            let (tensor_type, row_bytes) =
+                quantized_matrix_row(matrices, bytes, first_row + offset);
+            for (group_index, group_output) in row_output.chunks_mut(BATCH_LANES).enumerate() {
+                let lanes = group_output.len();
+                let group_start = group_index * BATCH_LANES * column_count;
+                quantized_row_dots(
+                    tensor_type,
+                    row_bytes,
+                    &inputs[group_start..group_start + lanes * column_count],
+                    column_count,
+                    &mut sums[..lanes],
+                );
+                for (value, sum) in group_output.iter_mut().zip(sums.iter()) {
+                    *value = store(*sum);
+                }
+            }
+        }
+    });
+}
+
+/// Running top-k rows and log-sum-exp of one input's logits.
+#[derive(Clone, Debug)]
+pub(super) struct TopLogits {
+    /// `(row, logit)`, best first; equal logits keep the lower row first.
+    pub(super) top: Vec<(usize, f64)>,
+    max: f64,
+    /// Sum of `exp(logit - max)` over every row seen.
+    scaled_sum: f64,
+}
+
+impl Default for TopLogits {
+    fn default() -> Self {
+        Self {
+            top: Vec::new(),
+            max: f64::NEG_INFINITY,
+            scaled_sum: 0.0,
         }
     }
-    Ok(values)
 }
 
-fn f16_to_f32(bits: u16) -> f32 {
-    let sign = ((bits & 0x8000) as u32) << 16;
-    let exp = ((bits >> 10) & 0x1f) as i32;
-    let frac = (bits & 0x03ff) as u32;
-    let f32_bits = if exp == 0 {
-        if frac == 0 {
-            sign
+impl TopLogits {
+    fn clear(&mut self) {
+        self.top.clear();
+        self.max = f64::NEG_INFINITY;
+        self.scaled_sum = 0.0;
+    }
+
+    pub(super) fn log_sum_exp(&self) -> f64 {
+        self.max + self.scaled_sum.ln()
+    }
+
+    fn push(&mut self, k: usize, row: usize, logit: f64) {
+        if logit > self.max {
+            self.scaled_sum = self.scaled_sum * (self.max - logit).exp() + 1.0;
+            self.max = logit;
         } else {
-            let mut mant = frac;
-            let mut exponent = -14i32;
-            while mant & 0x0400 == 0 {
-                mant <<= 1;
-                exponent -= 1;
+            self.scaled_sum += (logit - self.max).exp();
+        }
+        self.insert(k, row, logit);
+    }
+
+    fn insert(&mut self, k: usize, row: usize, logit: f64) {
+        let ranks_before = |(other_row, other_logit): &(usize, f64)| {
+            logit
+                .total_cmp(other_logit)
+                .then_with(|| other_row.cmp(&row))
+                .is_gt()
+        };
+        if self.top.len() == k && self.top.last().is_none_or(|last| !ranks_before(last)) {
+            return;
+        }
+        let index = self
+            .top
+            .iter()
+            .position(ranks_before)
+            .unwrap_or(self.top.len());
+        if self.top.len() == k {
+            self.top.pop();
+        }
+        self.top.insert(index, (row, logit));
+    }
+
+    fn merge(&mut self, k: usize, other: &Self) {
+        let max = self.max.max(other.max);
+        if max > f64::NEG_INFINITY {
+            self.scaled_sum = self.scaled_sum * (self.max - max).exp()
+                + other.scaled_sum * (other.max - max).exp();
+            self.max = max;
+        }
+        for (row, logit) in &other.top {
+            self.insert(k, *row, *logit);
+        }
+    }
+}
+
+/// Output-head form of [`project_quantized_rows_batch_into`] that keeps, per
+/// input, only the `k` largest logits and the log-sum-exp over every row.
+/// The rows are split into contiguous shards, one per task; each shard
+/// tracks its own running summaries in `shards[shard * batch..]`, and the
+/// shards are merged into `shards[..batch]` in row order. Logit values are
+/// those of the full projection, and ties resolve to the lower row.
+pub(super) fn project_quantized_rows_top_k_into(
+    matrix: QuantizedMatrix,
+    bytes: &[u8],
+    inputs: &[f32],
+    batch: usize,
+    k: usize,
+    shards: &mut [TopLogits],
+) {
+    let column_count = inputs.len() / batch.max(1);
+    let shard_capacity = shards.len() / batch.max(1);
+    let rows_per_task = parallel::items_per_task(matrix.row_count, batch * column_count)
+        .max(matrix.row_count.div_ceil(shard_capacity.max(1)));
+    let shard_count = matrix.row_count.div_ceil(rows_per_task);
+    let shards = &mut shards[..shard_count * batch];
+    parallel::for_each_chunk_mut(shards, batch, |task_index, summaries| {
+        for summary in summaries.iter_mut() {
+            summary.clear();
+        }
+        let first_row = task_index * rows_per_task;
+        let last_row = (first_row + rows_per_task).min(matrix.row_count);
+        let mut sums = [0.0f64; BATCH_LANES];
+        for row in first_row..last_row {
+            let row_bytes = &bytes[row * matrix.row_nbytes..(row + 1) * matrix.row_nbytes];
+            for (group_index, group) in summaries.chunks_mut(BATCH_LANES).enumerate() {
+                let lanes = group.len();
+                let group_start = group_index * BATCH_LANES * column_count;
+                quantized_row_dots(
+                    matrix.tensor_type,
+                    row_bytes,
+                    &inputs[group_start..group_start + lanes * column_count],
+                    column_count,
+                    &mut sums[..lanes],
+                );
+                for (summary, sum) in group.iter_mut().zip(sums.iter()) {
+                    summary.push(k, row, *sum);
+                }
             }
-            mant &= 0x03ff;
-            let exp32 = (exponent + 127) as u32;
-            sign | (exp32 << 23) | (mant << 13)
         }
-    } else if exp == 0x1f {
-        sign | 0x7f80_0000 | (frac << 13)
-    } else {
-        let exp32 = (exp - 15 + 127) as u32;
-        sign | (exp32 << 23) | (frac << 13)
-    };
-    f32::from_bits(f32_bits)
+    });
+    let (merged, rest) = shards.split_at_mut(batch);
+    for shard in rest.chunks_exact(batch) {
+        for (summary, other) in merged.iter_mut().zip(shard) {
+            summary.merge(k, other);
+        }
+    }
+}
+
+/// Multi-input form of [`swiglu_rows_into`]; `rows[row * batch + lane]`
+/// receives the gate/up projections of input `lane`.
+pub(super) fn swiglu_rows_batch_into(
+    gate: QuantizedMatrix,
+    up: QuantizedMatrix,
+    bytes: &[u8],
+    inputs: &[f32],
+    batch: usize,
+    rows: &mut [SwiGluRow],
+) {
+    let (gate_bytes, up_bytes) = bytes.split_at(gate.nbytes());
+    let column_count = inputs.len() / batch.max(1);
+    let rows_per_task = parallel::items_per_task(gate.row_count, 2 * batch * column_count);
+    parallel::for_each_chunk_mut(rows, rows_per_task * batch, |task_index, task_rows| {
+        let first_row = task_index * rows_per_task;
+        let mut gate_sums = [0.0f64; BATCH_LANES];
+        let mut up_sums = [0.0f64; BATCH_LANES];
+        for (offset, row_lanes) in task_rows.chunks_exact_mut(batch).enumerate() {
+            let row_index = first_row + offset;
+            let gate_row =
+                &gate_bytes[row_index * gate.row_nbytes..(row_index + 1) * gate.row_nbytes];
+            let up_row = &up_bytes[row_index * up.row_nbytes..(row_index + 1) * up.row_nbytes];
+            for (group_index, group_rows) in row_lanes.chunks_mut(BATCH_LANES).enumerate() {
+                let lanes = group_rows.len();
+                let group_start = group_index * BATCH_LANES * column_count;
+                let group_inputs = &inputs[group_start..group_start + lanes * column_count];
+                quantized_row_dots(
+                    gate.tensor_type,
+                    gate_row,
+                    group_inputs,
+                    column_count,
+                    &mut gate_sums[..lanes],
+                );
+                quantized_row_dots(
+                    up.tensor_type,
+                    up_row,
+                    group_inputs,
+                    column_count,
+                    &mut up_sums[..lanes],
+                );
+                for ((row, gate_sum), up_sum) in group_rows
+                    .iter_mut()
+                    .zip(gate_sums.iter())
+                    .zip(up_sums.iter())
+                {
+                    let gate_value = *gate_sum as f32;
+                    let up_value = *up_sum as f32;
+                    *row = SwiGluRow {
+                        gate: gate_value,
+                        up: up_value,
+                        activated: silu(gate_value) * up_value,
+                    };
+                }
+            }
+        }
+    });
+}
+
+/// Dots one quantized row with `sums.len()` inputs stored back to back,
+/// decoding each block once. Per input this is [`quantized_row_dot`].
+fn quantized_row_dots(
+    tensor_type: u32,
+    row_bytes: &[u8],
+    inputs: &[f32],
+    column_count: usize,
+    sums: &mut [f64],
+) {
+    let (type_size, decode_block) = quantized_block_decoder(tensor_type);
+    let mut block_values = [0.0f32; 256];
+    sums.fill(0.0);
+    for (block_index, block) in row_bytes.chunks_exact(type_size).enumerate() {
+        let block_start = block_index * 256;
+        if block_start >= column_count {
+            break;
+        }
+        let block_end = (block_start + 256).min(column_count);
+        decode_block(block, &mut block_values);
+        for (lane, sum) in sums.iter_mut().enumerate() {
+            let lane_start = lane * column_count;
+            for (input, value) in inputs[lane_start + block_start..lane_start + block_end]
+                .iter()
+                .zip(block_values.iter())
+            {
+                *sum += *input as f64 * *value as f64;
+            }
+        }
+    }
 }
 
 fn checksum_f32_values(values: &[f32]) -> f64 {
@@ -4618,16 +5220,13 @@ fn softmax_f64(values: &[f64]) -> Vec<f64> {
 fn rms_normalize_values(
     values: &[f32],
     weights: &[f32],
-    header: &GgufHeader,
+    rms_epsilon: f32,
 ) -> Result<(Vec<f32>, f64, f32), GgufError> {
     if values.len() != weights.len() || values.is_empty() {
         return Err(GgufError::InvalidTensorRange(
             "RMS normalization".to_string(),
         ));
     }
-    let rms_epsilon = header
-        .f32_value("llama.attention.layer_norm_rms_epsilon")
-        .unwrap_or(0.00001);
     let mean_square = values
         .iter()
         .map(|value| (*value as f64) * (*value as f64))
@@ -4802,15 +5401,13 @@ fn read_f64_le(reader: &mut impl Read) -> Result<f64, io::Error> {
 #[cfg(test)]
 mod tests {
     use super::*;
+    use crate::aeronn::test_support::{
+        synthetic_quantized_rows, write_gguf_string, write_test_gguf, TestTensor,
+    };
+    use crate::dtype::f16_to_f32;
     use std::fs;
     use std::io::{Seek, Write};
 
-    fn write_gguf_string(file: &mut File, value: &str) {
-        file.write_all(&(value.len() as u64).to_le_bytes())
-            .expect("write string len");
-        file.write_all(value.as_bytes()).expect("write string");
-    }
-
     #[test]
     fn reads_minimal_gguf_directory() {
         let path = std::env::temp_dir().join(format!(
@@ -5142,6 +5739,315 @@ mod tests {
         assert_eq!(values[256], 0.5);
     }
 
+    #[test]
+    fn gathers_quantized_rows_into_contiguous_matrix() {
+        let path = write_test_gguf(
+            "gather-rows",
+            &[],
+            &[
+                TestTensor {
+                    name: "token_embd.weight".to_string(),
+                    dimensions: vec![512, 5],
+                    tensor_type: 12,
+                    data: synthetic_quantized_rows(12, 512, 5, 7),
+                },
+                TestTensor {
+                    name: "output.weight".to_string(),
+                    dimensions: vec![256, 3],
+                    tensor_type: 14,
+                    data: synthetic_quantized_rows(14, 256, 3, 11),
+                },
+            ],
+        );
+        let header = GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read header");
+
+        let rows = [4u64, 0, 4, 2];
+        let gathered = header
+            .gather_rows("token_embd.weight", &rows)
+            .expect("gather Q4_K rows");
+        assert_eq!(gathered.shape(), &[4, 512]);
+        let gathered = gathered.to_vec();
+        for (position, row_index) in rows.iter().enumerate() {
+            let expected = header
+                .read_quantized_row_sample("token_embd.weight", *row_index)
+                .expect("read Q4_K row")
+                .decoded_values;
+            assert_eq!(
+                &gathered[position * 512..(position + 1) * 512],
+                &expected[..]
+            );
+        }
+
+        let gathered = header
+            .gather_rows("output.weight", &[1])
+            .expect("gather Q6_K row")
+            .to_vec();
+        let expected = header
+            .read_quantized_row_sample("output.weight", 1)
+            .expect("read Q6_K row")
+            .decoded_values;
+        assert_eq!(gathered, expected);
+
+        assert!(matches!(
+            header.gather_rows("token_embd.weight", &[5]),
+            Err(GgufError::InvalidTensorRange(_))
+        ));
+        let _ = fs::remove_file(path);
+    }
+
+    #[test]
+    fn qtensors_match_quantized_row_dots() {
+        let path = write_test_gguf(
+            "qtensor",
+            &[],
+            &[
+                TestTensor {
+                    name: "ffn_up.weight".to_string(),
+                    dimensions: vec![512, 6],
+                    tensor_type: 12,
+                    data: synthetic_quantized_rows(12, 512, 6, 5),
+                },
+                TestTensor {
+                    name: "output.weight".to_string(),
+                    dimensions: vec![256, 4],
+                    tensor_type: 14,
+                    data: synthetic_quantized_rows(14, 256, 4, 9),
+                },
+            ],
+        );
+        let header = GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read header");
+        let tensors = header
+            .load_qtensors(&["ffn_up.weight", "output.weight"])
+            .expect("load quantized tensors");
+        // SAFETY: the test file is not modified while the tensors are alive.
+        let mapped = unsafe { header.map_qtensors(&["ffn_up.weight", "output.weight"]) }
+            .expect("map quantized tensors");
+        for (tensor, mapped) in tensors.iter().zip(&mapped) {
+            assert_eq!(tensor.as_bytes(), mapped.as_bytes());
+            assert_eq!(tensor.shape(), mapped.shape());
+        }
+        drop(mapped);
+
+        for (tensor, name) in tensors.iter().zip(["ffn_up.weight", "output.weight"]) {
+            let [rows, columns] = [tensor.shape()[0], tensor.shape()[1]];
+            let matrix = header.quantized_matrix(name).expect("quantized matrix");
+            assert_eq!(tensor.nbytes(), matrix.nbytes());
+            assert_eq!(
+                tensor.dequantize(),
+                header
+                    .gather_rows(name, &(0..rows as u64).collect::<Vec<_>>())
+                    .expect("gather rows")
+            );
+            let input = (0..columns)
+                .map(|i| ((i * 13 % 29) as f32 - 14.0) / 8.0)
+                .collect::<Vec<_>>();
+            let output = tensor.matvec(&NdArray::from_list(input.clone(), Some(&[columns])));
+            for (row, value) in output.to_vec().iter().enumerate() {
+                let row_bytes = &tensor.as_bytes()[row * matrix.row_nbytes..][..matrix.row_nbytes];
+                let expected = quantized_row_dot(matrix.tensor_type, row_bytes, &input);
+                assert!((*value as f64 - expected).abs() < 1e-4 * expected.abs().max(1.0));
+            }
+        }
+        assert!(matches!(
+            header.load_qtensor("missing"),
+            Err(GgufError::TensorNotFound(_))
+        ));
+        let _ = fs::remove_file(path);
+    }
+
+    #[test]
+    fn loads_half_precision_tensors_as_typed_arrays() {
+        let values = [1.0f32, -2.5, 0.25, 65504.0, -0.0, 3.0];
+        let f16_bytes = values
+            .iter()
+            .flat_map(|value| F16::from_f32(*value).to_bits().to_le_bytes())
+            .collect();
+        let bf16_bytes = values
+            .iter()
+            .flat_map(|value| BF16::from_f32(*value).to_bits().to_le_bytes())
+            .collect();
+        let path = write_test_gguf(
+            "typed-tensors",
+            &[],
+            &[
+                TestTensor {
+                    name: "half".to_string(),
+                    dimensions: vec![3, 2],
+                    tensor_type: 1,
+                    data: f16_bytes,
+                },
+                TestTensor {
+                    name: "brain".to_string(),
+                    dimensions: vec![3, 2],
+                    tensor_type: 30,
+                    data: bf16_bytes,
+                },
+            ],
+        );
+        let header = GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read header");
+
+        let half = header.load_f16_tensor("half").expect("load F16");
+        assert_eq!(half.shape(), &[3, 2]);
+        assert_eq!(half.nbytes(), 12);
+        assert_eq!(half.to_f32().to_vec(), values);
+        let brain = header.load_bf16_tensor("brain").expect("load BF16");
+        assert_eq!(brain.to_f32().to_vec()[..3], values[..3]);
+        assert_eq!(brain.to_f32().to_vec()[3], 65536.0);
+        let widened = header
+            .load_typed_tensor::<f32>("half")
+            .expect("load F16 as f32");
+        assert_eq!(widened.to_vec(), values);
+        assert!(matches!(
+            header.load_f32_tensor("half"),
+            Err(GgufError::UnsupportedTensorType { tensor_type: 1, .. })
+        ));
+        let _ = fs::remove_file(path);
+    }
+
+    #[test]
+    fn fused_qkv_projection_matches_separate_projections() {
+        let path = write_test_gguf(
+            "fused-qkv",
+            &[],
+            &[
+                TestTensor {
+                    name: "blk.0.attn_q.weight".to_string(),
+                    dimensions: vec![256, 8],
+                    tensor_type: 12,
+                    data: synthetic_quantized_rows(12, 256, 8, 3),
+                },
+                TestTensor {
+                    name: "blk.0.attn_k.weight".to_string(),
+                    dimensions: vec![256, 4],
+                    tensor_type: 12,
+                    data: synthetic_quantized_rows(12, 256, 4, 5),
+                },
+                TestTensor {
+                    name: "blk.0.attn_v.weight".to_string(),
+                    dimensions: vec![256, 4],
+                    tensor_type: 14,
+                    data: synthetic_quantized_rows(14, 256, 4, 9),
+                },
+            ],
+        );
+        let header = GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read header");
+        let input = (0..256)
+            .map(|idx| ((idx % 17) as f32 - 8.0) / 16.0)
+            .collect::<Vec<_>>();
+
+        let mut projection = GgufQkvProjection::default();
+        for _ in 0..2 {
+            header
+                .read_qkv_projection_into(
+                    &input,
+                    "blk.0.attn_q.weight",
+                    "blk.0.attn_k.weight",
+                    "blk.0.attn_v.weight",
+                    &mut projection,
+                )
+                .expect("fused QKV projection");
+        }
+
+        for (tensor_name, row_count, fused) in [
+            ("blk.0.attn_q.weight", 8, projection.query()),
+            ("blk.0.attn_k.weight", 4, projection.key()),
+            ("blk.0.attn_v.weight", 4, projection.value()),
+        ] {
+            let expected = header
+                .read_quantized_logits_for_values(&input, tensor_name, 0, row_count)
+                .map(logit_values_to_f32)
+                .expect("separate projection");
+            assert_eq!(fused, &expected[..]);
+        }
+        assert!(matches!(
+            header.read_qkv_projection(
+                &input[..128],
+                "blk.0.attn_q.weight",
+                "blk.0.attn_k.weight",
+                "blk.0.attn_v.weight",
+            ),
+            Err(GgufError::InvalidTensorRange(_))
+        ));
+        let _ = fs::remove_file(path);
+    }
+
+    #[test]
+    fn fused_swiglu_ffn_matches_unfused_projections() {
+        let path = write_test_gguf(
+            "fused-swiglu",
+            &[],
+            &[
+                TestTensor {
+                    name: "blk.0.ffn_gate.weight".to_string(),
+                    dimensions: vec![256, 512],
+                    tensor_type: 12,
+                    data: synthetic_quantized_rows(12, 256, 512, 13),
+                },
+                TestTensor {
+                    name: "blk.0.ffn_up.weight".to_string(),
+                    dimensions: vec![256, 512],
+                    tensor_type: 12,
+                    data: synthetic_quantized_rows(12, 256, 512, 17),
+                },
+                TestTensor {
+                    name: "blk.0.ffn_down.weight".to_string(),
+                    dimensions: vec![512, 256],
+                    tensor_type: 14,
+                    data: synthetic_quantized_rows(14, 512, 256, 19),
+                },
+            ],
+        );
+        let header = GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read header");
+        let input = (0..256)
+            .map(|idx| ((idx % 13) as f32 - 6.0) / 32.0)
+            .collect::<Vec<_>>();
+
+        let mut scratch = GgufSwiGluScratch::default();
+        header
+            .read_swiglu_ffn_into(
+                &input,
+                "blk.0.ffn_gate.weight",
+                "blk.0.ffn_up.weight",
+                "blk.0.ffn_down.weight",
+                &mut scratch,
+            )
+            .expect("fused SwiGLU FFN");
+
+        let gate = header
+            .read_quantized_logits_for_values(&input, "blk.0.ffn_gate.weight", 0, 512)
+            .map(logit_values_to_f32)
+            .expect("gate projection");
+        let up = header
+            .read_quantized_logits_for_values(&input, "blk.0.ffn_up.weight", 0, 512)
+            .map(logit_values_to_f32)
+            .expect("up projection");
+        let activated = gate
+            .iter()
+            .zip(up.iter())
+            .map(|(gate, up)| silu(*gate) * *up)
+            .collect::<Vec<_>>();
+        let output = header
+            .read_quantized_logits_for_values(&activated, "blk.0.ffn_down.weight", 0, 256)
+            .map(logit_values_to_f32)
+            .expect("down projection");
+
+        assert_eq!(scratch.activated(), &activated[..]);
+        assert_eq!(scratch.output(), &output[..]);
+        assert_eq!(scratch.gate_checksum(), checksum_f32_values(&gate));
+        assert_eq!(scratch.up_checksum(), checksum_f32_values(&up));
+        assert!(matches!(
+            header.read_swiglu_ffn_into(
+                &input,
+                "blk.0.ffn_gate.weight",
+                "blk.0.ffn_up.weight",
+                "blk.0.ffn_gate.weight",
+                &mut scratch,
+            ),
+            Err(GgufError::InvalidTensorRange(_))
+        ));
+        let _ = fs::remove_file(path);
+    }
+
     #[test]
     fn computes_f32_dot_product() {
         let left = [1.0f32, -2.0, 3.0];
@@ -0,0 +1,199 @@
+//! Paged KV storage: a pool of fixed-size position blocks shared by any
+//! number of sequences, each of which maps its positions onto pool blocks
+//! through a block table.
+//!
+//! A block holds `block_tokens` positions of RoPE-rotated keys and of values
+//! for every layer, laid out `[layer][position][kv value]`, so memory is
+//! spent in proportion to live tokens instead of `max_context` per sequence.
+//! Blocks are reference counted so sequences can share them.
+
+use super::model::GgufError;
+
+pub struct GgufPagedKvCache {
+    layer_count: usize,
+    kv_length: usize,
+    block_tokens: usize,
+    keys: Vec<f32>,
+    values: Vec<f32>,
+    ref_counts: Vec<u32>,
+    free_blocks: Vec<u32>,
+}
+
+impl GgufPagedKvCache {
+    pub fn new(
+        layer_count: usize,
+        kv_length: usize,
+        block_tokens: usize,
+        block_count: usize,
+    ) -> Self {
+        let block_values = layer_count * block_tokens * kv_length;
+        Self {
+            layer_count,
+            kv_length,
+            block_tokens,
+            keys: vec![0.0; block_count * block_values],
+            values: vec![0.0; block_count * block_values],
+            ref_counts: vec![0; block_count],
+            // Popped from the back, so low block ids are handed out first.
+            free_blocks: (0..block_count as u32).rev().collect(),
+        }
+    }
+
+    pub fn layer_count(&self) -> usize {
+        self.layer_count
+    }
+
+    pub fn kv_length(&self) -> usize {
+        self.kv_length
+    }
+
+    pub fn block_tokens(&self) -> usize {
+        self.block_tokens
+    }
+
+    pub fn block_count(&self) -> usize {
+        self.ref_counts.len()
+    }
+
+    pub fn free_block_count(&self) -> usize {
+        self.free_blocks.len()
+    }
+
+    pub fn used_block_count(&self) -> usize {
+        self.block_count() - self.free_block_count()
+    }
+
+    /// Bytes of keys and values held by one block.
+    pub fn block_bytes(&self) -> usize {
+        2 * self.layer_count * self.block_tokens * self.kv_length * std::mem::size_of::<f32>()
+    }
+
+    pub fn used_bytes(&self) -> usize {
+        self.used_block_count() * self.block_bytes()
+    }
+
+    /// Number of blocks needed to hold `token_count` positions.
+    pub fn blocks_for(&self, token_count: usize) -> usize {
+        token_count.div_ceil(self.block_tokens)
+    }
+
+    pub fn ref_count(&self, block: u32) -> u32 {
+        self.ref_counts[block as usize]
+    }
+
+    /// Takes a free block with a reference count of one.
+    pub fn allocate(&mut self) -> Result<u32, GgufError> {
+        let block = self
+            .free_blocks
+            .pop()
+            .ok_or_else(|| GgufError::InvalidTensorRange("paged KV cache is full".to_string()))?;
+        self.ref_counts[block as usize] = 1;
+        Ok(block)
+    }
+
+    /// Adds a reference to a block another sequence already holds.
+    pub fn retain(&mut self, block: u32) {
+        debug_assert!(
+            self.ref_counts[block as usize] > 0,
+            "retain of a free block"
+        );
+        self.ref_counts[block as usize] += 1;
+    }
+
+    /// Drops one reference; the block returns to the pool at zero.
+    pub fn release(&mut self, block: u32) {
+        let ref_count = &mut self.ref_counts[block as usize];
+        debug_assert!(*ref_count > 0, "release of a free block");
+        *ref_count -= 1;
+        if *ref_count == 0 {
+            self.free_blocks.push(block);
+        }
+    }
+
+    /// Keys and values of one layer in `block`, `block_tokens` rows each.
+    pub(super) fn layer_rows(&self, block: u32, layer_index: usize) -> (&[f32], &[f32]) {
+        let range = self.layer_range(block, layer_index);
+        (&self.keys[range.clone()], &self.values[range])
+    }
+
+    /// The key and value rows of one position in `block`.
+    pub(super) fn rows_mut(
+        &mut self,
+        block: u32,
+        layer_index: usize,
+        offset: usize,
+    ) -> (&mut [f32], &mut [f32]) {
+        let start = self.layer_range(block, layer_index).start + offset * self.kv_length;
+        let end = start + self.kv_length;
+        (&mut self.keys[start..end], &mut self.values[start..end])
+    }
+
+    /// Copies every layer of `source` into `target`, for copy-on-write.
+    pub(super) fn copy_block(&mut self, source: u32, target: u32) {
+        let block_values = self.layer_count * self.block_tokens * self.kv_length;
+        let source_start = source as usize * block_values;
+        let target_start = target as usize * block_values;
+        self.keys
+            .copy_within(source_start..source_start + block_values, target_start);
+        self.values
+            .copy_within(source_start..source_start + block_values, target_start);
+    }
+
+    fn layer_range(&self, block: u32, layer_index: usize) -> std::ops::Range<usize> {
+        let layer_values = self.block_tokens * self.kv_length;
+        let start = (block as usize * self.layer_count + layer_index) * layer_values;
+        start..start + layer_values
+    }
+}
+
+/// Iterates the first `count` key/value rows of one layer of a sequence,
+/// following its block table.
+pub(super) fn paged_kv_rows<'a>(
+    cache: &'a GgufPagedKvCache,
+    block_table: &'a [u32],
+    layer_index: usize,
+    count: usize,
+) -> impl Iterator<Item = (&'a [f32], &'a [f32])> + 'a {
+    let kv_length = cache.kv_length;
+    block_table
+        .iter()
+        .flat_map(move |block| {
+            let (keys, values) = cache.layer_rows(*block, layer_index);
+            keys.chunks_exact(kv_length)
+                .zip(values.chunks_exact(kv_length))
+        })
+        .take(count)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn blocks_are_reference_counted_and_reused() {
+        let mut cache = GgufPagedKvCache::new(2, 3, 4, 3);
+        assert_eq!(cache.block_bytes(), 2 * 2 * 4 * 3 * 4);
+        let first = cache.allocate().expect("first block");
+        let second = cache.allocate().expect("second block");
+        assert_eq!((first, second), (0, 1));
+        cache.retain(second);
+        cache.release(second);
+        assert_eq!(cache.ref_count(second), 1);
+        assert_eq!(cache.used_block_count(), 2);
+
+        let (keys, values) = cache.rows_mut(second, 1, 2);
+        keys.copy_from_slice(&[1.0, 2.0, 3.0]);
+        values.copy_from_slice(&[4.0, 5.0, 6.0]);
+        let third = cache.allocate().expect("third block");
+        assert!(cache.allocate().is_err());
+        cache.copy_block(second, third);
+        let block_table = [first, third];
+        let rows = paged_kv_rows(&cache, &block_table, 1, 7).collect::<Vec<_>>();
+        assert_eq!(rows.len(), 7);
+        assert_eq!(rows[6], (&[1.0, 2.0, 3.0][..], &[4.0, 5.0, 6.0][..]));
+
+        cache.release(first);
+        assert_eq!(cache.free_block_count(), 1);
+        assert_eq!(cache.allocate().expect("reused block"), first);
+    }
+}
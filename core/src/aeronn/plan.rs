@@ -0,0 +1,276 @@
+//! Execution plan of a llama-style GGUF model, resolved once at load.
+//!
+//! Building a plan looks up every tensor a forward pass touches, checks the
+//! shapes against each other and against the attention topology, and keeps
+//! the results: matrix types, row strides and file offsets, norm weights and
+//! the head layout. Hot loops read the plan instead of going back to the
+//! header's metadata and tensor table for every token and layer.
+
+use super::attention::HeadLayout;
+use super::model::{GgufError, GgufHeader, QuantizedMatrix};
+
+/// Tensors and norm weights of one transformer block.
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufLayerPlan {
+    layer_index: usize,
+    pub(super) attn_norm: Vec<f32>,
+    /// Query, key and value projections, in that order.
+    pub(super) qkv: [QuantizedMatrix; 3],
+    pub(super) attn_output: QuantizedMatrix,
+    pub(super) ffn_norm: Vec<f32>,
+    pub(super) gate: QuantizedMatrix,
+    pub(super) up: QuantizedMatrix,
+    pub(super) down: QuantizedMatrix,
+}
+
+impl GgufLayerPlan {
+    /// Block index in the GGUF file (`blk.<index>.*`).
+    pub fn layer_index(&self) -> usize {
+        self.layer_index
+    }
+
+    pub fn feed_forward_length(&self) -> usize {
+        self.gate.row_count
+    }
+}
+
+/// Validated layout of the embedding, a contiguous run of blocks, the final
+/// norm and the output head.
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufModelPlan {
+    pub(super) heads: HeadLayout,
+    pub(super) rope_freq_base: f32,
+    pub(super) rms_epsilon: f32,
+    pub(super) embedding: QuantizedMatrix,
+    pub(super) final_norm: Vec<f32>,
+    pub(super) output: QuantizedMatrix,
+    pub(super) layers: Vec<GgufLayerPlan>,
+}
+
+impl GgufModelPlan {
+    /// Resolves blocks `layer_start..layer_start + layer_count` between
+    /// `input_tensor_name` and the final norm and output head.
+    pub fn new(
+        header: &GgufHeader,
+        input_tensor_name: &str,
+        layer_start: usize,
+        layer_count: usize,
+        final_norm_tensor_name: &str,
+        output_tensor_name: &str,
+    ) -> Result<Self, GgufError> {
+        if layer_count == 0 {
+            return Err(GgufError::InvalidTensorRange(
+                "model plan layer count".to_string(),
+            ));
+        }
+        let head_count = header
+            .u32_value("llama.attention.head_count")
+            .ok_or_else(|| GgufError::InvalidTensorRange("attention head count".to_string()))?
+            as usize;
+        let kv_head_count = header
+            .u32_value("llama.attention.head_count_kv")
+            .ok_or_else(|| GgufError::InvalidTensorRange("attention kv head count".to_string()))?
+            as usize;
+        if head_count == 0 || kv_head_count == 0 || !head_count.is_multiple_of(kv_head_count) {
+            return Err(GgufError::InvalidTensorRange(
+                "attention head topology".to_string(),
+            ));
+        }
+        let rope_freq_base = header.f32_value("llama.rope.freq_base").unwrap_or(10000.0);
+        let rms_epsilon = header
+            .f32_value("llama.attention.layer_norm_rms_epsilon")
+            .unwrap_or(0.00001);
+
+        let embedding = header.quantized_matrix(input_tensor_name)?;
+        let embedding_length = embedding.column_count;
+        let final_norm = header.load_f32_tensor(final_norm_tensor_name)?.to_vec();
+        let output = header.quantized_matrix(output_tensor_name)?;
+        if final_norm.len() != embedding_length || output.column_count != embedding_length {
+            return Err(GgufError::InvalidTensorRange(format!(
+                "model plan output head {output_tensor_name}"
+            )));
+        }
+
+        let mut head_dimension = 0usize;
+        let mut layers = Vec::with_capacity(layer_count);
+        for layer_index in layer_start..layer_start + layer_count {
+            let layer = GgufLayerPlan::new(header, layer_index, embedding_length)?;
+            let query_row_count = layer.qkv[0].row_count;
+            let key_row_count = layer.qkv[1].row_count;
+            if query_row_count % head_count != 0
+                || key_row_count % kv_head_count != 0
+                || layer.qkv[2].row_count != key_row_count
+                || query_row_count / head_count != key_row_count / kv_head_count
+                || !(query_row_count / head_count).is_multiple_of(2)
+                || (head_dimension != 0 && query_row_count / head_count != head_dimension)
+            {
+                return Err(GgufError::InvalidTensorRange(format!(
+                    "layer {layer_index} attention head dimension"
+                )));
+            }
+            head_dimension = query_row_count / head_count;
+            layers.push(layer);
+        }
+        Ok(Self {
+            heads: HeadLayout {
+                head_count,
+                kv_head_count,
+                head_dimension,
+            },
+            rope_freq_base,
+            rms_epsilon,
+            embedding,
+            final_norm,
+            output,
+            layers,
+        })
+    }
+
+    pub fn head_count(&self) -> usize {
+        self.heads.head_count
+    }
+
+    pub fn kv_head_count(&self) -> usize {
+        self.heads.kv_head_count
+    }
+
+    pub fn head_dimension(&self) -> usize {
+        self.heads.head_dimension
+    }
+
+    pub fn embedding_length(&self) -> usize {
+        self.embedding.column_count
+    }
+
+    pub fn vocab_size(&self) -> usize {
+        self.output.row_count
+    }
+
+    pub fn rope_freq_base(&self) -> f32 {
+        self.rope_freq_base
+    }
+
+    pub fn rms_epsilon(&self) -> f32 {
+        self.rms_epsilon
+    }
+
+    pub fn layers(&self) -> &[GgufLayerPlan] {
+        &self.layers
+    }
+
+    /// Widest feed-forward block, which sizes the SwiGLU scratch.
+    pub fn feed_forward_length(&self) -> usize {
+        self.layers
+            .iter()
+            .map(GgufLayerPlan::feed_forward_length)
+            .max()
+            .unwrap_or(0)
+    }
+}
+
+impl GgufLayerPlan {
+    fn new(
+        header: &GgufHeader,
+        layer_index: usize,
+        embedding_length: usize,
+    ) -> Result<Self, GgufError> {
+        let attn_norm = header
+            .load_f32_tensor(&format!("blk.{layer_index}.attn_norm.weight"))?
+            .to_vec();
+        let ffn_norm = header
+            .load_f32_tensor(&format!("blk.{layer_index}.ffn_norm.weight"))?
+            .to_vec();
+        let qkv = [
+            header.quantized_matrix(&format!("blk.{layer_index}.attn_q.weight"))?,
+            header.quantized_matrix(&format!("blk.{layer_index}.attn_k.weight"))?,
+            header.quantized_matrix(&format!("blk.{layer_index}.attn_v.weight"))?,
+        ];
+        let attn_output =
+            header.quantized_matrix(&format!("blk.{layer_index}.attn_output.weight"))?;
+        let gate = header.quantized_matrix(&format!("blk.{layer_index}.ffn_gate.weight"))?;
+        let up = header.quantized_matrix(&format!("blk.{layer_index}.ffn_up.weight"))?;
+        let down = header.quantized_matrix(&format!("blk.{layer_index}.ffn_down.weight"))?;
+        if attn_norm.len() != embedding_length
+            || ffn_norm.len() != embedding_length
+            || qkv
+                .iter()
+                .any(|matrix| matrix.column_count != embedding_length)
+            || attn_output.column_count != qkv[0].row_count
+            || attn_output.row_count != embedding_length
+            || gate.column_count != embedding_length
+            || up.column_count != embedding_length
+            || gate.row_count != up.row_count
+            || down.column_count != gate.row_count
+            || down.row_count != embedding_length
+        {
+            return Err(GgufError::InvalidTensorRange(format!(
+                "layer {layer_index} tensor shapes"
+            )));
+        }
+        Ok(Self {
+            layer_index,
+            attn_norm,
+            qkv,
+            attn_output,
+            ffn_norm,
+            gate,
+            up,
+            down,
+        })
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::aeronn::test_support::write_synthetic_llama_gguf;
+
+    #[test]
+    fn plan_resolves_layers_once_and_rejects_missing_blocks() {
+        let path = write_synthetic_llama_gguf("model-plan", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let plan = GgufModelPlan::new(
+            &header,
+            "token_embd.weight",
+            0,
+            2,
+            "output_norm.weight",
+            "output.weight",
+        )
+        .expect("build plan");
+        assert_eq!(
+            plan.head_count(),
+            header.u32_value("llama.attention.head_count").unwrap() as usize
+        );
+        assert_eq!(
+            plan.head_count() * plan.head_dimension(),
+            plan.layers()[0].qkv[0].row_count
+        );
+        assert_eq!(
+            plan.layers()
+                .iter()
+                .map(GgufLayerPlan::layer_index)
+                .collect::<Vec<_>>(),
+            vec![0, 1]
+        );
+        assert_eq!(
+            plan.layers()[1].attn_norm,
+            header
+                .load_f32_tensor("blk.1.attn_norm.weight")
+                .expect("norm weights")
+                .to_vec()
+        );
+
+        assert!(GgufModelPlan::new(
+            &header,
+            "token_embd.weight",
+            1,
+            2,
+            "output_norm.weight",
+            "output.weight",
+        )
+        .is_err());
+        let _ = std::fs::remove_file(path);
+    }
+}
@@ -0,0 +1,328 @@
+//! Prompt-prefix KV cache shared across decode sessions.
+//!
+//! Cached prefixes live in a radix tree keyed by token ids whose edges are
+//! whole KV blocks of `block_tokens` positions. Each node owns the immutable
+//! keys and values of its block for every layer. Nodes in use by a session
+//! are reference counted, and unreferenced leaves are evicted least recently
+//! used first whenever an insert would exceed the memory budget.
+
+use super::model::GgufError;
+use std::collections::HashMap;
+
+#[derive(Clone, Copy, Debug, Default, PartialEq)]
+pub struct GgufPrefixCacheStats {
+    pub lookup_count: u64,
+    /// Lookups that reused at least one cached block.
+    pub hit_count: u64,
+    pub requested_token_count: u64,
+    pub reused_token_count: u64,
+    pub inserted_block_count: u64,
+    pub evicted_block_count: u64,
+    pub resident_block_count: usize,
+    pub resident_bytes: usize,
+}
+
+impl GgufPrefixCacheStats {
+    /// Share of requested prompt tokens served from the cache.
+    pub fn token_hit_rate(&self) -> f64 {
+        if self.requested_token_count == 0 {
+            0.0
+        } else {
+            self.reused_token_count as f64 / self.requested_token_count as f64
+        }
+    }
+
+    /// Share of lookups that reused at least one block.
+    pub fn request_hit_rate(&self) -> f64 {
+        if self.lookup_count == 0 {
+            0.0
+        } else {
+            self.hit_count as f64 / self.lookup_count as f64
+        }
+    }
+}
+
+struct PrefixNode {
+    parent: Option<usize>,
+    edge: Box<[u64]>,
+    children: HashMap<Box<[u64]>, usize>,
+    /// `[layer][block position][kv value]` for keys and values alike.
+    keys: Vec<f32>,
+    values: Vec<f32>,
+    ref_count: usize,
+    last_used: u64,
+}
+
+pub struct GgufPrefixCache {
+    block_tokens: usize,
+    memory_budget_bytes: usize,
+    /// `(model_hash, layer_count, kv_length)` of the session that first used
+    /// the cache.
+    geometry: Option<(u64, usize, usize)>,
+    nodes: Vec<Option<PrefixNode>>,
+    free_slots: Vec<usize>,
+    root_children: HashMap<Box<[u64]>, usize>,
+    clock: u64,
+    stats: GgufPrefixCacheStats,
+}
+
+impl GgufPrefixCache {
+    pub fn new(block_tokens: usize, memory_budget_bytes: usize) -> Self {
+        Self {
+            block_tokens: block_tokens.max(1),
+            memory_budget_bytes,
+            geometry: None,
+            nodes: Vec::new(),
+            free_slots: Vec::new(),
+            root_children: HashMap::new(),
+            clock: 0,
+            stats: GgufPrefixCacheStats::default(),
+        }
+    }
+
+    pub fn block_tokens(&self) -> usize {
+        self.block_tokens
+    }
+
+    pub fn memory_budget_bytes(&self) -> usize {
+        self.memory_budget_bytes
+    }
+
+    pub fn stats(&self) -> GgufPrefixCacheStats {
+        self.stats
+    }
+
+    /// Drops every unreferenced block.
+    pub fn clear(&mut self) {
+        while self.evict_one() {}
+    }
+
+    /// Binds the cache to one model and its KV shape; later sessions must
+    /// match both. A same-shaped model with other weights (another fine-tune
+    /// or quantization) is rejected by its hash, since its sessions would
+    /// otherwise reuse keys and values computed by the first model.
+    pub(super) fn check_geometry(
+        &mut self,
+        model_hash: u64,
+        layer_count: usize,
+        kv_length: usize,
+    ) -> Result<(), GgufError> {
+        let geometry = (model_hash, layer_count, kv_length);
+        match self.geometry {
+            None => {
+                self.geometry = Some(geometry);
+                Ok(())
+            }
+            Some(bound) if bound == geometry => Ok(()),
+            Some((bound_hash, ..)) if bound_hash != model_hash => Err(
+                GgufError::InvalidTensorRange("prefix cache model hash".to_string()),
+            ),
+            Some(_) => Err(GgufError::InvalidTensorRange(
+                "prefix cache KV geometry".to_string(),
+            )),
+        }
+    }
+
+    /// Walks the longest cached prefix of `tokens` (whole blocks only), takes
+    /// a reference on every node along it and records the lookup. `tokens` is
+    /// the full request; the caller must `release` the returned path.
+    pub(super) fn acquire(&mut self, tokens: &[u64], reusable_tokens: usize) -> Vec<usize> {
+        self.clock += 1;
+        let mut path = Vec::new();
+        let mut children = &self.root_children;
+        for edge in tokens[..reusable_tokens].chunks_exact(self.block_tokens) {
+            let Some(&node_index) = children.get(edge) else {
+                break;
+            };
+            path.push(node_index);
+            children = &self.node(node_index).children;
+        }
+        for node_index in &path {
+            let clock = self.clock;
+            let node = self.node_mut(*node_index);
+            node.ref_count += 1;
+            node.last_used = clock;
+        }
+        self.stats.lookup_count += 1;
+        self.stats.hit_count += u64::from(!path.is_empty());
+        self.stats.requested_token_count += tokens.len() as u64;
+        self.stats.reused_token_count += (path.len() * self.block_tokens) as u64;
+        path
+    }
+
+    pub(super) fn release(&mut self, path: &[usize]) {
+        for node_index in path {
+            let node = self.node_mut(*node_index);
+            node.ref_count = node.ref_count.saturating_sub(1);
+        }
+    }
+
+    pub(super) fn block(&self, node_index: usize) -> (&[f32], &[f32]) {
+        let node = self.node(node_index);
+        (&node.keys, &node.values)
+    }
+
+    /// Adds the block `edge` below `parent` (the root when `None`), filling its
+    /// keys and values with `fill`. The new node starts with one reference,
+    /// which the caller releases with the rest of its path. Returns `None`
+    /// when the block cannot fit in the budget even after eviction.
+    pub(super) fn insert(
+        &mut self,
+        parent: Option<usize>,
+        edge: &[u64],
+        fill: impl FnOnce(&mut [f32], &mut [f32]),
+    ) -> Option<usize> {
+        let children = match parent {
+            Some(parent) => &self.node(parent).children,
+            None => &self.root_children,
+        };
+        if let Some(&existing) = children.get(edge) {
+            self.node_mut(existing).ref_count += 1;
+            return Some(existing);
+        }
+        let block_bytes = self.block_bytes();
+        while self.stats.resident_bytes + block_bytes > self.memory_budget_bytes {
+            if !self.evict_one() {
+                return None;
+            }
+        }
+
+        let block_values = block_bytes / (2 * std::mem::size_of::<f32>());
+        let mut node = PrefixNode {
+            parent,
+            edge: edge.into(),
+            children: HashMap::new(),
+            keys: vec![0.0; block_values],
+            values: vec![0.0; block_values],
+            ref_count: 1,
+            last_used: self.clock,
+        };
+        fill(&mut node.keys, &mut node.values);
+        let node_index = match self.free_slots.pop() {
+            Some(slot) => {
+                self.nodes[slot] = Some(node);
+                slot
+            }
+            None => {
+                self.nodes.push(Some(node));
+                self.nodes.len() - 1
+            }
+        };
+        let children = match parent {
+            Some(parent) => &mut self.node_mut(parent).children,
+            None => &mut self.root_children,
+        };
+        children.insert(edge.into(), node_index);
+        self.stats.inserted_block_count += 1;
+        self.stats.resident_block_count += 1;
+        self.stats.resident_bytes += block_bytes;
+        Some(node_index)
+    }
+
+    fn block_bytes(&self) -> usize {
+        let (_, layer_count, kv_length) = self.geometry.unwrap_or((0, 0, 0));
+        2 * layer_count * self.block_tokens * kv_length * std::mem::size_of::<f32>()
+    }
+
+    /// Evicts the least recently used leaf nobody references.
+    fn evict_one(&mut self) -> bool {
+        let victim = self
+            .nodes
+            .iter()
+            .enumerate()
+            .filter_map(|(index, node)| node.as_ref().map(|node| (index, node)))
+            .filter(|(_, node)| node.ref_count == 0 && node.children.is_empty())
+            .min_by_key(|(index, node)| (node.last_used, *index))
+            .map(|(index, _)| index);
+        let Some(victim) = victim else {
+            return false;
+        };
+        let node = self.nodes[victim].take().expect("victim node is resident");
+        let siblings = match node.parent {
+            Some(parent) => &mut self.node_mut(parent).children,
+            None => &mut self.root_children,
+        };
+        siblings.remove(&node.edge);
+        self.free_slots.push(victim);
+        self.stats.evicted_block_count += 1;
+        self.stats.resident_block_count -= 1;
+        self.stats.resident_bytes -= self.block_bytes();
+        true
+    }
+
+    fn node(&self, node_index: usize) -> &PrefixNode {
+        self.nodes[node_index]
+            .as_ref()
+            .expect("prefix cache node is resident")
+    }
+
+    fn node_mut(&mut self, node_index: usize) -> &mut PrefixNode {
+        self.nodes[node_index]
+            .as_mut()
+            .expect("prefix cache node is resident")
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn fill_with(value: f32) -> impl FnOnce(&mut [f32], &mut [f32]) {
+        move |keys, values| {
+            keys.fill(value);
+            values.fill(-value);
+        }
+    }
+
+    #[test]
+    fn evicts_least_recently_used_unreferenced_leaves() {
+        // One layer, kv_length 2, two-token blocks: 32 bytes per block.
+        let mut cache = GgufPrefixCache::new(2, 96);
+        cache.check_geometry(7, 1, 2).expect("geometry");
+        let first = cache.insert(None, &[1, 2], fill_with(1.0)).expect("insert");
+        let second = cache
+            .insert(Some(first), &[3, 4], fill_with(2.0))
+            .expect("insert child");
+        cache.release(&[first, second]);
+        let other = cache.insert(None, &[9, 9], fill_with(3.0)).expect("insert");
+        cache.release(&[other]);
+        assert_eq!(cache.stats().resident_bytes, 96);
+
+        let path = cache.acquire(&[1, 2, 3, 4, 5], 4);
+        assert_eq!(path, vec![first, second]);
+        assert_eq!(cache.block(second).0, &[2.0; 4]);
+        // Full budget: the new block must evict `[9, 9]`, the only
+        // unreferenced leaf, even though `[1, 2, 3, 4]` is older.
+        let third = cache
+            .insert(Some(second), &[5, 6], fill_with(4.0))
+            .expect("insert after eviction");
+        assert!(cache.acquire(&[9, 9, 1], 2).is_empty());
+        cache.release(&path);
+        cache.release(&[third]);
+
+        let stats = cache.stats();
+        assert_eq!(stats.evicted_block_count, 1);
+        assert_eq!(stats.resident_block_count, 3);
+        assert_eq!(stats.lookup_count, 2);
+        assert_eq!(stats.reused_token_count, 4);
+        assert_eq!(stats.request_hit_rate(), 0.5);
+        assert_eq!(stats.token_hit_rate(), 0.5);
+
+        cache.clear();
+        assert_eq!(cache.stats().resident_bytes, 0);
+        assert!(cache.acquire(&[1, 2, 3], 2).is_empty());
+    }
+
+    #[test]
+    fn insert_fails_when_every_block_is_referenced() {
+        let mut cache = GgufPrefixCache::new(1, 16);
+        cache.check_geometry(7, 1, 2).expect("geometry");
+        let held = cache.insert(None, &[1], fill_with(1.0)).expect("insert");
+        assert!(cache.insert(None, &[2], fill_with(2.0)).is_none());
+        cache.release(&[held]);
+        assert!(cache.insert(None, &[2], fill_with(2.0)).is_some());
+        assert!(cache.check_geometry(7, 2, 2).is_err());
+        assert!(cache.check_geometry(8, 1, 2).is_err());
+        assert!(cache.check_geometry(7, 1, 2).is_ok());
+    }
+}
@@ -0,0 +1,407 @@
+//! Token sampling over a row of logits.
+//!
+//! `GgufSampler` applies repetition penalties, prunes candidates with top-k
+//! (a linear-time selection) and min-p (a threshold in logit space) before
+//! any exponential is taken, then softmaxes the survivors at the configured
+//! temperature, applies top-p and draws from a seeded SplitMix64 stream. The
+//! probability arithmetic and draw are those of the sampled decode smoke
+//! example, so a given seed reproduces its token choices.
+
+use super::model::GgufError;
+
+/// SplitMix64, the generator behind every sampled draw in this crate.
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub struct SplitMix64 {
+    state: u64,
+}
+
+impl SplitMix64 {
+    pub fn new(seed: u64) -> Self {
+        Self { state: seed }
+    }
+
+    /// The current state; a generator built from it continues the stream.
+    pub fn state(&self) -> u64 {
+        self.state
+    }
+
+    pub fn next_u64(&mut self) -> u64 {
+        self.state = self.state.wrapping_add(0x9E3779B97F4A7C15);
+        let mut value = self.state;
+        value = (value ^ (value >> 30)).wrapping_mul(0xBF58476D1CE4E5B9);
+        value = (value ^ (value >> 27)).wrapping_mul(0x94D049BB133111EB);
+        value ^ (value >> 31)
+    }
+
+    /// A uniform draw in `[0, 1)` from the top 53 bits.
+    pub fn next_unit(&mut self) -> f64 {
+        let value = self.next_u64() >> 11;
+        (value as f64) * (1.0 / ((1u64 << 53) as f64))
+    }
+}
+
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufSamplerOptions {
+    /// Softmax temperature; `0.0` picks the highest logit without a draw.
+    pub temperature: f64,
+    /// Keeps the `top_k` highest logits; `0` disables the filter.
+    pub top_k: usize,
+    /// Keeps the smallest most-likely prefix with at least this much mass;
+    /// `1.0` disables the filter.
+    pub top_p: f64,
+    /// Drops tokens less likely than `min_p` times the most likely one;
+    /// `0.0` disables the filter.
+    pub min_p: f64,
+    /// Divides positive and multiplies negative logits of recent tokens.
+    pub repetition_penalty: f64,
+    /// Subtracted once per occurrence of a recent token.
+    pub frequency_penalty: f64,
+    /// Subtracted once from every recent token.
+    pub presence_penalty: f64,
+    /// How many trailing history tokens the penalties see; `0` means all.
+    pub penalty_last_n: usize,
+    pub seed: u64,
+}
+
+impl GgufSamplerOptions {
+    /// Plain temperature sampling over the full vocabulary.
+    pub fn new(temperature: f64, seed: u64) -> Self {
+        Self {
+            temperature,
+            top_k: 0,
+            top_p: 1.0,
+            min_p: 0.0,
+            repetition_penalty: 1.0,
+            frequency_penalty: 0.0,
+            presence_penalty: 0.0,
+            penalty_last_n: 64,
+            seed,
+        }
+    }
+
+    fn has_penalties(&self) -> bool {
+        self.repetition_penalty != 1.0
+            || self.frequency_penalty != 0.0
+            || self.presence_penalty != 0.0
+    }
+}
+
+/// A token that survived pruning, with its penalized logit and final
+/// sampling probability.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct GgufSamplingCandidate {
+    pub token_id: u64,
+    pub logit: f64,
+    pub probability: f64,
+}
+
+pub struct GgufSampler {
+    options: GgufSamplerOptions,
+    rng: SplitMix64,
+    candidates: Vec<GgufSamplingCandidate>,
+    recent: Vec<u64>,
+    last_draw: f64,
+}
+
+impl GgufSampler {
+    pub fn new(options: GgufSamplerOptions) -> Result<Self, GgufError> {
+        let valid = options.temperature.is_finite()
+            && options.temperature >= 0.0
+            && options.top_p > 0.0
+            && options.top_p <= 1.0
+            && (0.0..=1.0).contains(&options.min_p)
+            && options.repetition_penalty.is_finite()
+            && options.repetition_penalty > 0.0
+            && options.frequency_penalty.is_finite()
+            && options.presence_penalty.is_finite();
+        if !valid {
+            return Err(GgufError::InvalidTensorRange("sampler options".to_string()));
+        }
+        Ok(Self {
+            rng: SplitMix64::new(options.seed),
+            options,
+            candidates: Vec::new(),
+            recent: Vec::new(),
+            last_draw: 0.0,
+        })
+    }
+
+    pub fn options(&self) -> &GgufSamplerOptions {
+        &self.options
+    }
+
+    /// State of the draw stream, as the smoke examples report it.
+    pub fn rng_state(&self) -> u64 {
+        self.rng.state()
+    }
+
+    /// Continues the draw stream from a state taken with `rng_state`.
+    pub fn set_rng_state(&mut self, state: u64) {
+        self.rng = SplitMix64::new(state);
+    }
+
+    /// The uniform draw behind the most recent `sample`, `0.0` if greedy.
+    pub fn last_draw(&self) -> f64 {
+        self.last_draw
+    }
+
+    /// Candidates and probabilities from the most recent call.
+    pub fn candidates(&self) -> &[GgufSamplingCandidate] {
+        &self.candidates
+    }
+
+    /// Penalizes, prunes and normalizes `logits` (indexed by token id)
+    /// without drawing. With top-k or top-p enabled the candidates are sorted
+    /// by descending logit, ties on the lower token id; otherwise they stay
+    /// in token order. `history` holds the tokens seen so far, oldest first.
+    pub fn prepare(
+        &mut self,
+        logits: &[f64],
+        history: &[u64],
+    ) -> Result<&[GgufSamplingCandidate], GgufError> {
+        if logits.is_empty() {
+            return Err(GgufError::InvalidTensorRange("sampler logits".to_string()));
+        }
+        self.candidates.clear();
+        self.candidates
+            .extend(
+                logits
+                    .iter()
+                    .enumerate()
+                    .map(|(token_id, logit)| GgufSamplingCandidate {
+                        token_id: token_id as u64,
+                        logit: *logit,
+                        probability: 0.0,
+                    }),
+            );
+        if self.options.has_penalties() {
+            self.apply_penalties(history);
+        }
+
+        let temperature = self.options.temperature;
+        if temperature == 0.0 {
+            let mut best = 0usize;
+            for (index, candidate) in self.candidates.iter().enumerate().skip(1) {
+                if candidate
+                    .logit
+                    .total_cmp(&self.candidates[best].logit)
+                    .is_gt()
+                {
+                    best = index;
+                }
+            }
+            self.candidates.swap(0, best);
+            self.candidates.truncate(1);
+            self.candidates[0].probability = 1.0;
+            return Ok(&self.candidates);
+        }
+
+        let top_k = self.options.top_k;
+        let sorted = top_k > 0 || self.options.top_p < 1.0;
+        if top_k > 0 && top_k < self.candidates.len() {
+            self.candidates
+                .select_nth_unstable_by(top_k - 1, descending_logit);
+            self.candidates.truncate(top_k);
+        }
+        if self.options.min_p > 0.0 {
+            // p / p_max >= min_p, compared in scaled-logit space.
+            let threshold = self.options.min_p.ln();
+            let max_scaled = self.max_scaled_logit();
+            self.candidates
+                .retain(|candidate| candidate.logit / temperature - max_scaled >= threshold);
+        }
+        if sorted {
+            self.candidates.sort_by(descending_logit);
+        }
+
+        let max_scaled = self.max_scaled_logit();
+        for candidate in self.candidates.iter_mut() {
+            candidate.probability = (candidate.logit / temperature - max_scaled).exp();
+        }
+        self.normalize();
+
+        if self.options.top_p < 1.0 {
+            let mut cumulative_probability = 0.0f64;
+            let mut keep = self.candidates.len();
+            for (index, candidate) in self.candidates.iter().enumerate() {
+                cumulative_probability += candidate.probability;
+                if cumulative_probability >= self.options.top_p {
+                    keep = index + 1;
+                    break;
+                }
+            }
+            if keep < self.candidates.len() {
+                self.candidates.truncate(keep);
+                self.normalize();
+            }
+        }
+        Ok(&self.candidates)
+    }
+
+    /// [`Self::prepare`], then draws a token. Greedy sampling consumes no
+    /// draw.
+    pub fn sample(&mut self, logits: &[f64], history: &[u64]) -> Result<u64, GgufError> {
+        self.prepare(logits, history)?;
+        if self.options.temperature == 0.0 {
+            self.last_draw = 0.0;
+            return Ok(self.candidates[0].token_id);
+        }
+        let draw = self.rng.next_unit();
+        self.last_draw = draw;
+        let mut cumulative_probability = 0.0f64;
+        for candidate in &self.candidates {
+            cumulative_probability += candidate.probability;
+            if draw <= cumulative_probability {
+                return Ok(candidate.token_id);
+            }
+        }
+        Ok(self.candidates[self.candidates.len() - 1].token_id)
+    }
+
+    fn apply_penalties(&mut self, history: &[u64]) {
+        let window = match self.options.penalty_last_n {
+            0 => history,
+            last_n => &history[history.len().saturating_sub(last_n)..],
+        };
+        self.recent.clear();
+        self.recent.extend_from_slice(window);
+        self.recent.sort_unstable();
+        let options = &self.options;
+        for run in self.recent.chunk_by(|left, right| left == right) {
+            let Some(candidate) = self.candidates.get_mut(run[0] as usize) else {
+                continue;
+            };
+            if candidate.logit > 0.0 {
+                candidate.logit /= options.repetition_penalty;
+            } else {
+                candidate.logit *= options.repetition_penalty;
+            }
+            candidate.logit -=
+                run.len() as f64 * options.frequency_penalty + options.presence_penalty;
+        }
+    }
+
+    fn max_scaled_logit(&self) -> f64 {
+        self.candidates
+            .iter()
+            .map(|candidate| candidate.logit / self.options.temperature)
+            .fold(f64::NEG_INFINITY, f64::max)
+    }
+
+    fn normalize(&mut self) {
+        let weight_sum = self
+            .candidates
+            .iter()
+            .map(|candidate| candidate.probability)
+            .sum::<f64>();
+        let count = self.candidates.len() as f64;
+        for candidate in self.candidates.iter_mut() {
+            candidate.probability = if weight_sum > 0.0 {
+                candidate.probability / weight_sum
+            } else {
+                1.0 / count
+            };
+        }
+    }
+}
+
+fn descending_logit(
+    left: &GgufSamplingCandidate,
+    right: &GgufSamplingCandidate,
+) -> std::cmp::Ordering {
+    right
+        .logit
+        .total_cmp(&left.logit)
+        .then_with(|| left.token_id.cmp(&right.token_id))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn splitmix_stream_matches_reference_values() {
+        let mut rng = SplitMix64::new(12345);
+        let first = rng.next_u64();
+        assert_eq!(first, 2454886589211414944);
+        assert_eq!(rng.state(), 12345u64.wrapping_add(0x9E3779B97F4A7C15));
+        let draw = SplitMix64::new(12345).next_unit();
+        assert_eq!(draw, (first >> 11) as f64 / (1u64 << 53) as f64);
+    }
+
+    #[test]
+    fn filters_prune_before_drawing() {
+        let logits = [1.0, 4.0, 3.0, -2.0, 4.0, 0.5];
+        let mut options = GgufSamplerOptions::new(1.0, 7);
+        options.top_k = 3;
+        let mut sampler = GgufSampler::new(options.clone()).expect("sampler");
+        let tokens = sampler
+            .prepare(&logits, &[])
+            .expect("prepare")
+            .iter()
+            .map(|candidate| candidate.token_id)
+            .collect::<Vec<_>>();
+        assert_eq!(tokens, vec![1, 4, 2]);
+        let total = sampler
+            .candidates()
+            .iter()
+            .map(|candidate| candidate.probability)
+            .sum::<f64>();
+        assert!((total - 1.0).abs() < 1e-12);
+
+        options.top_k = 0;
+        options.min_p = 0.3;
+        let mut sampler = GgufSampler::new(options.clone()).expect("sampler");
+        let kept = sampler.prepare(&logits, &[]).expect("prepare").len();
+        // e^-1 >= 0.3 > e^-3: only the 4.0 and 3.0 logits survive.
+        assert_eq!(kept, 3);
+
+        options.min_p = 0.0;
+        options.top_p = 0.5;
+        let mut sampler = GgufSampler::new(options.clone()).expect("sampler");
+        let kept = sampler
+            .prepare(&logits, &[])
+            .expect("prepare")
+            .iter()
+            .map(|candidate| candidate.token_id)
+            .collect::<Vec<_>>();
+        assert_eq!(kept, vec![1, 4]);
+
+        options.top_p = 1.0;
+        options.temperature = 0.0;
+        options.repetition_penalty = 2.0;
+        options.presence_penalty = 0.5;
+        let mut sampler = GgufSampler::new(options).expect("sampler");
+        // Token 1 becomes 4.0 / 2 - 0.5, so token 4 wins without a draw.
+        assert_eq!(sampler.sample(&logits, &[1, 1]).expect("greedy"), 4);
+        assert_eq!(sampler.rng_state(), 7);
+        assert!(GgufSampler::new(GgufSamplerOptions::new(-1.0, 0)).is_err());
+    }
+
+    #[test]
+    fn draws_follow_cumulative_probabilities() {
+        let logits = [0.0, 2.0, 1.0];
+        let mut sampler = GgufSampler::new(GgufSamplerOptions::new(0.7, 99)).expect("sampler");
+        let mut rng = SplitMix64::new(99);
+        for _ in 0..16 {
+            let token = sampler.sample(&logits, &[]).expect("sample");
+            let draw = rng.next_unit();
+            assert_eq!(sampler.last_draw(), draw);
+            let weights = logits
+                .iter()
+                .map(|logit| (logit / 0.7 - 2.0 / 0.7).exp())
+                .collect::<Vec<_>>();
+            let weight_sum = weights.iter().sum::<f64>();
+            let mut cumulative_probability = 0.0;
+            let expected = weights
+                .iter()
+                .position(|weight| {
+                    cumulative_probability += weight / weight_sum;
+                    draw <= cumulative_probability
+                })
+                .unwrap_or(2);
+            assert_eq!(token, expected as u64);
+        }
+        assert_eq!(sampler.rng_state(), rng.state());
+    }
+}
@@ -0,0 +1,409 @@
+//! Continuous batching over the sequence slots of a `GgufDecodeSession`.
+//!
+//! Submitted requests wait in a queue and are admitted between steps whenever
+//! a slot is free. Each `step` is one batched pass: every decoding sequence
+//! contributes its pending token and the remaining lanes carry prompt chunks
+//! of newly admitted sequences, so every weight row is read once for all of
+//! them. A sequence that reaches its token budget or stop token is retired in
+//! the same step, returning its slot and KV blocks to the pool.
+
+use super::model::GgufError;
+use super::sampling::{GgufSampler, GgufSamplerOptions};
+use super::session::{argmax_token, GgufDecodeSession};
+use std::collections::VecDeque;
+
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufGenerationRequest {
+    pub prompt_token_ids: Vec<u64>,
+    pub max_new_tokens: usize,
+    /// Generation ends once this token has been emitted.
+    pub stop_token_id: Option<u64>,
+    /// Sampling settings; `None` decodes greedily.
+    pub sampling: Option<GgufSamplerOptions>,
+}
+
+impl GgufGenerationRequest {
+    pub fn new(prompt_token_ids: Vec<u64>, max_new_tokens: usize) -> Self {
+        Self {
+            prompt_token_ids,
+            max_new_tokens,
+            stop_token_id: None,
+            sampling: None,
+        }
+    }
+}
+
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufGenerationResult {
+    pub request_id: u64,
+    pub prompt_token_count: usize,
+    pub generated_token_ids: Vec<u64>,
+    /// Scheduler steps completed when the request was admitted and retired.
+    pub admitted_step: u64,
+    pub finished_step: u64,
+}
+
+#[derive(Clone, Copy, Debug, Default, PartialEq)]
+pub struct GgufSchedulerStats {
+    pub step_count: u64,
+    pub admitted_request_count: u64,
+    pub finished_request_count: u64,
+    pub prefill_token_count: u64,
+    pub generated_token_count: u64,
+    /// Tokens pushed through the model, summed over all steps.
+    pub lane_count: u64,
+}
+
+impl GgufSchedulerStats {
+    /// Average number of tokens carried by one batched pass.
+    pub fn mean_batch_size(&self) -> f64 {
+        if self.step_count == 0 {
+            0.0
+        } else {
+            self.lane_count as f64 / self.step_count as f64
+        }
+    }
+}
+
+struct ActiveSequence {
+    request_id: u64,
+    slot: usize,
+    request: GgufGenerationRequest,
+    /// Prompt tokens already in the slot's KV cache.
+    prefilled: usize,
+    generated: Vec<u64>,
+    sampler: Option<GgufSampler>,
+    admitted_step: u64,
+}
+
+impl ActiveSequence {
+    fn is_decoding(&self) -> bool {
+        self.prefilled == self.request.prompt_token_ids.len()
+    }
+
+    fn is_finished(&self) -> bool {
+        self.generated.len() >= self.request.max_new_tokens
+            || matches!(
+                (self.generated.last(), self.request.stop_token_id),
+                (Some(last), Some(stop)) if *last == stop
+            )
+    }
+}
+
+pub struct GgufBatchScheduler {
+    session: GgufDecodeSession,
+    pending: VecDeque<(u64, GgufGenerationRequest)>,
+    active: Vec<ActiveSequence>,
+    free_slots: Vec<usize>,
+    next_request_id: u64,
+    stats: GgufSchedulerStats,
+}
+
+impl GgufBatchScheduler {
+    /// Takes over every sequence slot of `session`, clearing them. The session
+    /// must allow at least one batch lane per slot so that each active
+    /// sequence advances in every step.
+    pub fn new(mut session: GgufDecodeSession) -> Result<Self, GgufError> {
+        let slot_count = session.sequence_count();
+        if slot_count > session.options().max_batch_tokens {
+            return Err(GgufError::InvalidTensorRange(
+                "scheduler needs max_batch_tokens >= max_sequences".to_string(),
+            ));
+        }
+        for slot in 0..slot_count {
+            session.truncate_sequence(slot, 0);
+        }
+        Ok(Self {
+            session,
+            pending: VecDeque::new(),
+            active: Vec::with_capacity(slot_count),
+            free_slots: (0..slot_count).rev().collect(),
+            next_request_id: 0,
+            stats: GgufSchedulerStats::default(),
+        })
+    }
+
+    pub fn session(&self) -> &GgufDecodeSession {
+        &self.session
+    }
+
+    pub fn into_session(self) -> GgufDecodeSession {
+        self.session
+    }
+
+    pub fn stats(&self) -> GgufSchedulerStats {
+        self.stats
+    }
+
+    pub fn pending_count(&self) -> usize {
+        self.pending.len()
+    }
+
+    pub fn active_count(&self) -> usize {
+        self.active.len()
+    }
+
+    pub fn is_idle(&self) -> bool {
+        self.pending.is_empty() && self.active.is_empty()
+    }
+
+    /// Queues a request and returns its id. It is admitted at the start of
+    /// the next step with a free slot.
+    pub fn submit(&mut self, request: GgufGenerationRequest) -> Result<u64, GgufError> {
+        let fed_token_count =
+            request.prompt_token_ids.len() + request.max_new_tokens.saturating_sub(1);
+        if request.prompt_token_ids.is_empty()
+            || (self.session.options().attention_window == 0
+                && fed_token_count > self.session.max_context())
+            || request
+                .prompt_token_ids
+                .iter()
+                .any(|token| *token >= self.session.vocab_size() as u64)
+        {
+            return Err(GgufError::InvalidTensorRange(
+                "scheduler generation request".to_string(),
+            ));
+        }
+        if let Some(options) = &request.sampling {
+            GgufSampler::new(options.clone())?;
+        }
+        let request_id = self.next_request_id;
+        self.next_request_id += 1;
+        self.pending.push_back((request_id, request));
+        Ok(request_id)
+    }
+
+    /// Admits queued requests into free slots, runs one batched pass over all
+    /// active sequences and returns the requests that finished in it.
+    pub fn step(&mut self) -> Result<Vec<GgufGenerationResult>, GgufError> {
+        let mut finished = Vec::new();
+        self.admit(&mut finished);
+        if self.active.is_empty() {
+            return Ok(finished);
+        }
+
+        // Decoding sequences take one lane each; prompt chunks share the rest.
+        let budget = self.session.options().max_batch_tokens;
+        let mut plan = Vec::with_capacity(self.active.len());
+        for (index, sequence) in self.active.iter().enumerate() {
+            if sequence.is_decoding() {
+                plan.push((index, 1));
+            }
+        }
+        let mut lane_count = plan.len();
+        for (index, sequence) in self.active.iter().enumerate() {
+            let remaining = sequence.request.prompt_token_ids.len() - sequence.prefilled;
+            let count = remaining.min(budget - lane_count);
+            if count > 0 {
+                plan.push((index, count));
+                lane_count += count;
+            }
+        }
+
+        let segments = plan
+            .iter()
+            .map(|(index, count)| {
+                let sequence = &self.active[*index];
+                let tokens = if sequence.is_decoding() {
+                    &sequence.generated[sequence.generated.len() - 1..]
+                } else {
+                    &sequence.request.prompt_token_ids
+                        [sequence.prefilled..sequence.prefilled + count]
+                };
+                (sequence.slot, tokens)
+            })
+            .collect::<Vec<_>>();
+        let vocab_size = self.session.vocab_size();
+        // Greedy lanes need only each token's best logit, so an all-greedy
+        // step skips materializing the full logits.
+        let greedy = plan
+            .iter()
+            .all(|(index, _)| self.active[*index].sampler.is_none());
+        if greedy {
+            self.session.decode_sequences_top_k(&segments, 1)?;
+        } else {
+            self.session.decode_sequences(&segments)?;
+        }
+        let logits = self.session.batch_logits();
+        let best = self.session.top_candidates();
+
+        let mut lane = 0usize;
+        for (index, count) in plan {
+            lane += count;
+            let sequence = &mut self.active[index];
+            if !sequence.is_decoding() {
+                sequence.prefilled += count;
+                self.stats.prefill_token_count += count as u64;
+                if !sequence.is_decoding() {
+                    continue;
+                }
+            }
+            let token = match &mut sequence.sampler {
+                Some(sampler) => sampler.sample(
+                    &logits[(lane - 1) * vocab_size..lane * vocab_size],
+                    self.session.sequence_tokens(sequence.slot),
+                )?,
+                None if greedy => best[lane - 1].token_id,
+                None => argmax_token(&logits[(lane - 1) * vocab_size..lane * vocab_size]),
+            };
+            sequence.generated.push(token);
+            self.stats.generated_token_count += 1;
+        }
+        self.stats.step_count += 1;
+        self.stats.lane_count += lane_count as u64;
+
+        let mut index = 0;
+        while index < self.active.len() {
+            if self.active[index].is_finished() {
+                let sequence = self.active.remove(index);
+                finished.push(self.retire(sequence));
+            } else {
+                index += 1;
+            }
+        }
+        Ok(finished)
+    }
+
+    /// Steps until every submitted request has finished and returns them in
+    /// completion order.
+    pub fn run_until_idle(&mut self) -> Result<Vec<GgufGenerationResult>, GgufError> {
+        let mut finished = Vec::new();
+        while !self.is_idle() {
+            finished.extend(self.step()?);
+        }
+        Ok(finished)
+    }
+
+    fn admit(&mut self, finished: &mut Vec<GgufGenerationResult>) {
+        while !self.free_slots.is_empty() {
+            let Some((request_id, request)) = self.pending.pop_front() else {
+                break;
+            };
+            self.stats.admitted_request_count += 1;
+            let sequence = ActiveSequence {
+                request_id,
+                slot: self.free_slots.pop().expect("free slot"),
+                generated: Vec::with_capacity(request.max_new_tokens),
+                sampler: request.sampling.clone().map(|options| {
+                    GgufSampler::new(options).expect("sampler options checked at submit")
+                }),
+                request,
+                prefilled: 0,
+                admitted_step: self.stats.step_count,
+            };
+            if sequence.is_finished() {
+                finished.push(self.retire(sequence));
+            } else {
+                self.active.push(sequence);
+            }
+        }
+    }
+
+    fn retire(&mut self, sequence: ActiveSequence) -> GgufGenerationResult {
+        self.session.truncate_sequence(sequence.slot, 0);
+        self.free_slots.push(sequence.slot);
+        self.stats.finished_request_count += 1;
+        GgufGenerationResult {
+            request_id: sequence.request_id,
+            prompt_token_count: sequence.request.prompt_token_ids.len(),
+            generated_token_ids: sequence.generated,
+            admitted_step: sequence.admitted_step,
+            finished_step: self.stats.step_count,
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::aeronn::session::GgufDecodeSessionOptions;
+    use crate::aeronn::test_support::write_synthetic_llama_gguf;
+    use crate::GgufHeader;
+
+    #[test]
+    fn batched_requests_match_sequential_greedy_runs() {
+        let path = write_synthetic_llama_gguf("scheduler", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let prompts = [
+            vec![3u64, 17, 5, 9, 21, 8],
+            vec![12u64],
+            vec![7u64, 1, 22, 30],
+        ];
+        let mut single = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let sampling = GgufSamplerOptions {
+            top_k: 8,
+            repetition_penalty: 1.3,
+            ..GgufSamplerOptions::new(0.8, 42)
+        };
+        single.reset();
+        let expected_sampled = single
+            .generate_sampled(
+                &prompts[1],
+                6,
+                &mut GgufSampler::new(sampling.clone()).expect("sampler"),
+            )
+            .expect("sampled decode");
+        let expected = prompts
+            .iter()
+            .map(|prompt| {
+                single.reset();
+                single.generate_greedy(prompt, 5).expect("greedy decode")
+            })
+            .collect::<Vec<_>>();
+
+        let mut options = GgufDecodeSessionOptions::new(2, 32);
+        options.max_sequences = 2;
+        options.max_batch_tokens = 4;
+        options.kv_block_tokens = 4;
+        let session = GgufDecodeSession::new(&header, options).expect("build session");
+        let mut scheduler = GgufBatchScheduler::new(session).expect("build scheduler");
+        for prompt in &prompts[..2] {
+            scheduler
+                .submit(GgufGenerationRequest::new(prompt.clone(), 5))
+                .expect("submit");
+        }
+        let mut results = scheduler.step().expect("first step");
+        assert_eq!(scheduler.active_count(), 2);
+        let mut stopped = GgufGenerationRequest::new(prompts[2].clone(), 5);
+        stopped.stop_token_id = Some(expected[2][1]);
+        let stopped_length = expected[2]
+            .iter()
+            .position(|token| Some(*token) == stopped.stop_token_id)
+            .expect("stop token")
+            + 1;
+        scheduler.submit(stopped).expect("submit mid-run");
+        scheduler
+            .submit(GgufGenerationRequest::new(prompts[0].clone(), 0))
+            .expect("submit empty");
+        let mut sampled = GgufGenerationRequest::new(prompts[1].clone(), 6);
+        sampled.sampling = Some(sampling);
+        scheduler.submit(sampled).expect("submit sampled");
+        assert_eq!(scheduler.pending_count(), 3);
+        results.extend(scheduler.run_until_idle().expect("run scheduler"));
+        results.sort_by_key(|result| result.request_id);
+
+        assert_eq!(results.len(), 5);
+        assert_eq!(results[0].generated_token_ids, expected[0]);
+        assert_eq!(results[1].generated_token_ids, expected[1]);
+        assert_eq!(
+            results[2].generated_token_ids,
+            expected[2][..stopped_length]
+        );
+        assert!(results[3].generated_token_ids.is_empty());
+        assert_eq!(results[4].generated_token_ids, expected_sampled);
+        assert!(results[2].admitted_step > 0);
+
+        let stats = scheduler.stats();
+        assert_eq!(stats.finished_request_count, 5);
+        assert_eq!(stats.prefill_token_count, 12);
+        assert_eq!(stats.generated_token_count, 16 + stopped_length as u64);
+        assert!(stats.mean_batch_size() > 1.0);
+        assert_eq!(scheduler.session().kv_cache().used_block_count(), 0);
+        assert!(scheduler
+            .submit(GgufGenerationRequest::new(Vec::new(), 1))
+            .is_err());
+        let _ = std::fs::remove_file(path);
+    }
+}
@@ -0,0 +1,2257 @@
+//! Stateful decoding over a GGUF Llama checkpoint.
+//!
+//! `GgufDecodeSession` loads the quantized weights of a layer range once,
+//! keeps its KV cache in a paged block pool and owns a scratch arena sized at
+//! construction, so a steady-state `decode_step` does not touch the heap.
+//! Several positions can be pushed through the stack in one batched pass,
+//! which prompt prefill and speculative verification both use. The session
+//! holds `max_sequences` independent sequence slots sharing that pool; the
+//! single-sequence methods act on slot 0, and `decode_sequences` advances any
+//! mix of slots in one pass. Forked slots share KV blocks copy-on-write, which
+//! parallel sampling and beam search use to prefill a prompt only once.
+//!
+//! With `attention_window` set, each token attends to the first
+//! `attention_sinks` positions plus the most recent window, as in
+//! StreamingLLM, and older window rows are overwritten in a ring, so memory
+//! and per-token cost stay flat on unbounded streams. Sinks are scored as if
+//! the window directly followed them: the query is rotated at the token's
+//! position inside that compacted cache, while window keys keep their
+//! absolute positions, whose relative distances are already the compacted
+//! ones. No cached key is ever re-rotated.
+//!
+//! Slot 0 can be saved to a snapshot file and restored into a session of the
+//! same model instead of prefilling the history again.
+
+use super::attention::{causal_attention_into, HeadLayout};
+use super::model::{
+    decode_quantized_row_into, project_quantized_rows_batch_into,
+    project_quantized_rows_top_k_into, swiglu_rows_batch_into, GgufError, GgufHeader, SwiGluRow,
+    TopLogits,
+};
+use super::paged_kv::{paged_kv_rows, GgufPagedKvCache};
+use super::plan::{GgufLayerPlan, GgufModelPlan};
+use super::prefix_cache::GgufPrefixCache;
+use super::sampling::{GgufSampler, GgufSamplingCandidate};
+use super::snapshot::{read_f32s_into, read_f64s_into, read_u64s, Fnv1a, SnapshotHeader};
+use crate::mmap::MappedFile;
+use crate::parallel;
+use std::fs::File;
+use std::io::{BufWriter, Write};
+use std::time::Instant;
+
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufDecodeSessionOptions {
+    pub input_tensor_name: String,
+    pub layer_start: usize,
+    pub layer_count: usize,
+    pub final_norm_tensor_name: String,
+    pub output_tensor_name: String,
+    pub max_context: usize,
+    /// Most positions one batched forward pass may carry (prefill chunks and
+    /// speculative verification both stay within it).
+    pub max_batch_tokens: usize,
+    /// Positions per paged KV block.
+    pub kv_block_tokens: usize,
+    /// Sequence slots sharing the KV pool, which holds a full `max_context`
+    /// for each of them.
+    pub max_sequences: usize,
+    /// Leading positions that stay attendable once `attention_window`
+    /// starts evicting.
+    pub attention_sinks: usize,
+    /// Most recent positions each token attends to besides the sinks; `0`
+    /// keeps the whole context. `attention_sinks + attention_window +
+    /// max_batch_tokens - 1` must fit in `max_context`.
+    pub attention_window: usize,
+}
+
+impl GgufDecodeSessionOptions {
+    /// Options for the first `layer_count` blocks of a standard Llama GGUF file
+    /// (`token_embd.weight`, `output_norm.weight`, `output.weight`).
+    pub fn new(layer_count: usize, max_context: usize) -> Self {
+        Self {
+            input_tensor_name: "token_embd.weight".to_string(),
+            layer_start: 0,
+            layer_count,
+            final_norm_tensor_name: "output_norm.weight".to_string(),
+            output_tensor_name: "output.weight".to_string(),
+            max_context,
+            max_batch_tokens: 8,
+            kv_block_tokens: 16,
+            max_sequences: 1,
+            attention_sinks: 4,
+            attention_window: 0,
+        }
+    }
+}
+
+/// Outcome of [`GgufDecodeSession::generate_speculative`].
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufSpeculativeDecodeSample {
+    pub generated_token_ids: Vec<u64>,
+    pub draft_layer_count: usize,
+    pub draft_length: usize,
+    pub verify_pass_count: usize,
+    pub drafted_token_count: usize,
+    pub accepted_token_count: usize,
+    pub acceptance_rate: f64,
+    /// Wall time after prefill, spent drafting and verifying.
+    pub decode_seconds: f64,
+    pub effective_tokens_per_second: f64,
+}
+
+/// One finished beam of [`GgufDecodeSession::generate_beam_search`].
+#[derive(Clone, Debug, PartialEq)]
+pub struct GgufBeamHypothesis {
+    pub token_ids: Vec<u64>,
+    /// Sum of the log-probabilities of `token_ids` under the model.
+    pub log_probability: f64,
+}
+
+/// A scored next-token extension of one beam.
+#[derive(Clone, Copy, Debug, PartialEq)]
+struct BeamCandidate {
+    parent: usize,
+    token: u64,
+    log_probability: f64,
+}
+
+/// Weight bytes of one block, laid out as its [`GgufLayerPlan`] describes.
+struct LayerWeights {
+    qkv_bytes: Vec<u8>,
+    attn_output_bytes: Vec<u8>,
+    gate_up_bytes: Vec<u8>,
+    down_bytes: Vec<u8>,
+}
+
+/// Cached tokens of one sequence slot and the pool blocks holding their KV.
+struct DecodeSequence {
+    tokens: Vec<u64>,
+    /// Pool block holding cache rows `i * kv_block_tokens..` for each entry `i`.
+    block_table: Vec<u32>,
+    /// Window tokens dropped from the front of `tokens` after the sinks.
+    evicted: usize,
+}
+
+/// Sink-plus-window cache policy. Positions past the sinks map onto a ring
+/// of `ring` rows, which holds `max_batch_tokens - 1` rows beyond the window
+/// so that no lane of a batched pass overwrites a row an earlier lane reads.
+#[derive(Clone, Copy, Debug, PartialEq)]
+struct KvWindow {
+    sinks: usize,
+    window: usize,
+    ring: usize,
+}
+
+impl KvWindow {
+    /// Cache row of absolute position `position`.
+    fn row(&self, position: usize) -> usize {
+        if position < self.sinks {
+            position
+        } else {
+            self.sinks + (position - self.sinks) % self.ring
+        }
+    }
+
+    /// Position of a token inside its compacted sinks-plus-window context.
+    fn compacted_position(&self, position: usize) -> usize {
+        position.min(self.sinks + self.window - 1)
+    }
+}
+
+/// Precomputed RoPE angles for the first `max_context` positions; later
+/// positions, reached only with an attention window, are computed the same
+/// way on demand.
+struct RopeTable {
+    half_dimension: usize,
+    /// `freq_base^(2i / head_dimension)` for every rotated pair `i`.
+    divisors: Vec<f64>,
+    cos: Vec<f32>,
+    sin: Vec<f32>,
+}
+
+impl RopeTable {
+    fn new(head_dimension: usize, freq_base: f64, position_count: usize) -> Self {
+        let divisors = (0..head_dimension)
+            .step_by(2)
+            .map(|dim| freq_base.powf(dim as f64 / head_dimension as f64))
+            .collect::<Vec<_>>();
+        let mut cos = Vec::with_capacity(position_count * divisors.len());
+        let mut sin = Vec::with_capacity(position_count * divisors.len());
+        for position in 0..position_count {
+            for divisor in &divisors {
+                let angle = position as f64 / divisor;
+                cos.push(angle.cos() as f32);
+                sin.push(angle.sin() as f32);
+            }
+        }
+        Self {
+            half_dimension: divisors.len(),
+            divisors,
+            cos,
+            sin,
+        }
+    }
+
+    /// `cos`/`sin` rows for `position`, borrowed from the table or written
+    /// into the given buffers.
+    fn angles<'a>(
+        &'a self,
+        position: usize,
+        cos: &'a mut [f32],
+        sin: &'a mut [f32],
+    ) -> (&'a [f32], &'a [f32]) {
+        let start = position * self.half_dimension;
+        if start < self.cos.len() {
+            let end = start + self.half_dimension;
+            return (&self.cos[start..end], &self.sin[start..end]);
+        }
+        for ((cos, sin), divisor) in cos.iter_mut().zip(sin.iter_mut()).zip(&self.divisors) {
+            let angle = position as f64 / divisor;
+            *cos = angle.cos() as f32;
+            *sin = angle.sin() as f32;
+        }
+        (cos, sin)
+    }
+}
+
+/// Per-pass temporaries, allocated once for `max_batch_tokens` positions.
+/// Buffers are position-major except `by_row`, `ffn_rows` and
+/// `logits_by_row`, which hold kernel output as `[row][position]`.
+struct DecodeScratch {
+    batch_len: usize,
+    state: Vec<f32>,
+    normalized: Vec<f32>,
+    by_row: Vec<f32>,
+    qkv: Vec<f32>,
+    attention_input: Vec<f32>,
+    /// Per-head online-softmax state of the tiled attention kernel.
+    attention_workspace: Vec<f64>,
+    /// Queries rotated at their compacted position, for scoring sinks.
+    sink_queries: Vec<f32>,
+    rope_cos: Vec<f32>,
+    rope_sin: Vec<f32>,
+    scores: Vec<f64>,
+    ffn_rows: Vec<SwiGluRow>,
+    activated: Vec<f32>,
+    logits_by_row: Vec<f64>,
+    logits: Vec<f64>,
+    /// Per-shard summaries of the top-k output head, `batch` per shard.
+    head_shards: Vec<TopLogits>,
+    /// Lanes of the latest top-k pass and the candidates kept per lane.
+    candidate_lanes: usize,
+    candidate_count: usize,
+    candidates: Vec<GgufSamplingCandidate>,
+    log_sum_exp: Vec<f64>,
+}
+
+/// What the output head produces at the end of a pass.
+#[derive(Clone, Copy, Debug, PartialEq)]
+enum OutputHead {
+    /// Every logit of every lane.
+    Logits,
+    /// The `k` most likely tokens and the log-sum-exp of every lane.
+    TopK(usize),
+    /// Nothing; for prompt chunks whose logits nobody reads.
+    Skip,
+}
+
+pub struct GgufDecodeSession {
+    options: GgufDecodeSessionOptions,
+    plan: GgufModelPlan,
+    embedding_bytes: Vec<u8>,
+    output_bytes: Vec<u8>,
+    layers: Vec<LayerWeights>,
+    rope: RopeTable,
+    window: Option<KvWindow>,
+    kv: GgufPagedKvCache,
+    sequences: Vec<DecodeSequence>,
+    scratch: DecodeScratch,
+    model_hash: u64,
+}
+
+impl GgufDecodeSession {
+    pub fn new(header: &GgufHeader, options: GgufDecodeSessionOptions) -> Result<Self, GgufError> {
+        if options.layer_count == 0
+            || options.max_context == 0
+            || options.max_batch_tokens == 0
+            || options.kv_block_tokens == 0
+            || options.max_sequences == 0
+            || (options.attention_window > 0
+                && options.attention_sinks + options.attention_window + options.max_batch_tokens
+                    - 1
+                    > options.max_context)
+        {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session options".to_string(),
+            ));
+        }
+        let plan = GgufModelPlan::new(
+            header,
+            &options.input_tensor_name,
+            options.layer_start,
+            options.layer_count,
+            &options.final_norm_tensor_name,
+            &options.output_tensor_name,
+        )?;
+        let heads = plan.heads;
+        let head_dimension = heads.head_dimension;
+        let embedding_length = plan.embedding_length();
+        let feed_forward_length = plan.feed_forward_length();
+
+        let mut embedding_bytes = Vec::new();
+        header.read_quantized_matrices(&[plan.embedding], &mut embedding_bytes)?;
+        let mut output_bytes = Vec::new();
+        header.read_quantized_matrices(&[plan.output], &mut output_bytes)?;
+        let layers = plan
+            .layers
+            .iter()
+            .map(|layer| load_layer_weights(header, layer))
+            .collect::<Result<Vec<_>, _>>()?;
+
+        let mut hasher = Fnv1a::new();
+        hasher.write_u64(header.file_size);
+        for tensor in &header.tensors {
+            hasher.write(tensor.name.as_bytes());
+            for dimension in &tensor.dimensions {
+                hasher.write_u64(*dimension);
+            }
+            hasher.write_u64(u64::from(tensor.tensor_type));
+            hasher.write_u64(tensor.offset);
+        }
+        hasher.write_u64(options.layer_start as u64);
+        for name in [
+            &options.input_tensor_name,
+            &options.final_norm_tensor_name,
+            &options.output_tensor_name,
+        ] {
+            hasher.write(name.as_bytes());
+        }
+        hasher.write_sampled(&embedding_bytes);
+        hasher.write_sampled(&output_bytes);
+        for layer in &layers {
+            for bytes in [
+                &layer.qkv_bytes,
+                &layer.attn_output_bytes,
+                &layer.gate_up_bytes,
+                &layer.down_bytes,
+            ] {
+                hasher.write_sampled(bytes);
+            }
+        }
+        let model_hash = hasher.finish();
+
+        let rope = RopeTable::new(
+            head_dimension,
+            plan.rope_freq_base as f64,
+            options.max_context,
+        );
+        let window = (options.attention_window > 0).then(|| KvWindow {
+            sinks: options.attention_sinks,
+            window: options.attention_window,
+            ring: options.attention_window + options.max_batch_tokens - 1,
+        });
+
+        let batch = options.max_batch_tokens;
+        let qkv_length = heads.query_length() + 2 * heads.kv_length();
+        let scratch = DecodeScratch {
+            batch_len: 0,
+            state: vec![0.0; batch * embedding_length],
+            normalized: vec![0.0; batch * embedding_length],
+            by_row: vec![0.0; batch * qkv_length.max(embedding_length)],
+            qkv: vec![0.0; batch * qkv_length],
+            attention_input: vec![0.0; batch * heads.query_length()],
+            attention_workspace: vec![0.0; heads.workspace_len(batch, options.kv_block_tokens)],
+            sink_queries: vec![0.0; batch * heads.query_length()],
+            rope_cos: vec![0.0; head_dimension / 2],
+            rope_sin: vec![0.0; head_dimension / 2],
+            scores: vec![0.0; options.max_context],
+            ffn_rows: vec![SwiGluRow::default(); batch * feed_forward_length],
+            activated: vec![0.0; batch * feed_forward_length],
+            logits_by_row: vec![0.0; batch * plan.vocab_size()],
+            logits: vec![0.0; batch * plan.vocab_size()],
+            head_shards: vec![TopLogits::default(); parallel::thread_count() * batch],
+            candidate_lanes: 0,
+            candidate_count: 0,
+            candidates: Vec::new(),
+            log_sum_exp: vec![0.0; batch],
+        };
+        let sequence_blocks = options.max_context.div_ceil(options.kv_block_tokens);
+        let kv = GgufPagedKvCache::new(
+            layers.len(),
+            heads.kv_length(),
+            options.kv_block_tokens,
+            options.max_sequences * sequence_blocks,
+        );
+        let sequences = (0..options.max_sequences)
+            .map(|_| DecodeSequence {
+                tokens: Vec::with_capacity(options.max_context),
+                block_table: Vec::with_capacity(sequence_blocks),
+                evicted: 0,
+            })
+            .collect();
+        Ok(Self {
+            kv,
+            sequences,
+            options,
+            plan,
+            embedding_bytes,
+            output_bytes,
+            layers,
+            rope,
+            window,
+            scratch,
+            model_hash,
+        })
+    }
+
+    pub fn options(&self) -> &GgufDecodeSessionOptions {
+        &self.options
+    }
+
+    /// Validated model layout the session was built from.
+    pub fn plan(&self) -> &GgufModelPlan {
+        &self.plan
+    }
+
+    pub fn vocab_size(&self) -> usize {
+        self.plan.output.row_count
+    }
+
+    pub fn embedding_length(&self) -> usize {
+        self.plan.embedding.column_count
+    }
+
+    pub fn max_context(&self) -> usize {
+        self.options.max_context
+    }
+
+    /// Fingerprint of the checkpoint and layer range this session runs,
+    /// from the GGUF tensor directory and samples of every weight tensor.
+    /// Snapshots only restore into a session with the same hash.
+    pub fn model_hash(&self) -> u64 {
+        self.model_hash
+    }
+
+    /// Number of tokens fed so far, which is the position of the next one.
+    /// With an attention window this keeps counting past evicted tokens.
+    pub fn position(&self) -> usize {
+        self.sequence_position(0)
+    }
+
+    /// Tokens whose KV rows are cached: every token fed, or with an
+    /// attention window the sinks followed by the most recent tokens.
+    pub fn tokens(&self) -> &[u64] {
+        &self.sequences[0].tokens
+    }
+
+    /// [`Self::position`] for sequence slot `sequence`.
+    pub fn sequence_position(&self, sequence: usize) -> usize {
+        let state = &self.sequences[sequence];
+        state.evicted + state.tokens.len()
+    }
+
+    pub fn sequence_count(&self) -> usize {
+        self.sequences.len()
+    }
+
+    /// Tokens cached for sequence slot `sequence`.
+    pub fn sequence_tokens(&self, sequence: usize) -> &[u64] {
+        &self.sequences[sequence].tokens
+    }
+
+    /// Logits for the last token of the most recent forward pass; empty if
+    /// that pass kept only the top-k candidates.
+    pub fn logits(&self) -> &[f64] {
+        let vocab_size = self.vocab_size();
+        match self.scratch.batch_len {
+            0 => &[],
+            batch_len => &self.scratch.logits[(batch_len - 1) * vocab_size..batch_len * vocab_size],
+        }
+    }
+
+    /// Logits for every token of the most recent forward pass, back to back.
+    pub fn batch_logits(&self) -> &[f64] {
+        &self.scratch.logits[..self.scratch.batch_len * self.vocab_size()]
+    }
+
+    /// Candidates of the most recent top-k pass: `min(k, vocab_size)` per
+    /// token, back to back, each token's best first with ties on the lower
+    /// id. Probabilities are the full-vocabulary softmax at temperature 1.
+    pub fn top_candidates(&self) -> &[GgufSamplingCandidate] {
+        &self.scratch.candidates[..self.scratch.candidate_lanes * self.scratch.candidate_count]
+    }
+
+    /// Log-sum-exp of every token's logits from the most recent top-k pass,
+    /// so `logit - log_sum_exp` is a candidate's log-probability.
+    pub fn top_log_sum_exp(&self) -> &[f64] {
+        &self.scratch.log_sum_exp[..self.scratch.candidate_lanes]
+    }
+
+    /// The paged KV pool behind this session.
+    pub fn kv_cache(&self) -> &GgufPagedKvCache {
+        &self.kv
+    }
+
+    /// Pool blocks backing the cached positions of sequence slot
+    /// `sequence`, in position order.
+    pub fn block_table(&self, sequence: usize) -> &[u32] {
+        &self.sequences[sequence].block_table
+    }
+
+    /// Forgets the cached context; the weights and scratch buffers are kept.
+    pub fn reset(&mut self) {
+        self.truncate(0);
+    }
+
+    /// Rolls the cache back to its first `length` tokens and returns blocks no
+    /// longer needed to the pool. Evicted window positions cannot be
+    /// restored: rolling back past them keeps only the sinks.
+    pub fn truncate(&mut self, length: usize) {
+        self.truncate_sequence(0, length);
+    }
+
+    /// [`Self::truncate`] for sequence slot `sequence`.
+    pub fn truncate_sequence(&mut self, sequence: usize, length: usize) {
+        let state = &mut self.sequences[sequence];
+        let sinks = self.window.map_or(0, |window| window.sinks);
+        if length < sinks + state.evicted {
+            state.evicted = 0;
+            state.tokens.truncate(length.min(sinks));
+        } else {
+            state.tokens.truncate(length - state.evicted);
+        }
+        let keep = self.kv.blocks_for(self.cached_row_count(sequence));
+        let state = &mut self.sequences[sequence];
+        if keep < state.block_table.len() {
+            for block in state.block_table.drain(keep..) {
+                self.kv.release(block);
+            }
+        }
+    }
+
+    /// Shares the cached context of slot `source` with the empty slot
+    /// `target`. Only the block table is copied, with one more reference on
+    /// every block; a block is copied later, by whichever slot first writes
+    /// into it while it is still shared.
+    pub fn fork_sequence(&mut self, source: usize, target: usize) -> Result<(), GgufError> {
+        if source == target
+            || source >= self.sequences.len()
+            || target >= self.sequences.len()
+            || !self.sequences[target].tokens.is_empty()
+        {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session fork slots".to_string(),
+            ));
+        }
+        for index in 0..self.sequences[source].block_table.len() {
+            let block = self.sequences[source].block_table[index];
+            self.kv.retain(block);
+            self.sequences[target].block_table.push(block);
+        }
+        for index in 0..self.sequences[source].tokens.len() {
+            let token = self.sequences[source].tokens[index];
+            self.sequences[target].tokens.push(token);
+        }
+        self.sequences[target].evicted = self.sequences[source].evicted;
+        Ok(())
+    }
+
+    /// Writes the cached context of slot 0 (tokens, KV rows, the logits of
+    /// the latest pass) and optionally `sampler`'s options and draw state to
+    /// `path`, tagged with [`Self::model_hash`].
+    pub fn save_snapshot(
+        &self,
+        path: &str,
+        sampler: Option<&GgufSampler>,
+    ) -> Result<(), GgufError> {
+        let state = &self.sequences[0];
+        let row_count = self.cached_row_count(0);
+        let logits = if self.scratch.batch_len > 0 {
+            self.logits()
+        } else {
+            &[]
+        };
+        let header = SnapshotHeader {
+            model_hash: self.model_hash,
+            layer_count: self.layers.len(),
+            kv_length: self.plan.heads.kv_length(),
+            attention_sinks: self.window.map_or(0, |window| window.sinks),
+            attention_window: self.window.map_or(0, |window| window.window),
+            ring_rows: self.window.map_or(0, |window| window.ring),
+            evicted: state.evicted,
+            token_count: state.tokens.len(),
+            row_count,
+            logit_count: logits.len(),
+            sampler: sampler.map(|sampler| (sampler.options().clone(), sampler.rng_state())),
+        };
+        let mut writer = BufWriter::new(File::create(path)?);
+        writer.write_all(&header.encode())?;
+        for token in &state.tokens {
+            writer.write_all(&token.to_le_bytes())?;
+        }
+        for logit in logits {
+            writer.write_all(&logit.to_le_bytes())?;
+        }
+        for layer_index in 0..self.layers.len() {
+            for (key, value) in paged_kv_rows(&self.kv, &state.block_table, layer_index, row_count)
+            {
+                for value in key.iter().chain(value) {
+                    writer.write_all(&value.to_le_bytes())?;
+                }
+            }
+        }
+        writer.flush()?;
+        Ok(())
+    }
+
+    /// Replaces the context of slot 0 with a snapshot from
+    /// [`Self::save_snapshot`], copying the file straight into the KV pool
+    /// without a forward pass. [`Self::logits`] then returns the saved
+    /// logits, so decoding continues exactly where the saved session was.
+    /// Returns the saved sampler, if any, resuming its draw stream.
+    pub fn restore_snapshot(&mut self, path: &str) -> Result<Option<GgufSampler>, GgufError> {
+        let file = MappedFile::read(path)?;
+        let bytes = file.bytes();
+        let snapshot = SnapshotHeader::decode(bytes)?;
+        if snapshot.model_hash != self.model_hash {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session snapshot model hash".to_string(),
+            ));
+        }
+        let window = self.window.map_or((0, 0, 0), |window| {
+            (window.sinks, window.window, window.ring)
+        });
+        let cached_rows = match self.window {
+            Some(window) if snapshot.evicted > 0 => window.sinks + window.ring,
+            _ => snapshot.token_count,
+        };
+        if snapshot.layer_count != self.layers.len()
+            || snapshot.kv_length != self.plan.heads.kv_length()
+            || (
+                snapshot.attention_sinks,
+                snapshot.attention_window,
+                snapshot.ring_rows,
+            ) != window
+            || snapshot.row_count != cached_rows
+            || match self.window {
+                Some(window) => snapshot.token_count > window.sinks + window.ring,
+                None => snapshot.evicted > 0 || snapshot.token_count > self.options.max_context,
+            }
+            || (snapshot.logit_count != 0 && snapshot.logit_count != self.vocab_size())
+        {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session snapshot geometry".to_string(),
+            ));
+        }
+        let sampler = match snapshot.sampler.clone() {
+            Some((options, rng_state)) => {
+                let mut sampler = GgufSampler::new(options)?;
+                sampler.set_rng_state(rng_state);
+                Some(sampler)
+            }
+            None => None,
+        };
+
+        self.reset();
+        if let Err(error) = self.reserve_rows(0, 0..snapshot.row_count) {
+            self.reset();
+            return Err(error);
+        }
+        let (tokens_start, logits_start, kv_start) = snapshot.sections();
+        let kv_length = snapshot.kv_length;
+        let block_tokens = self.kv.block_tokens();
+        let mut rows = bytes[kv_start..].chunks_exact(2 * kv_length * 4);
+        for layer_index in 0..self.layers.len() {
+            for row in 0..snapshot.row_count {
+                let row_bytes = rows.next().expect("snapshot KV row");
+                let (key, value) = self.kv.rows_mut(
+                    self.sequences[0].block_table[row / block_tokens],
+                    layer_index,
+                    row % block_tokens,
+                );
+                read_f32s_into(&row_bytes[..kv_length * 4], key);
+                read_f32s_into(&row_bytes[kv_length * 4..], value);
+            }
+        }
+        let state = &mut self.sequences[0];
+        state
+            .tokens
+            .extend(read_u64s(&bytes[tokens_start..logits_start]));
+        state.evicted = snapshot.evicted;
+        read_f64s_into(
+            &bytes[logits_start..kv_start],
+            &mut self.scratch.logits[..snapshot.logit_count],
+        );
+        self.scratch.batch_len = usize::from(snapshot.logit_count > 0);
+        Ok(sampler)
+    }
+
+    /// Cache rows of slot `sequence` that hold live KV.
+    fn cached_row_count(&self, sequence: usize) -> usize {
+        let state = &self.sequences[sequence];
+        match self.window {
+            Some(window) if state.evicted > 0 => window.sinks + window.ring,
+            _ => state.tokens.len(),
+        }
+    }
+
+    /// Cache row holding absolute position `position`.
+    fn cache_row(&self, position: usize) -> usize {
+        match self.window {
+            Some(window) => window.row(position),
+            None => position,
+        }
+    }
+
+    /// How many more tokens slot `sequence` accepts.
+    fn remaining_context(&self, sequence: usize) -> usize {
+        match self.window {
+            Some(_) => usize::MAX,
+            None => self.options.max_context - self.sequences[sequence].tokens.len(),
+        }
+    }
+
+    /// Makes sure the cache rows of `positions` exist in the block table of
+    /// `sequence` and belong to it alone, copying blocks still shared with a
+    /// fork.
+    fn reserve_rows(
+        &mut self,
+        sequence: usize,
+        positions: std::ops::Range<usize>,
+    ) -> Result<(), GgufError> {
+        for position in positions {
+            let block_index = self.cache_row(position) / self.kv.block_tokens();
+            let state = &mut self.sequences[sequence];
+            while state.block_table.len() <= block_index {
+                state.block_table.push(self.kv.allocate()?);
+            }
+            let block = state.block_table[block_index];
+            if self.kv.ref_count(block) > 1 {
+                let copy = self.kv.allocate()?;
+                self.kv.copy_block(block, copy);
+                self.kv.release(block);
+                state.block_table[block_index] = copy;
+            }
+        }
+        Ok(())
+    }
+
+    /// Runs one token through every layer at the next cache position and
+    /// returns the output-head logits. Once the session is built this does
+    /// not allocate.
+    pub fn decode_step(&mut self, token: u64) -> Result<&[f64], GgufError> {
+        self.forward(&[(0, &[token])], self.layers.len(), OutputHead::Logits)?;
+        Ok(self.logits())
+    }
+
+    /// [`Self::decode_step`] that keeps only the `k` most likely next tokens.
+    /// The vocabulary is split across threads, each tracking its own running
+    /// top-k and log-sum-exp, so the full logits are neither stored nor
+    /// sorted. See [`Self::top_candidates`].
+    pub fn decode_step_top_k(
+        &mut self,
+        token: u64,
+        k: usize,
+    ) -> Result<&[GgufSamplingCandidate], GgufError> {
+        self.decode_sequences_top_k(&[(0, &[token])], k)
+    }
+
+    /// Runs up to `max_batch_tokens` tokens at consecutive positions in one
+    /// pass, reading every weight row once for the whole batch. Returns one
+    /// row of logits per token, back to back.
+    pub fn decode_batch(&mut self, tokens: &[u64]) -> Result<&[f64], GgufError> {
+        self.decode_sequences(&[(0, tokens)])
+    }
+
+    /// Advances several sequence slots in one batched pass. Each segment
+    /// names a distinct slot and the tokens to append to it; segments may
+    /// differ in length, so prompt chunks and single decode tokens can share
+    /// a pass. Returns one row of logits per token, in segment order.
+    pub fn decode_sequences(&mut self, segments: &[(usize, &[u64])]) -> Result<&[f64], GgufError> {
+        self.forward(segments, self.layers.len(), OutputHead::Logits)?;
+        Ok(self.batch_logits())
+    }
+
+    /// [`Self::decode_sequences`] with the top-k output head of
+    /// [`Self::decode_step_top_k`]; returns the candidates of every token.
+    pub fn decode_sequences_top_k(
+        &mut self,
+        segments: &[(usize, &[u64])],
+        k: usize,
+    ) -> Result<&[GgufSamplingCandidate], GgufError> {
+        if k == 0 {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session top-k".to_string(),
+            ));
+        }
+        self.forward(segments, self.layers.len(), OutputHead::TopK(k))?;
+        Ok(self.top_candidates())
+    }
+
+    /// Feeds `tokens` through the session in batched chunks and returns the
+    /// logits after the last one.
+    pub fn prefill(&mut self, tokens: &[u64]) -> Result<&[f64], GgufError> {
+        if tokens.is_empty() {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session prefill input".to_string(),
+            ));
+        }
+        self.prefill_with_head(tokens, OutputHead::Logits)?;
+        Ok(self.logits())
+    }
+
+    /// Feeds `tokens` in batched chunks; only the last chunk runs `head`.
+    fn prefill_with_head(&mut self, tokens: &[u64], head: OutputHead) -> Result<(), GgufError> {
+        let chunk_count = tokens.len().div_ceil(self.options.max_batch_tokens);
+        for (index, chunk) in tokens.chunks(self.options.max_batch_tokens).enumerate() {
+            let chunk_head = if index + 1 == chunk_count {
+                head
+            } else {
+                OutputHead::Skip
+            };
+            self.forward(&[(0, chunk)], self.layers.len(), chunk_head)?;
+        }
+        Ok(())
+    }
+
+    /// Candidates and log-sum-exp of the last token of the most recent
+    /// top-k pass.
+    fn last_top_candidates(&self) -> (&[GgufSamplingCandidate], f64) {
+        let lane = self.scratch.candidate_lanes - 1;
+        let count = self.scratch.candidate_count;
+        (
+            &self.scratch.candidates[lane * count..(lane + 1) * count],
+            self.scratch.log_sum_exp[lane],
+        )
+    }
+
+    /// Resets the session and prefills `tokens`, restoring the longest prefix
+    /// held by `cache` instead of recomputing it. Whole blocks computed here
+    /// are added to the cache for later requests. Logits match a plain
+    /// `prefill`. A cache must only be shared by sessions over the same model
+    /// and layer range.
+    pub fn prefill_with_prefix_cache(
+        &mut self,
+        cache: &mut GgufPrefixCache,
+        tokens: &[u64],
+    ) -> Result<&[f64], GgufError> {
+        let cached_rows = match self.window {
+            Some(window) => window.sinks + window.ring,
+            None => self.options.max_context,
+        };
+        if tokens.is_empty() || tokens.len() > cached_rows {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session prefill input".to_string(),
+            ));
+        }
+        let kv_length = self.plan.heads.kv_length();
+        cache.check_geometry(self.model_hash, self.layers.len(), kv_length)?;
+        self.reset();
+
+        // The last token is always recomputed so its logits are available.
+        let block_tokens = cache.block_tokens();
+        let block_values = block_tokens * kv_length;
+        let reusable_tokens = (tokens.len() - 1) / block_tokens * block_tokens;
+        let mut path = cache.acquire(tokens, reusable_tokens);
+        let reused_tokens = path.len() * block_tokens;
+        if let Err(error) = self.reserve_rows(0, 0..reused_tokens) {
+            self.reset();
+            cache.release(&path);
+            return Err(error);
+        }
+        for (block_index, node_index) in path.iter().enumerate() {
+            let (keys, values) = cache.block(*node_index);
+            for (layer_index, (layer_keys, layer_values)) in keys
+                .chunks_exact(block_values)
+                .zip(values.chunks_exact(block_values))
+                .enumerate()
+            {
+                for (offset, (key, value)) in layer_keys
+                    .chunks_exact(kv_length)
+                    .zip(layer_values.chunks_exact(kv_length))
+                    .enumerate()
+                {
+                    let position = block_index * block_tokens + offset;
+                    let (key_row, value_row) = self.kv.rows_mut(
+                        self.sequences[0].block_table[position / self.kv.block_tokens()],
+                        layer_index,
+                        position % self.kv.block_tokens(),
+                    );
+                    key_row.copy_from_slice(key);
+                    value_row.copy_from_slice(value);
+                }
+            }
+        }
+        self.sequences[0]
+            .tokens
+            .extend_from_slice(&tokens[..reused_tokens]);
+
+        let prefilled = self.prefill(&tokens[reused_tokens..]).map(|_| ());
+        if prefilled.is_ok() {
+            for block_index in path.len()..tokens.len() / block_tokens {
+                let block_start = block_index * block_tokens;
+                let (kv, block_table) = (&self.kv, &self.sequences[0].block_table);
+                let inserted = cache.insert(
+                    path.last().copied(),
+                    &tokens[block_start..block_start + block_tokens],
+                    |keys, values| {
+                        for (layer_index, (layer_keys, layer_values)) in keys
+                            .chunks_exact_mut(block_values)
+                            .zip(values.chunks_exact_mut(block_values))
+                            .enumerate()
+                        {
+                            let rows = paged_kv_rows(
+                                kv,
+                                block_table,
+                                layer_index,
+                                block_start + block_tokens,
+                            )
+                            .skip(block_start);
+                            for ((key, value), (source_key, source_value)) in layer_keys
+                                .chunks_exact_mut(kv_length)
+                                .zip(layer_values.chunks_exact_mut(kv_length))
+                                .zip(rows)
+                            {
+                                key.copy_from_slice(source_key);
+                                value.copy_from_slice(source_value);
+                            }
+                        }
+                    },
+                );
+                match inserted {
+                    Some(node_index) => path.push(node_index),
+                    None => break,
+                }
+            }
+        }
+        cache.release(&path);
+        prefilled?;
+        Ok(self.logits())
+    }
+
+    /// Prefills `prompt` and greedily appends `max_new_tokens` tokens. Ties pick
+    /// the lowest token id, matching `read_multi_layer_retained_kv_runtime_decode_sample`.
+    pub fn generate_greedy(
+        &mut self,
+        prompt: &[u64],
+        max_new_tokens: usize,
+    ) -> Result<Vec<u64>, GgufError> {
+        let mut generated = Vec::with_capacity(max_new_tokens);
+        self.prefill_with_head(prompt, OutputHead::TopK(1))?;
+        let mut token = self.last_top_candidates().0[0].token_id;
+        for step_index in 0..max_new_tokens {
+            generated.push(token);
+            if step_index + 1 < max_new_tokens {
+                token = self.decode_step_top_k(token, 1)?[0].token_id;
+            }
+        }
+        Ok(generated)
+    }
+
+    /// Prefills `prompt` and appends `max_new_tokens` tokens drawn by
+    /// `sampler`, whose penalties see the prompt and everything generated.
+    pub fn generate_sampled(
+        &mut self,
+        prompt: &[u64],
+        max_new_tokens: usize,
+        sampler: &mut GgufSampler,
+    ) -> Result<Vec<u64>, GgufError> {
+        let mut generated = Vec::with_capacity(max_new_tokens);
+        self.prefill(prompt)?;
+        for step_index in 0..max_new_tokens {
+            let token = sampler.sample(self.logits(), self.tokens())?;
+            generated.push(token);
+            if step_index + 1 < max_new_tokens {
+                self.decode_step(token)?;
+            }
+        }
+        Ok(generated)
+    }
+
+    /// Greedy decoding with layer-skip self-speculation: the first
+    /// `draft_layer_count` layers plus the output head draft up to
+    /// `draft_length` tokens, then the full stack verifies the pending token
+    /// and the whole draft in one batched pass. The longest draft prefix that
+    /// matches the full model's argmax is kept, followed by the full model's
+    /// own next token, so the output equals [`Self::generate_greedy`].
+    pub fn generate_speculative(
+        &mut self,
+        prompt: &[u64],
+        max_new_tokens: usize,
+        draft_layer_count: usize,
+        draft_length: usize,
+    ) -> Result<GgufSpeculativeDecodeSample, GgufError> {
+        if draft_layer_count == 0 || draft_layer_count > self.layers.len() {
+            return Err(GgufError::InvalidTensorRange(
+                "speculative draft layer count".to_string(),
+            ));
+        }
+        let mut generated = Vec::with_capacity(max_new_tokens);
+        self.prefill_with_head(prompt, OutputHead::TopK(1))?;
+        let mut pending = self.last_top_candidates().0[0].token_id;
+        let started = Instant::now();
+        let mut verify_tokens = Vec::with_capacity(self.options.max_batch_tokens);
+        let mut verify_pass_count = 0usize;
+        let mut drafted_token_count = 0usize;
+        let mut accepted_token_count = 0usize;
+        if max_new_tokens > 0 {
+            generated.push(pending);
+        }
+
+        while generated.len() < max_new_tokens {
+            let base = self.position();
+            let draft_budget = (max_new_tokens - generated.len() - 1)
+                .min(self.options.max_batch_tokens - 1)
+                .min(self.remaining_context(0).saturating_sub(1));
+            let draft_count = draft_length.min(draft_budget);
+
+            verify_tokens.clear();
+            verify_tokens.push(pending);
+            for draft_index in 0..draft_count {
+                self.forward(
+                    &[(0, &verify_tokens[draft_index..=draft_index])],
+                    draft_layer_count,
+                    OutputHead::TopK(1),
+                )?;
+                verify_tokens.push(self.last_top_candidates().0[0].token_id);
+            }
+            self.truncate(base);
+
+            let best = self.decode_sequences_top_k(&[(0, &verify_tokens)], 1)?;
+            let mut accepted = 0usize;
+            while accepted < draft_count && best[accepted].token_id == verify_tokens[accepted + 1] {
+                accepted += 1;
+            }
+            pending = best[accepted].token_id;
+            self.truncate(base + accepted + 1);
+
+            generated.extend_from_slice(&verify_tokens[1..=accepted]);
+            generated.push(pending);
+            verify_pass_count += 1;
+            drafted_token_count += draft_count;
+            accepted_token_count += accepted;
+        }
+
+        let decode_seconds = started.elapsed().as_secs_f64();
+        Ok(GgufSpeculativeDecodeSample {
+            draft_layer_count,
+            draft_length,
+            verify_pass_count,
+            drafted_token_count,
+            accepted_token_count,
+            acceptance_rate: if drafted_token_count > 0 {
+                accepted_token_count as f64 / drafted_token_count as f64
+            } else {
+                0.0
+            },
+            decode_seconds,
+            effective_tokens_per_second: if decode_seconds > 0.0 {
+                generated.len() as f64 / decode_seconds
+            } else {
+                0.0
+            },
+            generated_token_ids: generated,
+        })
+    }
+
+    /// Prefills `prompt` once and decodes `branch_count` continuations of it
+    /// in slots `0..branch_count`, which share the prompt's KV blocks
+    /// copy-on-write and advance together in one batched pass per token.
+    /// `choose(branch, logits)` picks each branch's next token.
+    pub fn generate_parallel(
+        &mut self,
+        prompt: &[u64],
+        branch_count: usize,
+        max_new_tokens: usize,
+        mut choose: impl FnMut(usize, &[f64]) -> u64,
+    ) -> Result<Vec<Vec<u64>>, GgufError> {
+        self.clear_branch_slots(branch_count)?;
+        let mut generated = vec![Vec::with_capacity(max_new_tokens); branch_count];
+        let logits = self.prefill(prompt)?;
+        if max_new_tokens == 0 {
+            return Ok(generated);
+        }
+        for (branch, tokens) in generated.iter_mut().enumerate() {
+            tokens.push(choose(branch, logits));
+        }
+        for branch in 1..branch_count {
+            self.fork_sequence(0, branch)?;
+        }
+
+        let vocab_size = self.vocab_size();
+        while generated[0].len() < max_new_tokens {
+            let segments = generated
+                .iter()
+                .enumerate()
+                .map(|(branch, tokens)| (branch, &tokens[tokens.len() - 1..]))
+                .collect::<Vec<_>>();
+            let logits = self.decode_sequences(&segments)?;
+            for (branch, (tokens, logits)) in generated
+                .iter_mut()
+                .zip(logits.chunks_exact(vocab_size))
+                .enumerate()
+            {
+                tokens.push(choose(branch, logits));
+            }
+        }
+        Ok(generated)
+    }
+
+    /// Beam search of width `beam_width` over `max_new_tokens` tokens. The
+    /// prompt is prefilled once; beam `i` lives in slot `i`, all beams are
+    /// scored in one batched pass per token, and a beam that several
+    /// survivors extend is forked copy-on-write rather than recomputed.
+    /// Hypotheses come back best first; ties keep the lower beam and token.
+    pub fn generate_beam_search(
+        &mut self,
+        prompt: &[u64],
+        beam_width: usize,
+        max_new_tokens: usize,
+    ) -> Result<Vec<GgufBeamHypothesis>, GgufError> {
+        self.clear_branch_slots(beam_width)?;
+        self.prefill_with_head(prompt, OutputHead::TopK(beam_width))?;
+        if max_new_tokens == 0 {
+            return Ok(vec![GgufBeamHypothesis {
+                token_ids: Vec::new(),
+                log_probability: 0.0,
+            }]);
+        }
+        let mut candidates = Vec::with_capacity(beam_width + 1);
+        let (top, normalizer) = self.last_top_candidates();
+        push_beam_candidates(&mut candidates, beam_width, 0, 0.0, top, normalizer);
+        let mut beams = candidates
+            .iter()
+            .map(|candidate| GgufBeamHypothesis {
+                token_ids: vec![candidate.token],
+                log_probability: candidate.log_probability,
+            })
+            .collect::<Vec<_>>();
+        for slot in 1..beams.len() {
+            self.fork_sequence(0, slot)?;
+        }
+
+        while beams[0].token_ids.len() < max_new_tokens {
+            let segments = beams
+                .iter()
+                .enumerate()
+                .map(|(slot, beam)| (slot, &beam.token_ids[beam.token_ids.len() - 1..]))
+                .collect::<Vec<_>>();
+            // A beam's best `beam_width` children are the only ones that can
+            // survive, so the head never needs more than that per beam.
+            let per_beam = self.decode_sequences_top_k(&segments, beam_width)?.len() / beams.len();
+            candidates.clear();
+            for (slot, ((beam, top), log_sum_exp)) in beams
+                .iter()
+                .zip(self.top_candidates().chunks_exact(per_beam))
+                .zip(self.top_log_sum_exp())
+                .enumerate()
+            {
+                push_beam_candidates(
+                    &mut candidates,
+                    beam_width,
+                    slot,
+                    beam.log_probability,
+                    top,
+                    *log_sum_exp,
+                );
+            }
+
+            // Each surviving parent keeps its slot for its best child; other
+            // children fork into the slots of beams that were dropped.
+            let mut slots = vec![None; candidates.len()];
+            let mut claimed = vec![false; candidates.len()];
+            for (slot, candidate) in slots.iter_mut().zip(&candidates) {
+                if !claimed[candidate.parent] {
+                    claimed[candidate.parent] = true;
+                    *slot = Some(candidate.parent);
+                }
+            }
+            let mut spare_slots = (0..candidates.len())
+                .filter(|slot| !claimed[*slot])
+                .collect::<Vec<_>>();
+            for slot in &spare_slots {
+                self.truncate_sequence(*slot, 0);
+            }
+            let mut next = vec![None; candidates.len()];
+            for (slot, candidate) in slots.into_iter().zip(&candidates) {
+                let slot = match slot {
+                    Some(slot) => slot,
+                    None => {
+                        let slot = spare_slots.pop().expect("spare beam slot");
+                        self.fork_sequence(candidate.parent, slot)?;
+                        slot
+                    }
+                };
+                let mut token_ids = beams[candidate.parent].token_ids.clone();
+                token_ids.push(candidate.token);
+                next[slot] = Some(GgufBeamHypothesis {
+                    token_ids,
+                    log_probability: candidate.log_probability,
+                });
+            }
+            beams = next
+                .into_iter()
+                .map(|beam| beam.expect("every beam slot is filled"))
+                .collect();
+        }
+        beams.sort_by(|left, right| right.log_probability.total_cmp(&left.log_probability));
+        Ok(beams)
+    }
+
+    /// Checks that `branch_count` slots fit in one batched pass and empties
+    /// them.
+    fn clear_branch_slots(&mut self, branch_count: usize) -> Result<(), GgufError> {
+        if branch_count == 0
+            || branch_count > self.sequences.len()
+            || branch_count > self.options.max_batch_tokens
+        {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session branch count".to_string(),
+            ));
+        }
+        for slot in 0..branch_count {
+            self.truncate_sequence(slot, 0);
+        }
+        Ok(())
+    }
+
+    /// Appends each segment's tokens to its sequence slot, pushing every
+    /// token through the first `layer_count` layers in one pass, and runs the
+    /// output head for every token as `head` asks.
+    fn forward(
+        &mut self,
+        segments: &[(usize, &[u64])],
+        layer_count: usize,
+        head: OutputHead,
+    ) -> Result<(), GgufError> {
+        let batch = segments
+            .iter()
+            .map(|(_, tokens)| tokens.len())
+            .sum::<usize>();
+        if batch == 0 || batch > self.options.max_batch_tokens {
+            return Err(GgufError::InvalidTensorRange(
+                "decode session batch size".to_string(),
+            ));
+        }
+        for (segment_index, (sequence, tokens)) in segments.iter().enumerate() {
+            if *sequence >= self.sequences.len()
+                || tokens.is_empty()
+                || segments[..segment_index]
+                    .iter()
+                    .any(|(earlier, _)| earlier == sequence)
+            {
+                return Err(GgufError::InvalidTensorRange(
+                    "decode session sequence segments".to_string(),
+                ));
+            }
+            if tokens.len() > self.remaining_context(*sequence) {
+                return Err(GgufError::InvalidTensorRange(
+                    "decode session context is full".to_string(),
+                ));
+            }
+            if tokens
+                .iter()
+                .any(|token| *token >= self.plan.embedding.row_count as u64)
+            {
+                return Err(GgufError::InvalidTensorRange(
+                    self.options.input_tensor_name.clone(),
+                ));
+            }
+        }
+        for (segment_index, (sequence, tokens)) in segments.iter().enumerate() {
+            let start = self.sequence_position(*sequence);
+            if let Err(error) = self.reserve_rows(*sequence, start..start + tokens.len()) {
+                for (sequence, _) in &segments[..=segment_index] {
+                    self.truncate_sequence(*sequence, self.sequence_position(*sequence));
+                }
+                return Err(error);
+            }
+        }
+
+        let heads = self.plan.heads;
+        let block_tokens = self.kv.block_tokens();
+        let embedding_length = self.plan.embedding.column_count;
+        let query_length = heads.query_length();
+        let kv_length = heads.kv_length();
+        let qkv_length = query_length + 2 * kv_length;
+        let window = self.window;
+        let rope = &self.rope;
+        let scratch = &mut self.scratch;
+        let state = &mut scratch.state[..batch * embedding_length];
+        let normalized = &mut scratch.normalized[..batch * embedding_length];
+        let attention_input = &mut scratch.attention_input[..batch * query_length];
+        let sink_queries = &mut scratch.sink_queries[..batch * query_length];
+
+        // `(sequence, position)` of every lane, in segment order.
+        let sequences = &self.sequences;
+        let lanes = || {
+            segments.iter().flat_map(|(sequence, tokens)| {
+                let start = sequences[*sequence].evicted + sequences[*sequence].tokens.len();
+                (start..start + tokens.len()).map(move |position| (*sequence, position))
+            })
+        };
+
+        let row_nbytes = self.plan.embedding.row_nbytes;
+        let tokens = segments.iter().flat_map(|(_, tokens)| tokens.iter());
+        for (token, token_state) in tokens.zip(state.chunks_exact_mut(embedding_length)) {
+            let row_start = *token as usize * row_nbytes;
+            decode_quantized_row_into(
+                self.plan.embedding.tensor_type,
+                &self.embedding_bytes[row_start..row_start + row_nbytes],
+                token_state,
+            );
+        }
+
+        for (layer_index, (layer, weights)) in self.plan.layers[..layer_count]
+            .iter()
+            .zip(&self.layers)
+            .enumerate()
+        {
+            rms_normalize_rows(state, &layer.attn_norm, self.plan.rms_epsilon, normalized);
+            let qkv_by_row = &mut scratch.by_row[..batch * qkv_length];
+            project_quantized_rows_batch_into(
+                &layer.qkv,
+                &weights.qkv_bytes,
+                normalized,
+                batch,
+                qkv_by_row,
+                |sum| sum as f32,
+            );
+            let qkv = &mut scratch.qkv[..batch * qkv_length];
+            transpose_into(qkv_by_row, batch, qkv);
+            for (((sequence, position), token_qkv), sink_query) in lanes()
+                .zip(qkv.chunks_exact_mut(qkv_length))
+                .zip(sink_queries.chunks_exact_mut(query_length))
+            {
+                let (query, key_value) = token_qkv.split_at_mut(query_length);
+                let (key, value) = key_value.split_at_mut(kv_length);
+                let row = match window {
+                    Some(window) => {
+                        let compacted = window.compacted_position(position);
+                        if compacted != position {
+                            sink_query.copy_from_slice(query);
+                            let (cos, sin) = rope.angles(
+                                compacted,
+                                &mut scratch.rope_cos,
+                                &mut scratch.rope_sin,
+                            );
+                            apply_rope_into(sink_query, heads.head_dimension, cos, sin);
+                        }
+                        window.row(position)
+                    }
+                    None => position,
+                };
+                let (cos, sin) =
+                    rope.angles(position, &mut scratch.rope_cos, &mut scratch.rope_sin);
+                apply_rope_into(query, heads.head_dimension, cos, sin);
+                apply_rope_into(key, heads.head_dimension, cos, sin);
+                let (key_row, value_row) = self.kv.rows_mut(
+                    sequences[sequence].block_table[row / block_tokens],
+                    layer_index,
+                    row % block_tokens,
+                );
+                key_row.copy_from_slice(key);
+                value_row.copy_from_slice(value);
+            }
+            if let Some(window) = window {
+                for ((((sequence, position), token_qkv), sink_query), output) in lanes()
+                    .zip(qkv.chunks_exact(qkv_length))
+                    .zip(sink_queries.chunks_exact(query_length))
+                    .zip(attention_input.chunks_exact_mut(query_length))
+                {
+                    let query = &token_qkv[..query_length];
+                    let mut spans = [(query, 0, 0); 3];
+                    let span_count = window_spans(
+                        window,
+                        position,
+                        sequences[sequence].evicted,
+                        query,
+                        sink_query,
+                        &mut spans,
+                    );
+                    let key_count = spans[..span_count]
+                        .iter()
+                        .map(|(_, _, count)| count)
+                        .sum::<usize>();
+                    attend_into(
+                        heads,
+                        &spans[..span_count],
+                        &self.kv,
+                        &sequences[sequence].block_table,
+                        layer_index,
+                        &mut scratch.scores[..key_count],
+                        output,
+                    );
+                }
+            } else {
+                // Each segment's lanes are consecutive positions of one
+                // sequence, so they attend as one tile of queries, with KV
+                // blocks as key tiles.
+                let mut first_lane = 0;
+                for (sequence, tokens) in segments {
+                    let lanes = first_lane..first_lane + tokens.len();
+                    let block_table = &sequences[*sequence].block_table;
+                    let kv = &self.kv;
+                    causal_attention_into(
+                        heads,
+                        &qkv[lanes.start * qkv_length..lanes.end * qkv_length],
+                        qkv_length,
+                        sequences[*sequence].tokens.len(),
+                        block_tokens,
+                        |tile| kv.layer_rows(block_table[tile], layer_index),
+                        &mut scratch.attention_workspace,
+                        &mut attention_input[lanes.start * query_length..lanes.end * query_length],
+                    );
+                    first_lane = lanes.end;
+                }
+            }
+
+            let output_by_row = &mut scratch.by_row[..batch * embedding_length];
+            project_quantized_rows_batch_into(
+                &[layer.attn_output],
+                &weights.attn_output_bytes,
+                attention_input,
+                batch,
+                output_by_row,
+                |sum| sum as f32,
+            );
+            add_transposed_into(state, output_by_row, batch);
+
+            rms_normalize_rows(state, &layer.ffn_norm, self.plan.rms_epsilon, normalized);
+            let feed_forward_length = layer.gate.row_count;
+            let ffn_rows = &mut scratch.ffn_rows[..batch * feed_forward_length];
+            swiglu_rows_batch_into(
+                layer.gate,
+                layer.up,
+                &weights.gate_up_bytes,
+                normalized,
+                batch,
+                ffn_rows,
+            );
+            let activated = &mut scratch.activated[..batch * feed_forward_length];
+            for (row_index, row_lanes) in ffn_rows.chunks_exact(batch).enumerate() {
+                for (lane, row) in row_lanes.iter().enumerate() {
+                    activated[lane * feed_forward_length + row_index] = row.activated;
+                }
+            }
+            project_quantized_rows_batch_into(
+                &[layer.down],
+                &weights.down_bytes,
+                activated,
+                batch,
+                output_by_row,
+                |sum| sum as f32,
+            );
+            add_transposed_into(state, output_by_row, batch);
+        }
+
+        rms_normalize_rows(
+            state,
+            &self.plan.final_norm,
+            self.plan.rms_epsilon,
+            normalized,
+        );
+        let vocab_size = self.plan.output.row_count;
+        scratch.batch_len = 0;
+        scratch.candidate_lanes = 0;
+        match head {
+            OutputHead::Logits => {
+                let logits_by_row = &mut scratch.logits_by_row[..batch * vocab_size];
+                project_quantized_rows_batch_into(
+                    &[self.plan.output],
+                    &self.output_bytes,
+                    normalized,
+                    batch,
+                    logits_by_row,
+                    |sum| sum,
+                );
+                transpose_into(
+                    logits_by_row,
+                    batch,
+                    &mut scratch.logits[..batch * vocab_size],
+                );
+                scratch.batch_len = batch;
+            }
+            OutputHead::TopK(k) => {
+                let k = k.min(vocab_size);
+                project_quantized_rows_top_k_into(
+                    self.plan.output,
+                    &self.output_bytes,
+                    normalized,
+                    batch,
+                    k,
+                    &mut scratch.head_shards,
+                );
+                scratch.candidates.clear();
+                for (summary, log_sum_exp) in scratch.head_shards[..batch]
+                    .iter()
+                    .zip(scratch.log_sum_exp.iter_mut())
+                {
+                    *log_sum_exp = summary.log_sum_exp();
+                    scratch
+                        .candidates
+                        .extend(
+                            summary
+                                .top
+                                .iter()
+                                .map(|(row, logit)| GgufSamplingCandidate {
+                                    token_id: *row as u64,
+                                    logit: *logit,
+                                    probability: (*logit - *log_sum_exp).exp(),
+                                }),
+                        );
+                }
+                scratch.candidate_lanes = batch;
+                scratch.candidate_count = k;
+            }
+            OutputHead::Skip => {}
+        }
+        for (sequence, tokens) in segments {
+            let state = &mut self.sequences[*sequence];
+            if let Some(window) = self.window {
+                let excess =
+                    (state.tokens.len() + tokens.len()).saturating_sub(window.sinks + window.ring);
+                // A pass never exceeds the ring, so the excess is all window.
+                if excess > 0 {
+                    state.tokens.drain(window.sinks..window.sinks + excess);
+                    state.evicted += excess;
+                }
+            }
+            state.tokens.extend_from_slice(tokens);
+        }
+        Ok(())
+    }
+}
+
+fn load_layer_weights(
+    header: &GgufHeader,
+    layer: &GgufLayerPlan,
+) -> Result<LayerWeights, GgufError> {
+    let mut qkv_bytes = Vec::new();
+    header.read_quantized_matrices(&layer.qkv, &mut qkv_bytes)?;
+    let mut attn_output_bytes = Vec::new();
+    header.read_quantized_matrices(&[layer.attn_output], &mut attn_output_bytes)?;
+    let mut gate_up_bytes = Vec::new();
+    header.read_quantized_matrices(&[layer.gate, layer.up], &mut gate_up_bytes)?;
+    let mut down_bytes = Vec::new();
+    header.read_quantized_matrices(&[layer.down], &mut down_bytes)?;
+    Ok(LayerWeights {
+        qkv_bytes,
+        attn_output_bytes,
+        gate_up_bytes,
+        down_bytes,
+    })
+}
+
+/// Same arithmetic as `rms_normalize_values`, applied to every row of
+/// `values` and written into `output`.
+fn rms_normalize_rows(values: &[f32], weights: &[f32], rms_epsilon: f32, output: &mut [f32]) {
+    for (row, output_row) in values
+        .chunks_exact(weights.len())
+        .zip(output.chunks_exact_mut(weights.len()))
+    {
+        let mean_square = row
+            .iter()
+            .map(|value| (*value as f64) * (*value as f64))
+            .sum::<f64>()
+            / row.len() as f64;
+        let rms = (mean_square + rms_epsilon as f64).sqrt();
+        for ((output, value), weight) in output_row.iter_mut().zip(row.iter()).zip(weights.iter()) {
+            *output = ((*value as f64) / rms * (*weight as f64)) as f32;
+        }
+    }
+}
+
+/// Rotates adjacent pairs of every head with precomputed angles, matching
+/// `apply_rope_to_projection` at the row's position.
+fn apply_rope_into(values: &mut [f32], head_dimension: usize, cos: &[f32], sin: &[f32]) {
+    for head in values.chunks_exact_mut(head_dimension) {
+        for ((pair, cos), sin) in head.chunks_exact_mut(2).zip(cos.iter()).zip(sin.iter()) {
+            let even = pair[0];
+            let odd = pair[1];
+            pair[0] = even * cos - odd * sin;
+            pair[1] = even * sin + odd * cos;
+        }
+    }
+}
+
+/// Fills `spans` with the sink rows and the (possibly wrapped) run of window
+/// rows a query at absolute `position` attends to, and returns how many
+/// spans are used. `evicted` is the sequence's count before this pass.
+fn window_spans<'a>(
+    window: KvWindow,
+    position: usize,
+    evicted: usize,
+    query: &'a [f32],
+    sink_query: &'a [f32],
+    spans: &mut [(&'a [f32], usize, usize); 3],
+) -> usize {
+    let sink_query = if window.compacted_position(position) == position {
+        query
+    } else {
+        sink_query
+    };
+    spans[0] = (sink_query, 0, (position + 1).min(window.sinks));
+    if position < window.sinks {
+        return 1;
+    }
+    let start = (position + 1)
+        .saturating_sub(window.window)
+        .max(window.sinks + evicted);
+    let (first, last) = (window.row(start), window.row(position));
+    if first <= last {
+        spans[1] = (query, first, last - first + 1);
+        2
+    } else {
+        spans[1] = (query, first, window.sinks + window.ring - first);
+        spans[2] = (query, window.sinks, last - window.sinks + 1);
+        3
+    }
+}
+
+/// Causal attention of one query over runs of cached rows of a sequence,
+/// read through its block table. Each span is `(query, first row, row
+/// count)`; spans may rotate the query differently, and all of them share
+/// one softmax over `scores`.
+fn attend_into(
+    heads: HeadLayout,
+    spans: &[(&[f32], usize, usize)],
+    kv: &GgufPagedKvCache,
+    block_table: &[u32],
+    layer_index: usize,
+    scores: &mut [f64],
+    output: &mut [f32],
+) {
+    let head_dimension = heads.head_dimension;
+    let value_repeat_factor = heads.head_count / heads.kv_head_count;
+    let scale = (head_dimension as f64).sqrt();
+    let span_rows = |(_, start, count): &(&[f32], usize, usize)| {
+        paged_kv_rows(kv, block_table, layer_index, start + count).skip(*start)
+    };
+    for (head_index, output_head) in output.chunks_exact_mut(head_dimension).enumerate() {
+        let head = head_index * head_dimension..(head_index + 1) * head_dimension;
+        let kv_offset = (head_index / value_repeat_factor) * head_dimension;
+        let mut span_scores = &mut scores[..];
+        for span in spans {
+            let query_head = &span.0[head.clone()];
+            let (current, rest) = span_scores.split_at_mut(span.2);
+            for (score, (key, _)) in current.iter_mut().zip(span_rows(span)) {
+                *score = query_head
+                    .iter()
+                    .zip(key[kv_offset..kv_offset + head_dimension].iter())
+                    .map(|(left, right)| (*left as f64) * (*right as f64))
+                    .sum::<f64>()
+                    / scale;
+            }
+            span_scores = rest;
+        }
+        softmax_in_place(scores);
+        for (dim, output) in output_head.iter_mut().enumerate() {
+            *output = scores
+                .iter()
+                .zip(spans.iter().flat_map(span_rows))
+                .map(|(weight, (_, value))| *weight * value[kv_offset + dim] as f64)
+                .sum::<f64>() as f32;
+        }
+    }
+}
+
+fn softmax_in_place(values: &mut [f64]) {
+    let max = values
+        .iter()
+        .copied()
+        .fold(f64::NEG_INFINITY, |left, right| left.max(right));
+    for value in values.iter_mut() {
+        *value = (*value - max).exp();
+    }
+    let sum = values.iter().sum::<f64>();
+    for value in values.iter_mut() {
+        *value /= sum;
+    }
+}
+
+/// `output[lane][row] = by_row[row][lane]` for `batch` lanes.
+fn transpose_into<T: Copy>(by_row: &[T], batch: usize, output: &mut [T]) {
+    let row_count = by_row.len() / batch;
+    for (row_index, row_lanes) in by_row.chunks_exact(batch).enumerate() {
+        for (lane, value) in row_lanes.iter().enumerate() {
+            output[lane * row_count + row_index] = *value;
+        }
+    }
+}
+
+/// `values[lane][row] += by_row[row][lane]` for `batch` lanes.
+fn add_transposed_into(values: &mut [f32], by_row: &[f32], batch: usize) {
+    let row_count = by_row.len() / batch;
+    for (row_index, row_lanes) in by_row.chunks_exact(batch).enumerate() {
+        for (lane, value) in row_lanes.iter().enumerate() {
+            values[lane * row_count + row_index] += *value;
+        }
+    }
+}
+
+/// Merges the extensions of beam `parent` into `candidates`, which keeps
+/// the best `width` seen so far in descending order. `top` holds the
+/// parent's best next tokens in head order and `normalizer` the
+/// log-sum-exp of all its logits. Earlier candidates win ties, so parents
+/// and tokens are preferred in ascending order.
+fn push_beam_candidates(
+    candidates: &mut Vec<BeamCandidate>,
+    width: usize,
+    parent: usize,
+    log_probability: f64,
+    top: &[GgufSamplingCandidate],
+    normalizer: f64,
+) {
+    for next in top {
+        let candidate = BeamCandidate {
+            parent,
+            token: next.token_id,
+            log_probability: log_probability + (next.logit - normalizer),
+        };
+        if candidates.len() == width
+            && !candidate
+                .log_probability
+                .total_cmp(&candidates[width - 1].log_probability)
+                .is_gt()
+        {
+            continue;
+        }
+        let index = candidates
+            .iter()
+            .position(|existing| {
+                candidate
+                    .log_probability
+                    .total_cmp(&existing.log_probability)
+                    .is_gt()
+            })
+            .unwrap_or(candidates.len());
+        candidates.insert(index, candidate);
+        candidates.truncate(width);
+    }
+}
+
+/// Index of the largest logit; ties resolve to the lowest index.
+pub(super) fn argmax_token(logits: &[f64]) -> u64 {
+    let mut best = 0usize;
+    for (index, logit) in logits.iter().enumerate().skip(1) {
+        if logit.total_cmp(&logits[best]).is_gt() {
+            best = index;
+        }
+    }
+    best as u64
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::aeronn::sampling::GgufSamplerOptions;
+    use crate::aeronn::test_support::write_synthetic_llama_gguf;
+    use crate::alloc_tracking::count_allocations;
+
+    fn log_sum_exp(logits: &[f64]) -> f64 {
+        let max = logits.iter().copied().fold(f64::NEG_INFINITY, f64::max);
+        max + logits
+            .iter()
+            .map(|logit| (*logit - max).exp())
+            .sum::<f64>()
+            .ln()
+    }
+
+    #[test]
+    fn greedy_session_matches_retained_kv_decoder() {
+        let path = write_synthetic_llama_gguf("session-greedy", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let prompt = [3u64, 17, 5, 9];
+        let retained = header
+            .read_multi_layer_retained_kv_runtime_decode_sample(
+                "token_embd.weight",
+                &prompt,
+                0,
+                2,
+                "output_norm.weight",
+                "output.weight",
+                1,
+                5,
+            )
+            .expect("retained decode");
+        let mut options = GgufDecodeSessionOptions::new(2, 16);
+        options.max_batch_tokens = 3;
+        let mut session = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let generated = session.generate_greedy(&prompt, 5).expect("session decode");
+
+        assert_eq!(generated, retained.generated_token_ids);
+        assert_eq!(session.position(), prompt.len() + 4);
+        let last_step = retained.steps.last().expect("retained steps");
+        assert!(session.logits().is_empty());
+        assert_eq!(
+            session.top_candidates()[0].token_id,
+            last_step.selected_token_id
+        );
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn batched_pass_matches_single_steps() {
+        let path = write_synthetic_llama_gguf("session-batch", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let tokens = [4u64, 11, 30, 2, 19];
+        let mut stepped = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 16))
+            .expect("build session");
+        let mut expected = Vec::new();
+        for token in tokens {
+            expected.extend_from_slice(stepped.decode_step(token).expect("decode step"));
+        }
+        let mut batched = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 16))
+            .expect("build session");
+        batched.decode_step(tokens[0]).expect("first step");
+        let vocab_size = batched.vocab_size();
+        let logits = batched.decode_batch(&tokens[1..]).expect("batched pass");
+
+        assert_eq!(logits, &expected[vocab_size..]);
+        assert_eq!(batched.tokens(), &tokens);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn top_k_head_matches_full_logits() {
+        let path = write_synthetic_llama_gguf("session-top-k", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let mut options = GgufDecodeSessionOptions::new(2, 32);
+        options.max_sequences = 2;
+        let mut full = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let mut top = GgufDecodeSession::new(&header, options).expect("build session");
+        let vocab_size = full.vocab_size();
+        let segments: [(usize, &[u64]); 2] = [(0, &[3, 17, 5]), (1, &[9, 30])];
+        for k in [1, 5, vocab_size + 3] {
+            full.reset();
+            top.reset();
+            let logits = full
+                .decode_sequences(&segments)
+                .expect("full head")
+                .to_vec();
+            let candidates = top
+                .decode_sequences_top_k(&segments, k)
+                .expect("top-k head")
+                .to_vec();
+            let kept = k.min(vocab_size);
+            assert_eq!(candidates.len(), 5 * kept);
+            assert!(top.batch_logits().is_empty());
+            for (lane, (logits, candidates)) in logits
+                .chunks_exact(vocab_size)
+                .zip(candidates.chunks_exact(kept))
+                .enumerate()
+            {
+                let mut order = (0..vocab_size).collect::<Vec<_>>();
+                order.sort_by(|left, right| logits[*right].total_cmp(&logits[*left]));
+                let expected_log_sum_exp = log_sum_exp(logits);
+                assert!((top.top_log_sum_exp()[lane] - expected_log_sum_exp).abs() < 1e-9);
+                for (candidate, row) in candidates.iter().zip(&order) {
+                    assert_eq!(candidate.token_id, *row as u64, "lane {lane}");
+                    assert_eq!(candidate.logit, logits[*row]);
+                    assert!(
+                        (candidate.probability - (logits[*row] - expected_log_sum_exp).exp()).abs()
+                            < 1e-12
+                    );
+                }
+            }
+        }
+        assert!(top.decode_step_top_k(1, 0).is_err());
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn speculative_decode_matches_greedy_output() {
+        let path = write_synthetic_llama_gguf("session-speculative", 3);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let prompt = [7u64, 1, 22];
+        let mut greedy = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(3, 32))
+            .expect("build session");
+        let expected = greedy.generate_greedy(&prompt, 9).expect("greedy decode");
+
+        let mut session = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(3, 32))
+            .expect("build session");
+        let shallow = session
+            .generate_speculative(&prompt, 9, 1, 3)
+            .expect("speculative decode");
+        assert_eq!(shallow.generated_token_ids, expected);
+        assert_eq!(session.tokens(), greedy.tokens());
+        assert!(shallow.accepted_token_count <= shallow.drafted_token_count);
+        assert_eq!(
+            shallow.verify_pass_count + shallow.accepted_token_count,
+            expected.len() - 1
+        );
+
+        session.reset();
+        let full_draft = session
+            .generate_speculative(&prompt, 9, 3, 3)
+            .expect("full-depth draft");
+        assert_eq!(full_draft.generated_token_ids, expected);
+        assert_eq!(full_draft.acceptance_rate, 1.0);
+        assert_eq!(full_draft.verify_pass_count, 2);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn prefix_cache_prefill_matches_plain_prefill() {
+        let path = write_synthetic_llama_gguf("session-prefix-cache", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let system_prompt = [5u64, 9, 13, 2, 8, 21, 1, 30, 4, 17];
+        let first_request = [&system_prompt[..], &[3, 6]].concat();
+        let second_request = [&system_prompt[..], &[11]].concat();
+        let mut plain = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let mut session = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let mut cache = GgufPrefixCache::new(4, 1 << 20);
+
+        for request in [&first_request, &second_request] {
+            plain.reset();
+            let expected = plain.prefill(request).expect("plain prefill").to_vec();
+            let logits = session
+                .prefill_with_prefix_cache(&mut cache, request)
+                .expect("cached prefill");
+            assert_eq!(logits, &expected[..]);
+            assert_eq!(session.tokens(), &request[..]);
+        }
+        plain.reset();
+        session.reset();
+        assert_eq!(
+            session
+                .prefill_with_prefix_cache(&mut cache, &second_request)
+                .map(argmax_token)
+                .expect("cached prefill"),
+            argmax_token(plain.prefill(&second_request).expect("plain prefill"))
+        );
+
+        let stats = cache.stats();
+        assert_eq!(stats.lookup_count, 3);
+        assert_eq!(stats.hit_count, 2);
+        assert_eq!(stats.reused_token_count, 16);
+        assert_eq!(stats.inserted_block_count, 3);
+        assert_eq!(
+            stats.requested_token_count,
+            (first_request.len() + 2 * second_request.len()) as u64
+        );
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn prefix_cache_rejects_a_same_shaped_model() {
+        let path = write_synthetic_llama_gguf("session-prefix-cache-owner", 2);
+        let other_path = write_synthetic_llama_gguf("session-prefix-cache-other", 3);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let other_header = GgufHeader::read(other_path.to_str().expect("utf8 temp path"))
+            .expect("read synthetic GGUF");
+        // Both sessions run two layers, so their KV caches have one shape.
+        let mut session = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let mut other = GgufDecodeSession::new(&other_header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        assert_ne!(other.model_hash(), session.model_hash());
+        let mut cache = GgufPrefixCache::new(4, 1 << 20);
+        let request = [5u64, 9, 13, 2, 8, 21, 1, 30, 4];
+
+        session
+            .prefill_with_prefix_cache(&mut cache, &request)
+            .expect("cached prefill");
+        assert!(matches!(
+            other.prefill_with_prefix_cache(&mut cache, &request),
+            Err(GgufError::InvalidTensorRange(_))
+        ));
+        assert!(other.tokens().is_empty());
+        assert_eq!(cache.stats().lookup_count, 1);
+        session.reset();
+        session
+            .prefill_with_prefix_cache(&mut cache, &request)
+            .expect("cached prefill for the owning model");
+        let _ = std::fs::remove_file(path);
+        let _ = std::fs::remove_file(other_path);
+    }
+
+    #[test]
+    fn steady_state_decode_step_does_not_allocate() {
+        let path = write_synthetic_llama_gguf("session-alloc", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let mut session = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 16))
+            .expect("build session");
+        session.prefill(&[1, 2, 3]).expect("prefill");
+        session.decode_step(4).expect("warm-up step");
+
+        for token in [5u64, 6, 7] {
+            let (logit_count, allocations) =
+                count_allocations(|| session.decode_step(token).map(|logits| logits.len()));
+            assert_eq!(logit_count.expect("decode step"), session.vocab_size());
+            assert_eq!(allocations, 0, "decode step for token {token} allocated");
+        }
+        session.decode_step_top_k(8, 4).expect("warm-up top-k step");
+        for token in [9u64, 10] {
+            let (candidate_count, allocations) = count_allocations(|| {
+                session
+                    .decode_step_top_k(token, 4)
+                    .map(|candidates| candidates.len())
+            });
+            assert_eq!(candidate_count.expect("top-k step"), 4);
+            assert_eq!(allocations, 0, "top-k step for token {token} allocated");
+        }
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn paged_blocks_follow_live_tokens() {
+        let path = write_synthetic_llama_gguf("session-paged", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let mut contiguous = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 16))
+            .expect("build contiguous session");
+        let mut options = GgufDecodeSessionOptions::new(2, 16);
+        options.kv_block_tokens = 3;
+        let mut paged = GgufDecodeSession::new(&header, options).expect("build paged session");
+        assert_eq!(paged.kv_cache().block_count(), 6);
+        assert_eq!(paged.kv_cache().used_block_count(), 0);
+
+        let prompt = [1u64, 2, 3, 4, 5, 6, 7];
+        assert_eq!(
+            paged.generate_greedy(&prompt, 4).expect("paged greedy"),
+            contiguous
+                .generate_greedy(&prompt, 4)
+                .expect("contiguous greedy")
+        );
+        assert_eq!(paged.kv_cache().used_block_count(), 4);
+        assert_eq!(paged.block_table(0), &[0, 1, 2, 3]);
+
+        paged.truncate(4);
+        assert_eq!(paged.kv_cache().used_block_count(), 2);
+        paged.reset();
+        assert_eq!(paged.kv_cache().used_bytes(), 0);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn attention_window_matches_full_context_until_eviction() {
+        let path = write_synthetic_llama_gguf("session-window-short", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let mut full = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let mut options = GgufDecodeSessionOptions::new(2, 32);
+        options.attention_sinks = 2;
+        options.attention_window = 8;
+        let mut windowed = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+
+        // Eight tokens fit the window, so nothing is masked yet.
+        let prompt = [3u64, 14, 15, 9, 2];
+        assert_eq!(
+            windowed
+                .generate_greedy(&prompt, 3)
+                .expect("windowed greedy"),
+            full.generate_greedy(&prompt, 3).expect("full greedy")
+        );
+        assert_eq!(windowed.tokens(), full.tokens());
+        options.attention_window = 26;
+        assert!(GgufDecodeSession::new(&header, options).is_err());
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn attention_window_keeps_memory_flat_past_max_context() {
+        let path = write_synthetic_llama_gguf("session-window-long", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let mut options = GgufDecodeSessionOptions::new(2, 16);
+        options.attention_sinks = 2;
+        options.attention_window = 6;
+        options.max_batch_tokens = 4;
+        options.kv_block_tokens = 2;
+        let mut greedy = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let prompt = [7u64, 1, 22];
+        let expected = greedy
+            .generate_greedy(&prompt, 40)
+            .expect("windowed greedy");
+        assert_eq!(greedy.position(), prompt.len() + 39);
+        // Two sinks plus a ring of window + max_batch_tokens - 1 rows.
+        assert_eq!(greedy.tokens().len(), 2 + 9);
+        assert_eq!(greedy.tokens()[..2], prompt[..2]);
+        assert_eq!(greedy.kv_cache().used_block_count(), 6);
+
+        // Speculative decoding rolls back rejected drafts across the ring.
+        let mut session = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let speculative = session
+            .generate_speculative(&prompt, 40, 1, 3)
+            .expect("speculative decode");
+        assert_eq!(speculative.generated_token_ids, expected);
+        assert_eq!(session.tokens(), greedy.tokens());
+        assert_eq!(session.kv_cache().used_block_count(), 6);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn snapshot_restore_resumes_without_prefill() {
+        let path = write_synthetic_llama_gguf("session-snapshot", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let snapshot_path = std::env::temp_dir().join(format!(
+            "aeronum-session-snapshot-{}.kvs",
+            std::process::id()
+        ));
+        let snapshot_path = snapshot_path.to_str().expect("utf8 temp path");
+        let mut original = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let mut options = GgufSamplerOptions::new(0.8, 7);
+        options.top_k = 8;
+        let mut sampler = GgufSampler::new(options).expect("sampler");
+        original
+            .generate_sampled(&[3, 14, 15, 9, 2, 6], 4, &mut sampler)
+            .expect("sampled decode");
+        original
+            .save_snapshot(snapshot_path, Some(&sampler))
+            .expect("save snapshot");
+
+        let mut restored = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        let mut restored_sampler = restored
+            .restore_snapshot(snapshot_path)
+            .expect("restore snapshot")
+            .expect("saved sampler");
+        assert_eq!(restored.tokens(), original.tokens());
+        assert_eq!(restored.logits(), original.logits());
+        for _ in 0..5 {
+            let token = sampler
+                .sample(original.logits(), original.tokens())
+                .expect("sample");
+            assert_eq!(
+                restored_sampler
+                    .sample(restored.logits(), restored.tokens())
+                    .expect("sample"),
+                token
+            );
+            let expected = original.decode_step(token).expect("decode step").to_vec();
+            assert_eq!(
+                restored.decode_step(token).expect("decode step"),
+                &expected[..]
+            );
+        }
+
+        let mut windowed_options = GgufDecodeSessionOptions::new(2, 32);
+        windowed_options.attention_window = 8;
+        let mut windowed =
+            GgufDecodeSession::new(&header, windowed_options).expect("build session");
+        assert!(windowed.restore_snapshot(snapshot_path).is_err());
+        let other_path = write_synthetic_llama_gguf("session-snapshot-other", 3);
+        let other_header = GgufHeader::read(other_path.to_str().expect("utf8 temp path"))
+            .expect("read synthetic GGUF");
+        let mut other = GgufDecodeSession::new(&other_header, GgufDecodeSessionOptions::new(2, 32))
+            .expect("build session");
+        assert_ne!(other.model_hash(), original.model_hash());
+        assert!(other.restore_snapshot(snapshot_path).is_err());
+        assert!(other.tokens().is_empty());
+        let _ = std::fs::remove_file(snapshot_path);
+        let _ = std::fs::remove_file(other_path);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn parallel_branches_share_prompt_blocks() {
+        let path = write_synthetic_llama_gguf("session-parallel", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let prompt = [5u64, 9, 13, 2, 8, 21, 1, 30, 4, 17];
+        // Branch `b` takes the `b`-th token after the argmax, wrapping around.
+        let choose = |branch: usize, logits: &[f64]| {
+            (argmax_token(logits) + branch as u64) % logits.len() as u64
+        };
+        let mut options = GgufDecodeSessionOptions::new(2, 16);
+        options.kv_block_tokens = 4;
+        let mut single = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let expected = (0..3)
+            .map(|branch| {
+                let mut token = choose(branch, single.prefill(&prompt).expect("prefill"));
+                let mut tokens = vec![token];
+                for _ in 1..4 {
+                    token = choose(branch, single.decode_step(token).expect("decode step"));
+                    tokens.push(token);
+                }
+                single.reset();
+                tokens
+            })
+            .collect::<Vec<_>>();
+
+        options.max_sequences = 3;
+        let mut session = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let generated = session
+            .generate_parallel(&prompt, 3, 4, choose)
+            .expect("parallel decode");
+        assert_eq!(generated, expected);
+        // 13 cached positions per branch: two full prompt blocks stay shared,
+        // the partly filled third one was copied on write.
+        assert_eq!(session.block_table(1)[..2], session.block_table(2)[..2]);
+        assert_ne!(session.block_table(1)[2], session.block_table(2)[2]);
+        assert_eq!(session.kv_cache().used_block_count(), 2 + 3 * 2);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn beam_search_scores_match_stepwise_log_probabilities() {
+        let path = write_synthetic_llama_gguf("session-beam", 2);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let prompt = [3u64, 17, 5, 9];
+        let mut options = GgufDecodeSessionOptions::new(2, 16);
+        options.kv_block_tokens = 4;
+        options.max_sequences = 3;
+        let mut session = GgufDecodeSession::new(&header, options.clone()).expect("build session");
+        let greedy = session.generate_greedy(&prompt, 5).expect("greedy decode");
+        let single_beam = session
+            .generate_beam_search(&prompt, 1, 5)
+            .expect("beam width 1");
+        assert_eq!(single_beam.len(), 1);
+        assert_eq!(single_beam[0].token_ids, greedy);
+
+        let beams = session
+            .generate_beam_search(&prompt, 3, 5)
+            .expect("beam width 3");
+        assert_eq!(beams.len(), 3);
+        let mut checker = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(2, 16))
+            .expect("build session");
+        for (beam, next) in beams.iter().zip(beams.iter().skip(1)) {
+            assert!(beam.log_probability >= next.log_probability);
+            assert_ne!(beam.token_ids, next.token_ids);
+        }
+        for beam in &beams {
+            checker.reset();
+            let mut logits = checker.prefill(&prompt).expect("prefill").to_vec();
+            let mut log_probability = 0.0;
+            for (index, token) in beam.token_ids.iter().enumerate() {
+                log_probability += logits[*token as usize] - log_sum_exp(&logits);
+                if index + 1 < beam.token_ids.len() {
+                    logits = checker.decode_step(*token).expect("decode step").to_vec();
+                }
+            }
+            assert!((log_probability - beam.log_probability).abs() < 1e-9);
+        }
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn decode_step_rejects_full_context_and_unknown_tokens() {
+        let path = write_synthetic_llama_gguf("session-limits", 1);
+        let header =
+            GgufHeader::read(path.to_str().expect("utf8 temp path")).expect("read synthetic GGUF");
+        let mut session = GgufDecodeSession::new(&header, GgufDecodeSessionOptions::new(1, 2))
+            .expect("build session");
+        assert!(session.decode_step(session.vocab_size() as u64).is_err());
+        session.prefill(&[1, 2]).expect("prefill");
+        assert!(session.decode_step(3).is_err());
+        session.reset();
+        assert_eq!(session.position(), 0);
+        assert!(session.decode_step(3).is_ok());
+        let _ = std::fs::remove_file(path);
+    }
+}
@@ -0,0 +1,242 @@
+//! On-disk format of decode session snapshots.
+//!
+//! A snapshot is a fixed little-endian header followed by the cached token
+//! ids (`u64`), the logits of the last decoded token (`f64`) and the KV rows
+//! of every layer (`f32`, `[layer][row][key, value]`). Every section starts
+//! on an 8-byte boundary, so each section is read in place. The header
+//! carries a hash of the model the session was built from, so state is never
+//! restored into a different model.
+
+use super::model::GgufError;
+use super::sampling::GgufSamplerOptions;
+
+const SNAPSHOT_MAGIC: &[u8; 4] = b"AKVS";
+const SNAPSHOT_VERSION: u32 = 1;
+const HEADER_WORDS: usize = 21;
+pub(super) const HEADER_BYTES: usize = 8 + HEADER_WORDS * 8;
+
+/// 64-bit FNV-1a.
+pub(super) struct Fnv1a(u64);
+
+impl Fnv1a {
+    pub(super) fn new() -> Self {
+        Self(0xcbf29ce484222325)
+    }
+
+    pub(super) fn write(&mut self, bytes: &[u8]) {
+        for byte in bytes {
+            self.0 ^= *byte as u64;
+            self.0 = self.0.wrapping_mul(0x100000001b3);
+        }
+    }
+
+    pub(super) fn write_u64(&mut self, value: u64) {
+        self.write(&value.to_le_bytes());
+    }
+
+    /// Hashes the length of `bytes` and 256 evenly spaced 8-byte windows of
+    /// it, which tells apart fine-tunes of one architecture without reading
+    /// every weight byte.
+    pub(super) fn write_sampled(&mut self, bytes: &[u8]) {
+        const SAMPLES: usize = 256;
+        self.write_u64(bytes.len() as u64);
+        if bytes.len() <= SAMPLES * 8 {
+            self.write(bytes);
+            return;
+        }
+        let stride = (bytes.len() - 8) / (SAMPLES - 1);
+        for sample in 0..SAMPLES {
+            let start = sample * stride;
+            self.write(&bytes[start..start + 8]);
+        }
+    }
+
+    pub(super) fn finish(&self) -> u64 {
+        self.0
+    }
+}
+
+#[derive(Clone, Debug, PartialEq)]
+pub(super) struct SnapshotHeader {
+    pub(super) model_hash: u64,
+    pub(super) layer_count: usize,
+    pub(super) kv_length: usize,
+    pub(super) attention_sinks: usize,
+    pub(super) attention_window: usize,
+    /// Window ring rows, `0` without an attention window.
+    pub(super) ring_rows: usize,
+    pub(super) evicted: usize,
+    pub(super) token_count: usize,
+    pub(super) row_count: usize,
+    /// Length of the stored logits row, `0` before the first pass.
+    pub(super) logit_count: usize,
+    /// Sampler options and draw-stream state.
+    pub(super) sampler: Option<(GgufSamplerOptions, u64)>,
+}
+
+impl SnapshotHeader {
+    pub(super) fn encode(&self) -> Vec<u8> {
+        let (options, rng_state) = match &self.sampler {
+            Some((options, rng_state)) => (options.clone(), *rng_state),
+            None => (GgufSamplerOptions::new(0.0, 0), 0),
+        };
+        let words: [u64; HEADER_WORDS] = [
+            self.model_hash,
+            self.layer_count as u64,
+            self.kv_length as u64,
+            self.attention_sinks as u64,
+            self.attention_window as u64,
+            self.ring_rows as u64,
+            self.evicted as u64,
+            self.token_count as u64,
+            self.row_count as u64,
+            self.logit_count as u64,
+            u64::from(self.sampler.is_some()),
+            options.temperature.to_bits(),
+            options.top_k as u64,
+            options.top_p.to_bits(),
+            options.min_p.to_bits(),
+            options.repetition_penalty.to_bits(),
+            options.frequency_penalty.to_bits(),
+            options.presence_penalty.to_bits(),
+            options.penalty_last_n as u64,
+            options.seed,
+            rng_state,
+        ];
+        let mut bytes = Vec::with_capacity(HEADER_BYTES);
+        bytes.extend_from_slice(SNAPSHOT_MAGIC);
+        bytes.extend_from_slice(&SNAPSHOT_VERSION.to_le_bytes());
+        for word in words {
+            bytes.extend_from_slice(&word.to_le_bytes());
+        }
+        bytes
+    }
+
+    /// Parses the header and checks that `bytes` is exactly as long as the
+    /// sections it describes.
+    pub(super) fn decode(bytes: &[u8]) -> Result<Self, GgufError> {
+        let invalid =
+            || GgufError::InvalidTensorRange("decode session snapshot header".to_string());
+        if bytes.len() < HEADER_BYTES
+            || &bytes[..4] != SNAPSHOT_MAGIC
+            || bytes[4..8] != SNAPSHOT_VERSION.to_le_bytes()
+        {
+            return Err(invalid());
+        }
+        let mut words = [0u64; HEADER_WORDS];
+        for (word, bytes) in words.iter_mut().zip(bytes[8..HEADER_BYTES].chunks_exact(8)) {
+            *word = u64::from_le_bytes(bytes.try_into().expect("8-byte word"));
+        }
+        let mut counts = [0usize; HEADER_WORDS];
+        for (count, word) in counts.iter_mut().zip(words) {
+            // Hashes and float bits are read from `words`; only counts
+            // must fit in `usize`.
+            *count = usize::try_from(word).unwrap_or(usize::MAX);
+        }
+        let header = Self {
+            model_hash: words[0],
+            layer_count: counts[1],
+            kv_length: counts[2],
+            attention_sinks: counts[3],
+            attention_window: counts[4],
+            ring_rows: counts[5],
+            evicted: counts[6],
+            token_count: counts[7],
+            row_count: counts[8],
+            logit_count: counts[9],
+            sampler: (words[10] == 1).then(|| {
+                let options = GgufSamplerOptions {
+                    temperature: f64::from_bits(words[11]),
+                    top_k: counts[12],
+                    top_p: f64::from_bits(words[13]),
+                    min_p: f64::from_bits(words[14]),
+                    repetition_penalty: f64::from_bits(words[15]),
+                    frequency_penalty: f64::from_bits(words[16]),
+                    presence_penalty: f64::from_bits(words[17]),
+                    penalty_last_n: counts[18],
+                    seed: words[19],
+                };
+                (options, words[20])
+            }),
+        };
+        if header.byte_len() != Some(bytes.len()) {
+            return Err(invalid());
+        }
+        Ok(header)
+    }
+
+    /// Total file length implied by the header.
+    fn byte_len(&self) -> Option<usize> {
+        let kv_values = self
+            .layer_count
+            .checked_mul(self.row_count)?
+            .checked_mul(2 * self.kv_length)?;
+        HEADER_BYTES
+            .checked_add(self.token_count.checked_mul(8)?)?
+            .checked_add(self.logit_count.checked_mul(8)?)?
+            .checked_add(kv_values.checked_mul(4)?)
+    }
+
+    /// Byte offsets of the token, logit and KV sections.
+    pub(super) fn sections(&self) -> (usize, usize, usize) {
+        let tokens = HEADER_BYTES;
+        let logits = tokens + self.token_count * 8;
+        (tokens, logits, logits + self.logit_count * 8)
+    }
+}
+
+pub(super) fn read_u64s(bytes: &[u8]) -> impl Iterator<Item = u64> + '_ {
+    bytes
+        .chunks_exact(8)
+        .map(|value| u64::from_le_bytes(value.try_into().expect("8-byte value")))
+}
+
+pub(super) fn read_f64s_into(bytes: &[u8], output: &mut [f64]) {
+    for (output, value) in output.iter_mut().zip(bytes.chunks_exact(8)) {
+        *output = f64::from_le_bytes(value.try_into().expect("8-byte value"));
+    }
+}
+
+pub(super) fn read_f32s_into(bytes: &[u8], output: &mut [f32]) {
+    for (output, value) in output.iter_mut().zip(bytes.chunks_exact(4)) {
+        *output = f32::from_le_bytes(value.try_into().expect("4-byte value"));
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn header_round_trips_and_checks_length() {
+        let mut options = GgufSamplerOptions::new(0.7, 42);
+        options.top_k = 40;
+        options.top_p = 0.9;
+        let header = SnapshotHeader {
+            model_hash: u64::MAX - 3,
+            layer_count: 2,
+            kv_length: 4,
+            attention_sinks: 4,
+            attention_window: 0,
+            ring_rows: 0,
+            evicted: 0,
+            token_count: 3,
+            row_count: 3,
+            logit_count: 5,
+            sampler: Some((options, 0x1234)),
+        };
+        let mut bytes = header.encode();
+        assert_eq!(bytes.len(), HEADER_BYTES);
+        bytes.resize(HEADER_BYTES + 3 * 8 + 5 * 8 + 2 * 3 * 8 * 4, 0);
+        assert_eq!(
+            SnapshotHeader::decode(&bytes).expect("decode header"),
+            header
+        );
+
+        bytes.pop();
+        assert!(SnapshotHeader::decode(&bytes).is_err());
+        bytes.push(0);
+        bytes[0] = b'G';
+        assert!(SnapshotHeader::decode(&bytes).is_err());
+    }
+}
@@ -0,0 +1,223 @@
+//! Synthetic GGUF writers shared by the aeronn unit tests.
+
+use std::fs::File;
+use std::io::{Seek, SeekFrom, Write};
+use std::path::PathBuf;
+
+pub(crate) fn write_gguf_string(file: &mut File, value: &str) {
+    file.write_all(&(value.len() as u64).to_le_bytes())
+        .expect("write string len");
+    file.write_all(value.as_bytes()).expect("write string");
+}
+
+pub(crate) enum TestMetadataValue {
+    U32(u32),
+    F32(f32),
+}
+
+pub(crate) struct TestTensor {
+    pub(crate) name: String,
+    pub(crate) dimensions: Vec<u64>,
+    pub(crate) tensor_type: u32,
+    pub(crate) data: Vec<u8>,
+}
+
+pub(crate) fn write_test_gguf(
+    tag: &str,
+    metadata: &[(&str, TestMetadataValue)],
+    tensors: &[TestTensor],
+) -> PathBuf {
+    let path = std::env::temp_dir().join(format!(
+        "aeronum-gguf-header-{}-{}.gguf",
+        std::process::id(),
+        tag
+    ));
+    let mut file = File::create(&path).expect("create GGUF test file");
+    file.write_all(b"GGUF").expect("write magic");
+    file.write_all(&3u32.to_le_bytes()).expect("write version");
+    file.write_all(&(tensors.len() as u64).to_le_bytes())
+        .expect("write tensor count");
+    file.write_all(&(metadata.len() as u64).to_le_bytes())
+        .expect("write metadata count");
+    for (key, value) in metadata {
+        write_gguf_string(&mut file, key);
+        match value {
+            TestMetadataValue::U32(value) => {
+                file.write_all(&4u32.to_le_bytes()).expect("write u32 type");
+                file.write_all(&value.to_le_bytes())
+                    .expect("write u32 value");
+            }
+            TestMetadataValue::F32(value) => {
+                file.write_all(&6u32.to_le_bytes()).expect("write f32 type");
+                file.write_all(&value.to_le_bytes())
+                    .expect("write f32 value");
+            }
+        }
+    }
+    let mut data_offset = 0u64;
+    let mut tensor_offsets = Vec::with_capacity(tensors.len());
+    for tensor in tensors {
+        write_gguf_string(&mut file, &tensor.name);
+        file.write_all(&(tensor.dimensions.len() as u32).to_le_bytes())
+            .expect("write tensor dims");
+        for dimension in &tensor.dimensions {
+            file.write_all(&dimension.to_le_bytes())
+                .expect("write tensor dim");
+        }
+        file.write_all(&tensor.tensor_type.to_le_bytes())
+            .expect("write tensor type");
+        file.write_all(&data_offset.to_le_bytes())
+            .expect("write tensor offset");
+        tensor_offsets.push(data_offset);
+        data_offset = align_to(data_offset + tensor.data.len() as u64, 32);
+    }
+    let directory_end = file.stream_position().expect("directory end");
+    let data_start = align_to(directory_end, 32);
+    for (tensor, offset) in tensors.iter().zip(tensor_offsets) {
+        file.seek(SeekFrom::Start(data_start + offset))
+            .expect("seek tensor data");
+        file.write_all(&tensor.data).expect("write tensor data");
+    }
+    file.set_len(data_start + data_offset)
+        .expect("pad tensor data");
+    path
+}
+
+fn align_to(value: u64, alignment: u64) -> u64 {
+    value.div_ceil(alignment) * alignment
+}
+
+fn splitmix64_byte(state: &mut u64) -> u8 {
+    *state = state.wrapping_add(0x9E37_79B9_7F4A_7C15);
+    let mut z = *state;
+    z = (z ^ (z >> 30)).wrapping_mul(0xBF58_476D_1CE4_E5B9);
+    z = (z ^ (z >> 27)).wrapping_mul(0x94D0_49BB_1331_11EB);
+    ((z ^ (z >> 31)) & 0xff) as u8
+}
+
+/// Random Q4_K (type 12) or Q6_K (type 14) rows with roughly zero-mean values
+/// of magnitude around one, so stacked synthetic layers stay well conditioned.
+pub(crate) fn synthetic_quantized_rows(
+    tensor_type: u32,
+    column_count: usize,
+    row_count: usize,
+    seed: u64,
+) -> Vec<u8> {
+    let mut state = seed;
+    let block_count = column_count.div_ceil(256) * row_count;
+    let mut bytes = Vec::new();
+    for _ in 0..block_count {
+        if tensor_type == 12 {
+            // Equal 6-bit scale and min codes with dmin = 7.5 * d center every
+            // sub-block around zero.
+            let mut block = vec![0u8; 144];
+            block[0..2].copy_from_slice(&0x1c00u16.to_le_bytes());
+            block[2..4].copy_from_slice(&0x2780u16.to_le_bytes());
+            block[4..16].fill(0x11 * (1 + splitmix64_byte(&mut state) % 3));
+            block[16..144]
+                .iter_mut()
+                .for_each(|byte| *byte = splitmix64_byte(&mut state));
+            bytes.extend(block);
+        } else {
+            let mut block = vec![0u8; 210];
+            block[0..192]
+                .iter_mut()
+                .for_each(|byte| *byte = splitmix64_byte(&mut state));
+            block[192..208]
+                .iter_mut()
+                .for_each(|byte| *byte = ((splitmix64_byte(&mut state) % 15) as i8 - 7) as u8);
+            block[208..210].copy_from_slice(&0x1c00u16.to_le_bytes());
+            bytes.extend(block);
+        }
+    }
+    bytes
+}
+
+fn synthetic_norm_weight(length: usize, seed: u64) -> Vec<u8> {
+    (0..length)
+        .flat_map(|idx| (0.75 + ((idx as u64 * 7 + seed) % 11) as f32 / 20.0).to_le_bytes())
+        .collect()
+}
+
+pub(crate) const SYNTHETIC_EMBEDDING_LENGTH: usize = 256;
+pub(crate) const SYNTHETIC_VOCAB_SIZE: usize = 32;
+
+/// Writes a tiny Llama-shaped GGUF file: 256-wide embeddings, 4 query heads
+/// over 2 KV heads of dimension 64, a 512-wide SwiGLU FFN and a 32 token
+/// vocabulary, with Q4_K/Q6_K projections and F32 norms.
+pub(crate) fn write_synthetic_llama_gguf(tag: &str, layer_count: usize) -> PathBuf {
+    let embedding = SYNTHETIC_EMBEDDING_LENGTH;
+    let vocab = SYNTHETIC_VOCAB_SIZE;
+    let feed_forward = 512;
+    let kv_rows = 128;
+    let mut tensors = vec![
+        TestTensor {
+            name: "token_embd.weight".to_string(),
+            dimensions: vec![embedding as u64, vocab as u64],
+            tensor_type: 12,
+            data: synthetic_quantized_rows(12, embedding, vocab, 1),
+        },
+        TestTensor {
+            name: "output_norm.weight".to_string(),
+            dimensions: vec![embedding as u64],
+            tensor_type: 0,
+            data: synthetic_norm_weight(embedding, 2),
+        },
+        TestTensor {
+            name: "output.weight".to_string(),
+            dimensions: vec![embedding as u64, vocab as u64],
+            tensor_type: 14,
+            data: synthetic_quantized_rows(14, embedding, vocab, 3),
+        },
+    ];
+    for layer_index in 0..layer_count {
+        let seed = 100 * (layer_index as u64 + 1);
+        let quantized = [
+            ("attn_q", 12, embedding, embedding),
+            ("attn_k", 12, embedding, kv_rows),
+            ("attn_v", 14, embedding, kv_rows),
+            ("attn_output", 12, embedding, embedding),
+            ("ffn_gate", 12, embedding, feed_forward),
+            ("ffn_up", 12, embedding, feed_forward),
+            ("ffn_down", 14, feed_forward, embedding),
+        ];
+        for (offset, (name, tensor_type, columns, rows)) in quantized.into_iter().enumerate() {
+            tensors.push(TestTensor {
+                name: format!("blk.{layer_index}.{name}.weight"),
+                dimensions: vec![columns as u64, rows as u64],
+                tensor_type,
+                data: synthetic_quantized_rows(tensor_type, columns, rows, seed + offset as u64),
+            });
+        }
+        for (offset, name) in ["attn_norm", "ffn_norm"].into_iter().enumerate() {
+            tensors.push(TestTensor {
+                name: format!("blk.{layer_index}.{name}.weight"),
+                dimensions: vec![embedding as u64],
+                tensor_type: 0,
+                data: synthetic_norm_weight(embedding, seed + 10 + offset as u64),
+            });
+        }
+    }
+    write_test_gguf(
+        tag,
+        &[
+            (
+                "llama.block_count",
+                TestMetadataValue::U32(layer_count as u32),
+            ),
+            (
+                "llama.embedding_length",
+                TestMetadataValue::U32(embedding as u32),
+            ),
+            ("llama.context_length", TestMetadataValue::U32(128)),
+            ("llama.attention.head_count", TestMetadataValue::U32(4)),
+            ("llama.attention.head_count_kv", TestMetadataValue::U32(2)),
+            ("llama.rope.freq_base", TestMetadataValue::F32(10000.0)),
+            (
+                "llama.attention.layer_norm_rms_epsilon",
+                TestMetadataValue::F32(1e-5),
+            ),
+        ],
+        &tensors,
+    )
+}
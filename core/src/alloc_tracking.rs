@@ -0,0 +1,68 @@
+//! Test-only global allocator that counts heap allocations made by threads
+//! that opted into tracking. Pool workers inherit the flag from the thread that
+//! submitted their job, so parallel kernels are counted too.
+
+use std::alloc::{GlobalAlloc, Layout, System};
+use std::cell::Cell;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+
+struct CountingAllocator;
+
+static ALLOCATIONS: AtomicUsize = AtomicUsize::new(0);
+static COUNTING: Mutex<()> = Mutex::new(());
+
+thread_local! {
+    static TRACKING: Cell<bool> = const { Cell::new(false) };
+}
+
+#[global_allocator]
+static GLOBAL: CountingAllocator = CountingAllocator;
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        record_allocation();
+        System.alloc(layout)
+    }
+
+    unsafe fn alloc_zeroed(&self, layout: Layout) -> *mut u8 {
+        record_allocation();
+        System.alloc_zeroed(layout)
+    }
+
+    unsafe fn realloc(&self, ptr: *mut u8, layout: Layout, new_size: usize) -> *mut u8 {
+        record_allocation();
+        System.realloc(ptr, layout, new_size)
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        System.dealloc(ptr, layout)
+    }
+}
+
+fn record_allocation() {
+    if TRACKING.try_with(Cell::get).unwrap_or(false) {
+        ALLOCATIONS.fetch_add(1, Ordering::Relaxed);
+    }
+}
+
+pub(crate) fn is_tracking() -> bool {
+    TRACKING.with(Cell::get)
+}
+
+pub(crate) fn set_tracking(tracking: bool) {
+    TRACKING.with(|flag| flag.set(tracking));
+}
+
+/// Runs `f` and returns its result with the number of heap allocations
+/// (including reallocations) it made.
+pub(crate) fn count_allocations<R>(f: impl FnOnce() -> R) -> (R, usize) {
+    let _counting = COUNTING
+        .lock()
+        .unwrap_or_else(|poisoned| poisoned.into_inner());
+    ALLOCATIONS.store(0, Ordering::Relaxed);
+    set_tracking(true);
+    let result = f();
+    set_tracking(false);
+    (result, ALLOCATIONS.load(Ordering::Relaxed))
+}
@@ -0,0 +1,436 @@
+//! Element types other than `f32` and arrays stored in them.
+//!
+//! [`TypedArray`] holds f16, bf16, i8, f32 or f64 elements with the same
+//! shared, strided layout as [`NdArray`]. It is a storage type: arithmetic
+//! widens elements to `f32` as they are read and accumulates in `f32`, so a
+//! half-precision weight matrix costs two bytes per element while resident
+//! and is multiplied without being expanded first ([`NdArray::matmul_typed`]
+//! converts each element when the GEMM packs it).
+
+use std::any::Any;
+use std::fmt::Debug;
+use std::sync::Arc;
+
+use crate::gemm::{self, MatrixRef};
+use crate::strided::walk_runs;
+use crate::{c_strides, NdArray};
+
+/// Storage element type of a [`TypedArray`].
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+pub enum DType {
+    F16,
+    BF16,
+    I8,
+    F32,
+    F64,
+}
+
+impl DType {
+    pub fn byte_size(self) -> usize {
+        match self {
+            Self::I8 => 1,
+            Self::F16 | Self::BF16 => 2,
+            Self::F32 => 4,
+            Self::F64 => 8,
+        }
+    }
+}
+
+/// IEEE 754 half precision, stored as its bit pattern.
+#[derive(Clone, Copy, Debug, Default, PartialEq, Eq, Hash)]
+#[repr(transparent)]
+pub struct F16(u16);
+
+/// bfloat16 (the upper half of an `f32`), stored as its bit pattern.
+#[derive(Clone, Copy, Debug, Default, PartialEq, Eq, Hash)]
+#[repr(transparent)]
+pub struct BF16(u16);
+
+impl F16 {
+    pub fn from_bits(bits: u16) -> Self {
+        Self(bits)
+    }
+
+    pub fn to_bits(self) -> u16 {
+        self.0
+    }
+}
+
+impl BF16 {
+    pub fn from_bits(bits: u16) -> Self {
+        Self(bits)
+    }
+
+    pub fn to_bits(self) -> u16 {
+        self.0
+    }
+}
+
+/// An array element type. Conversions from `f32` round to nearest (ties to
+/// even for the float types); `i8` saturates and maps NaN to zero.
+pub trait Element: Copy + Default + Debug + PartialEq + Send + Sync + 'static {
+    const DTYPE: DType;
+
+    fn to_f32(self) -> f32;
+
+    fn from_f32(value: f32) -> Self;
+}
+
+impl Element for F16 {
+    const DTYPE: DType = DType::F16;
+
+    fn to_f32(self) -> f32 {
+        f16_to_f32(self.0)
+    }
+
+    fn from_f32(value: f32) -> Self {
+        Self(f32_to_f16(value))
+    }
+}
+
+impl Element for BF16 {
+    const DTYPE: DType = DType::BF16;
+
+    fn to_f32(self) -> f32 {
+        f32::from_bits((self.0 as u32) << 16)
+    }
+
+    fn from_f32(value: f32) -> Self {
+        let bits = value.to_bits();
+        if value.is_nan() {
+            // Keep it a (quiet) NaN even if the payload sits in the low half.
+            return Self((bits >> 16) as u16 | 0x0040);
+        }
+        let round_to_even = 0x7fff + ((bits >> 16) & 1);
+        Self(((bits + round_to_even) >> 16) as u16)
+    }
+}
+
+impl Element for i8 {
+    const DTYPE: DType = DType::I8;
+
+    fn to_f32(self) -> f32 {
+        self as f32
+    }
+
+    fn from_f32(value: f32) -> Self {
+        value.round() as i8
+    }
+}
+
+impl Element for f32 {
+    const DTYPE: DType = DType::F32;
+
+    fn to_f32(self) -> f32 {
+        self
+    }
+
+    fn from_f32(value: f32) -> Self {
+        value
+    }
+}
+
+impl Element for f64 {
+    const DTYPE: DType = DType::F64;
+
+    fn to_f32(self) -> f32 {
+        self as f32
+    }
+
+    fn from_f32(value: f32) -> Self {
+        value as f64
+    }
+}
+
+pub(crate) fn f16_to_f32(bits: u16) -> f32 {
+    let sign = ((bits & 0x8000) as u32) << 16;
+    let exp = ((bits >> 10) & 0x1f) as i32;
+    let frac = (bits & 0x03ff) as u32;
+    let f32_bits = if exp == 0 {
+        if frac == 0 {
+            sign
+        } else {
+            let mut mant = frac;
+            let mut exponent = -14i32;
+            while mant & 0x0400 == 0 {
+                mant <<= 1;
+                exponent -= 1;
+            }
+            mant &= 0x03ff;
+            let exp32 = (exponent + 127) as u32;
+            sign | (exp32 << 23) | (mant << 13)
+        }
+    } else if exp == 0x1f {
+        sign | 0x7f80_0000 | (frac << 13)
+    } else {
+        let exp32 = (exp - 15 + 127) as u32;
+        sign | (exp32 << 23) | (frac << 13)
+    };
+    f32::from_bits(f32_bits)
+}
+
+fn f32_to_f16(value: f32) -> u16 {
+    let bits = value.to_bits();
+    let sign = ((bits >> 16) & 0x8000) as u16;
+    let exp = ((bits >> 23) & 0xff) as i32;
+    let mant = bits & 0x007f_ffff;
+    if exp == 0xff {
+        let nan = if mant != 0 {
+            0x0200 | (mant >> 13) as u16
+        } else {
+            0
+        };
+        return sign | 0x7c00 | nan;
+    }
+    let unbiased = exp - 127;
+    if unbiased > 15 {
+        return sign | 0x7c00;
+    }
+    if unbiased >= -14 {
+        let mut half = (((unbiased + 15) as u32) << 10) | (mant >> 13);
+        let rest = mant & 0x1fff;
+        // A carry out of the mantissa bumps the exponent, up to infinity.
+        if rest > 0x1000 || (rest == 0x1000 && half & 1 == 1) {
+            half += 1;
+        }
+        return sign | half as u16;
+    }
+    if unbiased < -25 {
+        return sign;
+    }
+    // Subnormal half: shift the full significand down to units of 2^-24.
+    let full = mant | 0x0080_0000;
+    let shift = (-14 - unbiased) as u32 + 13;
+    let mut half = full >> shift;
+    let rest = full & ((1 << shift) - 1);
+    let halfway = 1 << (shift - 1);
+    if rest > halfway || (rest == halfway && half & 1 == 1) {
+        half += 1;
+    }
+    sign | half as u16
+}
+
+/// An n-dimensional array of `T`, laid out like [`NdArray`]: shared storage
+/// plus shape, element strides and offset.
+#[derive(Clone, Debug, PartialEq)]
+pub struct TypedArray<T: Element> {
+    data: Arc<Vec<T>>,
+    shape: Vec<usize>,
+    strides: Vec<isize>,
+    offset: isize,
+}
+
+impl<T: Element> TypedArray<T> {
+    pub fn from_vec(data: Vec<T>, shape: &[usize]) -> Self {
+        assert_eq!(shape.iter().product::<usize>(), data.len());
+        Self {
+            data: Arc::new(data),
+            shape: shape.to_vec(),
+            strides: c_strides(shape),
+            offset: 0,
+        }
+    }
+
+    pub fn zeros(shape: &[usize]) -> Self {
+        Self::from_vec(vec![T::default(); shape.iter().product()], shape)
+    }
+
+    /// Rounds every element of `array` to `T`.
+    pub fn from_f32(array: &NdArray) -> Self {
+        let mut values = Vec::with_capacity(array.len());
+        walk_runs(
+            array.shape(),
+            [array.strides()],
+            [array.offset()],
+            |len, [start], [stride]| {
+                values.extend(
+                    (0..len)
+                        .map(|i| T::from_f32(array.data[(start + i as isize * stride) as usize])),
+                );
+            },
+        );
+        Self::from_vec(values, array.shape())
+    }
+
+    /// Widens every element to `f32`.
+    pub fn to_f32(&self) -> NdArray {
+        NdArray::from_list(self.map_values(T::to_f32), Some(&self.shape))
+    }
+
+    /// Converts every element to `U` through `f32`; a cast to the same type
+    /// copies the elements unchanged.
+    pub fn cast<U: Element>(&self) -> TypedArray<U> {
+        if let Some(same) = (self as &dyn Any).downcast_ref::<TypedArray<U>>() {
+            return TypedArray::from_vec(same.to_vec(), &self.shape);
+        }
+        TypedArray::from_vec(
+            self.map_values(|value| U::from_f32(value.to_f32())),
+            &self.shape,
+        )
+    }
+
+    pub fn dtype(&self) -> DType {
+        T::DTYPE
+    }
+
+    pub fn shape(&self) -> &[usize] {
+        &self.shape
+    }
+
+    pub fn strides(&self) -> &[isize] {
+        &self.strides
+    }
+
+    pub fn len(&self) -> usize {
+        self.shape.iter().product()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Bytes taken by the elements this array covers.
+    pub fn nbytes(&self) -> usize {
+        self.len() * T::DTYPE.byte_size()
+    }
+
+    pub fn get(&self, idx: &[usize]) -> Option<T> {
+        if idx.len() != self.shape.len() {
+            return None;
+        }
+        let mut linear = self.offset;
+        for ((index, dim), stride) in idx.iter().zip(&self.shape).zip(&self.strides) {
+            if index >= dim {
+                return None;
+            }
+            linear += *index as isize * stride;
+        }
+        self.data.get(usize::try_from(linear).ok()?).copied()
+    }
+
+    /// Elements in row-major order.
+    pub fn to_vec(&self) -> Vec<T> {
+        self.map_values(|value| value)
+    }
+
+    /// Reverses the axes, sharing storage.
+    pub fn transpose(&self) -> Self {
+        Self {
+            data: Arc::clone(&self.data),
+            shape: self.shape.iter().rev().copied().collect(),
+            strides: self.strides.iter().rev().copied().collect(),
+            offset: self.offset,
+        }
+    }
+
+    fn map_values<U>(&self, convert: impl Fn(T) -> U) -> Vec<U> {
+        let mut values = Vec::with_capacity(self.len());
+        walk_runs(
+            &self.shape,
+            [&self.strides],
+            [self.offset],
+            |len, [start], [stride]| {
+                values.extend(
+                    (0..len).map(|i| convert(self.data[(start + i as isize * stride) as usize])),
+                );
+            },
+        );
+        values
+    }
+
+    fn matrix(&self) -> MatrixRef<'_, T> {
+        MatrixRef {
+            data: &self.data,
+            offset: self.offset,
+            row_stride: self.strides[0],
+            column_stride: self.strides[1],
+        }
+    }
+}
+
+impl NdArray {
+    /// 2D `self @ rhs` with `rhs` stored as `T`. Elements of `rhs` widen to
+    /// `f32` as the GEMM packs them, and products accumulate in `f32`.
+    pub fn matmul_typed<T: Element>(&self, rhs: &TypedArray<T>) -> NdArray {
+        assert_eq!(self.shape().len(), 2);
+        assert_eq!(rhs.shape.len(), 2);
+        let (m, k1) = (self.shape()[0], self.shape()[1]);
+        let (k2, n) = (rhs.shape[0], rhs.shape[1]);
+        assert_eq!(k1, k2);
+        let mut out = vec![0.0; m * n];
+        gemm::gemm_into(m, n, k1, self.matrix(), rhs.matrix(), &mut out);
+        NdArray::from_list(out, Some(&[m, n]))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn half_precision_conversions_round_to_nearest_even() {
+        for (value, bits) in [
+            (0.0f32, 0x0000u16),
+            (-0.0, 0x8000),
+            (1.0, 0x3c00),
+            (-2.0, 0xc000),
+            (65504.0, 0x7bff),
+            (65520.0, 0x7c00),
+            (f32::INFINITY, 0x7c00),
+            (6.0e-8, 0x0001),
+            (2.0f32.powi(-25), 0x0000),
+            (1.0 + 2.0f32.powi(-11), 0x3c00),
+            (1.0 + 3.0 * 2.0f32.powi(-11), 0x3c02),
+        ] {
+            assert_eq!(F16::from_f32(value).to_bits(), bits, "{value}");
+        }
+        for bits in (0..=u16::MAX).step_by(7) {
+            let half = F16::from_bits(bits);
+            if !half.to_f32().is_nan() {
+                assert_eq!(F16::from_f32(half.to_f32()), half);
+            }
+        }
+        assert!(F16::from_f32(f32::NAN).to_f32().is_nan());
+
+        assert_eq!(BF16::from_f32(1.0).to_bits(), 0x3f80);
+        assert_eq!(BF16::from_f32(1.0 + 2.0f32.powi(-8)).to_bits(), 0x3f80);
+        assert_eq!(
+            BF16::from_f32(1.0 + 3.0 * 2.0f32.powi(-8)).to_bits(),
+            0x3f82
+        );
+        assert_eq!(BF16::from_f32(f32::MAX).to_f32(), f32::INFINITY);
+        assert!(BF16::from_f32(f32::from_bits(0x7f80_0001))
+            .to_f32()
+            .is_nan());
+        assert_eq!(i8::from_f32(300.0), 127);
+        assert_eq!(i8::from_f32(-2.5), -3);
+        assert_eq!(i8::from_f32(f32::NAN), 0);
+    }
+
+    #[test]
+    fn typed_arrays_convert_views_and_multiply_in_f32() {
+        // Quarter steps in [-1, 2) are exact in every float type.
+        let values = (0..12).map(|i| i as f32 * 0.25 - 1.0).collect::<Vec<_>>();
+        let array = NdArray::from_list(values.clone(), Some(&[3, 4]));
+        let half = TypedArray::<F16>::from_f32(&array.transpose());
+        assert_eq!(half.shape(), &[4, 3]);
+        assert_eq!(half.dtype(), DType::F16);
+        assert_eq!(half.nbytes(), 24);
+        assert_eq!(half.get(&[1, 2]), Some(F16::from_f32(1.25)));
+        assert_eq!(half.to_f32().to_vec(), array.transpose().to_vec());
+        assert_eq!(half.transpose().to_f32(), array);
+        assert_eq!(
+            half.cast::<BF16>().to_f32().to_vec(),
+            array.transpose().to_vec()
+        );
+        let wide = half.transpose().cast::<f64>();
+        assert_eq!(wide.cast::<f64>(), wide);
+        assert_eq!(wide.to_f32().to_vec(), values);
+        assert_eq!(half.cast::<i8>().to_vec()[..4], [-1, 0, 1, -1]);
+
+        let lhs = NdArray::from_list((0..6).map(|i| i as f32 - 2.0).collect(), Some(&[2, 3]));
+        assert_eq!(lhs.matmul_typed(&half.transpose()), lhs.matmul(&array));
+        let rhs = TypedArray::<BF16>::from_f32(&array.transpose());
+        assert_eq!(array.matmul_typed(&rhs), array.matmul(&array.transpose()));
+    }
+}
@@ -0,0 +1,580 @@
+//! Deferred elementwise expressions over `NdArray`s.
+//!
+//! [`LazyArray`] records elementwise and broadcast operations as a DAG instead
+//! of materializing every intermediate. Evaluation flattens the DAG into a
+//! register program (shared subexpressions computed once, registers reused
+//! after their last read) and runs it over the output in blocks of
+//! [`BLOCK`] elements: each block loads its slice of every input, applies
+//! every operation while the block sits in L1, and writes the result once.
+//! Programs are cached per thread by expression structure, so re-evaluating
+//! the same formula on new data or new constants skips compilation.
+
+use std::cell::RefCell;
+use std::collections::HashMap;
+use std::sync::Arc;
+
+use crate::parallel;
+use crate::strided::offset_of;
+use crate::{broadcast_shape, NdArray};
+
+/// Output elements evaluated together per register.
+const BLOCK: usize = 256;
+/// Compiled programs kept per thread before the cache is cleared.
+const CACHE_CAPACITY: usize = 64;
+
+thread_local! {
+    static PROGRAMS: RefCell<HashMap<Vec<Step>, Arc<Program>>> = RefCell::new(HashMap::new());
+}
+
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+enum Unary {
+    Neg,
+    Exp,
+    Ln,
+    Sqrt,
+    Recip,
+    Tanh,
+    Relu,
+}
+
+impl Unary {
+    fn apply(self, input: &[f32], output: &mut [f32]) {
+        let pairs = output.iter_mut().zip(input);
+        match self {
+            Self::Neg => pairs.for_each(|(out, x)| *out = -x),
+            Self::Exp => pairs.for_each(|(out, x)| *out = x.exp()),
+            Self::Ln => pairs.for_each(|(out, x)| *out = x.ln()),
+            Self::Sqrt => pairs.for_each(|(out, x)| *out = x.sqrt()),
+            Self::Recip => pairs.for_each(|(out, x)| *out = 1.0 / x),
+            Self::Tanh => pairs.for_each(|(out, x)| *out = x.tanh()),
+            Self::Relu => pairs.for_each(|(out, x)| *out = x.max(0.0)),
+        }
+    }
+}
+
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+enum Binary {
+    Add,
+    Sub,
+    Mul,
+    Div,
+    Max,
+}
+
+impl Binary {
+    fn apply(self, left: &[f32], right: &[f32], output: &mut [f32]) {
+        let triples = output.iter_mut().zip(left).zip(right);
+        match self {
+            Self::Add => triples.for_each(|((out, a), b)| *out = a + b),
+            Self::Sub => triples.for_each(|((out, a), b)| *out = a - b),
+            Self::Mul => triples.for_each(|((out, a), b)| *out = a * b),
+            Self::Div => triples.for_each(|((out, a), b)| *out = a / b),
+            Self::Max => triples.for_each(|((out, a), b)| *out = a.max(*b)),
+        }
+    }
+}
+
+#[derive(Debug)]
+enum Node {
+    Input(NdArray),
+    Scalar(f32),
+    Unary(Unary, LazyArray),
+    Binary(Binary, LazyArray, LazyArray),
+}
+
+/// An elementwise expression over `NdArray`s that is evaluated in one fused
+/// pass. Operations broadcast like their eager `NdArray` counterparts and
+/// check shapes when they are recorded; nothing is computed until
+/// [`LazyArray::eval`]. Cloning shares the node, so reusing a clone in
+/// several places computes it once per element.
+#[derive(Clone, Debug)]
+pub struct LazyArray {
+    shape: Arc<[usize]>,
+    node: Arc<Node>,
+}
+
+impl LazyArray {
+    /// A constant broadcast to any shape.
+    pub fn scalar(value: f32) -> Self {
+        Self {
+            shape: Arc::from([]),
+            node: Arc::new(Node::Scalar(value)),
+        }
+    }
+
+    pub fn shape(&self) -> &[usize] {
+        &self.shape
+    }
+
+    pub fn add(&self, other: &Self) -> Self {
+        self.binary(Binary::Add, other)
+    }
+
+    pub fn sub(&self, other: &Self) -> Self {
+        self.binary(Binary::Sub, other)
+    }
+
+    pub fn mul(&self, other: &Self) -> Self {
+        self.binary(Binary::Mul, other)
+    }
+
+    pub fn div(&self, other: &Self) -> Self {
+        self.binary(Binary::Div, other)
+    }
+
+    /// Elementwise maximum.
+    pub fn maximum(&self, other: &Self) -> Self {
+        self.binary(Binary::Max, other)
+    }
+
+    pub fn neg(&self) -> Self {
+        self.unary(Unary::Neg)
+    }
+
+    pub fn exp(&self) -> Self {
+        self.unary(Unary::Exp)
+    }
+
+    pub fn ln(&self) -> Self {
+        self.unary(Unary::Ln)
+    }
+
+    pub fn sqrt(&self) -> Self {
+        self.unary(Unary::Sqrt)
+    }
+
+    /// `1 / self`.
+    pub fn recip(&self) -> Self {
+        self.unary(Unary::Recip)
+    }
+
+    pub fn tanh(&self) -> Self {
+        self.unary(Unary::Tanh)
+    }
+
+    pub fn relu(&self) -> Self {
+        self.unary(Unary::Relu)
+    }
+
+    /// Evaluates the expression into a new contiguous array.
+    pub fn eval(&self) -> NdArray {
+        let mut out = NdArray::from_data_shape(Vec::new(), &[0]);
+        self.eval_into(&mut out);
+        out
+    }
+
+    /// Evaluates the expression into `out`, reusing its buffer when it is
+    /// already an unshared contiguous array of this shape.
+    pub fn eval_into(&self, out: &mut NdArray) {
+        let Compiled {
+            program,
+            inputs,
+            scalars,
+        } = self.compile();
+        let values = out.reuse_for(&self.shape);
+        if values.is_empty() {
+            return;
+        }
+
+        let mut input_strides = inputs
+            .iter()
+            .map(|input| input.strided().broadcast_strides(&self.shape))
+            .collect::<Vec<_>>();
+        let dims = merge_dynamic(&self.shape, &mut input_strides);
+        let (outer_dims, row_len) = dims.split_at(dims.len() - 1);
+        let row_len = row_len[0];
+        let outer_strides = input_strides
+            .iter()
+            .map(|strides| &strides[..strides.len() - 1])
+            .collect::<Vec<_>>();
+
+        let work_per_row = row_len * program.steps.len().max(1);
+        let rows_per_task = parallel::items_per_task(values.len() / row_len, work_per_row);
+        parallel::for_each_chunk_mut(values, rows_per_task * row_len, |task_index, rows| {
+            let mut registers = vec![vec![0.0f32; BLOCK]; program.register_count];
+            for (row_offset, row) in rows.chunks_exact_mut(row_len).enumerate() {
+                let row_index = task_index * rows_per_task + row_offset;
+                for (block_index, block) in row.chunks_mut(BLOCK).enumerate() {
+                    let column = (block_index * BLOCK) as isize;
+                    for step in &program.steps {
+                        let mut target = std::mem::take(&mut registers[step.dst]);
+                        let target_block = &mut target[..block.len()];
+                        match step.op {
+                            Step::Input(input) => {
+                                let strides = &input_strides[input];
+                                let start = inputs[input].offset()
+                                    + offset_of(row_index, outer_dims, outer_strides[input])
+                                    + column * strides[strides.len() - 1];
+                                load(
+                                    &inputs[input].data,
+                                    start,
+                                    strides[strides.len() - 1],
+                                    target_block,
+                                );
+                            }
+                            Step::Scalar(scalar) => target_block.fill(scalars[scalar]),
+                            Step::Unary(op, a) => op.apply(&registers[step.args[a]], target_block),
+                            Step::Binary(op, a, b) => op.apply(
+                                &registers[step.args[a]],
+                                &registers[step.args[b]],
+                                target_block,
+                            ),
+                        }
+                        registers[step.dst] = target;
+                    }
+                    block.copy_from_slice(&registers[program.result][..block.len()]);
+                }
+            }
+        });
+    }
+
+    fn unary(&self, op: Unary) -> Self {
+        Self {
+            shape: Arc::clone(&self.shape),
+            node: Arc::new(Node::Unary(op, self.clone())),
+        }
+    }
+
+    fn binary(&self, op: Binary, other: &Self) -> Self {
+        let shape = broadcast_shape(&self.shape, &other.shape).unwrap_or_else(|| {
+            panic!("incompatible shapes {:?} and {:?}", self.shape, other.shape)
+        });
+        Self {
+            shape: Arc::from(shape),
+            node: Arc::new(Node::Binary(op, self.clone(), other.clone())),
+        }
+    }
+
+    /// Flattens the DAG into its structural key, inputs and scalars, and
+    /// fetches (or builds) the register program for that key.
+    fn compile(&self) -> Compiled<'_> {
+        let mut flat = Flattener::default();
+        let result = flat.visit(self);
+        let key = flat.steps;
+        let program = PROGRAMS.with(|programs| {
+            let mut programs = programs.borrow_mut();
+            if let Some(program) = programs.get(&key) {
+                return Arc::clone(program);
+            }
+            if programs.len() >= CACHE_CAPACITY {
+                programs.clear();
+            }
+            let program = Arc::new(Program::allocate(&key, result));
+            programs.insert(key, Arc::clone(&program));
+            program
+        });
+        Compiled {
+            program,
+            inputs: flat.inputs,
+            scalars: flat.scalars,
+        }
+    }
+}
+
+impl NdArray {
+    /// Starts a lazy expression with this array as an input. The array's
+    /// storage is shared, not copied.
+    pub fn lazy(&self) -> LazyArray {
+        LazyArray {
+            shape: Arc::from(self.shape()),
+            node: Arc::new(Node::Input(self.clone())),
+        }
+    }
+}
+
+/// One operation in static single assignment form. `Input` and `Scalar`
+/// number the expression's inputs and constants in visiting order; operands
+/// of `Unary` and `Binary` are indices of earlier steps.
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+enum Step {
+    Input(usize),
+    Scalar(usize),
+    Unary(Unary, usize),
+    Binary(Binary, usize, usize),
+}
+
+#[derive(Default)]
+struct Flattener<'a> {
+    steps: Vec<Step>,
+    inputs: Vec<&'a NdArray>,
+    scalars: Vec<f32>,
+    seen: HashMap<*const Node, usize>,
+}
+
+impl<'a> Flattener<'a> {
+    /// Returns the step index computing `expr`, adding steps for any part of
+    /// it not seen yet.
+    fn visit(&mut self, expr: &'a LazyArray) -> usize {
+        let key = Arc::as_ptr(&expr.node);
+        if let Some(&step) = self.seen.get(&key) {
+            return step;
+        }
+        let step = match &*expr.node {
+            Node::Input(array) => {
+                self.inputs.push(array);
+                Step::Input(self.inputs.len() - 1)
+            }
+            Node::Scalar(value) => {
+                self.scalars.push(*value);
+                Step::Scalar(self.scalars.len() - 1)
+            }
+            Node::Unary(op, a) => Step::Unary(*op, self.visit(a)),
+            Node::Binary(op, a, b) => {
+                let a = self.visit(a);
+                Step::Binary(*op, a, self.visit(b))
+            }
+        };
+        self.steps.push(step);
+        self.seen.insert(key, self.steps.len() - 1);
+        self.steps.len() - 1
+    }
+}
+
+struct Compiled<'a> {
+    program: Arc<Program>,
+    inputs: Vec<&'a NdArray>,
+    scalars: Vec<f32>,
+}
+
+/// The steps of an expression with registers assigned.
+#[derive(Debug)]
+struct Program {
+    steps: Vec<ProgramStep>,
+    register_count: usize,
+    result: usize,
+}
+
+#[derive(Debug)]
+struct ProgramStep {
+    op: Step,
+    dst: usize,
+    /// Registers of the step's operands, indexed by the operand slots of
+    /// `op` (`Unary(_, 0)`, `Binary(_, 0, 1)`).
+    args: [usize; 2],
+}
+
+impl Program {
+    /// Assigns registers so that a step's result never shares a register with
+    /// its own operands, and frees each register after its last read.
+    fn allocate(steps: &[Step], result: usize) -> Self {
+        let mut last_use = (0..steps.len()).collect::<Vec<_>>();
+        for (index, step) in steps.iter().enumerate() {
+            match *step {
+                Step::Unary(_, a) => last_use[a] = index,
+                Step::Binary(_, a, b) => {
+                    last_use[a] = index;
+                    last_use[b] = index;
+                }
+                Step::Input(_) | Step::Scalar(_) => {}
+            }
+        }
+        last_use[result] = steps.len();
+
+        let mut register_of = vec![0usize; steps.len()];
+        let mut free = Vec::new();
+        let mut register_count = 0;
+        let mut program = Vec::with_capacity(steps.len());
+        for (index, step) in steps.iter().enumerate() {
+            let dst = free.pop().unwrap_or_else(|| {
+                register_count += 1;
+                register_count - 1
+            });
+            register_of[index] = dst;
+            let (op, args) = match *step {
+                Step::Unary(op, a) => (Step::Unary(op, 0), [register_of[a], 0]),
+                Step::Binary(op, a, b) => {
+                    (Step::Binary(op, 0, 1), [register_of[a], register_of[b]])
+                }
+                other => (other, [0, 0]),
+            };
+            program.push(ProgramStep { op, dst, args });
+            let mut operands = match *step {
+                Step::Unary(_, a) => vec![a],
+                Step::Binary(_, a, b) => vec![a, b],
+                Step::Input(_) | Step::Scalar(_) => vec![],
+            };
+            operands.dedup();
+            for operand in operands {
+                if last_use[operand] == index {
+                    free.push(register_of[operand]);
+                }
+            }
+        }
+        Self {
+            steps: program,
+            register_count,
+            result: register_of[result],
+        }
+    }
+}
+
+/// Fills `output` with `data[start + i * stride]`.
+fn load(data: &[f32], start: isize, stride: isize, output: &mut [f32]) {
+    match stride {
+        0 => output.fill(data[start as usize]),
+        1 => {
+            let start = start as usize;
+            output.copy_from_slice(&data[start..start + output.len()]);
+        }
+        _ => {
+            for (index, value) in output.iter_mut().enumerate() {
+                *value = data[(start + index as isize * stride) as usize];
+            }
+        }
+    }
+}
+
+/// Drops size-1 axes of `shape` and merges neighbouring axes that every
+/// operand steps through contiguously, rewriting `strides` to match. Always
+/// leaves at least one axis.
+fn merge_dynamic(shape: &[usize], strides: &mut [Vec<isize>]) -> Vec<usize> {
+    let mut dims = Vec::with_capacity(shape.len().max(1));
+    let mut merged = vec![Vec::with_capacity(shape.len().max(1)); strides.len()];
+    for (axis, &dim) in shape.iter().enumerate() {
+        if dim == 1 {
+            continue;
+        }
+        let contiguous_with_outer = !dims.is_empty()
+            && merged
+                .iter()
+                .zip(strides.iter())
+                .all(|(outer, strides)| outer.last() == Some(&(strides[axis] * dim as isize)));
+        if contiguous_with_outer {
+            *dims.last_mut().expect("outer axis") *= dim;
+            for (outer, strides) in merged.iter_mut().zip(strides.iter()) {
+                *outer.last_mut().expect("outer axis") = strides[axis];
+            }
+        } else {
+            dims.push(dim);
+            for (outer, strides) in merged.iter_mut().zip(strides.iter()) {
+                outer.push(strides[axis]);
+            }
+        }
+    }
+    if dims.is_empty() {
+        dims.push(1);
+        for outer in &mut merged {
+            outer.push(0);
+        }
+    }
+    for (strides, merged) in strides.iter_mut().zip(merged) {
+        *strides = merged;
+    }
+    dims
+}
+
+#[cfg(test)]
+pub(crate) fn cached_program_count() -> usize {
+    PROGRAMS.with(|programs| programs.borrow().len())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn filled(shape: &[usize], seed: usize) -> NdArray {
+        let len = shape.iter().product::<usize>();
+        NdArray::from_list(
+            (0..len)
+                .map(|i| ((i * seed % 29) as f32 - 14.0) / 8.0)
+                .collect(),
+            Some(shape),
+        )
+    }
+
+    #[test]
+    fn fused_expressions_match_eager_ops_exactly() {
+        // Rows wider than one block, a transposed input, row and column
+        // broadcasts and a scalar.
+        let x = filled(&[300, 3, 7], 5).transpose();
+        let scale = filled(&[300], 7);
+        let shift = filled(&[7, 1, 1], 11);
+        let half = NdArray::from_list(vec![0.5], Some(&[]));
+        let eager = x
+            .mul(&scale)
+            .add(&shift)
+            .mul(&x.mul(&scale).add(&shift))
+            .sub(&half)
+            .div(&scale.mul(&scale).add(&half));
+        let y = x.lazy().mul(&scale.lazy()).add(&shift.lazy());
+        let half_lazy = LazyArray::scalar(0.5);
+        let lazy = y
+            .mul(&y)
+            .sub(&half_lazy)
+            .div(&scale.lazy().mul(&scale.lazy()).add(&half_lazy));
+        assert_eq!(lazy.shape(), eager.shape());
+        assert_eq!(lazy.eval(), eager);
+
+        let unary = x
+            .lazy()
+            .tanh()
+            .exp()
+            .add(&LazyArray::scalar(1.0))
+            .ln()
+            .sqrt()
+            .recip()
+            .neg()
+            .maximum(&LazyArray::scalar(-0.9))
+            .relu()
+            .eval()
+            .to_vec();
+        let expected = x
+            .to_vec()
+            .iter()
+            .map(|v| {
+                (-(1.0 / (v.tanh().exp() + 1.0).ln().sqrt()))
+                    .max(-0.9)
+                    .max(0.0)
+            })
+            .collect::<Vec<_>>();
+        assert_eq!(unary, expected);
+    }
+
+    #[test]
+    fn programs_are_cached_by_structure_and_reuse_output() {
+        let a = filled(&[64, 64], 3);
+        let b = filled(&[64], 5);
+        let norm = |a: &NdArray, b: &NdArray, eps: f32| {
+            a.lazy()
+                .sub(&b.lazy())
+                .div(&b.lazy().mul(&b.lazy()).add(&LazyArray::scalar(eps)).sqrt())
+        };
+        let mut out = NdArray::zeros(&[64, 64]);
+        norm(&a, &b, 1e-5).eval_into(&mut out);
+        let cached = cached_program_count();
+        let storage = out.data.as_ptr();
+
+        // Same structure, different data and constant: no new program, same
+        // output buffer.
+        let c = filled(&[64, 64], 7);
+        norm(&c, &b, 1e-3).eval_into(&mut out);
+        assert_eq!(cached_program_count(), cached);
+        assert_eq!(out.data.as_ptr(), storage);
+        let eps = NdArray::from_list(vec![1e-3], Some(&[]));
+        let denominator = b.mul(&b).add(&eps).to_vec();
+        let denominator = NdArray::from_list(
+            denominator.iter().map(|value| value.sqrt()).collect(),
+            Some(&[64]),
+        );
+        assert_eq!(out, c.sub(&b).div(&denominator));
+
+        let _ = a.lazy().add(&b.lazy()).eval();
+        assert_eq!(cached_program_count(), cached + 1);
+    }
+
+    #[test]
+    fn register_allocation_reuses_freed_registers() {
+        // ((x + 1) * (x + 1)) chained eight times needs only a handful of
+        // registers regardless of length.
+        let x = filled(&[10], 3).lazy();
+        let mut expr = x.clone();
+        for _ in 0..8 {
+            let y = expr.add(&LazyArray::scalar(1.0));
+            expr = y.mul(&y);
+        }
+        let compiled = expr.compile();
+        assert!(compiled.program.register_count <= 3);
+        assert_eq!(compiled.inputs.len(), 1);
+        assert_eq!(compiled.scalars.len(), 8);
+    }
+}
@@ -3,23 +3,53 @@
 //! This is intentionally tiny and exists to make the v0 spec testable via `cargo test`.
 
 pub mod aeronn;
+#[cfg(test)]
+mod alloc_tracking;
+mod dtype;
+mod gemm;
 pub mod gpu;
+mod lazy;
+mod mmap;
+mod npy;
+mod parallel;
+mod quant;
+mod reduce;
+mod storage;
+mod strided;
 
 pub use aeronn::{
-    GgufAttentionScoreSample, GgufCachedAttentionParitySample, GgufError,
-    GgufGpuQuantizedLogitsSample, GgufHeader, GgufLayerExecutionSummary, GgufMetadataValue,
+    GgufAttentionScoreSample, GgufBatchScheduler, GgufBeamHypothesis,
+    GgufCachedAttentionParitySample, GgufDecodeSession, GgufDecodeSessionOptions, GgufError,
+    GgufGenerationRequest, GgufGenerationResult, GgufGpuQuantizedLogitsSample, GgufHeader,
+    GgufLayerExecutionSummary, GgufLayerPlan, GgufMetadataValue, GgufModelPlan,
     GgufMultiLayerCachedFinalLogitsParitySample, GgufMultiLayerFinalLogitsSample,
-    GgufMultiTokenAttentionSample, GgufMultiTokenLayerLogitsSample, GgufProjectionValueSample,
+    GgufMultiTokenAttentionSample, GgufMultiTokenLayerLogitsSample, GgufPagedKvCache,
+    GgufPrefixCache, GgufPrefixCacheStats, GgufProjectionValueSample, GgufQkvProjection,
     GgufQuantizedBlockSample, GgufQuantizedLogitValue, GgufQuantizedNormalizedLogitsSample,
     GgufQuantizedPrefixLogitsSample, GgufQuantizedRowDotSample, GgufQuantizedRowSample,
-    GgufRetainedKvAutoregressiveDecodeSample, GgufRetainedKvDecodeStepSample,
+    GgufRetainedKvAutoregressiveDecodeSample, GgufRetainedKvDecodeStepSample, GgufSampler,
+    GgufSamplerOptions, GgufSamplingCandidate, GgufSchedulerStats,
     GgufSingleTokenAttentionOutputSample, GgufSingleTokenFfnOutputSample,
-    GgufSingleTokenLayerLogitsSample, GgufTensorByteSample, GgufValueType, LlamaModel,
+    GgufSingleTokenLayerLogitsSample, GgufSpeculativeDecodeSample, GgufSwiGluScratch,
+    GgufTensorByteSample, GgufValueType, LlamaModel, SplitMix64,
 };
+pub use dtype::{DType, Element, TypedArray, BF16, F16};
+use gemm::MatrixRef;
 pub use gpu::{Backend, Device, GpuDevice, GpuError, HipBlas, HipBuffer, HipRuntime};
+pub use lazy::LazyArray;
+pub use quant::{QTensor, QuantFormat};
+pub use reduce::Reduction;
+use std::ops::Range;
+use std::sync::Arc;
+use storage::Buffer;
+use strided::Strided;
+
+/// An n-dimensional `f32` array. Storage is reference-counted: clones, views,
+/// reshapes, transposes and slices share one buffer and differ only in shape,
+/// strides and offset. Mutation copies the buffer first if it is shared.
 #[derive(Clone, Debug, PartialEq)]
 pub struct NdArray {
-    data: Vec<f32>,
+    data: Arc<Buffer>,
     shape: Vec<usize>,
     /// Strides in elements (not bytes).
     strides: Vec<isize>,
@@ -60,7 +90,7 @@ impl NdArray {
         assert_eq!(shape.len(), strides.len());
         // No bounds checking beyond basic sanity; tests cover invariants.
         Self {
-            data: self.data.clone(),
+            data: Arc::clone(&self.data),
             shape: shape.to_vec(),
             strides: strides.to_vec(),
             offset: self.offset + offset,
@@ -74,7 +104,60 @@ impl NdArray {
         if new_shape.iter().product::<usize>() != self.len() {
             return None;
         }
-        Some(Self::from_data_shape(self.to_vec(), new_shape))
+        Some(Self {
+            data: Arc::clone(&self.data),
+            shape: new_shape.to_vec(),
+            strides: c_strides(new_shape),
+            offset: self.offset,
+        })
+    }
+
+    /// Reverses the axes, sharing storage.
+    pub fn transpose(&self) -> Self {
+        let axes = (0..self.shape.len()).rev().collect::<Vec<_>>();
+        self.permute(&axes)
+    }
+
+    /// Reorders the axes so that axis `i` of the result is axis `axes[i]` of
+    /// `self`, sharing storage.
+    pub fn permute(&self, axes: &[usize]) -> Self {
+        let mut seen = vec![false; self.shape.len()];
+        assert_eq!(axes.len(), self.shape.len(), "permute needs every axis");
+        for axis in axes {
+            assert!(
+                *axis < seen.len() && !std::mem::replace(&mut seen[*axis], true),
+                "invalid axis permutation {axes:?}"
+            );
+        }
+        Self {
+            data: Arc::clone(&self.data),
+            shape: axes.iter().map(|axis| self.shape[*axis]).collect(),
+            strides: axes.iter().map(|axis| self.strides[*axis]).collect(),
+            offset: self.offset,
+        }
+    }
+
+    /// Restricts `axis` to `range`, sharing storage.
+    pub fn slice_axis(&self, axis: usize, range: Range<usize>) -> Self {
+        assert!(axis < self.shape.len(), "axis {axis} out of range");
+        assert!(
+            range.start <= range.end && range.end <= self.shape[axis],
+            "slice {range:?} out of bounds for axis of length {}",
+            self.shape[axis]
+        );
+        let mut shape = self.shape.clone();
+        shape[axis] = range.end - range.start;
+        Self {
+            data: Arc::clone(&self.data),
+            shape,
+            strides: self.strides.clone(),
+            offset: self.offset + range.start as isize * self.strides[axis],
+        }
+    }
+
+    /// Whether `self` and `other` read the same buffer.
+    pub fn shares_storage(&self, other: &Self) -> bool {
+        Arc::ptr_eq(&self.data, &other.data)
     }
 
     pub fn shape(&self) -> &[usize] {
@@ -98,7 +181,7 @@ impl NdArray {
     }
 
     pub fn is_contiguous(&self) -> bool {
-        self.strides == c_strides(&self.shape)
+        strided::is_c_contiguous(&self.shape, &self.strides)
     }
 
     pub fn get(&self, idx: &[usize]) -> Option<f32> {
@@ -110,95 +193,171 @@ impl NdArray {
         let Some(li) = self.linear_index(idx) else {
             return false;
         };
-        if let Some(x) = self.data.get_mut(li) {
-            *x = value;
-            true
-        } else {
-            false
+        if li >= self.data.len() {
+            return false;
         }
+        // Copy-on-write: a buffer shared with clones or views is duplicated
+        // before the first write, so they keep seeing the old values.
+        Arc::make_mut(&mut self.data).to_mut()[li] = value;
+        true
     }
 
     pub fn add(&self, other: &Self) -> Self {
-        let (out_shape, left, right) = broadcast_pair(self, other);
-        let mut out = NdArray::zeros(&out_shape);
-        for out_i in 0..out.len() {
-            let mi = unravel_index(out_i, &out_shape);
-            let a = left.get_broadcasted(&mi);
-            let b = right.get_broadcasted(&mi);
-            out.data[out_i] = a + b;
-        }
-        out
+        self.zip_map(other, |a, b| a + b)
     }
 
     pub fn sub(&self, other: &Self) -> Self {
-        let (out_shape, left, right) = broadcast_pair(self, other);
-        let mut out = NdArray::zeros(&out_shape);
-        for out_i in 0..out.len() {
-            let mi = unravel_index(out_i, &out_shape);
-            out.data[out_i] = left.get_broadcasted(&mi) - right.get_broadcasted(&mi);
-        }
-        out
+        self.zip_map(other, |a, b| a - b)
     }
 
     pub fn mul(&self, other: &Self) -> Self {
-        let (out_shape, left, right) = broadcast_pair(self, other);
-        let mut out = NdArray::zeros(&out_shape);
-        for out_i in 0..out.len() {
-            let mi = unravel_index(out_i, &out_shape);
-            out.data[out_i] = left.get_broadcasted(&mi) * right.get_broadcasted(&mi);
-        }
-        out
+        self.zip_map(other, |a, b| a * b)
     }
 
     pub fn div(&self, other: &Self) -> Self {
-        let (out_shape, left, right) = broadcast_pair(self, other);
-        let mut out = NdArray::zeros(&out_shape);
-        for out_i in 0..out.len() {
-            let mi = unravel_index(out_i, &out_shape);
-            out.data[out_i] = left.get_broadcasted(&mi) / right.get_broadcasted(&mi);
-        }
-        out
+        self.zip_map(other, |a, b| a / b)
+    }
+
+    /// `out = self + other`, reusing `out`'s buffer when it is already an
+    /// unshared contiguous array of the result shape.
+    pub fn add_into(&self, other: &Self, out: &mut Self) {
+        self.zip_map_into(other, out, |a, b| a + b);
+    }
+
+    /// `out = self - other`; see [`NdArray::add_into`].
+    pub fn sub_into(&self, other: &Self, out: &mut Self) {
+        self.zip_map_into(other, out, |a, b| a - b);
+    }
+
+    /// `out = self * other`; see [`NdArray::add_into`].
+    pub fn mul_into(&self, other: &Self, out: &mut Self) {
+        self.zip_map_into(other, out, |a, b| a * b);
+    }
+
+    /// `out = self / other`; see [`NdArray::add_into`].
+    pub fn div_into(&self, other: &Self, out: &mut Self) {
+        self.zip_map_into(other, out, |a, b| a / b);
+    }
+
+    /// `self += other` in place, with `other` broadcast to `self`'s shape.
+    /// Writes go through `self`'s strides, so a view updates just the
+    /// elements it covers; shared storage is copied first.
+    pub fn add_assign(&mut self, other: &Self) {
+        self.update(other, |a, b| a + b);
+    }
+
+    /// `self -= other` in place; see [`NdArray::add_assign`].
+    pub fn sub_assign(&mut self, other: &Self) {
+        self.update(other, |a, b| a - b);
+    }
+
+    /// `self *= other` in place; see [`NdArray::add_assign`].
+    pub fn mul_assign(&mut self, other: &Self) {
+        self.update(other, |a, b| a * b);
+    }
+
+    /// `self /= other` in place; see [`NdArray::add_assign`].
+    pub fn div_assign(&mut self, other: &Self) {
+        self.update(other, |a, b| a / b);
+    }
+
+    /// `self += alpha * x` in place (BLAS `axpy`), e.g. an SGD step with
+    /// `alpha = -learning_rate`.
+    pub fn axpy(&mut self, alpha: f32, x: &Self) {
+        self.update(x, move |a, b| a + alpha * b);
     }
 
     pub fn sum(&self, axis: Option<usize>, keepdims: bool) -> Self {
-        match axis {
-            None => {
-                let s: f32 = (0..self.len())
-                    .map(|i| {
-                        let mi = unravel_index(i, &self.shape);
-                        self.get(&mi).unwrap()
-                    })
-                    .sum();
-                if keepdims {
-                    NdArray::from_list(vec![s], Some(&vec![1; self.shape.len()]))
-                } else {
-                    NdArray::from_list(vec![s], Some(&[]))
-                }
+        self.reduce(Reduction::Sum, &self.axes_or_all(axis), keepdims)
+    }
+
+    pub fn mean(&self, axis: Option<usize>, keepdims: bool) -> Self {
+        self.reduce(Reduction::Mean, &self.axes_or_all(axis), keepdims)
+    }
+
+    pub fn max(&self, axis: Option<usize>, keepdims: bool) -> Self {
+        self.reduce(Reduction::Max, &self.axes_or_all(axis), keepdims)
+    }
+
+    pub fn min(&self, axis: Option<usize>, keepdims: bool) -> Self {
+        self.reduce(Reduction::Min, &self.axes_or_all(axis), keepdims)
+    }
+
+    pub fn logsumexp(&self, axis: Option<usize>, keepdims: bool) -> Self {
+        self.reduce(Reduction::LogSumExp, &self.axes_or_all(axis), keepdims)
+    }
+
+    /// Reduces over every axis in `axes` (an empty list reduces nothing).
+    /// The reduced axes are dropped from the result, or kept with length 1
+    /// when `keepdims` is set. Sums are accumulated pairwise; `Max`, `Min`
+    /// and `LogSumExp` propagate NaN. Panics if an axis repeats or is out of
+    /// range, or if `Max`/`Min` reduce over zero elements.
+    pub fn reduce(&self, reduction: Reduction, axes: &[usize], keepdims: bool) -> Self {
+        let out_shape = self.reduced_shape(axes, keepdims);
+        let values = match reduction {
+            Reduction::Sum | Reduction::Mean => reduce::reduce_axes(
+                self.strided(),
+                axes,
+                &reduce::Sum {
+                    mean: reduction == Reduction::Mean,
+                },
+            ),
+            Reduction::Max => {
+                self.assert_nonempty_reduction(axes);
+                reduce::reduce_axes(self.strided(), axes, &reduce::Extremum::<true>)
             }
-            Some(ax) => {
-                assert!(ax < self.shape.len());
-                let mut out_shape = self.shape.clone();
-                if keepdims {
-                    out_shape[ax] = 1;
-                } else {
-                    out_shape.remove(ax);
-                }
-                let mut out = NdArray::zeros(&out_shape);
-
-                for in_i in 0..self.len() {
-                    let mi = unravel_index(in_i, &self.shape);
-                    let mut oi = mi.clone();
-                    if keepdims {
-                        oi[ax] = 0;
-                    } else {
-                        oi.remove(ax);
-                    }
-                    let out_li = out.linear_index_usize(&oi);
-                    out.data[out_li] += self.get(&mi).unwrap();
-                }
-                out
+            Reduction::Min => {
+                self.assert_nonempty_reduction(axes);
+                reduce::reduce_axes(self.strided(), axes, &reduce::Extremum::<false>)
             }
+            Reduction::LogSumExp => reduce::reduce_axes(self.strided(), axes, &reduce::LogSumExp),
+        };
+        Self::from_data_shape(values, &out_shape)
+    }
+
+    /// Index of the first maximum along `axis` for every position of the
+    /// other axes, in row-major order; with `None`, the flat row-major index
+    /// of the first maximum. NaN counts as the maximum.
+    pub fn argmax(&self, axis: Option<usize>) -> Vec<usize> {
+        let axes = self.axes_or_all(axis);
+        self.reduced_shape(&axes, false);
+        self.assert_nonempty_reduction(&axes);
+        reduce::reduce_axes(self.strided(), &axes, &reduce::ArgMax)
+    }
+
+    fn axes_or_all(&self, axis: Option<usize>) -> Vec<usize> {
+        match axis {
+            Some(axis) => vec![axis],
+            None => (0..self.shape.len()).collect(),
+        }
+    }
+
+    /// Shape after reducing `axes`, validating them.
+    fn reduced_shape(&self, axes: &[usize], keepdims: bool) -> Vec<usize> {
+        for (index, axis) in axes.iter().enumerate() {
+            assert!(
+                *axis < self.shape.len() && !axes[..index].contains(axis),
+                "invalid reduction axes {axes:?} for shape {:?}",
+                self.shape
+            );
         }
+        self.shape
+            .iter()
+            .enumerate()
+            .filter_map(|(axis, dim)| match axes.contains(&axis) {
+                false => Some(*dim),
+                true if keepdims => Some(1),
+                true => None,
+            })
+            .collect()
+    }
+
+    fn assert_nonempty_reduction(&self, axes: &[usize]) {
+        assert!(
+            axes.iter().all(|axis| self.shape[*axis] != 0),
+            "reduction over zero elements of shape {:?} has no identity",
+            self.shape
+        );
     }
 
     /// 2D matmul only.
@@ -208,26 +367,65 @@ impl NdArray {
         let (m, k1) = (self.shape[0], self.shape[1]);
         let (k2, n) = (other.shape[0], other.shape[1]);
         assert_eq!(k1, k2);
-        let mut out = NdArray::zeros(&[m, n]);
-        for i in 0..m {
-            for j in 0..n {
-                let mut acc = 0.0f32;
-                for kk in 0..k1 {
-                    acc += self.get(&[i, kk]).unwrap() * other.get(&[kk, j]).unwrap();
-                }
-                out.set(&[i, j], acc);
-            }
-        }
-        out
+        let mut out = vec![0.0; m * n];
+        gemm::gemm_into(m, n, k1, self.matrix(), other.matrix(), &mut out);
+        Self::from_data_shape(out, &[m, n])
+    }
+
+    /// `out = self.matmul(other)`, reusing `out`'s buffer when it is already
+    /// an unshared contiguous array of the result shape.
+    pub fn matmul_into(&self, other: &Self, out: &mut Self) {
+        assert_eq!(self.shape.len(), 2);
+        assert_eq!(other.shape.len(), 2);
+        let (m, k1) = (self.shape[0], self.shape[1]);
+        let (k2, n) = (other.shape[0], other.shape[1]);
+        assert_eq!(k1, k2);
+        let values = out.reuse_for(&[m, n]);
+        values.fill(0.0);
+        gemm::gemm_into(m, n, k1, self.matrix(), other.matrix(), values);
+    }
+
+    /// Matrix product over the last two axes with the leading (batch) axes
+    /// broadcast against each other, like NumPy's `@`: `[b, 1, m, k]` times
+    /// `[h, k, n]` gives `[b, h, m, n]`. Both operands need at least two axes;
+    /// strided and transposed views are read in place.
+    pub fn batched_matmul(&self, other: &Self) -> Self {
+        assert!(
+            self.shape.len() >= 2 && other.shape.len() >= 2,
+            "batched_matmul needs at least 2-D operands, got {:?} and {:?}",
+            self.shape,
+            other.shape
+        );
+        let (left_batch, left_matrix) = self.shape.split_at(self.shape.len() - 2);
+        let (right_batch, right_matrix) = other.shape.split_at(other.shape.len() - 2);
+        let (m, k) = (left_matrix[0], left_matrix[1]);
+        let (k2, n) = (right_matrix[0], right_matrix[1]);
+        assert_eq!(k, k2, "matmul inner dimensions differ");
+        let mut shape = broadcast_shape(left_batch, right_batch).unwrap_or_else(|| {
+            panic!("incompatible batch shapes {left_batch:?} and {right_batch:?}")
+        });
+        let left_strides = self.batch_strided().broadcast_strides(&shape);
+        let right_strides = other.batch_strided().broadcast_strides(&shape);
+        let mut out = vec![0.0; shape.iter().product::<usize>() * m * n];
+        gemm::batched_gemm_into(
+            &shape,
+            m,
+            n,
+            k,
+            self.matrix(),
+            &left_strides,
+            other.matrix(),
+            &right_strides,
+            &mut out,
+        );
+        shape.extend([m, n]);
+        Self::from_data_shape(out, &shape)
     }
 
     pub fn to_vec(&self) -> Vec<f32> {
-        (0..self.len())
-            .map(|i| {
-                let mi = unravel_index(i, &self.shape);
-                self.get(&mi).unwrap()
-            })
-            .collect()
+        let mut values = vec![0.0; self.len()];
+        strided::copy_into(self.strided(), &mut values);
+        values
     }
 
     pub fn to_hip_buffer(&self, runtime: &HipRuntime) -> Result<HipBuffer, GpuError> {
@@ -244,7 +442,7 @@ impl NdArray {
     fn from_data_shape(data: Vec<f32>, shape: &[usize]) -> Self {
         let strides = c_strides(shape);
         Self {
-            data,
+            data: Arc::new(data.into()),
             shape: shape.to_vec(),
             strides,
             offset: 0,
@@ -268,25 +466,95 @@ impl NdArray {
         Some(li as usize)
     }
 
-    fn linear_index_usize(&self, idx: &[usize]) -> usize {
-        self.linear_index(idx).unwrap()
+    fn strided(&self) -> Strided<'_> {
+        Strided {
+            data: &self.data,
+            shape: &self.shape,
+            strides: &self.strides,
+            offset: self.offset,
+        }
+    }
+
+    /// The matrix spanned by the last two axes at batch index zero, as a
+    /// strided GEMM operand.
+    fn matrix(&self) -> MatrixRef<'_> {
+        let rank = self.strides.len();
+        MatrixRef {
+            data: &self.data,
+            offset: self.offset,
+            row_stride: self.strides[rank - 2],
+            column_stride: self.strides[rank - 1],
+        }
     }
 
-    fn get_broadcasted(&self, out_multi_idx: &[usize]) -> f32 {
-        // out_multi_idx is in output shape coordinates.
-        // Align trailing dimensions.
-        let out_nd = out_multi_idx.len();
-        let in_nd = self.shape.len();
-        let mut in_idx = vec![0usize; in_nd];
-        for (a, in_i) in in_idx.iter_mut().enumerate() {
-            let out_axis = out_nd - in_nd + a;
-            *in_i = if self.shape[a] == 1 {
-                0
-            } else {
-                out_multi_idx[out_axis]
-            };
+    /// All axes but the last two.
+    fn batch_strided(&self) -> Strided<'_> {
+        let batch_rank = self.shape.len() - 2;
+        Strided {
+            data: &self.data,
+            shape: &self.shape[..batch_rank],
+            strides: &self.strides[..batch_rank],
+            offset: self.offset,
         }
-        self.get(&in_idx).unwrap()
+    }
+
+    /// Broadcasting elementwise `op(self, other)` into `out`.
+    fn zip_map_into(&self, other: &Self, out: &mut Self, op: impl Fn(f32, f32) -> f32) {
+        let broadcast;
+        let out_shape = if self.shape == other.shape {
+            &self.shape[..]
+        } else {
+            broadcast = broadcast_pair(self, other).0;
+            &broadcast[..]
+        };
+        let values = out.reuse_for(out_shape);
+        strided::binary_map_into(out_shape, self.strided(), other.strided(), values, op);
+    }
+
+    /// `self = op(self, other)` elementwise through `self`'s strides.
+    fn update(&mut self, other: &Self, op: impl Fn(f32, f32) -> f32) {
+        if self.shape != other.shape {
+            let (out_shape, _, _) = broadcast_pair(self, other);
+            assert_eq!(
+                out_shape, self.shape,
+                "cannot broadcast {:?} into {:?} in place",
+                other.shape, self.shape
+            );
+        }
+        // Copy-on-write, as in `set`.
+        let data = Arc::make_mut(&mut self.data).to_mut();
+        strided::update_in_place(
+            data,
+            &self.shape,
+            &self.strides,
+            self.offset,
+            other.strided(),
+            op,
+        );
+    }
+
+    /// Turns `self` into an unshared contiguous array of `shape` and returns
+    /// its values, keeping the current buffer when `self` already is one. The
+    /// returned values are unspecified.
+    fn reuse_for(&mut self, shape: &[usize]) -> &mut [f32] {
+        let reusable = self.shape == shape
+            && self.is_contiguous()
+            && Arc::get_mut(&mut self.data).is_some_and(|data| !data.borrows_file());
+        if !reusable {
+            *self = Self::zeros(shape);
+        }
+        let (start, len) = (self.offset as usize, self.len());
+        &mut Arc::get_mut(&mut self.data)
+            .expect("unshared output buffer")
+            .to_mut()[start..start + len]
+    }
+
+    /// Broadcasting elementwise `op(self, other)` into a new contiguous array.
+    fn zip_map(&self, other: &Self, op: impl Fn(f32, f32) -> f32) -> Self {
+        let (out_shape, left, right) = broadcast_pair(self, other);
+        let mut values = vec![0.0; out_shape.iter().product()];
+        strided::binary_map_into(&out_shape, left.strided(), right.strided(), &mut values, op);
+        Self::from_data_shape(values, &out_shape)
     }
 }
 
@@ -300,19 +568,6 @@ fn c_strides(shape: &[usize]) -> Vec<isize> {
     strides
 }
 
-fn unravel_index(mut linear: usize, shape: &[usize]) -> Vec<usize> {
-    if shape.is_empty() {
-        return vec![];
-    }
-    let mut idx = vec![0usize; shape.len()];
-    for axis in (0..shape.len()).rev() {
-        let dim = shape[axis];
-        idx[axis] = linear % dim;
-        linear /= dim;
-    }
-    idx
-}
-
 fn broadcast_pair<'a>(a: &'a NdArray, b: &'a NdArray) -> (Vec<usize>, &'a NdArray, &'a NdArray) {
     let out = broadcast_shape(a.shape(), b.shape())
         .unwrap_or_else(|| panic!("incompatible shapes {:?} and {:?}", a.shape(), b.shape()));
@@ -435,6 +690,37 @@ mod tests {
         assert_relative_eq!(s0.to_vec()[0], 5.0);
     }
 
+    #[test]
+    fn reductions_over_axis_tuples() {
+        let a = NdArray::from_list((0..24).map(|x| x as f32).collect(), Some(&[2, 3, 4]));
+        let s = a.reduce(Reduction::Sum, &[0, 2], false);
+        assert_eq!(s.shape(), &[3]);
+        assert_eq!(s.to_vec(), vec![60., 92., 124.]);
+        let m = a.reduce(Reduction::Mean, &[2, 0], true);
+        assert_eq!(m.shape(), &[1, 3, 1]);
+        assert_eq!(m.to_vec(), vec![7.5, 11.5, 15.5]);
+        assert_eq!(
+            a.max(Some(1), false).to_vec(),
+            vec![8., 9., 10., 11., 20., 21., 22., 23.]
+        );
+        assert_eq!(a.transpose().min(None, false).to_vec(), vec![0.]);
+        assert_eq!(a.argmax(Some(2)), vec![3; 6]);
+        assert_eq!(a.transpose().argmax(None), vec![23]);
+        let lse = a.logsumexp(Some(2), false).to_vec();
+        assert_relative_eq!(
+            lse[0],
+            3.0 + (1.0f32 + (-1f32).exp() + (-2f32).exp() + (-3f32).exp()).ln()
+        );
+        assert_eq!(a.reduce(Reduction::Sum, &[], false), a);
+    }
+
+    #[test]
+    #[should_panic]
+    fn reductions_reject_repeated_axes() {
+        let a = NdArray::zeros(&[2, 3]);
+        let _ = a.reduce(Reduction::Sum, &[1, 1], false);
+    }
+
     #[test]
     fn reshape_contiguous_preserves_row_major_order() {
         let a = NdArray::from_list((0..12).map(|x| x as f32).collect(), Some(&[3, 4]));
@@ -662,4 +948,187 @@ mod tests {
         let b = NdArray::zeros(&[6]);
         let _ = a.matmul(&b);
     }
+
+    #[test]
+    fn batched_matmul_broadcasts_batch_axes() {
+        let values = |len: usize, seed: usize| {
+            (0..len)
+                .map(|i| ((i * seed % 23) as f32 - 11.0) / 7.0)
+                .collect::<Vec<_>>()
+        };
+        // Attention-shaped: [batch, heads, seq, dim] @ keys viewed as
+        // [batch, heads, dim, seq] through a permuted, non-contiguous view.
+        let q = NdArray::from_list(values(2 * 3 * 5 * 4, 5), Some(&[2, 3, 5, 4]));
+        let k = NdArray::from_list(values(2 * 3 * 5 * 4, 7), Some(&[2, 3, 5, 4]));
+        let k_t = k.permute(&[0, 1, 3, 2]);
+        let scores = q.batched_matmul(&k_t);
+        assert_eq!(scores.shape(), &[2, 3, 5, 5]);
+        for b in 0..2 {
+            for h in 0..3 {
+                let q2 = q.slice_axis(0, b..b + 1).slice_axis(1, h..h + 1);
+                let q2 = q2.view(&[5, 4], &q2.strides()[2..], 0);
+                let k2 = k_t.slice_axis(0, b..b + 1).slice_axis(1, h..h + 1);
+                let k2 = k2.view(&[4, 5], &k2.strides()[2..], 0);
+                let expected = q2.matmul(&k2);
+                for i in 0..5 {
+                    for j in 0..5 {
+                        assert_relative_eq!(
+                            scores.get(&[b, h, i, j]).unwrap(),
+                            expected.get(&[i, j]).unwrap()
+                        );
+                    }
+                }
+            }
+        }
+
+        // Shared weights broadcast over a batch, and size-1 axes on both sides.
+        let x = NdArray::from_list(values(4 * 2 * 3, 3), Some(&[4, 1, 2, 3]));
+        let w = NdArray::from_list(values(2 * 3 * 6, 11), Some(&[2, 3, 6]));
+        let y = x.batched_matmul(&w);
+        assert_eq!(y.shape(), &[4, 2, 2, 6]);
+        for b in 0..4 {
+            let x2 = x.slice_axis(0, b..b + 1).reshape(&[2, 3]).unwrap();
+            for h in 0..2 {
+                let w2 = w.slice_axis(0, h..h + 1).reshape(&[3, 6]).unwrap();
+                let expected = x2.matmul(&w2);
+                let actual = y.slice_axis(0, b..b + 1).slice_axis(1, h..h + 1).to_vec();
+                assert_eq!(actual, expected.to_vec());
+            }
+        }
+        let plain = x.slice_axis(0, 0..1).reshape(&[2, 3]).unwrap();
+        assert_eq!(
+            plain.batched_matmul(&w.slice_axis(0, 0..1).reshape(&[3, 6]).unwrap()),
+            plain.matmul(&w.slice_axis(0, 0..1).reshape(&[3, 6]).unwrap())
+        );
+    }
+
+    #[test]
+    #[should_panic]
+    fn batched_matmul_incompatible_batches_panic() {
+        let a = NdArray::zeros(&[2, 3, 4]);
+        let b = NdArray::zeros(&[3, 4, 5]);
+        let _ = a.batched_matmul(&b);
+    }
+
+    #[test]
+    fn elementwise_ops_allocate_per_call_not_per_element() {
+        let a = NdArray::from_list((0..4096).map(|x| x as f32).collect(), Some(&[64, 64]));
+        let row = NdArray::from_list((0..64).map(|x| x as f32).collect(), Some(&[1, 64]));
+        let transposed = a.view(&[64, 64], &[1, 64], 0);
+        for (left, right) in [(&a, &a), (&a, &row), (&transposed, &row)] {
+            let (out, allocations) = crate::alloc_tracking::count_allocations(|| left.mul(right));
+            assert_eq!(out.shape(), &[64, 64]);
+            assert!(allocations < 16, "{allocations} allocations");
+        }
+        assert_eq!(
+            transposed.sub(&row).get(&[3, 5]),
+            Some(transposed.get(&[3, 5]).unwrap() - 5.0)
+        );
+    }
+
+    #[test]
+    fn into_and_assign_ops_reuse_buffers() {
+        let a = NdArray::from_list((0..256).map(|x| x as f32).collect(), Some(&[16, 16]));
+        let b = NdArray::from_list((0..256).map(|x| (x % 7) as f32).collect(), Some(&[16, 16]));
+        let row = NdArray::from_list((0..16).map(|x| x as f32).collect(), Some(&[16]));
+
+        let mut out = NdArray::zeros(&[1]);
+        a.sub_into(&row, &mut out);
+        assert_eq!(out, a.sub(&row));
+        a.matmul_into(&b, &mut out);
+        assert_eq!(out, a.matmul(&b));
+
+        // A shared output gets a fresh buffer instead of overwriting the clone.
+        let kept = out.clone();
+        a.mul_into(&b, &mut out);
+        assert_eq!(out, a.mul(&b));
+        assert_eq!(kept, a.matmul(&b));
+
+        let mut params = a.clone();
+        params.axpy(-0.5, &b);
+        assert_eq!(params, a.sub(&b.mul(&NdArray::from_list(vec![0.5], None))));
+        assert_eq!(a.get(&[0, 1]), Some(1.0), "clone was copied on write");
+        params.div_assign(&NdArray::from_list(vec![2.0], None));
+        params.add_assign(&row);
+        params.mul_assign(&b);
+        let expected = a
+            .sub(&b.mul(&NdArray::from_list(vec![0.5], None)))
+            .div(&NdArray::from_list(vec![2.0], None))
+            .add(&row)
+            .mul(&b);
+        assert_eq!(params, expected);
+
+        // Updating a transposed view writes through its strides.
+        let mut transposed = a.transpose();
+        transposed.sub_assign(&row);
+        assert_eq!(transposed.get(&[2, 3]), Some(a.get(&[3, 2]).unwrap() - 3.0));
+        assert_eq!(transposed.strides(), &[1, 16]);
+
+        // Steady state: same-shape updates and products reuse every buffer.
+        let mut grad = NdArray::zeros(&[16, 16]);
+        a.matmul_into(&b, &mut grad);
+        let ((), allocations) = crate::alloc_tracking::count_allocations(|| {
+            for _ in 0..4 {
+                a.matmul_into(&b, &mut grad);
+                grad.add_assign(&b);
+                a.sub_into(&b, &mut out);
+                params.axpy(-0.01, &grad);
+            }
+        });
+        assert_eq!(allocations, 0);
+    }
+
+    #[test]
+    #[should_panic]
+    fn assign_cannot_grow_the_target() {
+        let mut row = NdArray::zeros(&[1, 4]);
+        row.add_assign(&NdArray::zeros(&[3, 4]));
+    }
+
+    #[test]
+    fn views_reshape_transpose_and_slices_share_storage() {
+        let base = NdArray::from_list((0..24).map(|x| x as f32).collect(), Some(&[2, 3, 4]));
+        let reshaped = base.reshape(&[6, 4]).expect("contiguous reshape");
+        let transposed = base.transpose();
+        let sliced = base.slice_axis(2, 1..3);
+        let permuted = base.permute(&[1, 0, 2]);
+        for derived in [&reshaped, &transposed, &sliced, &permuted] {
+            assert!(derived.shares_storage(&base));
+        }
+        assert_eq!(transposed.shape(), &[4, 3, 2]);
+        assert_eq!(transposed.get(&[3, 2, 1]), base.get(&[1, 2, 3]));
+        assert_eq!(sliced.shape(), &[2, 3, 2]);
+        assert_eq!(sliced.to_vec()[..4], [1., 2., 5., 6.]);
+        assert_eq!(permuted.get(&[2, 1, 0]), base.get(&[1, 2, 0]));
+        assert_eq!(
+            reshaped.reshape(&[24]).expect("flatten").to_vec(),
+            base.to_vec()
+        );
+        // A contiguous slice of rows reshapes without copying.
+        let rows = reshaped.slice_axis(0, 2..4);
+        let flat = rows.reshape(&[8]).expect("contiguous rows");
+        assert!(flat.shares_storage(&base));
+        assert_eq!(flat.to_vec(), (8..16).map(|x| x as f32).collect::<Vec<_>>());
+    }
+
+    #[test]
+    fn set_copies_shared_storage_on_write() {
+        let base = NdArray::arange(6).reshape(&[2, 3]).expect("reshape");
+        let mut view = base.transpose();
+        assert!(view.set(&[2, 1], 50.0));
+        assert!(!view.shares_storage(&base));
+        assert_eq!(view.get(&[2, 1]), Some(50.0));
+        assert_eq!(base.get(&[1, 2]), Some(5.0));
+
+        // Once unshared, further writes stay in place.
+        let mut owned = NdArray::zeros(&[3]);
+        let before = owned.clone();
+        assert!(owned.set(&[0], 1.0));
+        let unique = owned.clone();
+        drop(unique);
+        let (_, allocations) = crate::alloc_tracking::count_allocations(|| owned.set(&[1], 2.0));
+        assert_eq!(allocations, 0);
+        assert_eq!(before.to_vec(), vec![0.0; 3]);
+        assert_eq!(owned.to_vec(), vec![1.0, 2.0, 0.0]);
+    }
 }
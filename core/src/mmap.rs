@@ -0,0 +1,158 @@
+//! Read-only file mappings without external crates.
+//!
+//! On Unix [`MappedFile::open`] maps the file with `mmap(2)` through a direct
+//! FFI binding, so pages are faulted in from the page cache as they are read
+//! and never copied into a heap buffer first. Elsewhere, or when the kernel
+//! refuses the mapping, the file is read into memory instead; callers see the
+//! same bytes either way.
+//!
+//! A mapping is only as stable as the file behind it. `MAP_PRIVATE` isolates
+//! it from writes made through the mapping, not from the file: if this or
+//! another process truncates the file, touching the lost pages raises
+//! `SIGBUS`, and if it rewrites the file in place, the new contents may show
+//! through pages that are not yet copied, under what the rest of the crate
+//! treats as an immutable `&[u8]`. Nothing here can rule that out, so `open`
+//! is `unsafe` and only the explicitly `unsafe` public loaders use it; the
+//! safe ones go through [`MappedFile::read`], which owns its bytes.
+
+use std::fs::File;
+use std::io;
+use std::path::Path;
+
+#[cfg(unix)]
+use std::os::raw::{c_int, c_long, c_void};
+
+#[cfg(unix)]
+const PROT_READ: c_int = 1;
+#[cfg(unix)]
+const MAP_PRIVATE: c_int = 2;
+
+#[cfg(unix)]
+extern "C" {
+    fn mmap(
+        addr: *mut c_void,
+        length: usize,
+        prot: c_int,
+        flags: c_int,
+        fd: c_int,
+        offset: c_long,
+    ) -> *mut c_void;
+    fn munmap(addr: *mut c_void, length: usize) -> c_int;
+}
+
+enum Backing {
+    #[cfg(unix)]
+    Mapped {
+        ptr: *mut c_void,
+        len: usize,
+    },
+    Owned(Vec<u8>),
+}
+
+pub(crate) struct MappedFile {
+    backing: Backing,
+}
+
+// The bytes are never written through, so sharing them across threads is
+// sound on the terms `MappedFile::open` already demands of its callers: the
+// file stays unchanged while the mapping is alive.
+unsafe impl Send for MappedFile {}
+unsafe impl Sync for MappedFile {}
+
+impl MappedFile {
+    /// Reads the whole file into memory; the result is never a mapping.
+    pub(crate) fn read(path: impl AsRef<Path>) -> io::Result<Self> {
+        Ok(Self {
+            backing: Backing::Owned(std::fs::read(path)?),
+        })
+    }
+
+    /// Maps the file read-only, falling back to reading it into memory.
+    ///
+    /// # Safety
+    ///
+    /// The file must not be truncated or modified, by this or any other
+    /// process, until the result is dropped. Otherwise reading
+    /// [`Self::bytes`] may fault with `SIGBUS` or observe bytes changing
+    /// under a shared reference, both undefined behavior.
+    pub(crate) unsafe fn open(path: impl AsRef<Path>) -> io::Result<Self> {
+        let mut file = File::open(path)?;
+        let len = usize::try_from(file.metadata()?.len())
+            .map_err(|_| io::Error::new(io::ErrorKind::InvalidData, "file too large to map"))?;
+        #[cfg(unix)]
+        if len > 0 {
+            use std::os::unix::io::AsRawFd;
+            let ptr = unsafe {
+                mmap(
+                    std::ptr::null_mut(),
+                    len,
+                    PROT_READ,
+                    MAP_PRIVATE,
+                    file.as_raw_fd(),
+                    0,
+                )
+            };
+            // MAP_FAILED is `(void *) -1`.
+            if ptr as isize != -1 {
+                return Ok(Self {
+                    backing: Backing::Mapped { ptr, len },
+                });
+            }
+        }
+        let mut bytes = Vec::with_capacity(len);
+        io::Read::read_to_end(&mut file, &mut bytes)?;
+        Ok(Self {
+            backing: Backing::Owned(bytes),
+        })
+    }
+
+    pub(crate) fn bytes(&self) -> &[u8] {
+        match &self.backing {
+            #[cfg(unix)]
+            Backing::Mapped { ptr, len } => unsafe {
+                std::slice::from_raw_parts(*ptr as *const u8, *len)
+            },
+            Backing::Owned(bytes) => bytes,
+        }
+    }
+}
+
+impl Drop for MappedFile {
+    fn drop(&mut self) {
+        #[cfg(unix)]
+        if let Backing::Mapped { ptr, len } = self.backing {
+            unsafe {
+                munmap(ptr, len);
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn mapped_file_sees_file_bytes() {
+        let path = std::env::temp_dir().join(format!("aeronum-mmap-{}", std::process::id()));
+        std::fs::write(&path, b"mapped bytes").expect("write temp file");
+        // SAFETY: the file is only rewritten after the mapping is dropped.
+        let mapped = unsafe { MappedFile::open(&path) }.expect("map temp file");
+        assert_eq!(mapped.bytes(), b"mapped bytes");
+        #[cfg(unix)]
+        assert!(matches!(mapped.backing, Backing::Mapped { .. }));
+        drop(mapped);
+
+        std::fs::write(&path, b"").expect("truncate temp file");
+        // SAFETY: as above.
+        assert!(unsafe { MappedFile::open(&path) }
+            .expect("map empty file")
+            .bytes()
+            .is_empty());
+        assert!(MappedFile::read(&path)
+            .expect("read empty file")
+            .bytes()
+            .is_empty());
+        let _ = std::fs::remove_file(path);
+    }
+}
@@ -0,0 +1,701 @@
+//! NumPy `.npy` and `.npz` files.
+//!
+//! Loading reads the file into memory once. A little-endian `float32` payload
+//! that sits at a 4-byte-aligned address is then used in place rather than
+//! copied again; that covers every `.npy` file NumPy writes and every array
+//! in an `.npz` file written by [`NdArray::save_npz`]. The `unsafe`
+//! [`NdArray::map_npy`] and [`NdArray::map_npz`] skip the read as well and use
+//! a read-only mapping of the file, which is only sound while nothing
+//! modifies the file. Fortran-order payloads become column-major views rather
+//! than being transposed. Other float widths, byte orders and misaligned
+//! payloads are converted into an owned buffer.
+//!
+//! Saving streams the elements through the array's strides in fixed-size
+//! chunks, so a large or non-contiguous array is never copied whole.
+//! `.npz` archives are uncompressed zip files, as produced by `numpy.savez`;
+//! `numpy.savez_compressed` archives are rejected.
+
+use std::fs::File;
+use std::io::{self, BufWriter, Seek, SeekFrom, Write};
+use std::path::Path;
+use std::sync::Arc;
+
+use crate::dtype::{Element, F16};
+use crate::mmap::MappedFile;
+use crate::storage::Buffer;
+use crate::strided::walk_runs;
+use crate::{c_strides, NdArray};
+
+const MAGIC: &[u8] = b"\x93NUMPY";
+/// NumPy pads headers so the payload starts on this boundary.
+const HEADER_ALIGN: usize = 64;
+/// Bytes staged per `write` call when streaming elements out.
+const WRITE_CHUNK: usize = 64 * 1024;
+
+const LOCAL_HEADER: u32 = 0x0403_4b50;
+const CENTRAL_HEADER: u32 = 0x0201_4b50;
+const END_OF_CENTRAL_DIRECTORY: u32 = 0x0605_4b50;
+const ZIP64_EXTRA: u16 = 0x0001;
+/// Extra-field id for alignment padding, the one `zipalign` uses.
+const PADDING_EXTRA: u16 = 0xd935;
+/// 1980-01-01, the earliest date a zip entry can carry.
+const DOS_DATE: u16 = (1 << 5) | 1;
+
+impl NdArray {
+    /// Loads a `.npy` file of `float16`, `float32` or `float64` values.
+    pub fn load_npy(path: impl AsRef<Path>) -> io::Result<Self> {
+        let file = Arc::new(MappedFile::read(path)?);
+        let len = file.bytes().len();
+        parse_npy(&file, 0..len)
+    }
+
+    /// Like [`Self::load_npy`], but a little-endian `float32` payload is used
+    /// straight from a read-only mapping of the file, with no read or copy.
+    ///
+    /// # Safety
+    ///
+    /// The file must not be truncated or modified, by this or any other
+    /// process, while the returned array, a view of it, or a clone that has
+    /// not been written to is alive. The mapping does not protect against
+    /// that: a truncated file makes reads of the array fault with `SIGBUS`,
+    /// and a rewritten one changes its values under live shared references,
+    /// both undefined behavior.
+    pub unsafe fn map_npy(path: impl AsRef<Path>) -> io::Result<Self> {
+        // SAFETY: the caller keeps the file unchanged while the array lives.
+        let file = Arc::new(unsafe { MappedFile::open(path) }?);
+        let len = file.bytes().len();
+        parse_npy(&file, 0..len)
+    }
+
+    /// Writes `self` as a version 1.0 (2.0 for very long shapes) `.npy` file
+    /// of little-endian `float32` values.
+    pub fn save_npy(&self, path: impl AsRef<Path>) -> io::Result<()> {
+        let mut writer = BufWriter::new(File::create(path)?);
+        self.write_npy(&mut writer)?;
+        writer.flush()
+    }
+
+    /// Streams `self` to `writer` in `.npy` format, as [`Self::save_npy`].
+    pub fn write_npy<W: Write>(&self, mut writer: W) -> io::Result<()> {
+        writer.write_all(&npy_header(&self.shape))?;
+        let mut staged = Vec::with_capacity(WRITE_CHUNK);
+        let mut result = Ok(());
+        walk_runs(
+            &self.shape,
+            [&self.strides],
+            [self.offset],
+            |len, [start], [stride]| {
+                for step in 0..len {
+                    let value = self.data[(start + step as isize * stride) as usize];
+                    staged.extend_from_slice(&value.to_le_bytes());
+                    if staged.len() >= WRITE_CHUNK && result.is_ok() {
+                        result = writer.write_all(&staged);
+                        staged.clear();
+                    }
+                }
+            },
+        );
+        result?;
+        writer.write_all(&staged)
+    }
+
+    /// Loads every array of an uncompressed `.npz` archive, in archive order,
+    /// with the `.npy` suffix dropped from the names.
+    pub fn load_npz(path: impl AsRef<Path>) -> io::Result<Vec<(String, Self)>> {
+        npz_arrays(Arc::new(MappedFile::read(path)?))
+    }
+
+    /// Like [`Self::load_npz`], but arrays are used straight from a read-only
+    /// mapping of the archive where their payloads allow it, as
+    /// [`Self::map_npy`] does.
+    ///
+    /// # Safety
+    ///
+    /// As for [`Self::map_npy`]: the archive must not be truncated or
+    /// modified while any returned array, view or unwritten clone is alive.
+    pub unsafe fn map_npz(path: impl AsRef<Path>) -> io::Result<Vec<(String, Self)>> {
+        // SAFETY: the caller keeps the archive unchanged while the arrays live.
+        npz_arrays(Arc::new(unsafe { MappedFile::open(path) }?))
+    }
+
+    /// Writes `arrays` as an uncompressed `.npz` archive readable by
+    /// `numpy.load`. Each payload is padded to a 64-byte file offset, so
+    /// [`Self::load_npz`] and [`Self::map_npz`] use every array in place.
+    pub fn save_npz(path: impl AsRef<Path>, arrays: &[(&str, &Self)]) -> io::Result<()> {
+        let mut writer = BufWriter::new(File::create(path)?);
+        let mut entries = Vec::with_capacity(arrays.len());
+        let mut position = 0u64;
+        for (name, array) in arrays {
+            let name = format!("{name}.npy");
+            let header = npy_header(&array.shape);
+            let size = header.len() as u64 + array.len() as u64 * 4;
+            let (Ok(size), Ok(offset)) = (u32::try_from(size), u32::try_from(position)) else {
+                return Err(io::Error::new(
+                    io::ErrorKind::InvalidInput,
+                    "npz archives over 4 GiB are not supported",
+                ));
+            };
+            let unpadded = position as usize + 30 + name.len() + 4;
+            let padding = unpadded.next_multiple_of(HEADER_ALIGN) - unpadded;
+
+            write_u32s(&mut writer, &[LOCAL_HEADER])?;
+            write_u16s(&mut writer, &[20, 0, 0, 0, DOS_DATE])?;
+            // The CRC is patched in once the payload has been streamed.
+            write_u32s(&mut writer, &[0, size, size])?;
+            write_u16s(&mut writer, &[name.len() as u16, 4 + padding as u16])?;
+            writer.write_all(name.as_bytes())?;
+            write_u16s(&mut writer, &[PADDING_EXTRA, padding as u16])?;
+            writer.write_all(&vec![0; padding])?;
+            let mut payload = Crc32Writer::new(&mut writer);
+            array.write_npy(&mut payload)?;
+            let crc = payload.crc();
+
+            let end = position + 30 + name.len() as u64 + 4 + padding as u64 + size as u64;
+            writer.seek(SeekFrom::Start(position + 14))?;
+            write_u32s(&mut writer, &[crc])?;
+            writer.seek(SeekFrom::Start(end))?;
+            entries.push((name, crc, size, offset));
+            position = end;
+        }
+
+        let directory_offset = position;
+        for (name, crc, size, offset) in &entries {
+            write_u32s(&mut writer, &[CENTRAL_HEADER])?;
+            write_u16s(&mut writer, &[20, 20, 0, 0, 0, DOS_DATE])?;
+            write_u32s(&mut writer, &[*crc, *size, *size])?;
+            write_u16s(&mut writer, &[name.len() as u16, 0, 0, 0, 0])?;
+            write_u32s(&mut writer, &[0, *offset])?;
+            writer.write_all(name.as_bytes())?;
+            position += 46 + name.len() as u64;
+        }
+        let (Ok(count), Ok(directory_size), Ok(directory_offset)) = (
+            u16::try_from(entries.len()),
+            u32::try_from(position - directory_offset),
+            u32::try_from(directory_offset),
+        ) else {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidInput,
+                "npz archive too large for a zip32 directory",
+            ));
+        };
+        write_u32s(&mut writer, &[END_OF_CENTRAL_DIRECTORY])?;
+        write_u16s(&mut writer, &[0, 0, count, count])?;
+        write_u32s(&mut writer, &[directory_size, directory_offset])?;
+        write_u16s(&mut writer, &[0])?;
+        writer.flush()
+    }
+}
+
+/// The arrays of the `.npz` archive held by `file`.
+fn npz_arrays(file: Arc<MappedFile>) -> io::Result<Vec<(String, NdArray)>> {
+    zip_entries(file.bytes())?
+        .into_iter()
+        .map(|(name, range)| {
+            let name = name.strip_suffix(".npy").unwrap_or(&name).to_string();
+            Ok((name, parse_npy(&file, range)?))
+        })
+        .collect()
+}
+
+/// Element type of a `.npy` payload.
+#[derive(Clone, Copy, Debug, PartialEq)]
+struct Descr {
+    width: usize,
+    little_endian: bool,
+}
+
+fn invalid(message: impl Into<String>) -> io::Error {
+    io::Error::new(io::ErrorKind::InvalidData, message.into())
+}
+
+/// Parses the `.npy` file stored at `range` of `file`.
+fn parse_npy(file: &Arc<MappedFile>, range: std::ops::Range<usize>) -> io::Result<NdArray> {
+    let bytes = &file.bytes()[range.clone()];
+    if bytes.len() < 10 || !bytes.starts_with(MAGIC) {
+        return Err(invalid("not an npy file"));
+    }
+    let (header_start, header_len) = match bytes[6] {
+        1 => (10, u16::from_le_bytes([bytes[8], bytes[9]]) as usize),
+        2 | 3 if bytes.len() >= 12 => (
+            12,
+            u32::from_le_bytes([bytes[8], bytes[9], bytes[10], bytes[11]]) as usize,
+        ),
+        version => return Err(invalid(format!("unsupported npy version {version}"))),
+    };
+    let header = bytes
+        .get(header_start..header_start + header_len)
+        .ok_or_else(|| invalid("truncated npy header"))?;
+    let header = String::from_utf8_lossy(header);
+    let (descr, fortran_order, shape) = parse_header(&header)?;
+
+    let len = shape
+        .iter()
+        .try_fold(1usize, |len, dim| len.checked_mul(*dim))
+        .ok_or_else(|| invalid("npy shape too large"))?;
+    let payload = header_start + header_len;
+    let values = len
+        .checked_mul(descr.width)
+        .and_then(|nbytes| bytes.get(payload..payload.checked_add(nbytes)?))
+        .ok_or_else(|| invalid("truncated npy payload"))?;
+    let strides = if fortran_order {
+        let mut strides = c_strides(&shape.iter().rev().copied().collect::<Vec<_>>());
+        strides.reverse();
+        strides
+    } else {
+        c_strides(&shape)
+    };
+
+    let mapped = (descr
+        == Descr {
+            width: 4,
+            little_endian: true,
+        })
+    .then(|| Buffer::from_file(Arc::clone(file), range.start + payload, len))
+    .flatten();
+    let data = mapped.unwrap_or_else(|| {
+        let values: Vec<f32> = match descr.width {
+            2 => values
+                .chunks_exact(2)
+                .map(|b| {
+                    let bits = [b[0], b[1]];
+                    let bits = if descr.little_endian {
+                        u16::from_le_bytes(bits)
+                    } else {
+                        u16::from_be_bytes(bits)
+                    };
+                    F16::from_bits(bits).to_f32()
+                })
+                .collect(),
+            4 => values
+                .chunks_exact(4)
+                .map(|b| {
+                    let bytes = [b[0], b[1], b[2], b[3]];
+                    if descr.little_endian {
+                        f32::from_le_bytes(bytes)
+                    } else {
+                        f32::from_be_bytes(bytes)
+                    }
+                })
+                .collect(),
+            _ => values
+                .chunks_exact(8)
+                .map(|b| {
+                    let bytes = [b[0], b[1], b[2], b[3], b[4], b[5], b[6], b[7]];
+                    if descr.little_endian {
+                        f64::from_le_bytes(bytes) as f32
+                    } else {
+                        f64::from_be_bytes(bytes) as f32
+                    }
+                })
+                .collect(),
+        };
+        values.into()
+    });
+    Ok(NdArray {
+        data: Arc::new(data),
+        shape,
+        strides,
+        offset: 0,
+    })
+}
+
+/// Reads `descr`, `fortran_order` and `shape` from the Python dict literal
+/// NumPy writes as the header, e.g.
+/// `{'descr': '<f4', 'fortran_order': False, 'shape': (2, 3), }`.
+fn parse_header(header: &str) -> io::Result<(Descr, bool, Vec<usize>)> {
+    let value = |key: &str| {
+        let start = header
+            .find(&format!("'{key}'"))
+            .or_else(|| header.find(&format!("\"{key}\"")))
+            .ok_or_else(|| invalid(format!("npy header has no {key}")))?;
+        let rest = &header[start + key.len() + 2..];
+        let colon = rest
+            .find(':')
+            .ok_or_else(|| invalid("malformed npy header"))?;
+        Ok::<_, io::Error>(rest[colon + 1..].trim_start())
+    };
+
+    let descr = value("descr")?;
+    let quote = descr.chars().next().filter(|c| *c == '\'' || *c == '"');
+    let descr = quote
+        .and_then(|quote| descr[1..].split(quote).next())
+        .ok_or_else(|| invalid("npy descr is not a simple type string"))?;
+    let little_endian = match descr.as_bytes().first() {
+        Some(b'<') => true,
+        Some(b'>') => false,
+        Some(b'=') => cfg!(target_endian = "little"),
+        _ => return Err(invalid(format!("unsupported npy dtype {descr}"))),
+    };
+    let width = match &descr[1..] {
+        "f2" => 2,
+        "f4" => 4,
+        "f8" => 8,
+        _ => return Err(invalid(format!("unsupported npy dtype {descr}"))),
+    };
+
+    let fortran_order = value("fortran_order")?.starts_with("True");
+    let shape = value("shape")?;
+    let shape = shape
+        .strip_prefix('(')
+        .and_then(|shape| shape.split(')').next())
+        .ok_or_else(|| invalid("malformed npy shape"))?
+        .split(',')
+        .map(str::trim)
+        .filter(|dim| !dim.is_empty())
+        .map(|dim| dim.trim_end_matches('L').parse())
+        .collect::<Result<Vec<usize>, _>>()
+        .map_err(|_| invalid("malformed npy shape"))?;
+    Ok((
+        Descr {
+            width,
+            little_endian,
+        },
+        fortran_order,
+        shape,
+    ))
+}
+
+/// The magic, version, header length and padded header of a `<f4` array.
+fn npy_header(shape: &[usize]) -> Vec<u8> {
+    let dims = shape
+        .iter()
+        .map(|dim| dim.to_string())
+        .collect::<Vec<_>>()
+        .join(", ");
+    let shape = if shape.len() == 1 {
+        format!("({dims},)")
+    } else {
+        format!("({dims})")
+    };
+    let dict = format!("{{'descr': '<f4', 'fortran_order': False, 'shape': {shape}, }}");
+    let (version, prefix) = if (10 + dict.len() + 1).next_multiple_of(HEADER_ALIGN) - 10 <= 0xffff {
+        (1, 10)
+    } else {
+        (2, 12)
+    };
+    let total = (prefix + dict.len() + 1).next_multiple_of(HEADER_ALIGN);
+    let header_len = total - prefix;
+
+    let mut bytes = Vec::with_capacity(total);
+    bytes.extend_from_slice(MAGIC);
+    bytes.extend_from_slice(&[version, 0]);
+    if version == 1 {
+        bytes.extend_from_slice(&(header_len as u16).to_le_bytes());
+    } else {
+        bytes.extend_from_slice(&(header_len as u32).to_le_bytes());
+    }
+    bytes.extend_from_slice(dict.as_bytes());
+    bytes.resize(total - 1, b' ');
+    bytes.push(b'\n');
+    bytes
+}
+
+/// Names and byte ranges of the stored entries of a zip archive.
+fn zip_entries(bytes: &[u8]) -> io::Result<Vec<(String, std::ops::Range<usize>)>> {
+    let u16_at = |at: usize| {
+        bytes
+            .get(at..at + 2)
+            .map(|b| u16::from_le_bytes([b[0], b[1]]) as usize)
+            .ok_or_else(|| invalid("truncated npz archive"))
+    };
+    let u32_at = |at: usize| {
+        bytes
+            .get(at..at + 4)
+            .map(|b| u32::from_le_bytes([b[0], b[1], b[2], b[3]]) as usize)
+            .ok_or_else(|| invalid("truncated npz archive"))
+    };
+    let u64_at = |at: usize| {
+        bytes
+            .get(at..at + 8)
+            .map(|b| u64::from_le_bytes(b.try_into().expect("eight bytes")) as usize)
+            .ok_or_else(|| invalid("truncated npz archive"))
+    };
+
+    // The end record is the last thing in the file, followed by a comment of
+    // at most 64 KiB.
+    let search_start = bytes.len().saturating_sub(22 + 0xffff);
+    let end = (search_start..bytes.len().saturating_sub(21))
+        .rev()
+        .find(|&at| u32_at(at).ok() == Some(END_OF_CENTRAL_DIRECTORY as usize))
+        .ok_or_else(|| invalid("not an npz (zip) archive"))?;
+    let count = u16_at(end + 10)?;
+    let mut at = u32_at(end + 16)?;
+
+    let mut entries = Vec::with_capacity(count);
+    for _ in 0..count {
+        if u32_at(at)? != CENTRAL_HEADER as usize {
+            return Err(invalid("corrupt npz central directory"));
+        }
+        let method = u16_at(at + 10)?;
+        let mut size = u32_at(at + 24)?;
+        let name_len = u16_at(at + 28)?;
+        let extra_len = u16_at(at + 30)?;
+        let comment_len = u16_at(at + 32)?;
+        let mut local = u32_at(at + 42)?;
+        let name = bytes
+            .get(at + 46..at + 46 + name_len)
+            .ok_or_else(|| invalid("truncated npz archive"))?;
+        let name = String::from_utf8_lossy(name).into_owned();
+
+        // Zip64 sizes and offsets replace the 32-bit fields that are all ones,
+        // in order.
+        let mut extra = at + 46 + name_len;
+        let extra_end = extra + extra_len;
+        while extra + 4 <= extra_end {
+            let (id, len) = (u16_at(extra)?, u16_at(extra + 2)?);
+            if id == ZIP64_EXTRA as usize {
+                let mut field = extra + 4;
+                if size == 0xffff_ffff {
+                    size = u64_at(field)?;
+                    field += 8;
+                }
+                if u32_at(at + 20)? == 0xffff_ffff {
+                    field += 8;
+                }
+                if local == 0xffff_ffff {
+                    local = u64_at(field)?;
+                }
+            }
+            extra += 4 + len;
+        }
+        if method != 0 {
+            return Err(invalid(format!(
+                "npz entry {name} is compressed; only numpy.savez archives are supported"
+            )));
+        }
+        if u32_at(local)? != LOCAL_HEADER as usize {
+            return Err(invalid("corrupt npz local header"));
+        }
+        let start = local + 30 + u16_at(local + 26)? + u16_at(local + 28)?;
+        if start.checked_add(size).is_none_or(|end| end > bytes.len()) {
+            return Err(invalid("truncated npz archive"));
+        }
+        entries.push((name, start..start + size));
+        at = extra_end + comment_len;
+    }
+    Ok(entries)
+}
+
+fn write_u16s(writer: &mut impl Write, values: &[u16]) -> io::Result<()> {
+    values
+        .iter()
+        .try_for_each(|value| writer.write_all(&value.to_le_bytes()))
+}
+
+fn write_u32s(writer: &mut impl Write, values: &[u32]) -> io::Result<()> {
+    values
+        .iter()
+        .try_for_each(|value| writer.write_all(&value.to_le_bytes()))
+}
+
+/// CRC-32 (IEEE, reflected) lookup table.
+const CRC32_TABLE: [u32; 256] = {
+    let mut table = [0u32; 256];
+    let mut index = 0;
+    while index < 256 {
+        let mut crc = index as u32;
+        let mut bit = 0;
+        while bit < 8 {
+            crc = if crc & 1 == 1 {
+                (crc >> 1) ^ 0xedb8_8320
+            } else {
+                crc >> 1
+            };
+            bit += 1;
+        }
+        table[index] = crc;
+        index += 1;
+    }
+    table
+};
+
+/// Passes writes through while accumulating the zip CRC-32 of the bytes.
+struct Crc32Writer<W> {
+    inner: W,
+    state: u32,
+}
+
+impl<W: Write> Crc32Writer<W> {
+    fn new(inner: W) -> Self {
+        Self {
+            inner,
+            state: 0xffff_ffff,
+        }
+    }
+
+    fn crc(&self) -> u32 {
+        !self.state
+    }
+}
+
+impl<W: Write> Write for Crc32Writer<W> {
+    fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+        let written = self.inner.write(buf)?;
+        for byte in &buf[..written] {
+            self.state =
+                CRC32_TABLE[((self.state ^ *byte as u32) & 0xff) as usize] ^ (self.state >> 8);
+        }
+        Ok(written)
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        self.inner.flush()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn temp_path(tag: &str) -> std::path::PathBuf {
+        std::env::temp_dir().join(format!("aeronum-npy-{tag}-{}", std::process::id()))
+    }
+
+    /// A `.npy` file as another writer might lay it out.
+    fn npy_bytes(dict: &str, payload: &[u8]) -> Vec<u8> {
+        let header_len = (10 + dict.len() + 1).next_multiple_of(16) - 10;
+        let mut bytes = b"\x93NUMPY\x01\x00".to_vec();
+        bytes.extend_from_slice(&(header_len as u16).to_le_bytes());
+        bytes.extend_from_slice(dict.as_bytes());
+        bytes.resize(10 + header_len - 1, b' ');
+        bytes.push(b'\n');
+        bytes.extend_from_slice(payload);
+        bytes
+    }
+
+    #[test]
+    fn npy_round_trips_views_and_maps_files_on_request() {
+        let path = temp_path("round-trip");
+        let array = NdArray::from_list((0..24).map(|i| i as f32 * 0.5).collect(), Some(&[2, 3, 4]));
+        let view = array.transpose().slice_axis(1, 1..3);
+        view.save_npy(&path).expect("save npy");
+
+        let bytes = std::fs::read(&path).expect("read npy");
+        let dict = b"{'descr': '<f4', 'fortran_order': False, 'shape': (4, 2, 2), }";
+        assert_eq!(&bytes[..10], b"\x93NUMPY\x01\x00\x76\x00");
+        assert_eq!(&bytes[10..10 + dict.len()], dict);
+        assert_eq!(bytes[127], b'\n');
+        assert_eq!(bytes.len(), 128 + 16 * 4);
+        let loaded = NdArray::load_npy(&path).expect("load npy");
+        assert_eq!(loaded.shape(), view.shape());
+        assert_eq!(loaded.to_vec(), view.to_vec());
+        // SAFETY: the file is only rewritten after `loaded` is dropped.
+        let mut loaded = unsafe { NdArray::map_npy(&path) }.expect("map npy");
+        assert_eq!(loaded.to_vec(), view.to_vec());
+        // Mappings are page aligned, so the payload is used in place.
+        #[cfg(unix)]
+        assert!(loaded.data.borrows_file());
+
+        // Writes copy out of the mapping and leave the file alone.
+        assert!(loaded.set(&[0, 0, 0], -1.0));
+        assert!(!loaded.data.borrows_file());
+        assert_eq!(
+            NdArray::load_npy(&path).expect("reload npy").to_vec(),
+            view.to_vec()
+        );
+        drop(loaded);
+
+        let scalar = NdArray::from_list(vec![7.0], Some(&[]));
+        scalar.save_npy(&path).expect("save scalar");
+        assert_eq!(NdArray::load_npy(&path).expect("load scalar"), scalar);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn npy_reads_other_dtypes_byte_orders_and_fortran_order() {
+        let path = temp_path("dtypes");
+        let values = [1.5f64, -2.0, 0.25, 8.0, 3.0, -0.5];
+        let fortran = npy_bytes(
+            "{'descr': '<f8', 'fortran_order': True, 'shape': (2, 3), }",
+            &values
+                .iter()
+                .flat_map(|v| v.to_le_bytes())
+                .collect::<Vec<_>>(),
+        );
+        std::fs::write(&path, fortran).expect("write npy");
+        let loaded = NdArray::load_npy(&path).expect("load f8");
+        assert_eq!(loaded.shape(), &[2, 3]);
+        assert_eq!(loaded.to_vec(), [1.5, 0.25, 3.0, -2.0, 8.0, -0.5]);
+
+        let big_endian = npy_bytes(
+            "{'descr': '>f4', 'fortran_order': False, 'shape': (3,), }",
+            &[1.0f32, -2.0, 4.5]
+                .iter()
+                .flat_map(|v| v.to_be_bytes())
+                .collect::<Vec<_>>(),
+        );
+        std::fs::write(&path, big_endian).expect("write npy");
+        assert_eq!(
+            NdArray::load_npy(&path).expect("load >f4").to_vec(),
+            [1.0, -2.0, 4.5]
+        );
+
+        let half = npy_bytes(
+            "{'descr': '<f2', 'fortran_order': False, 'shape': (2,), }",
+            &[0x00, 0x3c, 0x00, 0xc0],
+        );
+        std::fs::write(&path, half).expect("write npy");
+        assert_eq!(
+            NdArray::load_npy(&path).expect("load f2").to_vec(),
+            [1.0, -2.0]
+        );
+
+        let ints = npy_bytes(
+            "{'descr': '<i4', 'fortran_order': False, 'shape': (1,), }",
+            &[0; 4],
+        );
+        std::fs::write(&path, ints).expect("write npy");
+        let error = NdArray::load_npy(&path).expect_err("integers are unsupported");
+        assert_eq!(error.kind(), io::ErrorKind::InvalidData);
+        let _ = std::fs::remove_file(path);
+    }
+
+    #[test]
+    fn npz_archives_round_trip_with_aligned_entries() {
+        let path = temp_path("archive");
+        let weights = NdArray::from_list((0..12).map(|i| i as f32 - 6.0).collect(), Some(&[3, 4]));
+        let bias = NdArray::from_list(vec![0.5, -0.5, 1.5], Some(&[3]));
+        let empty = NdArray::zeros(&[0, 4]);
+        NdArray::save_npz(
+            &path,
+            &[
+                ("weights", &weights.transpose()),
+                ("bias", &bias),
+                ("empty", &empty),
+            ],
+        )
+        .expect("save npz");
+
+        let loaded = NdArray::load_npz(&path).expect("load npz");
+        let names = loaded
+            .iter()
+            .map(|(name, _)| name.as_str())
+            .collect::<Vec<_>>();
+        assert_eq!(names, ["weights", "bias", "empty"]);
+        assert_eq!(loaded[0].1.shape(), &[4, 3]);
+        assert_eq!(loaded[0].1.to_vec(), weights.transpose().to_vec());
+        assert_eq!(loaded[1].1, bias);
+        assert_eq!(loaded[2].1.shape(), &[0, 4]);
+        // SAFETY: the archive is not modified while `mapped` is alive.
+        let mapped = unsafe { NdArray::map_npz(&path) }.expect("map npz");
+        assert_eq!(mapped, loaded);
+        #[cfg(unix)]
+        assert!(mapped[0].1.data.borrows_file() && mapped[1].1.data.borrows_file());
+        drop(mapped);
+
+        // The stored CRCs are the standard zip checksum of each payload.
+        let mut crc = Crc32Writer::new(io::sink());
+        crc.write_all(b"123456789").expect("write to sink");
+        assert_eq!(crc.crc(), 0xcbf4_3926);
+        let mut crc = Crc32Writer::new(io::sink());
+        bias.write_npy(&mut crc).expect("write to sink");
+        let bytes = std::fs::read(&path).expect("read npz");
+        let central = bytes
+            .windows(8)
+            .rposition(|window| window == b"bias.npy")
+            .expect("central directory entry")
+            - 46;
+        assert_eq!(bytes[central + 16..central + 20], crc.crc().to_le_bytes());
+        let _ = std::fs::remove_file(path);
+    }
+}
@@ -0,0 +1,251 @@
+use std::cell::Cell;
+use std::panic::{self, AssertUnwindSafe};
+use std::sync::{Condvar, Mutex, MutexGuard, Once, OnceLock};
+use std::thread;
+
+/// Minimum amount of scalar work (roughly multiply-adds) a task should own
+/// before it is worth handing to another thread.
+const MIN_TASK_WORK: usize = 1 << 15;
+
+thread_local! {
+    static IN_PARALLEL_TASK: Cell<bool> = const { Cell::new(false) };
+}
+
+pub(crate) fn thread_count() -> usize {
+    // Cached: `available_parallelism` may read cgroup files (and allocate) on Linux.
+    static THREAD_COUNT: OnceLock<usize> = OnceLock::new();
+    *THREAD_COUNT.get_or_init(|| {
+        thread::available_parallelism()
+            .map(|count| count.get())
+            .unwrap_or(1)
+    })
+}
+
+/// Picks how many items each task should own so that every task has at least
+/// `MIN_TASK_WORK` units of work and no more tasks than threads are created.
+pub(crate) fn items_per_task(item_count: usize, work_per_item: usize) -> usize {
+    let min_items = MIN_TASK_WORK.div_ceil(work_per_item.max(1)).max(1);
+    let balanced = item_count.div_ceil(thread_count()).max(1);
+    balanced.max(min_items)
+}
+
+/// Splits `values` into `chunk_len`-sized chunks and calls `task(chunk_index, chunk)`
+/// for every chunk, spreading the chunks across the shared worker pool.
+///
+/// The pool threads are started once per process and a call does not allocate,
+/// which keeps steady-state decode loops free of heap traffic.
+pub(crate) fn for_each_chunk_mut<T, F>(values: &mut [T], chunk_len: usize, task: F)
+where
+    T: Send,
+    F: Fn(usize, &mut [T]) + Sync,
+{
+    let chunk_len = chunk_len.max(1);
+    let len = values.len();
+    let base = SendPtr(values.as_mut_ptr());
+    pool().run(len.div_ceil(chunk_len), &|chunk_index| {
+        let start = chunk_index * chunk_len;
+        let end = (start + chunk_len).min(len);
+        // SAFETY: the pool hands out every chunk index exactly once, so the
+        // chunks never overlap, and `values` outlives `run`.
+        let chunk = unsafe { std::slice::from_raw_parts_mut(base.get().add(start), end - start) };
+        task(chunk_index, chunk);
+    });
+}
+
+struct SendPtr<T>(*mut T);
+
+impl<T> SendPtr<T> {
+    fn get(&self) -> *mut T {
+        self.0
+    }
+}
+
+unsafe impl<T: Send> Send for SendPtr<T> {}
+unsafe impl<T: Send> Sync for SendPtr<T> {}
+
+#[derive(Clone, Copy)]
+struct Job {
+    /// Borrowed task with its lifetime erased. `WorkerPool::run` does not return
+    /// until every claimed task has finished, so the pointer never dangles while
+    /// it can still be called.
+    task: *const (dyn Fn(usize) + Sync),
+    #[cfg(test)]
+    tracked: bool,
+}
+
+unsafe impl Send for Job {}
+
+struct PoolState {
+    job: Option<Job>,
+    next_task: usize,
+    task_count: usize,
+    finished_tasks: usize,
+    panicked: bool,
+}
+
+struct WorkerPool {
+    state: Mutex<PoolState>,
+    work_ready: Condvar,
+    work_done: Condvar,
+    submit: Mutex<()>,
+    worker_count: usize,
+}
+
+fn pool() -> &'static WorkerPool {
+    static POOL: OnceLock<WorkerPool> = OnceLock::new();
+    static WORKERS: Once = Once::new();
+    let pool = POOL.get_or_init(|| WorkerPool {
+        state: Mutex::new(PoolState {
+            job: None,
+            next_task: 0,
+            task_count: 0,
+            finished_tasks: 0,
+            panicked: false,
+        }),
+        work_ready: Condvar::new(),
+        work_done: Condvar::new(),
+        submit: Mutex::new(()),
+        worker_count: thread_count() - 1,
+    });
+    WORKERS.call_once(|| {
+        for worker_index in 0..pool.worker_count {
+            // A worker that fails to start only costs parallelism: the submitting
+            // thread claims whatever tasks nobody else picks up.
+            let _ = thread::Builder::new()
+                .name(format!("aeronum-worker-{worker_index}"))
+                .spawn(move || pool.worker_loop());
+        }
+    });
+    pool
+}
+
+impl WorkerPool {
+    fn lock(&self) -> MutexGuard<'_, PoolState> {
+        self.state
+            .lock()
+            .unwrap_or_else(|poisoned| poisoned.into_inner())
+    }
+
+    fn run(&self, task_count: usize, task: &(dyn Fn(usize) + Sync)) {
+        let nested = IN_PARALLEL_TASK.with(Cell::get);
+        let submit = if task_count <= 1 || self.worker_count == 0 || nested {
+            None
+        } else {
+            // Another thread already owns the pool: run inline rather than queue.
+            self.submit.try_lock().ok()
+        };
+        let Some(_submit) = submit else {
+            (0..task_count).for_each(task);
+            return;
+        };
+
+        // SAFETY: only the lifetime is erased; see `Job::task`.
+        let task: &'static (dyn Fn(usize) + Sync) = unsafe { std::mem::transmute(task) };
+        {
+            let mut state = self.lock();
+            state.job = Some(Job {
+                task,
+                #[cfg(test)]
+                tracked: crate::alloc_tracking::is_tracking(),
+            });
+            state.next_task = 0;
+            state.task_count = task_count;
+            state.finished_tasks = 0;
+            state.panicked = false;
+        }
+        self.work_ready.notify_all();
+
+        IN_PARALLEL_TASK.with(|flag| flag.set(true));
+        let mut state = self.lock();
+        loop {
+            if state.next_task < state.task_count {
+                let task_index = state.next_task;
+                state.next_task += 1;
+                drop(state);
+                let completed = panic::catch_unwind(AssertUnwindSafe(|| task(task_index)));
+                state = self.lock();
+                state.finished_tasks += 1;
+                state.panicked |= completed.is_err();
+            } else if state.finished_tasks == state.task_count {
+                break;
+            } else {
+                state = self
+                    .work_done
+                    .wait(state)
+                    .unwrap_or_else(|poisoned| poisoned.into_inner());
+            }
+        }
+        state.job = None;
+        let panicked = state.panicked;
+        drop(state);
+        IN_PARALLEL_TASK.with(|flag| flag.set(false));
+        if panicked {
+            panic!("parallel task panicked");
+        }
+    }
+
+    fn worker_loop(&self) {
+        IN_PARALLEL_TASK.with(|flag| flag.set(true));
+        let mut state = self.lock();
+        loop {
+            let claimable = state.job.filter(|_| state.next_task < state.task_count);
+            let Some(job) = claimable else {
+                state = self
+                    .work_ready
+                    .wait(state)
+                    .unwrap_or_else(|poisoned| poisoned.into_inner());
+                continue;
+            };
+            let task_index = state.next_task;
+            state.next_task += 1;
+            drop(state);
+
+            #[cfg(test)]
+            crate::alloc_tracking::set_tracking(job.tracked);
+            // SAFETY: the submitter waits for this task before releasing `job`.
+            let task = unsafe { &*job.task };
+            let completed = panic::catch_unwind(AssertUnwindSafe(|| task(task_index)));
+            #[cfg(test)]
+            crate::alloc_tracking::set_tracking(false);
+
+            state = self.lock();
+            state.finished_tasks += 1;
+            state.panicked |= completed.is_err();
+            if state.finished_tasks == state.task_count {
+                self.work_done.notify_all();
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn for_each_chunk_mut_visits_every_chunk_once() {
+        let mut values = vec![0usize; 1003];
+        for _ in 0..3 {
+            for_each_chunk_mut(&mut values, 10, |chunk_index, chunk| {
+                for value in chunk.iter_mut() {
+                    *value += chunk_index + 1;
+                }
+            });
+        }
+        for (idx, value) in values.iter().enumerate() {
+            assert_eq!(*value, 3 * (idx / 10 + 1));
+        }
+    }
+
+    #[test]
+    fn nested_for_each_chunk_mut_runs_inline() {
+        let mut outer = vec![0usize; 64];
+        for_each_chunk_mut(&mut outer, 8, |_, chunk| {
+            for_each_chunk_mut(chunk, 2, |inner_index, inner| {
+                inner.iter_mut().for_each(|value| *value = inner_index + 1);
+            });
+        });
+        assert_eq!(&outer[..8], &[1, 1, 2, 2, 3, 3, 4, 4]);
+        assert_eq!(&outer[56..], &[1, 1, 2, 2, 3, 3, 4, 4]);
+    }
+}
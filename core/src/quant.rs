@@ -0,0 +1,494 @@
+//! Block-quantized weight matrices.
+//!
+//! A [`QTensor`] keeps GGML K-quant blocks exactly as they are stored in a
+//! GGUF file (4.5 bits per weight for Q4_K, 6.5625 for Q6_K), either read into
+//! memory or, through the `unsafe` `GgufHeader::map_qtensors`, straight out of
+//! a read-only mapping of the file, and is only ever expanded a block at a
+//! time. [`NdArray::matmul_quantized`] multiplies activations by such a
+//! matrix with fused dequantize-and-dot kernels that apply each sub-block
+//! scale once to a partial dot product instead of to every weight.
+
+use std::fmt;
+use std::ops::Range;
+use std::sync::Arc;
+
+use crate::dtype::f16_to_f32;
+use crate::mmap::MappedFile;
+use crate::{parallel, NdArray};
+
+/// Weights per K-quant super-block.
+pub(crate) const BLOCK_ELEMENTS: usize = 256;
+
+/// Storage format of a [`QTensor`].
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+pub enum QuantFormat {
+    Q4K,
+    Q6K,
+}
+
+impl QuantFormat {
+    /// The format of GGML tensor type `tensor_type`, if it is supported.
+    pub fn from_ggml_type(tensor_type: u32) -> Option<Self> {
+        match tensor_type {
+            12 => Some(Self::Q4K),
+            14 => Some(Self::Q6K),
+            _ => None,
+        }
+    }
+
+    pub fn ggml_type(self) -> u32 {
+        match self {
+            Self::Q4K => 12,
+            Self::Q6K => 14,
+        }
+    }
+
+    /// Bytes per block of [`BLOCK_ELEMENTS`] weights.
+    pub fn block_bytes(self) -> usize {
+        match self {
+            Self::Q4K => 144,
+            Self::Q6K => 210,
+        }
+    }
+
+    pub fn bits_per_weight(self) -> f64 {
+        (self.block_bytes() * 8) as f64 / BLOCK_ELEMENTS as f64
+    }
+
+    fn block_decoder(self) -> fn(&[u8], &mut [f32]) {
+        match self {
+            Self::Q4K => dequantize_q4_k_block_into,
+            Self::Q6K => dequantize_q6_k_block_into,
+        }
+    }
+}
+
+enum Storage {
+    Mapped(Arc<MappedFile>),
+    Owned(Vec<u8>),
+}
+
+/// A `rows x columns` matrix of block-quantized weights. Each row is stored as
+/// `columns.div_ceil(256)` blocks, the last one zero-padded. Clones share the
+/// bytes.
+#[derive(Clone)]
+pub struct QTensor {
+    storage: Arc<Storage>,
+    bytes: Range<usize>,
+    format: QuantFormat,
+    shape: [usize; 2],
+}
+
+impl QTensor {
+    /// Wraps `bytes` holding `rows` rows of `format` blocks.
+    pub fn from_bytes(format: QuantFormat, shape: [usize; 2], bytes: Vec<u8>) -> Self {
+        assert_eq!(bytes.len(), shape[0] * row_nbytes(format, shape[1]));
+        let len = bytes.len();
+        Self {
+            storage: Arc::new(Storage::Owned(bytes)),
+            bytes: 0..len,
+            format,
+            shape,
+        }
+    }
+
+    /// A view of the blocks at byte `offset` of `file`, which must hold them.
+    /// Callers that map a file take on its safety contract; see
+    /// `GgufHeader::map_qtensors`.
+    pub(crate) fn from_mapped(
+        format: QuantFormat,
+        shape: [usize; 2],
+        file: Arc<MappedFile>,
+        offset: usize,
+    ) -> Self {
+        let bytes = offset..offset + shape[0] * row_nbytes(format, shape[1]);
+        assert!(bytes.end <= file.bytes().len());
+        Self {
+            storage: Arc::new(Storage::Mapped(file)),
+            bytes,
+            format,
+            shape,
+        }
+    }
+
+    pub fn format(&self) -> QuantFormat {
+        self.format
+    }
+
+    /// `[rows, columns]`.
+    pub fn shape(&self) -> &[usize] {
+        &self.shape
+    }
+
+    /// Bytes of packed blocks.
+    pub fn nbytes(&self) -> usize {
+        self.bytes.len()
+    }
+
+    /// The packed blocks, row after row.
+    pub fn as_bytes(&self) -> &[u8] {
+        let bytes = match &*self.storage {
+            Storage::Mapped(file) => file.bytes(),
+            Storage::Owned(bytes) => bytes,
+        };
+        &bytes[self.bytes.clone()]
+    }
+
+    /// Expands every weight to `f32`.
+    pub fn dequantize(&self) -> NdArray {
+        let [rows, columns] = self.shape;
+        let decode = self.format.block_decoder();
+        let mut values = vec![0.0; rows * columns];
+        let mut block_values = [0.0f32; BLOCK_ELEMENTS];
+        let row_len = row_nbytes(self.format, columns);
+        for (row, values) in values.chunks_exact_mut(columns.max(1)).enumerate() {
+            let blocks = &self.as_bytes()[row * row_len..(row + 1) * row_len];
+            for (block, values) in blocks
+                .chunks_exact(self.format.block_bytes())
+                .zip(values.chunks_mut(BLOCK_ELEMENTS))
+            {
+                decode(block, &mut block_values);
+                values.copy_from_slice(&block_values[..values.len()]);
+            }
+        }
+        NdArray::from_list(values, Some(&self.shape))
+    }
+
+    /// `self @ input` for a 1D `input` of length `columns`.
+    pub fn matvec(&self, input: &NdArray) -> NdArray {
+        assert_eq!(input.shape(), &self.shape[1..]);
+        input.matmul_quantized(self)
+    }
+}
+
+impl fmt::Debug for QTensor {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        f.debug_struct("QTensor")
+            .field("format", &self.format)
+            .field("shape", &self.shape)
+            .field("mapped", &matches!(*self.storage, Storage::Mapped(_)))
+            .finish()
+    }
+}
+
+impl NdArray {
+    /// `self @ weight^T`: maps the last axis of `self` (length
+    /// `weight.shape()[1]`) to `weight.shape()[0]` outputs, the way a linear
+    /// layer applies a GGUF weight matrix. Weights are decoded a block at a
+    /// time; a single input row uses the fused dot kernels directly, and
+    /// several rows share each decoded block.
+    pub fn matmul_quantized(&self, weight: &QTensor) -> NdArray {
+        let [rows, columns] = weight.shape;
+        let rank = self.shape().len();
+        assert!(rank >= 1);
+        assert_eq!(self.shape()[rank - 1], columns);
+        let input_rows = self.len() / columns.max(1);
+        let mut out_shape = self.shape()[..rank - 1].to_vec();
+        out_shape.push(rows);
+        if input_rows == 0 || rows == 0 || columns == 0 {
+            return NdArray::zeros(&out_shape);
+        }
+
+        // Whole blocks of input per row, zero-padded past `columns`.
+        let padded = columns.next_multiple_of(BLOCK_ELEMENTS);
+        let mut inputs = vec![0.0f32; input_rows * padded];
+        for (row, values) in inputs
+            .chunks_exact_mut(padded)
+            .zip(self.to_vec().chunks_exact(columns))
+        {
+            row[..columns].copy_from_slice(values);
+        }
+        let block_sums = match weight.format {
+            QuantFormat::Q4K => inputs.chunks_exact(32).map(|x| x.iter().sum()).collect(),
+            QuantFormat::Q6K => Vec::new(),
+        };
+
+        let row_len = row_nbytes(weight.format, columns);
+        let block_bytes = weight.format.block_bytes();
+        let weights = weight.as_bytes();
+        // `transposed[r * input_rows + i]` is output `i` of weight row `r`.
+        let mut transposed = vec![0.0f32; rows * input_rows];
+        let rows_per_task = parallel::items_per_task(rows, input_rows * columns);
+        parallel::for_each_chunk_mut(
+            &mut transposed,
+            rows_per_task * input_rows,
+            |task_index, outputs| {
+                let mut block_values = [0.0f32; BLOCK_ELEMENTS];
+                let decode = weight.format.block_decoder();
+                for (offset, outputs) in outputs.chunks_exact_mut(input_rows).enumerate() {
+                    let row = task_index * rows_per_task + offset;
+                    let blocks = weights[row * row_len..(row + 1) * row_len]
+                        .chunks_exact(block_bytes)
+                        .enumerate();
+                    if input_rows == 1 {
+                        outputs[0] = blocks
+                            .map(|(index, block)| {
+                                let start = index * BLOCK_ELEMENTS;
+                                let input = &inputs[start..start + BLOCK_ELEMENTS];
+                                match weight.format {
+                                    QuantFormat::Q4K => {
+                                        q4_k_dot(block, input, &block_sums[start / 32..])
+                                    }
+                                    QuantFormat::Q6K => q6_k_dot(block, input),
+                                }
+                            })
+                            .sum();
+                        continue;
+                    }
+                    for (index, block) in blocks {
+                        decode(block, &mut block_values);
+                        let start = index * BLOCK_ELEMENTS;
+                        for (output, input) in outputs.iter_mut().zip(inputs.chunks_exact(padded)) {
+                            *output += dot(&block_values, &input[start..start + BLOCK_ELEMENTS]);
+                        }
+                    }
+                }
+            },
+        );
+
+        let mut out = vec![0.0f32; input_rows * rows];
+        for (row, outputs) in transposed.chunks_exact(input_rows).enumerate() {
+            for (input_row, value) in outputs.iter().enumerate() {
+                out[input_row * rows + row] = *value;
+            }
+        }
+        NdArray::from_list(out, Some(&out_shape))
+    }
+}
+
+fn row_nbytes(format: QuantFormat, columns: usize) -> usize {
+    columns.div_ceil(BLOCK_ELEMENTS) * format.block_bytes()
+}
+
+/// Eight independent accumulators, so the loop vectorizes without
+/// reassociating a single running sum.
+fn dot(left: &[f32], right: &[f32]) -> f32 {
+    let mut lanes = [0.0f32; 8];
+    for (left, right) in left.chunks_exact(8).zip(right.chunks_exact(8)) {
+        for lane in 0..8 {
+            lanes[lane] += left[lane] * right[lane];
+        }
+    }
+    lanes.iter().sum()
+}
+
+/// Dot product of one Q4_K block with 256 inputs. Each 32-weight sub-block
+/// is `d * scale * q - dmin * min`, so its contribution is
+/// `d * scale * (q . x) - dmin * min * sum(x)`; `sums` holds the per
+/// sub-block input sums, which are shared by every row.
+fn q4_k_dot(block: &[u8], input: &[f32], sums: &[f32]) -> f32 {
+    let d = f16_to_f32(u16::from_le_bytes([block[0], block[1]]));
+    let dmin = f16_to_f32(u16::from_le_bytes([block[2], block[3]]));
+    let scales = &block[4..16];
+    let mut total = 0.0f32;
+    for (chunk, (qs, input)) in block[16..144]
+        .chunks_exact(32)
+        .zip(input.chunks_exact(64))
+        .enumerate()
+    {
+        let (low_input, high_input) = input.split_at(32);
+        let mut low = [0.0f32; 8];
+        let mut high = [0.0f32; 8];
+        for ((qs, low_input), high_input) in qs
+            .chunks_exact(8)
+            .zip(low_input.chunks_exact(8))
+            .zip(high_input.chunks_exact(8))
+        {
+            for lane in 0..8 {
+                low[lane] += (qs[lane] & 0x0f) as f32 * low_input[lane];
+                high[lane] += (qs[lane] >> 4) as f32 * high_input[lane];
+            }
+        }
+        let (low_scale, low_min) = q4_k_scale_min(2 * chunk, scales);
+        let (high_scale, high_min) = q4_k_scale_min(2 * chunk + 1, scales);
+        total += d * low_scale as f32 * low.iter().sum::<f32>()
+            - dmin * low_min as f32 * sums[2 * chunk]
+            + d * high_scale as f32 * high.iter().sum::<f32>()
+            - dmin * high_min as f32 * sums[2 * chunk + 1];
+    }
+    total
+}
+
+/// Dot product of one Q6_K block with 256 inputs, scaling each 16-weight
+/// group's partial sum once.
+fn q6_k_dot(block: &[u8], input: &[f32]) -> f32 {
+    let d = f16_to_f32(u16::from_le_bytes([block[208], block[209]]));
+    let mut total = 0.0f32;
+    for half in 0..2 {
+        let ql = &block[64 * half..64 * half + 64];
+        let qh = &block[128 + 32 * half..128 + 32 * half + 32];
+        let scales = &block[192 + 8 * half..192 + 8 * half + 8];
+        let input = &input[128 * half..128 * half + 128];
+        for group in 0..2 {
+            let mut sums = [[0.0f32; 16]; 4];
+            for lane in 0..16 {
+                let l = 16 * group + lane;
+                let high = qh[l];
+                let q = [
+                    (ql[l] & 0x0f) | ((high & 3) << 4),
+                    (ql[l + 32] & 0x0f) | (((high >> 2) & 3) << 4),
+                    (ql[l] >> 4) | (((high >> 4) & 3) << 4),
+                    (ql[l + 32] >> 4) | (((high >> 6) & 3) << 4),
+                ];
+                for (quarter, sums) in sums.iter_mut().enumerate() {
+                    sums[lane] += (q[quarter] as i8 - 32) as f32 * input[32 * quarter + l];
+                }
+            }
+            for (quarter, sums) in sums.iter().enumerate() {
+                let scale = scales[group + 2 * quarter] as i8 as f32;
+                total += d * scale * sums.iter().sum::<f32>();
+            }
+        }
+    }
+    total
+}
+
+pub(crate) fn dequantize_q4_k_block_into(bytes: &[u8], values: &mut [f32]) {
+    let d = f16_to_f32(u16::from_le_bytes([bytes[0], bytes[1]]));
+    let dmin = f16_to_f32(u16::from_le_bytes([bytes[2], bytes[3]]));
+    let scales = &bytes[4..16];
+    let qs = &bytes[16..144];
+    let values = &mut values[..256];
+    let mut q_offset = 0usize;
+    let mut scale_idx = 0usize;
+    for n in (0..256).step_by(64) {
+        let (sc1, min1) = q4_k_scale_min(scale_idx, scales);
+        let (sc2, min2) = q4_k_scale_min(scale_idx + 1, scales);
+        let d1 = d * sc1 as f32;
+        let m1 = dmin * min1 as f32;
+        let d2 = d * sc2 as f32;
+        let m2 = dmin * min2 as f32;
+        for (l, byte) in qs[q_offset..q_offset + 32].iter().enumerate() {
+            values[n + l] = d1 * (byte & 0x0f) as f32 - m1;
+            values[n + l + 32] = d2 * (byte >> 4) as f32 - m2;
+        }
+        q_offset += 32;
+        scale_idx += 2;
+    }
+}
+
+pub(crate) fn q4_k_scale_min(index: usize, scales: &[u8]) -> (u8, u8) {
+    if index < 4 {
+        (scales[index] & 63, scales[index + 4] & 63)
+    } else {
+        (
+            (scales[index + 4] & 0x0f) | ((scales[index - 4] >> 6) << 4),
+            (scales[index + 4] >> 4) | ((scales[index] >> 6) << 4),
+        )
+    }
+}
+
+pub(crate) fn dequantize_q6_k_block_into(bytes: &[u8], values: &mut [f32]) {
+    let ql = &bytes[0..128];
+    let qh = &bytes[128..192];
+    let scales = &bytes[192..208];
+    let d = f16_to_f32(u16::from_le_bytes([bytes[208], bytes[209]]));
+    let values = &mut values[..256];
+    for n in (0..256).step_by(128) {
+        let ql_base = n / 2;
+        let qh_base = n / 4;
+        let scale_base = n / 16;
+        for l in 0..32usize {
+            let scale_pair = l / 16;
+            let qh_byte = qh[qh_base + l];
+            let q1 = ((ql[ql_base + l] & 0x0f) | ((qh_byte & 3) << 4)) as i8 - 32;
+            let q2 = ((ql[ql_base + l + 32] & 0x0f) | (((qh_byte >> 2) & 3) << 4)) as i8 - 32;
+            let q3 = ((ql[ql_base + l] >> 4) | (((qh_byte >> 4) & 3) << 4)) as i8 - 32;
+            let q4 = ((ql[ql_base + l + 32] >> 4) | (((qh_byte >> 6) & 3) << 4)) as i8 - 32;
+            values[n + l] = d * scales[scale_base + scale_pair] as i8 as f32 * q1 as f32;
+            values[n + l + 32] = d * scales[scale_base + scale_pair + 2] as i8 as f32 * q2 as f32;
+            values[n + l + 64] = d * scales[scale_base + scale_pair + 4] as i8 as f32 * q3 as f32;
+            values[n + l + 96] = d * scales[scale_base + scale_pair + 6] as i8 as f32 * q4 as f32;
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    /// Random blocks with small positive super-block scales, so every weight
+    /// is finite.
+    fn random_blocks(format: QuantFormat, count: usize, seed: u64) -> Vec<u8> {
+        let mut state = seed;
+        let mut next = || {
+            state = state
+                .wrapping_mul(6364136223846793005)
+                .wrapping_add(1442695040888963407);
+            (state >> 33) as u8
+        };
+        let mut bytes = (0..count * format.block_bytes())
+            .map(|_| next())
+            .collect::<Vec<_>>();
+        for block in bytes.chunks_exact_mut(format.block_bytes()) {
+            match format {
+                QuantFormat::Q4K => {
+                    block[0..2].copy_from_slice(&0x1c00u16.to_le_bytes());
+                    block[2..4].copy_from_slice(&0x2000u16.to_le_bytes());
+                }
+                QuantFormat::Q6K => block[208..210].copy_from_slice(&0x1c00u16.to_le_bytes()),
+            }
+        }
+        bytes
+    }
+
+    fn reference(weights: &NdArray, inputs: &NdArray) -> Vec<f64> {
+        let (rows, columns) = (weights.shape()[0], weights.shape()[1]);
+        let (weights, inputs) = (weights.to_vec(), inputs.to_vec());
+        inputs
+            .chunks_exact(columns)
+            .flat_map(|input| {
+                weights.chunks_exact(columns).take(rows).map(move |row| {
+                    row.iter()
+                        .zip(input)
+                        .map(|(w, x)| *w as f64 * *x as f64)
+                        .sum::<f64>()
+                })
+            })
+            .collect()
+    }
+
+    #[test]
+    fn fused_kernels_match_dequantized_products() {
+        for format in [QuantFormat::Q4K, QuantFormat::Q6K] {
+            // 300 columns leaves a zero-padded tail block on every row.
+            let (rows, columns) = (5, 300);
+            let weight = QTensor::from_bytes(
+                format,
+                [rows, columns],
+                random_blocks(format, rows * 2, format.ggml_type() as u64),
+            );
+            assert_eq!(weight.nbytes(), rows * 2 * format.block_bytes());
+            let dense = weight.dequantize();
+            assert_eq!(dense.shape(), &[rows, columns]);
+            let inputs = NdArray::from_list(
+                (0..3 * columns)
+                    .map(|i| ((i * 37 % 101) as f32 - 50.0) / 25.0)
+                    .collect(),
+                Some(&[3, columns]),
+            );
+
+            let batched = inputs.matmul_quantized(&weight);
+            assert_eq!(batched.shape(), &[3, rows]);
+            let single = weight.matvec(&inputs.slice_axis(0, 1..2).reshape(&[columns]).unwrap());
+            assert_eq!(single.shape(), &[rows]);
+            let expected = reference(&dense, &inputs);
+            let scale = expected.iter().fold(1.0f64, |max, v| max.max(v.abs()));
+            for (actual, expected) in batched.to_vec().iter().zip(&expected) {
+                assert!(
+                    (*actual as f64 - expected).abs() < 1e-5 * scale,
+                    "{format:?}"
+                );
+            }
+            for (actual, expected) in single.to_vec().iter().zip(&expected[rows..]) {
+                assert!(
+                    (*actual as f64 - expected).abs() < 1e-5 * scale,
+                    "{format:?}"
+                );
+            }
+        }
+        assert_eq!(QuantFormat::Q4K.bits_per_weight(), 4.5);
+        assert_eq!(QuantFormat::from_ggml_type(14), Some(QuantFormat::Q6K));
+        assert_eq!(QuantFormat::from_ggml_type(8), None);
+    }
+}
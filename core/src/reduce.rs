@@ -0,0 +1,584 @@
+//! Axis reductions over strided `NdArray` storage.
+//!
+//! The reduced axes and the kept axes are merged separately (as in
+//! [`crate::strided`]), which leaves each output element reading a run of
+//! `inner` elements at a time. Two loop orders cover the common layouts:
+//!
+//! - The reduced axes are innermost in memory: every output folds its runs
+//!   with a slice kernel (pairwise, eight-lane summation for sums).
+//! - The kept axes are innermost (e.g. summing a row-major matrix over axis
+//!   0): every reduced position adds a contiguous row segment into a
+//!   per-column accumulator, so reads stay sequential.
+//!
+//! Outputs are spread over the worker pool. When there are fewer outputs than
+//! threads, each output's reduced range is also split into parts whose partial
+//! results are merged afterwards, so a full reduction of a large array uses
+//! every thread.
+
+use crate::parallel;
+use crate::strided::{merge_axes, offset_of, Strided};
+
+/// Summation block below which a run is summed with plain lane
+/// accumulators; longer runs are split in half recursively.
+const PAIRWISE_BLOCK: usize = 128;
+/// Columns accumulated together in the kept-axis-innermost loop.
+const COLUMN_BLOCK: usize = 1024;
+/// Reduced elements below which a reduction part is not split further.
+const MIN_PART_LEN: usize = 1 << 16;
+
+/// Reductions available through [`crate::NdArray::reduce`].
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub enum Reduction {
+    Sum,
+    Mean,
+    Max,
+    Min,
+    /// `log(sum(exp(x)))`, computed without overflow.
+    LogSumExp,
+}
+
+/// One reduction, folded over elements in index order. `index` is an
+/// element's row-major position among the reduced axes.
+pub(crate) trait Reducer: Sync {
+    type Acc: Copy + Send;
+    type Output: Copy + Default + Send;
+
+    fn identity(&self) -> Self::Acc;
+
+    fn push(&self, acc: &mut Self::Acc, value: f32, index: usize);
+
+    /// Folds a contiguous run whose first element has index `first_index`.
+    fn run(&self, acc: &mut Self::Acc, values: &[f32], first_index: usize) {
+        for (offset, value) in values.iter().enumerate() {
+            self.push(acc, *value, first_index + offset);
+        }
+    }
+
+    /// Folds `later`, which covers indices after those in `acc`.
+    fn merge(&self, acc: &mut Self::Acc, later: Self::Acc);
+
+    fn finish(&self, acc: Self::Acc, count: usize) -> Self::Output;
+}
+
+/// Sum, or mean when `mean` is set. Runs are summed pairwise in `f32`; runs
+/// and partial results are combined in `f64`.
+pub(crate) struct Sum {
+    pub(crate) mean: bool,
+}
+
+impl Reducer for Sum {
+    type Acc = f64;
+    type Output = f32;
+
+    fn identity(&self) -> f64 {
+        0.0
+    }
+
+    fn push(&self, acc: &mut f64, value: f32, _index: usize) {
+        *acc += value as f64;
+    }
+
+    fn run(&self, acc: &mut f64, values: &[f32], _first_index: usize) {
+        *acc += pairwise_sum(values) as f64;
+    }
+
+    fn merge(&self, acc: &mut f64, later: f64) {
+        *acc += later;
+    }
+
+    fn finish(&self, acc: f64, count: usize) -> f32 {
+        if self.mean {
+            (acc / count as f64) as f32
+        } else {
+            acc as f32
+        }
+    }
+}
+
+/// Maximum when `MAX`, else minimum. NaN propagates.
+pub(crate) struct Extremum<const MAX: bool>;
+
+impl<const MAX: bool> Extremum<MAX> {
+    fn better(value: f32, current: f32) -> bool {
+        if MAX {
+            value > current
+        } else {
+            value < current
+        }
+    }
+}
+
+impl<const MAX: bool> Reducer for Extremum<MAX> {
+    type Acc = f32;
+    type Output = f32;
+
+    fn identity(&self) -> f32 {
+        if MAX {
+            f32::NEG_INFINITY
+        } else {
+            f32::INFINITY
+        }
+    }
+
+    fn push(&self, acc: &mut f32, value: f32, _index: usize) {
+        if Self::better(value, *acc) || value.is_nan() {
+            *acc = value;
+        }
+    }
+
+    fn run(&self, acc: &mut f32, values: &[f32], _first_index: usize) {
+        let mut lanes = [self.identity(); 8];
+        let mut nan = false;
+        let mut chunks = values.chunks_exact(8);
+        for chunk in &mut chunks {
+            for (lane, value) in lanes.iter_mut().zip(chunk) {
+                *lane = if Self::better(*value, *lane) {
+                    *value
+                } else {
+                    *lane
+                };
+                nan |= value.is_nan();
+            }
+        }
+        for value in lanes.iter().chain(chunks.remainder()) {
+            self.push(acc, *value, 0);
+        }
+        if nan {
+            *acc = f32::NAN;
+        }
+    }
+
+    fn merge(&self, acc: &mut f32, later: f32) {
+        self.push(acc, later, 0);
+    }
+
+    fn finish(&self, acc: f32, _count: usize) -> f32 {
+        acc
+    }
+}
+
+/// `log(sum(exp(x)))` as a running maximum and the sum of `exp(x - max)`.
+pub(crate) struct LogSumExp;
+
+impl Reducer for LogSumExp {
+    type Acc = (f32, f64);
+    type Output = f32;
+
+    fn identity(&self) -> (f32, f64) {
+        (f32::NEG_INFINITY, 0.0)
+    }
+
+    fn push(&self, acc: &mut (f32, f64), value: f32, _index: usize) {
+        self.merge(acc, (value, 1.0));
+    }
+
+    fn run(&self, acc: &mut (f32, f64), values: &[f32], first_index: usize) {
+        let mut max = f32::NEG_INFINITY;
+        Extremum::<true>.run(&mut max, values, first_index);
+        if !max.is_finite() {
+            // Infinite or NaN maxima decide the result on their own.
+            for value in values {
+                self.push(acc, *value, 0);
+            }
+            return;
+        }
+        let scaled = values
+            .iter()
+            .map(|value| (value - max).exp() as f64)
+            .sum::<f64>();
+        self.merge(acc, (max, scaled));
+    }
+
+    fn merge(&self, acc: &mut (f32, f64), later: (f32, f64)) {
+        let (max, scaled) = *acc;
+        let (other_max, other_scaled) = later;
+        if max.is_nan() || other_max == f32::NEG_INFINITY {
+            return;
+        }
+        if other_max.is_nan() || max == f32::NEG_INFINITY {
+            *acc = later;
+        } else if other_max == f32::INFINITY || max == f32::INFINITY {
+            acc.0 = f32::INFINITY;
+        } else if other_max > max {
+            *acc = (
+                other_max,
+                scaled * ((max - other_max) as f64).exp() + other_scaled,
+            );
+        } else {
+            acc.1 = scaled + other_scaled * ((other_max - max) as f64).exp();
+        }
+    }
+
+    fn finish(&self, (max, scaled): (f32, f64), _count: usize) -> f32 {
+        if max.is_finite() {
+            max + scaled.ln() as f32
+        } else {
+            max
+        }
+    }
+}
+
+/// Index of the first maximum (or first NaN).
+pub(crate) struct ArgMax;
+
+impl Reducer for ArgMax {
+    type Acc = (f32, usize);
+    type Output = usize;
+
+    fn identity(&self) -> (f32, usize) {
+        (f32::NEG_INFINITY, usize::MAX)
+    }
+
+    fn push(&self, acc: &mut (f32, usize), value: f32, index: usize) {
+        let replace = acc.1 == usize::MAX || (!acc.0.is_nan() && (value > acc.0 || value.is_nan()));
+        if replace {
+            *acc = (value, index);
+        }
+    }
+
+    fn merge(&self, acc: &mut (f32, usize), later: (f32, usize)) {
+        if later.1 != usize::MAX {
+            self.push(acc, later.0, later.1);
+        }
+    }
+
+    fn finish(&self, acc: (f32, usize), _count: usize) -> usize {
+        acc.1
+    }
+}
+
+/// Reduces `source` over `axes` (distinct and in range) and returns the
+/// results in row-major order of the kept axes.
+pub(crate) fn reduce_axes<R: Reducer>(
+    source: Strided<'_>,
+    axes: &[usize],
+    reducer: &R,
+) -> Vec<R::Output> {
+    let (mut kept_shape, mut kept_strides) = (Vec::new(), Vec::new());
+    let (mut reduced_shape, mut reduced_strides) = (Vec::new(), Vec::new());
+    for (axis, (dim, stride)) in source.shape.iter().zip(source.strides).enumerate() {
+        if axes.contains(&axis) {
+            reduced_shape.push(*dim);
+            reduced_strides.push(*stride);
+        } else {
+            kept_shape.push(*dim);
+            kept_strides.push(*stride);
+        }
+    }
+    let (kept_dims, [kept_strides]) = merge_axes(&kept_shape, [&kept_strides]);
+    let (reduced_dims, [reduced_strides]) = merge_axes(&reduced_shape, [&reduced_strides]);
+    let layout = Layout {
+        data: source.data,
+        offset: source.offset,
+        kept_dims: &kept_dims,
+        kept_strides: &kept_strides,
+        reduced_dims: &reduced_dims,
+        reduced_strides: &reduced_strides,
+        reduced_count: reduced_shape.iter().product(),
+    };
+
+    let output_count = kept_shape.iter().product::<usize>();
+    let mut outputs = vec![R::Output::default(); output_count];
+    if output_count == 0 {
+        return outputs;
+    }
+    let work = layout.reduced_count.max(1);
+    let columns = *kept_dims.last().expect("merged axes");
+    let kept_inner_contiguous = kept_strides.last() == Some(&1) && columns >= 16;
+    let reduced_inner_contiguous = reduced_strides.last() == Some(&1);
+    if output_count >= parallel::thread_count()
+        && kept_inner_contiguous
+        && !reduced_inner_contiguous
+    {
+        let per_task = parallel::items_per_task(output_count, work);
+        parallel::for_each_chunk_mut(&mut outputs, per_task, |task_index, outputs| {
+            layout.reduce_columns(reducer, task_index * per_task, outputs);
+        });
+        return outputs;
+    }
+
+    let parts = if output_count >= parallel::thread_count() {
+        1
+    } else {
+        parallel::thread_count()
+            .div_ceil(output_count)
+            .min(layout.reduced_count.div_ceil(MIN_PART_LEN))
+            .max(1)
+    };
+    if parts == 1 {
+        let per_task = parallel::items_per_task(output_count, work);
+        parallel::for_each_chunk_mut(&mut outputs, per_task, |task_index, outputs| {
+            for (offset, output) in outputs.iter_mut().enumerate() {
+                let base = layout.kept_offset(task_index * per_task + offset);
+                let mut acc = reducer.identity();
+                layout.reduce_range(reducer, &mut acc, base, 0..layout.reduced_count);
+                *output = reducer.finish(acc, layout.reduced_count);
+            }
+        });
+        return outputs;
+    }
+
+    let mut partials = vec![reducer.identity(); output_count * parts];
+    let part_len = layout.reduced_count.div_ceil(parts);
+    parallel::for_each_chunk_mut(&mut partials, 1, |index, partial| {
+        let base = layout.kept_offset(index / parts);
+        let start = (index % parts) * part_len;
+        let end = (start + part_len).min(layout.reduced_count);
+        layout.reduce_range(reducer, &mut partial[0], base, start..end);
+    });
+    for (output, partials) in outputs.iter_mut().zip(partials.chunks_exact(parts)) {
+        let mut acc = partials[0];
+        for partial in &partials[1..] {
+            reducer.merge(&mut acc, *partial);
+        }
+        *output = reducer.finish(acc, layout.reduced_count);
+    }
+    outputs
+}
+
+/// Merged kept and reduced axes of one reduction.
+struct Layout<'a> {
+    data: &'a [f32],
+    offset: isize,
+    kept_dims: &'a [usize],
+    kept_strides: &'a [isize],
+    reduced_dims: &'a [usize],
+    reduced_strides: &'a [isize],
+    reduced_count: usize,
+}
+
+impl Layout<'_> {
+    fn kept_offset(&self, output: usize) -> isize {
+        self.offset + offset_of(output, self.kept_dims, self.kept_strides)
+    }
+
+    /// Folds reduced positions `range` of the output starting at `base`.
+    fn reduce_range<R: Reducer>(
+        &self,
+        reducer: &R,
+        acc: &mut R::Acc,
+        base: isize,
+        range: std::ops::Range<usize>,
+    ) {
+        let inner = *self.reduced_dims.last().expect("merged axes");
+        let stride = *self.reduced_strides.last().expect("merged axes");
+        let mut position = range.start;
+        while position < range.end {
+            let len = (inner - position % inner).min(range.end - position);
+            let start = base + offset_of(position, self.reduced_dims, self.reduced_strides);
+            if stride == 1 {
+                let start = start as usize;
+                reducer.run(acc, &self.data[start..start + len], position);
+            } else {
+                for step in 0..len {
+                    let value = self.data[(start + step as isize * stride) as usize];
+                    reducer.push(acc, value, position + step);
+                }
+            }
+            position += len;
+        }
+    }
+
+    /// Fills `outputs` (outputs `first_output..`) when the innermost kept
+    /// axis is contiguous: each reduced position contributes one contiguous
+    /// row segment to a block of per-column accumulators.
+    fn reduce_columns<R: Reducer>(
+        &self,
+        reducer: &R,
+        first_output: usize,
+        outputs: &mut [R::Output],
+    ) {
+        let columns = *self.kept_dims.last().expect("merged axes");
+        let mut accs = Vec::with_capacity(COLUMN_BLOCK.min(outputs.len()));
+        let mut done = 0;
+        while done < outputs.len() {
+            let output = first_output + done;
+            let len = (columns - output % columns)
+                .min(outputs.len() - done)
+                .min(COLUMN_BLOCK);
+            let base = self.kept_offset(output);
+            accs.clear();
+            accs.resize(len, reducer.identity());
+            for position in 0..self.reduced_count {
+                let start =
+                    (base + offset_of(position, self.reduced_dims, self.reduced_strides)) as usize;
+                for (acc, value) in accs.iter_mut().zip(&self.data[start..start + len]) {
+                    reducer.push(acc, *value, position);
+                }
+            }
+            for (output, acc) in outputs[done..done + len].iter_mut().zip(&accs) {
+                *output = reducer.finish(*acc, self.reduced_count);
+            }
+            done += len;
+        }
+    }
+}
+
+/// Sums `values` in blocks of [`PAIRWISE_BLOCK`] with eight lane
+/// accumulators, halving longer runs recursively; the rounding error grows
+/// with `log(len)` rather than `len`.
+fn pairwise_sum(values: &[f32]) -> f32 {
+    if values.len() > PAIRWISE_BLOCK {
+        let half = values.len() / 2 / 8 * 8;
+        return pairwise_sum(&values[..half]) + pairwise_sum(&values[half..]);
+    }
+    let mut lanes = [0.0f32; 8];
+    let mut chunks = values.chunks_exact(8);
+    for chunk in &mut chunks {
+        for (lane, value) in lanes.iter_mut().zip(chunk) {
+            *lane += value;
+        }
+    }
+    let tail = chunks.remainder().iter().sum::<f32>();
+    ((lanes[0] + lanes[1]) + (lanes[2] + lanes[3]))
+        + ((lanes[4] + lanes[5]) + (lanes[6] + lanes[7]))
+        + tail
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn naive<R: Reducer>(
+        data: &[f32],
+        shape: &[usize],
+        strides: &[isize],
+        axes: &[usize],
+        reducer: &R,
+    ) -> Vec<R::Output> {
+        let kept = (0..shape.len())
+            .filter(|axis| !axes.contains(axis))
+            .collect::<Vec<_>>();
+        let output_count = kept.iter().map(|axis| shape[*axis]).product::<usize>();
+        let reduced_count = axes.iter().map(|axis| shape[*axis]).product::<usize>();
+        (0..output_count)
+            .map(|output| {
+                let mut acc = reducer.identity();
+                for position in 0..reduced_count {
+                    let (mut offset, mut rest) = (0isize, output);
+                    for axis in kept.iter().rev() {
+                        offset += (rest % shape[*axis]) as isize * strides[*axis];
+                        rest /= shape[*axis];
+                    }
+                    rest = position;
+                    for axis in axes.iter().rev() {
+                        offset += (rest % shape[*axis]) as isize * strides[*axis];
+                        rest /= shape[*axis];
+                    }
+                    reducer.push(&mut acc, data[offset as usize], position);
+                }
+                reducer.finish(acc, reduced_count)
+            })
+            .collect()
+    }
+
+    #[test]
+    fn reductions_match_naive_fold_on_every_layout() {
+        let data = (0..24 * 40)
+            .map(|i| ((i * 37 % 101) as f32 - 50.0) / 9.0)
+            .collect::<Vec<_>>();
+        // Row-major, transposed and a view with a stepped axis.
+        let layouts: [(&[usize], &[isize]); 3] = [
+            (&[4, 6, 40], &[240, 40, 1]),
+            (&[40, 6, 4], &[1, 40, 240]),
+            (&[4, 3, 20], &[240, 80, 2]),
+        ];
+        for (shape, strides) in layouts {
+            let source = Strided {
+                data: &data,
+                shape,
+                strides,
+                offset: 0,
+            };
+            for axes in [&[][..], &[0], &[1], &[2], &[0, 2], &[1, 2], &[0, 1, 2]] {
+                let check = |actual: Vec<f32>, expected: Vec<f32>| {
+                    for (a, e) in actual.iter().zip(&expected) {
+                        assert!(
+                            (a - e).abs() <= 1e-4 * (1.0 + e.abs()),
+                            "{shape:?} {axes:?}: {a} vs {e}"
+                        );
+                    }
+                };
+                let sum = Sum { mean: true };
+                check(
+                    reduce_axes(source, axes, &sum),
+                    naive(&data, shape, strides, axes, &sum),
+                );
+                check(
+                    reduce_axes(source, axes, &Extremum::<false>),
+                    naive(&data, shape, strides, axes, &Extremum::<false>),
+                );
+                check(
+                    reduce_axes(source, axes, &LogSumExp),
+                    naive(&data, shape, strides, axes, &LogSumExp),
+                );
+                assert_eq!(
+                    reduce_axes(source, axes, &ArgMax),
+                    naive(&data, shape, strides, axes, &ArgMax)
+                );
+            }
+        }
+    }
+
+    /// Folding parts separately and merging them, as a split reduction does,
+    /// gives the single-pass result.
+    fn check_split<R: Reducer>(reducer: &R, values: &[f32]) -> Vec<(R::Output, R::Output)> {
+        let mut whole = reducer.identity();
+        reducer.run(&mut whole, values, 0);
+        let whole = reducer.finish(whole, values.len());
+        [1, 7, values.len() / 2, values.len() - 1]
+            .into_iter()
+            .map(|split| {
+                let (mut left, mut right) = (reducer.identity(), reducer.identity());
+                reducer.run(&mut left, &values[..split], 0);
+                reducer.run(&mut right, &values[split..], split);
+                reducer.merge(&mut left, right);
+                (reducer.finish(left, values.len()), whole)
+            })
+            .collect()
+    }
+
+    #[test]
+    fn split_reductions_merge_to_the_whole() {
+        let values = (0..300)
+            .map(|i| ((i * 53 % 97) as f32 - 48.0) / 5.0)
+            .collect::<Vec<_>>();
+        for (split, whole) in check_split(&Sum { mean: false }, &values)
+            .into_iter()
+            .chain(check_split(&Extremum::<true>, &values))
+            .chain(check_split(&LogSumExp, &values))
+        {
+            assert!(
+                (split - whole).abs() <= 1e-4 * (1.0 + whole.abs()),
+                "{split} vs {whole}"
+            );
+        }
+        for (split, whole) in check_split(&ArgMax, &values) {
+            assert_eq!(split, whole);
+        }
+        let mut with_nan = values.clone();
+        with_nan[200] = f32::NAN;
+        for (split, whole) in check_split(&ArgMax, &with_nan) {
+            assert_eq!((split, whole), (200, 200));
+        }
+    }
+
+    #[test]
+    fn pairwise_sum_keeps_long_runs_accurate() {
+        let values = vec![0.1f32; 1 << 22];
+        let exact = 0.1f32 as f64 * values.len() as f64;
+        let sequential = values.iter().sum::<f32>() as f64;
+        let pairwise = pairwise_sum(&values) as f64;
+        assert!((pairwise - exact).abs() / exact < 1e-6);
+        assert!((sequential - exact).abs() > 100.0 * (pairwise - exact).abs());
+
+        let mut max = f32::NEG_INFINITY;
+        Extremum::<true>.run(&mut max, &[1.0, f32::NAN, 3.0], 0);
+        assert!(max.is_nan());
+        let mut lse = LogSumExp.identity();
+        LogSumExp.run(&mut lse, &[f32::NEG_INFINITY, f32::NEG_INFINITY], 0);
+        assert_eq!(LogSumExp.finish(lse, 2), f32::NEG_INFINITY);
+        LogSumExp.run(&mut lse, &[1000.0, 1000.0], 0);
+        assert!((LogSumExp.finish(lse, 2) - (1000.0 + 2f32.ln())).abs() < 1e-3);
+    }
+}
@@ -0,0 +1,98 @@
+//! Element storage behind [`NdArray`](crate::NdArray).
+//!
+//! A buffer is either an owned vector or a window of a file's bytes holding
+//! little-endian `f32` values, so a loaded array need not be copied out of
+//! the file contents. The file is read into memory or, for the `unsafe`
+//! loaders that opt into it, mapped. Both read as a `&[f32]`; the first write
+//! to a file-backed buffer copies it into an owned vector, the same way a
+//! write to a shared buffer copies it.
+
+use std::fmt;
+use std::ops::Deref;
+use std::sync::Arc;
+
+use crate::mmap::MappedFile;
+
+pub(crate) enum Buffer {
+    Owned(Vec<f32>),
+    File {
+        file: Arc<MappedFile>,
+        /// Byte offset of the first element.
+        offset: usize,
+        len: usize,
+    },
+}
+
+impl Buffer {
+    /// `len` values at byte `offset` of `file`, or `None` if they are out of
+    /// range, not aligned for `f32`, or not in native byte order.
+    pub(crate) fn from_file(file: Arc<MappedFile>, offset: usize, len: usize) -> Option<Self> {
+        let bytes = file
+            .bytes()
+            .get(offset..offset.checked_add(len.checked_mul(4)?)?)?;
+        if cfg!(target_endian = "big")
+            || !(bytes.as_ptr() as usize).is_multiple_of(std::mem::align_of::<f32>())
+        {
+            return None;
+        }
+        Some(Self::File { file, offset, len })
+    }
+
+    pub(crate) fn borrows_file(&self) -> bool {
+        matches!(self, Self::File { .. })
+    }
+
+    /// The values as a mutable slice, copying a mapping into an owned vector
+    /// first.
+    pub(crate) fn to_mut(&mut self) -> &mut [f32] {
+        if self.borrows_file() {
+            *self = Self::Owned(self.to_vec());
+        }
+        match self {
+            Self::Owned(values) => values,
+            Self::File { .. } => unreachable!("file-backed buffers were copied above"),
+        }
+    }
+}
+
+impl Deref for Buffer {
+    type Target = [f32];
+
+    fn deref(&self) -> &[f32] {
+        match self {
+            Self::Owned(values) => values,
+            // SAFETY: `Buffer::from_file` checked that the range lies inside
+            // the file bytes and is aligned, the bytes live as long as `file`,
+            // and every bit pattern is a valid `f32`. A mapping also relies on
+            // the file staying unchanged, which the `unsafe` loaders that map
+            // files require of their callers.
+            Self::File { file, offset, len } => unsafe {
+                std::slice::from_raw_parts(file.bytes().as_ptr().add(*offset).cast(), *len)
+            },
+        }
+    }
+}
+
+impl From<Vec<f32>> for Buffer {
+    fn from(values: Vec<f32>) -> Self {
+        Self::Owned(values)
+    }
+}
+
+impl Clone for Buffer {
+    fn clone(&self) -> Self {
+        Self::Owned(self.to_vec())
+    }
+}
+
+impl PartialEq for Buffer {
+    fn eq(&self, other: &Self) -> bool {
+        **self == **other
+    }
+}
+
+impl fmt::Debug for Buffer {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        (**self).fmt(f)
+    }
+}
@@ -0,0 +1,396 @@
+//! Broadcast-aware strided iteration over `NdArray` storage.
+//!
+//! Elementwise kernels walk their operands by stepping element offsets along
+//! each axis instead of turning every output position back into a multi-index.
+//! Axes that are laid out back to back in every operand are merged first, so
+//! equal-shape contiguous operands collapse into one flat slice loop, and a
+//! broadcast row or column runs as a slice loop per output row. Only the
+//! per-call axis bookkeeping allocates, never the per-element work.
+
+/// One operand: `data[offset + sum(index[axis] * strides[axis])]` holds the
+/// element at `index` of an array of shape `shape`.
+#[derive(Clone, Copy, Debug)]
+pub(crate) struct Strided<'a> {
+    pub(crate) data: &'a [f32],
+    pub(crate) shape: &'a [usize],
+    pub(crate) strides: &'a [isize],
+    pub(crate) offset: isize,
+}
+
+impl Strided<'_> {
+    /// Strides of this operand broadcast to `out_shape`: leading axes it
+    /// lacks and its size-1 axes get stride `0`.
+    pub(crate) fn broadcast_strides(&self, out_shape: &[usize]) -> Vec<isize> {
+        let lead = out_shape.len() - self.shape.len();
+        (0..out_shape.len())
+            .map(|axis| match axis.checked_sub(lead) {
+                Some(own) if self.shape[own] != 1 => self.strides[own],
+                _ => 0,
+            })
+            .collect()
+    }
+}
+
+/// `output[i] = op(left[i], right[i])` over `out_shape` in row-major order,
+/// with both operands broadcast to `out_shape`.
+pub(crate) fn binary_map_into<F>(
+    out_shape: &[usize],
+    left: Strided<'_>,
+    right: Strided<'_>,
+    output: &mut [f32],
+    op: F,
+) where
+    F: Fn(f32, f32) -> f32,
+{
+    if left.shape == out_shape
+        && right.shape == out_shape
+        && is_c_contiguous(left.shape, left.strides)
+        && is_c_contiguous(right.shape, right.strides)
+    {
+        // Same-shape contiguous operands: one flat loop, no bookkeeping.
+        let len = out_shape.iter().product::<usize>();
+        let (l, r) = (left.offset as usize, right.offset as usize);
+        for ((out, a), b) in output[..len]
+            .iter_mut()
+            .zip(&left.data[l..l + len])
+            .zip(&right.data[r..r + len])
+        {
+            *out = op(*a, *b);
+        }
+        return;
+    }
+    let strides = [
+        left.broadcast_strides(out_shape),
+        right.broadcast_strides(out_shape),
+    ];
+    walk_rows(
+        out_shape,
+        [&strides[0], &strides[1]],
+        [left.offset, right.offset],
+        output,
+        |row, [l, r], [sl, sr]| match (sl, sr) {
+            (1, 1) => {
+                let (l, r) = (l as usize, r as usize);
+                let n = row.len();
+                for ((out, a), b) in row
+                    .iter_mut()
+                    .zip(&left.data[l..l + n])
+                    .zip(&right.data[r..r + n])
+                {
+                    *out = op(*a, *b);
+                }
+            }
+            (1, 0) => {
+                let (l, b, n) = (l as usize, right.data[r as usize], row.len());
+                for (out, a) in row.iter_mut().zip(&left.data[l..l + n]) {
+                    *out = op(*a, b);
+                }
+            }
+            (0, 1) => {
+                let (a, r, n) = (left.data[l as usize], r as usize, row.len());
+                for (out, b) in row.iter_mut().zip(&right.data[r..r + n]) {
+                    *out = op(a, *b);
+                }
+            }
+            _ => {
+                let (mut l, mut r) = (l, r);
+                for out in row.iter_mut() {
+                    *out = op(left.data[l as usize], right.data[r as usize]);
+                    l += sl;
+                    r += sr;
+                }
+            }
+        },
+    );
+}
+
+/// `target[i] = op(target[i], source[i])` in place over `shape`, where
+/// element `index` of the target lives at
+/// `data[offset + sum(index[axis] * strides[axis])]` and `source` is
+/// broadcast to `shape`.
+pub(crate) fn update_in_place<F>(
+    data: &mut [f32],
+    shape: &[usize],
+    strides: &[isize],
+    offset: isize,
+    source: Strided<'_>,
+    op: F,
+) where
+    F: Fn(f32, f32) -> f32,
+{
+    if shape == source.shape
+        && is_c_contiguous(shape, strides)
+        && is_c_contiguous(source.shape, source.strides)
+    {
+        // Same-shape contiguous operands: one flat loop, no bookkeeping.
+        let (start, len) = (offset as usize, shape.iter().product::<usize>());
+        let from = source.offset as usize;
+        for (value, other) in data[start..start + len]
+            .iter_mut()
+            .zip(&source.data[from..from + len])
+        {
+            *value = op(*value, *other);
+        }
+        return;
+    }
+    let source_strides = source.broadcast_strides(shape);
+    walk_runs(
+        shape,
+        [strides, &source_strides],
+        [offset, source.offset],
+        |len, [t, s], [st, ss]| match (st, ss) {
+            (1, 1) => {
+                let (t, s) = (t as usize, s as usize);
+                for (value, other) in data[t..t + len].iter_mut().zip(&source.data[s..s + len]) {
+                    *value = op(*value, *other);
+                }
+            }
+            (1, 0) => {
+                let (t, other) = (t as usize, source.data[s as usize]);
+                for value in &mut data[t..t + len] {
+                    *value = op(*value, other);
+                }
+            }
+            _ => {
+                let (mut t, mut s) = (t, s);
+                for _ in 0..len {
+                    let value = &mut data[t as usize];
+                    *value = op(*value, source.data[s as usize]);
+                    t += st;
+                    s += ss;
+                }
+            }
+        },
+    );
+}
+
+/// Element offset, relative to the start, of row-major position `position`
+/// over `dims`.
+pub(crate) fn offset_of(mut position: usize, dims: &[usize], strides: &[isize]) -> isize {
+    let mut offset = 0;
+    for (dim, stride) in dims.iter().zip(strides).rev() {
+        offset += (position % dim) as isize * stride;
+        position /= dim;
+    }
+    offset
+}
+
+/// Whether `strides` lay `shape` out row-major with no gaps.
+pub(crate) fn is_c_contiguous(shape: &[usize], strides: &[isize]) -> bool {
+    let mut expected = 1isize;
+    for (dim, stride) in shape.iter().zip(strides).rev() {
+        if *stride != expected {
+            return false;
+        }
+        expected *= *dim as isize;
+    }
+    shape.len() == strides.len()
+}
+
+/// Copies `source` into `output` in row-major order of its shape.
+pub(crate) fn copy_into(source: Strided<'_>, output: &mut [f32]) {
+    walk_rows(
+        source.shape,
+        [source.strides],
+        [source.offset],
+        output,
+        |row, [start], [stride]| {
+            if stride == 1 {
+                let start = start as usize;
+                row.copy_from_slice(&source.data[start..start + row.len()]);
+            } else {
+                let mut index = start;
+                for out in row.iter_mut() {
+                    *out = source.data[index as usize];
+                    index += stride;
+                }
+            }
+        },
+    );
+}
+
+/// Splits the row-major walk over `shape` into runs along the innermost
+/// merged axis and calls `row(output_run, start_offsets, inner_strides)` for
+/// each, where `start_offsets[k]` is operand `k`'s offset at the run's first
+/// element.
+fn walk_rows<const N: usize, F>(
+    shape: &[usize],
+    strides: [&[isize]; N],
+    offsets: [isize; N],
+    output: &mut [f32],
+    mut row: F,
+) where
+    F: FnMut(&mut [f32], [isize; N], [isize; N]),
+{
+    let total = shape.iter().product::<usize>();
+    let mut rest = &mut output[..total];
+    walk_runs(shape, strides, offsets, |len, starts, inner_strides| {
+        let (run, tail) = std::mem::take(&mut rest).split_at_mut(len);
+        rest = tail;
+        row(run, starts, inner_strides);
+    });
+}
+
+/// Like [`walk_rows`] without an output: calls `run(len, start_offsets,
+/// inner_strides)` for each run of `len` elements.
+pub(crate) fn walk_runs<const N: usize, F>(
+    shape: &[usize],
+    strides: [&[isize]; N],
+    offsets: [isize; N],
+    mut run: F,
+) where
+    F: FnMut(usize, [isize; N], [isize; N]),
+{
+    let total = shape.iter().product::<usize>();
+    if total == 0 {
+        return;
+    }
+    let (dims, merged) = merge_axes(shape, strides);
+    let inner = dims.len() - 1;
+    let inner_strides = std::array::from_fn(|operand| merged[operand][inner]);
+    let mut counter = vec![0usize; inner];
+    let mut starts = offsets;
+    for _ in 0..total / dims[inner] {
+        run(dims[inner], starts, inner_strides);
+        for axis in (0..inner).rev() {
+            counter[axis] += 1;
+            for (start, strides) in starts.iter_mut().zip(&merged) {
+                *start += strides[axis];
+            }
+            if counter[axis] < dims[axis] {
+                break;
+            }
+            counter[axis] = 0;
+            for (start, strides) in starts.iter_mut().zip(&merged) {
+                *start -= strides[axis] * dims[axis] as isize;
+            }
+        }
+    }
+}
+
+/// Drops size-1 axes and merges each axis into the one outside it whenever
+/// every operand steps over the inner axis exactly once per outer step. Always
+/// returns at least one axis.
+pub(crate) fn merge_axes<const N: usize>(
+    shape: &[usize],
+    strides: [&[isize]; N],
+) -> (Vec<usize>, [Vec<isize>; N]) {
+    let mut dims = Vec::with_capacity(shape.len().max(1));
+    let mut merged: [Vec<isize>; N] =
+        std::array::from_fn(|_| Vec::with_capacity(shape.len().max(1)));
+    for (axis, &dim) in shape.iter().enumerate() {
+        if dim == 1 {
+            continue;
+        }
+        let contiguous_with_outer = !dims.is_empty()
+            && merged
+                .iter()
+                .zip(&strides)
+                .all(|(outer, strides)| outer.last() == Some(&(strides[axis] * dim as isize)));
+        if contiguous_with_outer {
+            *dims.last_mut().expect("outer axis") *= dim;
+            for (outer, strides) in merged.iter_mut().zip(&strides) {
+                *outer.last_mut().expect("outer axis") = strides[axis];
+            }
+        } else {
+            dims.push(dim);
+            for (outer, strides) in merged.iter_mut().zip(&strides) {
+                outer.push(strides[axis]);
+            }
+        }
+    }
+    if dims.is_empty() {
+        dims.push(1);
+        for outer in &mut merged {
+            outer.push(0);
+        }
+    }
+    (dims, merged)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn element(operand: &Strided<'_>, out_index: &[usize]) -> f32 {
+        let lead = out_index.len() - operand.shape.len();
+        let mut offset = operand.offset;
+        for (axis, dim) in operand.shape.iter().enumerate() {
+            let index = if *dim == 1 { 0 } else { out_index[lead + axis] };
+            offset += index as isize * operand.strides[axis];
+        }
+        operand.data[offset as usize]
+    }
+
+    fn naive_map(out_shape: &[usize], left: Strided<'_>, right: Strided<'_>) -> Vec<f32> {
+        let total = out_shape.iter().product::<usize>();
+        (0..total)
+            .map(|mut linear| {
+                let mut index = vec![0; out_shape.len()];
+                for axis in (0..out_shape.len()).rev() {
+                    index[axis] = linear % out_shape[axis];
+                    linear /= out_shape[axis];
+                }
+                element(&left, &index) - 2.0 * element(&right, &index)
+            })
+            .collect()
+    }
+
+    /// Shape, strides and offset of one operand.
+    type Layout<'a> = (&'a [usize], &'a [isize], isize);
+
+    #[test]
+    fn strided_walk_matches_per_element_indexing() {
+        let data = (0..256).map(|value| value as f32).collect::<Vec<_>>();
+        let cases: [(&[usize], Layout, Layout); 7] = [
+            // Contiguous, equal shapes.
+            (&[4, 5], (&[4, 5], &[5, 1], 0), (&[4, 5], &[5, 1], 20)),
+            // Row and column broadcasts.
+            (&[4, 5], (&[4, 5], &[5, 1], 3), (&[1, 5], &[5, 1], 100)),
+            (&[4, 5], (&[4, 1], &[1, 1], 7), (&[4, 5], &[5, 1], 0)),
+            // Scalar and missing leading axes.
+            (&[2, 3, 4], (&[], &[], 9), (&[4], &[1], 50)),
+            // Transposed and stepped views.
+            (&[3, 4], (&[3, 4], &[1, 3], 0), (&[3, 4], &[8, 2], 1)),
+            // Reversed axis through a negative stride.
+            (&[2, 6], (&[2, 6], &[6, -1], 5), (&[2, 1], &[12, 1], 30)),
+            // Size-1 axes between merged axes.
+            (
+                &[2, 1, 3, 4],
+                (&[2, 1, 3, 4], &[12, 12, 4, 1], 0),
+                (&[1, 1, 1, 4], &[4, 4, 4, 1], 64),
+            ),
+        ];
+        for (out_shape, (ls, lst, lo), (rs, rst, ro)) in cases {
+            let left = Strided {
+                data: &data,
+                shape: ls,
+                strides: lst,
+                offset: lo,
+            };
+            let right = Strided {
+                data: &data,
+                shape: rs,
+                strides: rst,
+                offset: ro,
+            };
+            let mut output = vec![f32::NAN; out_shape.iter().product()];
+            binary_map_into(out_shape, left, right, &mut output, |a, b| a - 2.0 * b);
+            assert_eq!(output, naive_map(out_shape, left, right), "{out_shape:?}");
+
+            let mut copied = vec![f32::NAN; ls.iter().product()];
+            copy_into(left, &mut copied);
+            let expected = naive_map(
+                ls,
+                left,
+                Strided {
+                    data: &[0.0],
+                    shape: &[],
+                    strides: &[],
+                    offset: 0,
+                },
+            );
+            assert_eq!(copied, expected, "{ls:?}");
+        }
+    }
+}